@@ -2,6 +2,8 @@ import os.path
 
 from fastapi import Request, HTTPException, APIRouter, Response, Query
 from orchestration.api.mongo_schemas import SequentialID
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
 from utility.minio import cmd
 import json
 from datetime import datetime
@@ -28,36 +30,62 @@ def get_datasets(request: Request):
 
 @router.get("/dataset/sequential-id/{dataset}")
 def get_sequential_id(request: Request, dataset: str, limit: int = 1):
-    sequential_id_arr = []
+    if limit < 1:
+        raise HTTPException(status_code=422, detail="limit must be at least 1")
+
+    # reserve a contiguous block of `limit` ids atomically
+    # concurrent callers always get disjoint blocks
+    sequential_id = request.app.dataset_sequential_id_collection.find_one_and_update(
+        {"dataset_name": dataset},
+        {"$inc": {"file_count": limit}},
+        return_document=ReturnDocument.AFTER)
 
-    # find
-    sequential_id = request.app.dataset_sequential_id_collection.find_one({"dataset_name": dataset})
     if sequential_id is None:
-        # create one
+        # first allocation for this dataset, create the counter
+        # $setOnInsert makes concurrent creations a no-op, and the unique
+        # index on dataset_name rejects a second concurrent insert
         new_sequential_id = SequentialID(dataset)
-
-        # get the sequential id arr
-        for i in range(limit):
-            sequential_id_arr.append(new_sequential_id.get_sequential_id())
-
-        # add to collection
-        request.app.dataset_sequential_id_collection.insert_one(new_sequential_id.to_dict())
-
-        return sequential_id_arr
-
-    # if found
-    found_sequential_id = SequentialID(sequential_id["dataset_name"], sequential_id["subfolder_count"],
-                                       sequential_id["file_count"])
-    # get the sequential id arr
-    for i in range(limit):
-        sequential_id_arr.append(found_sequential_id.get_sequential_id())
-
-    new_values = {"$set": found_sequential_id.to_dict()}
-
-    # # update existing sequential id
-    request.app.dataset_sequential_id_collection.update_one({"dataset_name": dataset}, new_values)
-
-    return sequential_id_arr
+        try:
+            request.app.dataset_sequential_id_collection.update_one(
+                {"dataset_name": dataset},
+                {"$setOnInsert": new_sequential_id.to_dict()},
+                upsert=True)
+        except DuplicateKeyError:
+            pass
+
+        sequential_id = request.app.dataset_sequential_id_collection.find_one_and_update(
+            {"dataset_name": dataset},
+            {"$inc": {"file_count": limit}},
+            return_document=ReturnDocument.AFTER)
+
+    return SequentialID.get_sequential_id_range(sequential_id["file_count"], limit)
+
+
+def merge_duplicate_sequential_ids(collection):
+    # the previous find then update allocator could insert several counters
+    # for one dataset. keep the one with the highest file count, so no id is
+    # handed out twice, and the unique index on dataset_name can be built
+    kept_counters = {}
+    duplicate_ids = []
+    for counter in collection.find({}):
+        dataset = counter["dataset_name"]
+        kept_counter = kept_counters.get(dataset)
+        if kept_counter is None:
+            kept_counters[dataset] = counter
+        elif counter["file_count"] > kept_counter["file_count"]:
+            duplicate_ids.append(kept_counter["_id"])
+            kept_counters[dataset] = counter
+        else:
+            duplicate_ids.append(counter["_id"])
+
+    if len(duplicate_ids) > 0:
+        collection.delete_many({"_id": {"$in": duplicate_ids}})
+        print("removed {} duplicate sequential id counters".format(len(duplicate_ids)))
+
+    # the subfolder is derived from the file count, it is no longer stored
+    collection.update_many({"subfolder_count": {"$exists": True}}, {"$unset": {"subfolder_count": ""}})
+
+    return len(duplicate_ids)
 
 
 # -------------------- Dataset rate -------------------------
@@ -4,7 +4,7 @@ from datetime import datetime
 import pymongo
 from utility.minio import cmd
 from utility.path import separate_bucket_and_file_path
-from .api_utils import PrettyJSONResponse
+from .api_utils import PrettyJSONResponse, parse_job_time
 
 
 router = APIRouter()
@@ -94,6 +94,10 @@ def get_random_image_date_range(
         'task_input_dict.dataset': dataset
     }
 
+    # job times are stored as dates
+    start_date = parse_job_time(start_date)
+    end_date = parse_job_time(end_date)
+
     # Update the query based on provided start_date and end_date
     if start_date and end_date:
         query['task_creation_time'] = {'$gte': start_date, '$lte': end_date}
@@ -176,6 +180,10 @@ def get_images_metadata(
         'task_input_dict.dataset': dataset
     }
 
+    # job times are stored as dates
+    start_date = parse_job_time(start_date)
+    end_date = parse_job_time(end_date)
+
     # Update the query based on provided start_date and end_date
     if start_date and end_date:
         query['task_creation_time'] = {'$gte': start_date, '$lte': end_date}
@@ -261,6 +269,10 @@ def sorted_list_metadata(
         'task_input_dict.dataset': dataset
     }
 
+    # job times are stored as dates
+    start_date = parse_job_time(start_date)
+    end_date = parse_job_time(end_date)
+
     # Update the query based on provided start_date and end_date
     if start_date and end_date:
         query['task_creation_time'] = {'$gte': start_date, '$lte': end_date}
@@ -1,15 +1,25 @@
-from fastapi import Request, APIRouter, HTTPException
+from fastapi import Request, APIRouter, HTTPException, Response
 from utility.path import separate_bucket_and_file_path
 from utility.minio import cmd
 import uuid
+import time
+import threading
 from datetime import datetime, timedelta
 from orchestration.api.mongo_schemas import Task
 from orchestration.api.api_dataset import get_sequential_id
 import pymongo
-from .api_utils import PrettyJSONResponse
+from typing import List
+from .api_utils import PrettyJSONResponse, parse_job_times
 
 router = APIRouter()
 
+# how long the aggregated queue status is served from cache
+QUEUE_STATUS_CACHE_SECONDS = 2.0
+# image jobs are the image catalogue and stay in the completed collection
+IMAGE_TASK_TYPES = ["image_generation_task", "inpainting_generation_task"]
+queue_status_cache = {"time": 0.0, "status": None}
+queue_status_cache_lock = threading.Lock()
+
 
 # -------------------- Get -------------------------
 
@@ -61,6 +71,40 @@ def add_job(request: Request, task: Task):
     return {"uuid": task.uuid, "creation_time": task.task_creation_time}
 
 
+@router.post("/queue/image-generation/add-jobs", description="Add a list of jobs to db with a single insert")
+def add_jobs(request: Request, tasks: List[Task]):
+    if len(tasks) == 0:
+        return []
+
+    # all the jobs in the batch share the same creation time
+    task_creation_time = datetime.now()
+
+    # dataset => tasks that need a file path
+    dataset_auto_file_path_tasks = {}
+    for task in tasks:
+        if task.uuid in ["", None]:
+            # generate since its empty
+            task.uuid = str(uuid.uuid4())
+
+        task.task_creation_time = task_creation_time
+
+        # check if file_path is blank
+        if (task.task_input_dict is None or "file_path" not in task.task_input_dict or task.task_input_dict["file_path"] in [
+            '', "[auto]", "[default]"]) and "dataset" in task.task_input_dict:
+            dataset_name = task.task_input_dict["dataset"]
+            dataset_auto_file_path_tasks.setdefault(dataset_name, []).append(task)
+
+    # reserve the sequential ids of each dataset in one go
+    for dataset_name, dataset_tasks in dataset_auto_file_path_tasks.items():
+        sequential_id_arr = get_sequential_id(request, dataset=dataset_name, limit=len(dataset_tasks))
+        for task, sequential_id in zip(dataset_tasks, sequential_id_arr):
+            task.task_input_dict["file_path"] = "{}.jpg".format(sequential_id)
+
+    request.app.pending_jobs_collection.insert_many([task.to_dict() for task in tasks])
+
+    return [{"uuid": task.uuid, "creation_time": task.task_creation_time} for task in tasks]
+
+
 @router.get("/queue/image-generation/get-jobs-count-last-hour")
 def get_jobs_count_last_hour(request: Request, dataset):
 
@@ -71,7 +115,7 @@ def get_jobs_count_last_hour(request: Request, dataset):
     # Query the collection to count the documents created in the last hour
     pending_query = {"task_input_dict.dataset": dataset, "task_creation_time": {"$gte": time_ago}}
     in_progress_query = {"task_input_dict.dataset": dataset, "task_creation_time": {"$gte": time_ago}}
-    completed_query = {"task_input_dict.dataset": dataset, "task_completion_time": {"$gte": time_ago.strftime('%Y-%m-%d %H:%M:%S')}}
+    completed_query = {"task_input_dict.dataset": dataset, "task_completion_time": {"$gte": time_ago}}
 
     count = 0
 
@@ -101,7 +145,7 @@ def get_jobs_count_last_n_hour(request: Request, dataset, hours: int):
     # Query the collection to count the documents created in the last hour
     pending_query = {"task_input_dict.dataset": dataset, "task_creation_time": {"$gte": time_ago}}
     in_progress_query = {"task_input_dict.dataset": dataset, "task_creation_time": {"$gte": time_ago}}
-    completed_query = {"task_input_dict.dataset": dataset, "task_completion_time": {"$gte": time_ago.strftime('%Y-%m-%d %H:%M:%S')}}
+    completed_query = {"task_input_dict.dataset": dataset, "task_completion_time": {"$gte": time_ago}}
 
     count = 0
 
@@ -117,6 +161,85 @@ def get_jobs_count_last_n_hour(request: Request, dataset, hours: int):
     return count
 
 
+def get_dataset_counts(collection, pipeline):
+    dataset_counts = {}
+    for item in collection.aggregate(pipeline):
+        dataset_counts[item["_id"]] = item
+
+    return dataset_counts
+
+
+def compute_queue_status(request: Request):
+    # Calculate the timestamp for one hour ago
+    current_time = datetime.now()
+    time_ago = current_time - timedelta(hours=1)
+
+    # one $group per collection, counts every dataset at once
+    queued_pipeline = [
+        {"$group": {
+            "_id": "$task_input_dict.dataset",
+            "count": {"$sum": 1},
+            "count_last_hour": {"$sum": {"$cond": [{"$gte": ["$task_creation_time", time_ago]}, 1, 0]}},
+        }}
+    ]
+    completed_pipeline = [
+        {"$match": {"task_completion_time": {"$gte": time_ago}}},
+        {"$group": {
+            "_id": "$task_input_dict.dataset",
+            "count_last_hour": {"$sum": 1},
+        }}
+    ]
+
+    pending_counts = get_dataset_counts(request.app.pending_jobs_collection, queued_pipeline)
+    in_progress_counts = get_dataset_counts(request.app.in_progress_jobs_collection, queued_pipeline)
+    completed_counts = get_dataset_counts(request.app.completed_jobs_collection, completed_pipeline)
+
+    datasets = set(pending_counts) | set(in_progress_counts) | set(completed_counts)
+    datasets.discard(None)
+
+    status = {}
+    for dataset in datasets:
+        pending = pending_counts.get(dataset, {})
+        in_progress = in_progress_counts.get(dataset, {})
+        completed = completed_counts.get(dataset, {})
+
+        completed_last_hour = completed.get("count_last_hour", 0)
+        jobs_count_last_hour = (pending.get("count_last_hour", 0) +
+                                in_progress.get("count_last_hour", 0) +
+                                completed_last_hour)
+
+        # prefer the rolling throughput, the last hour average
+        # covers the time right after the api started
+        job_per_second = request.app.job_throughput_tracker.get_dataset_job_per_second(dataset)
+        if job_per_second is None:
+            job_per_second = completed_last_hour / 3600.0
+
+        status[dataset] = {
+            "pending_count": pending.get("count", 0),
+            "in_progress_count": in_progress.get("count", 0),
+            "jobs_count_last_hour": jobs_count_last_hour,
+            "completed_count_last_hour": completed_last_hour,
+            "job_per_second": job_per_second,
+        }
+
+    return status
+
+
+@router.get("/queue/image-generation/status-all", response_class=PrettyJSONResponse)
+def get_queue_status_all(request: Request, response: Response):
+    with queue_status_cache_lock:
+        cache_age = time.time() - queue_status_cache["time"]
+        if queue_status_cache["status"] is None or cache_age > QUEUE_STATUS_CACHE_SECONDS:
+            queue_status_cache["status"] = compute_queue_status(request)
+            queue_status_cache["time"] = time.time()
+
+        status = queue_status_cache["status"]
+
+    response.headers["Cache-Control"] = "max-age={}".format(int(QUEUE_STATUS_CACHE_SECONDS))
+
+    return status
+
+
 # -------------- Get jobs count ----------------------
 @router.get("/queue/image-generation/pending-count")
 def get_pending_job_count(request: Request):
@@ -251,7 +374,11 @@ def update_job_completed(request: Request, task: Task):
         raise HTTPException(status_code=404)
 
     # add to completed
-    request.app.completed_jobs_collection.insert_one(task.to_dict())
+    completed_job = parse_job_times(task.to_dict())
+    request.app.completed_jobs_collection.insert_one(completed_job)
+
+    # update the rolling throughput
+    request.app.job_throughput_tracker.add_completed_job(completed_job)
 
     # remove from in progress
     request.app.in_progress_jobs_collection.delete_one({"uuid": task.uuid})
@@ -267,7 +394,7 @@ def update_job_failed(request: Request, task: Task):
         raise HTTPException(status_code=404)
 
     # add to failed
-    request.app.failed_jobs_collection.insert_one(task.to_dict())
+    request.app.failed_jobs_collection.insert_one(parse_job_times(task.to_dict()))
 
     # remove from in progress
     request.app.in_progress_jobs_collection.delete_one({"uuid": task.uuid})
@@ -295,36 +422,80 @@ def cleanup_completed_and_orphaned_jobs(request: Request):
 
 
 
-# --------------- Job generation rate ---------------------
+# ---------------- Archive -------------------
 
-@router.get("/job/get-dataset-job-per-second")
-def get_job_generation_rate(request: Request, dataset: str, sample_size : int):
 
-    # 1. Take last N=50 image generations (only time stamp when it was submitted)
-    # 2. Sort by Time Stamp
-    # 3. Use TimeStamp of Oldest, divided by N=50;
-    # to get Images/Second = ImageTaskGenerationRate (images/second estimate), over window of last N=50 images
-    query = {
-        'task_input_dict.dataset': dataset
+def archive_jobs(request: Request, collection, query, status: str, batch_size: int):
+    # keep only the fields needed for stats in the history
+    projection = {
+        "uuid": 1,
+        "task_type": 1,
+        "task_input_dict.dataset": 1,
+        "task_creation_time": 1,
+        "task_start_time": 1,
+        "task_completion_time": 1,
+        "task_error_str": 1,
+        "task_output_file_dict.output_file_path": 1,
     }
-    # Query to find the n newest elements based on the task_completion_time
-    jobs = list(request.app.completed_jobs_collection.find(query).sort("task_creation_time",
-                                                                    pymongo.DESCENDING).limit(sample_size))
 
-    total_jobs = len(jobs)
-    if total_jobs == 0:
-        return 1.0
+    archived_count = 0
+    while True:
+        jobs = list(collection.find(query, projection).limit(batch_size))
+        if len(jobs) == 0:
+            break
+
+        history = []
+        for job in jobs:
+            history.append({
+                "uuid": job.get("uuid"),
+                "status": status,
+                "task_type": job.get("task_type"),
+                "dataset": (job.get("task_input_dict") or {}).get("dataset"),
+                "task_creation_time": job.get("task_creation_time"),
+                "task_start_time": job.get("task_start_time"),
+                "task_completion_time": job.get("task_completion_time"),
+                "task_error_str": job.get("task_error_str"),
+                "output_file_path": (job.get("task_output_file_dict") or {}).get("output_file_path"),
+            })
+
+        request.app.jobs_history_collection.insert_many(history)
+        collection.delete_many({"_id": {"$in": [job["_id"] for job in jobs]}})
+
+        archived_count += len(jobs)
+
+    return archived_count
 
-    job_per_second = 0.0
-    for job in jobs:
-        task_start_time = job['task_start_time']
-        task_completion_time = job['task_completion_time']
 
-        task_start_time = datetime.strptime(task_start_time, '%Y-%m-%d %H:%M:%S')
-        task_completion_time = datetime.strptime(task_completion_time, '%Y-%m-%d %H:%M:%S')
+@router.post("/queue/image-generation/archive-old-jobs",
+             description="Move failed jobs and completed non image jobs older than n days to the jobs history")
+def archive_old_jobs(request: Request, days: int = 30, batch_size: int = 1000):
+    time_ago = datetime.now() - timedelta(days=days)
 
-        difference_in_seconds = (task_completion_time - task_start_time).total_seconds()
-        this_job_per_second = 1.0 / difference_in_seconds
-        job_per_second += this_job_per_second / total_jobs
+    failed_query = {"task_completion_time": {"$lt": time_ago}}
+    completed_query = {"task_completion_time": {"$lt": time_ago},
+                       "task_type": {"$nin": IMAGE_TASK_TYPES}}
+
+    failed_count = archive_jobs(request, request.app.failed_jobs_collection, failed_query, "failed", batch_size)
+    completed_count = archive_jobs(request, request.app.completed_jobs_collection, completed_query, "completed", batch_size)
+
+    return {"failed_count": failed_count, "completed_count": completed_count}
+
+
+# --------------- Job generation rate ---------------------
+
+@router.get("/job/get-dataset-job-per-second")
+def get_job_generation_rate(request: Request, dataset: str, sample_size: int = None):
+    # completed jobs per second from the rolling throughput tracker
+    # sample_size is no longer used, kept for older clients
+    job_per_second = request.app.job_throughput_tracker.get_dataset_job_per_second(dataset)
+    if job_per_second is None:
+        return 0.0
 
     return job_per_second
+
+
+@router.get("/job/throughput", response_class=PrettyJSONResponse)
+def get_job_throughput(request: Request, dataset: str = None, task_type: str = None):
+    # ewma & windowed completion rates and latency histograms
+    # per dataset and per task type
+    return request.app.job_throughput_tracker.to_dict(dataset=dataset, task_type=task_type)
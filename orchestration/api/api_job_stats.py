@@ -77,8 +77,8 @@ def get_number_generated_images_per_day(request: Request, start_date: str = Quer
                 {'task_type': 'inpainting_generation_task'}
             ],
             'task_completion_time': {
-                '$gte': current_date.strftime("%Y-%m-%d %H:%M:%S"),
-                '$lte': (current_date + timedelta(days=1)).strftime("%Y-%m-%d %H:%M:%S")
+                '$gte': current_date,
+                '$lte': current_date + timedelta(days=1)
             }
         }
         
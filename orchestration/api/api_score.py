@@ -1,5 +1,5 @@
 from fastapi import Request, APIRouter, HTTPException
-from orchestration.api.mongo_schemas import RankingScore
+from orchestration.api.mongo_schemas import RankingScore, RankingScoreResidualColumns
 
 router = APIRouter()
 
@@ -18,6 +18,34 @@ def set_image_rank_score(request: Request, ranking_score: RankingScore):
     return True
 
 
+@router.post("/score/set-image-rank-scores-and-residuals",
+             description="Set image rank scores, residuals and residual percentiles of a model in one request")
+def set_image_rank_scores_and_residuals(request: Request, columns: RankingScoreResidualColumns):
+    num_images = len(columns.image_hashes)
+    if len(columns.scores) != num_images or len(columns.residuals) != num_images \
+            or len(columns.residual_percentiles) != num_images:
+        raise HTTPException(status_code=422, detail="Scores, residuals and residual percentiles should have one value per image hash.")
+
+    if num_images == 0:
+        return True
+
+    # check if any exists
+    query = {"model_id": columns.model_id,
+             "image_hash": {"$in": columns.image_hashes}}
+    for collection in [request.app.image_scores_collection,
+                       request.app.image_residuals_collection,
+                       request.app.image_residual_percentiles_collection]:
+        count = collection.count_documents(query)
+        if count > 0:
+            raise HTTPException(status_code=409, detail="Score or residual for specific model_id and image_hash already exists.")
+
+    request.app.image_scores_collection.insert_many(columns.to_score_dicts())
+    request.app.image_residuals_collection.insert_many(columns.to_residual_dicts())
+    request.app.image_residual_percentiles_collection.insert_many(columns.to_residual_percentile_dicts())
+
+    return True
+
+
 @router.get("/score/get-image-rank-score-by-hash", description="Get image rank score by hash")
 def get_image_rank_score_by_hash(request: Request, image_hash: str, model_id: int):
     # check if exist
@@ -1,6 +1,47 @@
 from starlette.responses import Response
+from datetime import datetime
+from dateutil.parser import parse
 import json, typing
 
+# job time fields, stored as native dates
+JOB_TIME_FIELDS = ["task_creation_time", "task_start_time", "task_completion_time"]
+
+
+def parse_job_time(value):
+    # workers send job times as strings, convert them to datetime
+    # so they are stored as native dates
+    if value is None or isinstance(value, datetime):
+        return value
+
+    if value == "":
+        return None
+
+    try:
+        return datetime.strptime(value, '%Y-%m-%d %H:%M:%S')
+    except ValueError:
+        pass
+
+    try:
+        return parse(value)
+    except (ValueError, OverflowError):
+        return None
+
+
+def parse_job_times(job: dict):
+    for field in JOB_TIME_FIELDS:
+        if field in job:
+            job[field] = parse_job_time(job[field])
+
+    return job
+
+
+def json_default(value):
+    if isinstance(value, datetime):
+        return str(value)
+
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
 class PrettyJSONResponse(Response):
     media_type = "application/json"
 
@@ -11,4 +52,5 @@ class PrettyJSONResponse(Response):
             allow_nan=False,
             indent=4,
             separators=(", ", ": "),
-        ).encode("utf-8")
\ No newline at end of file
+            default=json_default,
+        ).encode("utf-8")
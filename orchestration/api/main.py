@@ -1,10 +1,11 @@
 from fastapi import FastAPI, Request, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 import pymongo
+from datetime import datetime, timedelta
 from bson.objectid import ObjectId
 from dotenv import dotenv_values
 from orchestration.api.api_clip import router as clip_router
-from orchestration.api.api_dataset import router as dataset_router
+from orchestration.api.api_dataset import router as dataset_router, merge_duplicate_sequential_ids
 from orchestration.api.api_image import router as image_router
 from orchestration.api.api_job_stats import router as job_stats_router
 from orchestration.api.api_job import router as job_router
@@ -18,9 +19,15 @@ from orchestration.api.api_score import router as score_router
 from orchestration.api.api_residual import router as residual_router
 from orchestration.api.api_percentile import router as percentile_router
 from orchestration.api.api_residual_percentile import router as residual_percentile_router
+from orchestration.api.throughput_tracker import ThroughputTracker
 from utility.minio import cmd
 
 config = dotenv_values("./orchestration/api/.env")
+
+# days archived jobs are kept in the jobs history
+JOBS_HISTORY_TTL_DAYS = 180
+# completed jobs replayed into the job throughput at startup
+JOB_THROUGHPUT_REPLAY_SECONDS = 60 * 60
 app = FastAPI(title="Orchestration API")
 
 app.add_middleware(
@@ -68,6 +75,40 @@ def add_models_counter():
     return True
 
 
+def create_job_indexes():
+    # job times are native dates, these indexes serve
+    # the per dataset time range counts
+    creation_time_index = [("task_input_dict.dataset", pymongo.ASCENDING), ("task_creation_time", pymongo.ASCENDING)]
+    completion_time_index = [("task_input_dict.dataset", pymongo.ASCENDING), ("task_completion_time", pymongo.ASCENDING)]
+
+    app.pending_jobs_collection.create_index(creation_time_index)
+    app.in_progress_jobs_collection.create_index(creation_time_index)
+    app.completed_jobs_collection.create_index(completion_time_index)
+    app.failed_jobs_collection.create_index(completion_time_index)
+
+    # used by the archival of old jobs
+    app.completed_jobs_collection.create_index([("task_completion_time", pymongo.ASCENDING)])
+    app.failed_jobs_collection.create_index([("task_completion_time", pymongo.ASCENDING)])
+
+    # history entries expire on their own
+    app.jobs_history_collection.create_index([("task_completion_time", pymongo.ASCENDING)],
+                                             expireAfterSeconds=JOBS_HISTORY_TTL_DAYS * 24 * 60 * 60)
+    app.jobs_history_collection.create_index([("dataset", pymongo.ASCENDING), ("task_completion_time", pymongo.ASCENDING)])
+
+
+def load_job_throughput():
+    # the tracker is in memory, replay the recently completed jobs
+    # so the throughput is known right after a restart
+    since = datetime.now() - timedelta(seconds=JOB_THROUGHPUT_REPLAY_SECONDS)
+    jobs = app.completed_jobs_collection.find(
+        {"task_completion_time": {"$gte": since}},
+        {"task_type": 1, "task_input_dict.dataset": 1, "task_start_time": 1, "task_completion_time": 1}
+    ).sort("task_completion_time", pymongo.ASCENDING)
+
+    num_jobs = app.job_throughput_tracker.add_completed_jobs(jobs)
+    print("Replayed {} completed jobs into the job throughput".format(num_jobs))
+
+
 @app.on_event("startup")
 def startup_db_client():
     # add creation of mongodb here for now
@@ -79,8 +120,15 @@ def startup_db_client():
     app.completed_jobs_collection = app.mongodb_db["completed-jobs"]
     app.failed_jobs_collection = app.mongodb_db["failed-jobs"]
 
+    # compact history of archived completed & failed jobs
+    app.jobs_history_collection = app.mongodb_db["jobs-history"]
+    create_job_indexes()
+
     # used to store sequential ids of generated images
     app.dataset_sequential_id_collection = app.mongodb_db["dataset-sequential-id"]
+    # one counter per dataset, makes the counter upsert race free
+    merge_duplicate_sequential_ids(app.dataset_sequential_id_collection)
+    app.dataset_sequential_id_collection.create_index("dataset_name", unique=True)
 
     # for training jobs
     app.training_pending_jobs_collection = app.mongodb_db["training-pending-jobs"]
@@ -114,6 +162,10 @@ def startup_db_client():
     # residual percentiles
     app.image_residual_percentiles_collection = app.mongodb_db["image-residual-percentiles"]
 
+    # rolling job throughput, updated on every completed job
+    app.job_throughput_tracker = ThroughputTracker()
+    load_job_throughput()
+
     print("Connected to the MongoDB database!")
 
     # get minio client
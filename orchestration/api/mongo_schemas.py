@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field, constr
-from typing import Union, Optional
+from typing import Union, Optional, List
 
 
 class Task(BaseModel):
@@ -39,6 +39,7 @@ class SequentialID:
     dataset_name: str
     subfolder_count: int = 0
     file_count: int = -1
+    max_num_files: int = 1000
 
     def __init__(self, dataset_name: str, subfolder_count=1, file_count=-1):
         self.dataset_name = dataset_name
@@ -46,10 +47,8 @@ class SequentialID:
         self.file_count = file_count
 
     def add_count(self):
-        max_num_files = 1000
-
         self.file_count += 1
-        if self.file_count != 0 and self.file_count % max_num_files == 0:
+        if self.file_count != 0 and self.file_count % self.max_num_files == 0:
             self.subfolder_count += 1
 
     def get_sequential_id(self) -> str:
@@ -57,10 +56,24 @@ class SequentialID:
 
         return "{0:04}/{1:06}".format(self.subfolder_count, self.file_count)
 
+    @staticmethod
+    def get_sequential_id_range(last_file_count: int, limit: int) -> list:
+        # returns the ids of the block of `limit` files ending at last_file_count
+        # the subfolder is derived from the file count, every subfolder
+        # holds max_num_files files and the first subfolder is 1
+        first_file_count = last_file_count - limit + 1
+
+        sequential_id_arr = []
+        for file_count in range(first_file_count, last_file_count + 1):
+            subfolder_count = 1 + file_count // SequentialID.max_num_files
+            sequential_id_arr.append("{0:04}/{1:06}".format(subfolder_count, file_count))
+
+        return sequential_id_arr
+
     def to_dict(self):
+        # the subfolder is derived from the file count, so only the count is stored
         return {
             "dataset_name": self.dataset_name,
-            "subfolder_count": self.subfolder_count,
             "file_count": self.file_count
         }
 
@@ -293,6 +306,27 @@ class RankingResidual(BaseModel):
         }
 
 
+# score, residual and residual percentile of every image of a model, as columns
+class RankingScoreResidualColumns(BaseModel):
+    model_id: int
+    image_hashes: List[str]
+    scores: List[float]
+    residuals: List[float]
+    residual_percentiles: List[float]
+
+    def to_score_dicts(self):
+        return [{"model_id": self.model_id, "image_hash": image_hash, "score": score}
+                for image_hash, score in zip(self.image_hashes, self.scores)]
+
+    def to_residual_dicts(self):
+        return [{"model_id": self.model_id, "image_hash": image_hash, "residual": residual}
+                for image_hash, residual in zip(self.image_hashes, self.residuals)]
+
+    def to_residual_percentile_dicts(self):
+        return [{"model_id": self.model_id, "image_hash": image_hash, "residual_percentile": residual_percentile}
+                for image_hash, residual_percentile in zip(self.image_hashes, self.residual_percentiles)]
+
+
 class RankingPercentile(BaseModel):
     model_id: int
     image_hash: str
@@ -0,0 +1,219 @@
+import math
+import threading
+import time
+from datetime import datetime
+
+# upper bounds of the latency histogram bins, in seconds
+LATENCY_HISTOGRAM_BINS = [1, 2, 5, 10, 20, 30, 60, 120, 300, 600, math.inf]
+
+
+# rolling completion statistics of one dataset or task type
+# every update is O(1):
+# - ewma rate: exponentially decayed completion count divided by the time constant
+# - windowed rate: completions in a ring of fixed size time buckets
+# - capacity rate: the highest ewma rate seen, decaying slowly
+# - latency: ewma of the job duration and a fixed bin histogram
+class RateStats:
+    def __init__(self, ewma_time_constant=300.0, bucket_seconds=5.0, num_buckets=60, latency_alpha=0.1,
+                 capacity_decay_time=6 * 3600.0):
+        self.ewma_time_constant = ewma_time_constant
+        self.bucket_seconds = bucket_seconds
+        self.num_buckets = num_buckets
+        self.latency_alpha = latency_alpha
+        self.capacity_decay_time = capacity_decay_time
+
+        self.completed_count = 0
+        self.decayed_count = 0.0
+        self.last_update_time = None
+        self.first_update_time = None
+
+        # ring buffer of (bucket index, count)
+        self.bucket_index = [-1] * num_buckets
+        self.bucket_count = [0] * num_buckets
+
+        self.latency_ewma = None
+        self.latency_histogram = [0] * len(LATENCY_HISTOGRAM_BINS)
+
+        # highest ewma rate and when it was seen
+        self.peak_rate = 0.0
+        self.peak_time = None
+
+    def add_completion(self, now, latency_seconds=None):
+        if self.first_update_time is None:
+            self.first_update_time = now
+
+        # decay the count to now then add this completion
+        if self.last_update_time is not None:
+            self.decayed_count *= math.exp(-(now - self.last_update_time) / self.ewma_time_constant)
+        self.decayed_count += 1.0
+        self.last_update_time = now
+        self.completed_count += 1
+
+        # windowed count
+        index = int(now // self.bucket_seconds)
+        slot = index % self.num_buckets
+        if self.bucket_index[slot] != index:
+            self.bucket_index[slot] = index
+            self.bucket_count[slot] = 0
+        self.bucket_count[slot] += 1
+
+        # only once the ewma covers a full time constant, the first
+        # completions give a noisy rate
+        if now - self.first_update_time >= self.ewma_time_constant:
+            ewma_rate = self.get_ewma_rate(now)
+            if ewma_rate >= self.get_decayed_peak_rate(now):
+                self.peak_rate = ewma_rate
+                self.peak_time = now
+
+        if latency_seconds is None or latency_seconds < 0:
+            return
+
+        if self.latency_ewma is None:
+            self.latency_ewma = latency_seconds
+        else:
+            self.latency_ewma += self.latency_alpha * (latency_seconds - self.latency_ewma)
+
+        for bin_index, upper_bound in enumerate(LATENCY_HISTOGRAM_BINS):
+            if latency_seconds <= upper_bound:
+                self.latency_histogram[bin_index] += 1
+                break
+
+    def get_ewma_rate(self, now):
+        if self.last_update_time is None:
+            return 0.0
+
+        decayed_count = self.decayed_count * math.exp(-(now - self.last_update_time) / self.ewma_time_constant)
+
+        # during warm up the decayed count only covers the time since the first completion
+        elapsed = now - self.first_update_time
+        warm_up = 1.0 - math.exp(-elapsed / self.ewma_time_constant) if elapsed > 0 else 0.0
+        if warm_up < 1e-3:
+            return 0.0
+
+        return decayed_count / (self.ewma_time_constant * warm_up)
+
+    def get_decayed_peak_rate(self, now):
+        if self.peak_time is None:
+            return 0.0
+
+        return self.peak_rate * math.exp(-max(now - self.peak_time, 0.0) / self.capacity_decay_time)
+
+    # completions per second the workers sustain for this dataset.
+    # the completion rate is capped by the jobs in the queue, so sizing the
+    # queue by it would shrink the queue every time it runs low. the highest
+    # rate seen only decays with capacity_decay_time instead
+    def get_capacity_rate(self, now):
+        return max(self.get_ewma_rate(now), self.get_decayed_peak_rate(now))
+
+    def get_window_rate(self, now):
+        current_index = int(now // self.bucket_seconds)
+        first_index = current_index - self.num_buckets + 1
+
+        count = 0
+        for slot in range(self.num_buckets):
+            if first_index <= self.bucket_index[slot] <= current_index:
+                count += self.bucket_count[slot]
+
+        # do not average over time before the first completion
+        window_seconds = self.num_buckets * self.bucket_seconds
+        if self.first_update_time is not None:
+            window_seconds = min(window_seconds, max(now - self.first_update_time, self.bucket_seconds))
+
+        return count / window_seconds
+
+    def to_dict(self, now):
+        return {
+            "completed_count": self.completed_count,
+            "ewma_job_per_second": self.get_ewma_rate(now),
+            "window_job_per_second": self.get_window_rate(now),
+            "window_seconds": self.num_buckets * self.bucket_seconds,
+            "capacity_job_per_second": self.get_capacity_rate(now),
+            "latency_ewma_seconds": self.latency_ewma,
+            "latency_histogram": {
+                "bins": [str(upper_bound) for upper_bound in LATENCY_HISTOGRAM_BINS],
+                "counts": list(self.latency_histogram),
+            },
+        }
+
+
+# per dataset and per task type completion statistics, kept in memory
+# the api replays the recently completed jobs at startup, so the statistics
+# survive a restart
+class ThroughputTracker:
+    def __init__(self, **rate_stats_kwargs):
+        self.rate_stats_kwargs = rate_stats_kwargs
+        self.dataset_stats = {}
+        self.task_type_stats = {}
+        self.lock = threading.Lock()
+
+    def get_stats(self, stats_dict, key):
+        stats = stats_dict.get(key)
+        if stats is None:
+            stats = RateStats(**self.rate_stats_kwargs)
+            stats_dict[key] = stats
+
+        return stats
+
+    # now is the completion time in seconds since the epoch, the current time by default
+    def add_completed_job(self, job: dict, now=None):
+        if now is None:
+            now = time.time()
+        latency_seconds = get_job_latency_seconds(job)
+
+        task_input_dict = job.get("task_input_dict") or {}
+        dataset = task_input_dict.get("dataset")
+        task_type = job.get("task_type")
+
+        with self.lock:
+            if dataset is not None:
+                self.get_stats(self.dataset_stats, dataset).add_completion(now, latency_seconds)
+            if task_type is not None:
+                self.get_stats(self.task_type_stats, task_type).add_completion(now, latency_seconds)
+
+    # completed jobs in the order they completed, with native date completion times
+    def add_completed_jobs(self, jobs):
+        num_jobs = 0
+        for job in jobs:
+            task_completion_time = job.get("task_completion_time")
+            if not isinstance(task_completion_time, datetime):
+                continue
+            self.add_completed_job(job, now=task_completion_time.timestamp())
+            num_jobs += 1
+
+        return num_jobs
+
+    # the jobs per second the dataset queue is sized for, see RateStats.get_capacity_rate
+    def get_dataset_job_per_second(self, dataset):
+        with self.lock:
+            stats = self.dataset_stats.get(dataset)
+            if stats is None:
+                return None
+
+            return stats.get_capacity_rate(time.time())
+
+    def to_dict(self, dataset=None, task_type=None):
+        now = time.time()
+        with self.lock:
+            datasets = {name: stats.to_dict(now) for name, stats in self.dataset_stats.items()
+                        if dataset is None or name == dataset}
+            task_types = {name: stats.to_dict(now) for name, stats in self.task_type_stats.items()
+                          if task_type is None or name == task_type}
+
+        return {
+            "datasets": datasets,
+            "task_types": task_types,
+        }
+
+
+def get_job_latency_seconds(job: dict):
+    try:
+        task_start_time = job.get("task_start_time")
+        task_completion_time = job.get("task_completion_time")
+        if isinstance(task_start_time, str):
+            task_start_time = datetime.strptime(task_start_time, '%Y-%m-%d %H:%M:%S')
+        if isinstance(task_completion_time, str):
+            task_completion_time = datetime.strptime(task_completion_time, '%Y-%m-%d %H:%M:%S')
+
+        return (task_completion_time - task_start_time).total_seconds()
+    except Exception:
+        return None
@@ -68,6 +68,23 @@ def http_get_jobs_count_last_hour(dataset_name: str):
     return 0
 
 
+# pending, in progress, last hour & throughput figures of every dataset
+def http_get_queue_status_all():
+    url = SERVER_ADRESS + "/queue/image-generation/status-all"
+
+    try:
+        response = requests.get(url)
+
+        if response.status_code == 200:
+            job_json = response.json()
+            return job_json
+
+    except Exception as e:
+        print('request exception ', e)
+
+    return None
+
+
 def http_get_dataset_list():
     url = SERVER_ADRESS + "/dataset/list"
 
@@ -179,8 +196,8 @@ def http_get_dataset_top_k_value(dataset : str):
     return None
 
 
-def http_get_dataset_job_per_second(dataset : str, sample_size : int):
-    url = SERVER_ADRESS + f"/job/get-dataset-job-per-second?dataset={dataset}&sample_size={sample_size}"
+def http_get_dataset_job_per_second(dataset : str):
+    url = SERVER_ADRESS + f"/job/get-dataset-job-per-second?dataset={dataset}"
 
     try:
         response = requests.get(url)
@@ -11,10 +11,12 @@ sys.path.insert(0, base_directory)
 from prompt_job_generator_state import PromptJobGeneratorState
 from prompt_job_generator_functions import (generate_icon_generation_jobs, generate_character_generation_jobs, generate_mechs_image_generation_jobs,
 generate_propaganda_posters_image_generation_jobs, generate_environmental_image_generation_jobs, generate_waifu_image_generation_jobs)
-from prompt_job_generator.http_requests.request import (http_get_in_progress_jobs_count, http_get_pending_jobs_count, http_get_dataset_list,
-                                                        http_get_dataset_job_per_second, http_get_jobs_count_last_hour,
+from prompt_job_generator.http_requests.request import (http_get_dataset_list, http_get_queue_status_all,
                                                         http_get_all_dataset_config, http_get_dataset_model_list)
-from prompt_job_generator_constants import JOB_PER_SECOND_SAMPLE_SIZE, DEFAULT_TOP_K_VALUE, DEFAULT_DATASET_RATE
+from prompt_job_generator_constants import (DEFAULT_TOP_K_VALUE, DEFAULT_DATASET_RATE,
+                                            SEQUENTIAL_ID_LEASE_BLOCK_SIZE, MINIMUM_JOB_PER_SECOND,
+                                            JOB_QUEUE_TARGET_SECONDS)
+from worker.prompt_generation.prompt_generator import add_dataset_jobs, SequentialIdLease
 
 from utility.path import separate_bucket_and_file_path
 
@@ -133,26 +135,29 @@ def update_dataset_job_queue_size(prompt_job_generator_state, list_datasets):
     if list_datasets is None:
         return
 
+    # get the queue status of all datasets with a single request
+    queue_status = http_get_queue_status_all()
+
+    if queue_status is None:
+        return
+
     # loop through all datasets and
     # for each dataset update the job_queue_size & job_queue_target
     # from orchestration api rates
     for dataset in list_datasets:
 
-        # get the number of jobs available for the dataset
-        in_progress_job_count = http_get_in_progress_jobs_count(dataset)
-        pending_job_count = http_get_pending_jobs_count(dataset)
-        job_per_second = http_get_dataset_job_per_second(dataset, JOB_PER_SECOND_SAMPLE_SIZE)
-        jobs_count_last_hour = http_get_jobs_count_last_hour(dataset)
-
-        if job_per_second is None:
-            job_per_second = 0.2
+        # datasets without any job are not in the status
+        dataset_status = queue_status.get(dataset, {})
 
-        if job_per_second == 0:
-            job_per_second = 0.2
+        # get the number of jobs available for the dataset
+        in_progress_job_count = dataset_status.get('in_progress_count', 0)
+        pending_job_count = dataset_status.get('pending_count', 0)
+        job_per_second = dataset_status.get('job_per_second', None)
+        jobs_count_last_hour = dataset_status.get('jobs_count_last_hour', 0)
 
-        # TODO remove this bullshit
-        if job_per_second > 1:
-            job_per_second = 0.2
+        # the throughput is unknown until jobs of the dataset complete
+        if job_per_second is None or job_per_second < MINIMUM_JOB_PER_SECOND:
+            job_per_second = MINIMUM_JOB_PER_SECOND
 
         if in_progress_job_count is None or pending_job_count is None:
             continue
@@ -170,7 +175,7 @@ def update_dataset_job_queue_size(prompt_job_generator_state, list_datasets):
         job_queue_size = in_progress_job_count + pending_job_count
         # Target number of Jobs in Queue
         # Equals: Time Speed (Jobs/Second) times 60*5 (300); 5 minutes
-        job_queue_target = int(60 * 5 * job_per_second)
+        job_queue_target = int(JOB_QUEUE_TARGET_SECONDS * job_per_second)
 
         # make sure the queue target size is allways smaller than the maximum queue size
         if job_queue_target > maximum_jobs_to_add:
@@ -329,6 +334,11 @@ def main():
     thread = threading.Thread(target=update_dataset_prompt_queue_background_thread, args=(prompt_job_generator_state,))
     thread.start()
 
+    # optionally prefetch sequential ids in blocks
+    sequential_id_lease = None
+    if SEQUENTIAL_ID_LEASE_BLOCK_SIZE > 0:
+        sequential_id_lease = SequentialIdLease(SEQUENTIAL_ID_LEASE_BLOCK_SIZE)
+
     print('starting prompt job generator')
     while True:
         # dictionary that maps dataset => number of jobs to add
@@ -367,8 +377,12 @@ def main():
         #- for each Dataset, TodoJob[i] += DatasetRate[i] / TotalRate
         #- then at end of loop, if >1.0, then emit job for that dataset
         dataset_todo_jobs = {}
+        # dictionary that maps dataset => jobs created this tick
+        # the jobs are submitted in bulk at the end of the tick
+        dataset_jobs = {}
         for dataset in list_datasets:
             dataset_todo_jobs[dataset] = 0
+            dataset_jobs[dataset] = []
 
         # Make sure we stop lopping
         # If there are no added jobs
@@ -415,8 +429,17 @@ def main():
                     dataset_number_jobs_to_add[dataset] = number_of_jobs_to_add - 1
 
                     print(f'number of jobs to spawn for dataset {dataset} is {number_of_jobs_to_add}')
-                    # Adding a job
-                    dataset_callback(prompt_job_generator_state)
+                    # Creating a job
+                    job = dataset_callback(prompt_job_generator_state)
+                    if job is not None:
+                        dataset_jobs[dataset].append(job)
+
+        # submit the jobs of each dataset
+        # one sequential id request & one add request per dataset
+        for dataset in list_datasets:
+            number_of_added_jobs = add_dataset_jobs(dataset, dataset_jobs[dataset], sequential_id_lease)
+            if number_of_added_jobs > 0:
+                print(f'added {number_of_added_jobs} jobs for dataset {dataset}')
 
         # sleep for n number of seconds
         time_to_sleep_in_seconds = 2
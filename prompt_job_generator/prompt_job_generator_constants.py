@@ -6,5 +6,10 @@ DEFAULT_PROMPT_GENERATION_POLICY = 'top-k'
 DEFAULT_TOP_K_VALUE = 0.1
 DEFAULT_DATASET_RATE = 1
 DEFAULT_HOURLY_LIMIT = 9999999
-JOB_PER_SECOND_SAMPLE_SIZE = 50
-PROMPT_QUEUE_SIZE = 32
\ No newline at end of file
+# used as the dataset throughput until its jobs start completing
+MINIMUM_JOB_PER_SECOND = 0.2
+# seconds of work the job queue of each dataset should hold
+JOB_QUEUE_TARGET_SECONDS = 60 * 5
+PROMPT_QUEUE_SIZE = 32
+# number of sequential ids leased per request, 0 disables leasing
+SEQUENTIAL_ID_LEASE_BLOCK_SIZE = 0
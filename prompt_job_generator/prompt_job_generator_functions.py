@@ -4,8 +4,14 @@ import sys
 base_directory = "./"
 sys.path.insert(0, base_directory)
 
-from worker.prompt_generation.prompt_generator import (generate_inpainting_job,
-                                                       generate_image_generation_jobs)
+from worker.prompt_generation.prompt_generator import (create_inpainting_job,
+                                                       create_image_generation_job)
+
+
+# each of these callbacks builds one job for its dataset
+# and returns it without submitting it, the jobs are
+# submitted in bulk once per tick by the caller
+
 def generate_icon_generation_jobs(prompt_job_generator_state):
 
     dataset_name = 'icons'
@@ -18,13 +24,13 @@ def generate_icon_generation_jobs(prompt_job_generator_state):
         init_img_path = mask['init_image']
         mask_path = mask['mask']
 
-    print(f"Adding '{dataset_name}' generation job")
+    print(f"Creating '{dataset_name}' generation job")
 
     prompt_queue = prompt_job_generator_state.prompt_queue
     scored_prompt = prompt_queue.get_dataset_prompt(dataset_name)
 
     if scored_prompt is None:
-        return
+        return None
 
     positive_prompt = scored_prompt.positive_prompt
     negative_prompt = scored_prompt.negative_prompt
@@ -33,7 +39,7 @@ def generate_icon_generation_jobs(prompt_job_generator_state):
     prompt_generation_policy = scored_prompt.generation_policy
     top_k = scored_prompt.top_k
 
-    generate_inpainting_job(
+    return create_inpainting_job(
         positive_prompt=positive_prompt,
         negative_prompt=negative_prompt,
         prompt_scoring_model=prompt_scoring_model,
@@ -56,13 +62,13 @@ def generate_character_generation_jobs(prompt_job_generator_state):
         init_img_path = mask['init_image']
         mask_path = mask['mask']
 
-    print(f"Adding '{dataset_name}' generation job")
+    print(f"Creating '{dataset_name}' generation job")
 
     prompt_queue = prompt_job_generator_state.prompt_queue
     scored_prompt = prompt_queue.get_dataset_prompt(dataset_name)
 
     if scored_prompt is None:
-        return
+        return None
 
     positive_prompt = scored_prompt.positive_prompt
     negative_prompt = scored_prompt.negative_prompt
@@ -71,7 +77,7 @@ def generate_character_generation_jobs(prompt_job_generator_state):
     prompt_generation_policy = scored_prompt.generation_policy
     top_k = scored_prompt.top_k
 
-    generate_inpainting_job(
+    return create_inpainting_job(
         positive_prompt=positive_prompt,
         negative_prompt=negative_prompt,
         prompt_scoring_model=prompt_scoring_model,
@@ -88,13 +94,13 @@ def generate_propaganda_posters_image_generation_jobs(prompt_job_generator_state
 
     dataset_name = 'propaganda-poster'
 
-    print(f"Adding '{dataset_name}' generation job")
+    print(f"Creating '{dataset_name}' generation job")
 
     prompt_queue = prompt_job_generator_state.prompt_queue
     scored_prompt = prompt_queue.get_dataset_prompt(dataset_name)
 
     if scored_prompt is None:
-        return
+        return None
 
     positive_prompt = scored_prompt.positive_prompt
     negative_prompt = scored_prompt.negative_prompt
@@ -103,7 +109,7 @@ def generate_propaganda_posters_image_generation_jobs(prompt_job_generator_state
     prompt_generation_policy = scored_prompt.generation_policy
     top_k = scored_prompt.top_k
 
-    generate_image_generation_jobs(
+    return create_image_generation_job(
         positive_prompt=positive_prompt,
         negative_prompt=negative_prompt,
         prompt_scoring_model=prompt_scoring_model,
@@ -118,13 +124,13 @@ def generate_environmental_image_generation_jobs(prompt_job_generator_state):
 
     dataset_name = 'environmental'
 
-    print(f"Adding '{dataset_name}' generation job")
+    print(f"Creating '{dataset_name}' generation job")
 
     prompt_queue = prompt_job_generator_state.prompt_queue
     scored_prompt = prompt_queue.get_dataset_prompt(dataset_name)
 
     if scored_prompt is None:
-        return
+        return None
 
     positive_prompt = scored_prompt.positive_prompt
     negative_prompt = scored_prompt.negative_prompt
@@ -133,7 +139,7 @@ def generate_environmental_image_generation_jobs(prompt_job_generator_state):
     prompt_generation_policy = scored_prompt.generation_policy
     top_k = scored_prompt.top_k
 
-    generate_image_generation_jobs(
+    return create_image_generation_job(
         positive_prompt=positive_prompt,
         negative_prompt=negative_prompt,
         prompt_scoring_model=prompt_scoring_model,
@@ -147,13 +153,13 @@ def generate_waifu_image_generation_jobs(prompt_job_generator_state):
 
     dataset_name = 'waifu'
 
-    print(f"Adding '{dataset_name}' generation job")
+    print(f"Creating '{dataset_name}' generation job")
 
     prompt_queue = prompt_job_generator_state.prompt_queue
     scored_prompt = prompt_queue.get_dataset_prompt(dataset_name)
 
     if scored_prompt is None:
-        return
+        return None
 
     positive_prompt = scored_prompt.positive_prompt
     negative_prompt = scored_prompt.negative_prompt
@@ -162,7 +168,7 @@ def generate_waifu_image_generation_jobs(prompt_job_generator_state):
     prompt_generation_policy = scored_prompt.generation_policy
     top_k = scored_prompt.top_k
 
-    generate_image_generation_jobs(
+    return create_image_generation_job(
         positive_prompt=positive_prompt,
         negative_prompt=negative_prompt,
         prompt_scoring_model=prompt_scoring_model,
@@ -186,13 +192,13 @@ def generate_mechs_image_generation_jobs(prompt_job_generator_state):
         init_img_path = mask['init_image']
         mask_path = mask['mask']
 
-    print(f"Adding '{dataset_name}' generation job")
+    print(f"Creating '{dataset_name}' generation job")
 
     prompt_queue = prompt_job_generator_state.prompt_queue
     scored_prompt = prompt_queue.get_dataset_prompt(dataset_name)
 
     if scored_prompt is None:
-        return
+        return None
 
     positive_prompt = scored_prompt.positive_prompt
     negative_prompt = scored_prompt.negative_prompt
@@ -201,7 +207,7 @@ def generate_mechs_image_generation_jobs(prompt_job_generator_state):
     prompt_generation_policy = scored_prompt.generation_policy
     top_k = scored_prompt.top_k
 
-    generate_inpainting_job(
+    return create_inpainting_job(
         positive_prompt=positive_prompt,
         negative_prompt=negative_prompt,
         prompt_scoring_model=prompt_scoring_model,
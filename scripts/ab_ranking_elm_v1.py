@@ -34,6 +34,9 @@ def parse_arguments():
     parser.add_argument('--duplicate-flip-option', type=int, default=0)
     parser.add_argument('--randomize-data-per-epoch', type=bool, default=True)
     parser.add_argument('--elm-sparsity', type=float, default=0.5)
+    parser.add_argument('--elm-hidden-size', type=int, default=None,
+                        help='Width of the random layers, defaults to the input size')
+    parser.add_argument('--fit-method', type=str, default="gradient", choices=["gradient", "closed-form"])
 
     return parser.parse_args()
 
@@ -63,7 +66,9 @@ if __name__ == '__main__':
                       target_option=args.target_option,
                       duplicate_flip_option=args.duplicate_flip_option,
                       randomize_data_per_epoch=args.randomize_data_per_epoch,
-                      elm_sparsity=args.elm_sparsity)
+                      elm_sparsity=args.elm_sparsity,
+                      elm_hidden_size=args.elm_hidden_size,
+                      fit_method=args.fit_method)
     else:
         # if all, train models for all existing datasets
         # get dataset name list
@@ -92,6 +97,8 @@ if __name__ == '__main__':
                               target_option=args.target_option,
                               duplicate_flip_option=args.duplicate_flip_option,
                               randomize_data_per_epoch=args.randomize_data_per_epoch,
-                              elm_sparsity=args.elm_sparsity)
+                              elm_sparsity=args.elm_sparsity,
+                              elm_hidden_size=args.elm_hidden_size,
+                              fit_method=args.fit_method)
             except Exception as e:
                 print("Error training model for {}: {}".format(dataset, e))
@@ -0,0 +1,113 @@
+import os
+import sys
+import time
+import json
+import resource
+import argparse
+import subprocess
+import torch
+
+base_directory = os.getcwd()
+sys.path.insert(0, base_directory)
+
+from stable_diffusion.model import attention
+from stable_diffusion.model.unet.unet_attention import CrossAttention
+from stable_diffusion.model.vae.auxiliary_classes import AttnBlock
+
+# latent space resolution reduction of the autoencoder
+LATENT_FACTOR = 8
+# attention layers with the most tokens, at the first level of the u-net and in the middle of the autoencoder
+LAYERS = ["unet-self", "unet-cross", "vae"]
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Benchmark peak memory and latency of the attention backends on cpu")
+
+    parser.add_argument('--resolutions', type=str, default="512,768")
+    parser.add_argument('--backends', type=str, default=",".join(attention.ATTENTION_BACKENDS))
+    parser.add_argument('--batch-size', type=int, default=1)
+    parser.add_argument('--chunk-memory-budget', type=int, default=256 * 1024 * 1024)
+    parser.add_argument('--repeats', type=int, default=2)
+    # runs one measurement, the benchmark starts a process per measurement so peak memory is not shared
+    parser.add_argument('--single', type=str, default=None, help=argparse.SUPPRESS)
+
+    return parser.parse_args()
+
+
+def get_layer_and_inputs(layer, resolution, batch_size):
+    latent_size = resolution // LATENT_FACTOR
+    if layer == "unet-self":
+        return CrossAttention(320, 320, 8, 40), (torch.randn(batch_size, latent_size * latent_size, 320),)
+    if layer == "unet-cross":
+        return CrossAttention(320, 768, 8, 40), (torch.randn(batch_size, latent_size * latent_size, 320),
+                                                 torch.randn(batch_size, 77, 768))
+    if layer == "vae":
+        # the autoencoder attends at the latent resolution with 512 channels
+        return AttnBlock(512), (torch.randn(batch_size, 512, latent_size, latent_size),)
+
+    raise Exception("layer is not supported: {}".format(layer))
+
+
+def get_max_rss_bytes():
+    # kilobytes on linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def run_single(layer, resolution, backend, batch_size, chunk_memory_budget, repeats):
+    attention.set_attention_backend(backend, chunk_memory_budget=chunk_memory_budget)
+    torch.manual_seed(0)
+    module, inputs = get_layer_and_inputs(layer, resolution, batch_size)
+
+    base_rss = get_max_rss_bytes()
+    latencies = []
+    with torch.no_grad():
+        for _ in range(repeats):
+            start_time = time.time()
+            module(*inputs)
+            latencies.append(time.time() - start_time)
+
+    return {"latency": min(latencies), "peak-memory": get_max_rss_bytes() - base_rss}
+
+
+def run_in_process(args, layer, resolution, backend):
+    single = "{},{},{}".format(layer, resolution, backend)
+    command = [sys.executable, os.path.abspath(__file__),
+               "--single", single,
+               "--batch-size", str(args.batch_size),
+               "--chunk-memory-budget", str(args.chunk_memory_budget),
+               "--repeats", str(args.repeats)]
+    process = subprocess.run(command, capture_output=True, text=True)
+    if process.returncode != 0:
+        # usually out of memory
+        return None
+
+    return json.loads(process.stdout.strip().splitlines()[-1])
+
+
+def main():
+    args = parse_arguments()
+
+    if args.single is not None:
+        layer, resolution, backend = args.single.split(",")
+        print(json.dumps(run_single(layer, int(resolution), backend, args.batch_size, args.chunk_memory_budget,
+                                    args.repeats)))
+        return
+
+    print("cpu count: {}, torch threads: {}".format(os.cpu_count(), torch.get_num_threads()))
+    print("{:>10} | {:>10} | {:>8} | {:>10} | {:>12}".format("resolution", "layer", "backend", "latency",
+                                                             "peak memory"))
+    for resolution in [int(resolution) for resolution in args.resolutions.split(",")]:
+        for layer in LAYERS:
+            for backend in args.backends.split(","):
+                result = run_in_process(args, layer, resolution, backend)
+                if result is None:
+                    print("{:>10} | {:>10} | {:>8} | {:>10} | {:>12}".format(resolution, layer, backend, "failed",
+                                                                             "-"))
+                    continue
+
+                print("{:>10} | {:>10} | {:>8} | {:>9.3f}s | {:>9.1f}MiB".format(
+                    resolution, layer, backend, result["latency"], result["peak-memory"] / (1024 * 1024)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+import os
+import sys
+import time
+import argparse
+import numpy as np
+import torch
+import torch.optim as optim
+
+base_directory = os.getcwd()
+sys.path.insert(0, base_directory)
+
+from training_worker.ab_ranking.model.ab_ranking_efficient_net import ABRankingEfficientNetModel, \
+    ABRankingEfficientNetDataset
+from training_worker.ab_ranking.model.ab_ranking_data_loader import ABRankingDatasetLoader
+from training_worker.ab_ranking.model import constants
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Benchmark efficient net training throughput on synthetic data")
+
+    parser.add_argument('--num-pairs', type=int, default=256)
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--num-workers', type=str, default="0,2",
+                        help="comma separated data loader worker counts to compare")
+
+    return parser.parse_args()
+
+
+def get_synthetic_dataset_loader(num_pairs):
+    dataset_loader = ABRankingDatasetLoader(dataset_name="synthetic",
+                                            normalize_vectors=True,
+                                            pooling_strategy=constants.MAX_POOLING)
+
+    # raw (2, 77, 768) embeddings, as read from the msgpack files
+    rng = np.random.default_rng(0)
+    pairs = []
+    for _ in range(num_pairs):
+        target = float(rng.integers(0, 2))
+        pairs.append((rng.standard_normal((2, 77, 768)), rng.standard_normal((2, 77, 768)), [target]))
+
+    dataset_loader.training_image_pair_data_arr = pairs
+    dataset_loader.training_data_total = num_pairs
+
+    return dataset_loader
+
+
+def get_model(channels_last):
+    torch.manual_seed(0)
+    ab_model = ABRankingEfficientNetModel(efficient_net_version="b0",
+                                          in_channels=1,
+                                          num_classes=1,
+                                          inputs_shape=(1, 1, 768 * 2))
+    if channels_last:
+        ab_model.model = ab_model.model.to(memory_format=torch.channels_last)
+
+    optimizer = optim.AdamW(ab_model.model.parameters(), lr=0.001, weight_decay=0.01)
+
+    return ab_model, optimizer
+
+
+# the previous loop, pairs are pooled in the main process per batch
+def run_batch_loop_epoch(dataset_loader, batch_size):
+    ab_model, optimizer = get_model(channels_last=False)
+    scaler = torch.cuda.amp.GradScaler(enabled=False)
+    num_pairs = dataset_loader.get_len_training_ab_data()
+    dataset_loader.current_training_data_index = 0
+
+    start_time = time.time()
+    for start in range(0, num_pairs, batch_size):
+        batch_features_x, \
+            batch_features_y, \
+            batch_targets = dataset_loader.get_next_training_feature_vectors_and_target_efficient_net(
+            min(batch_size, num_pairs - start), ab_model._device)
+        ab_model.train_step(optimizer, scaler, batch_features_x, batch_features_y, batch_targets)
+
+    return time.time() - start_time
+
+
+def run_data_loader_epoch(dataset_loader, batch_size, num_workers, precision, channels_last):
+    ab_model, optimizer = get_model(channels_last)
+    scaler = torch.cuda.amp.GradScaler(enabled=precision == constants.PRECISION_FP16)
+    training_data_loader = ab_model.get_training_data_loader(ABRankingEfficientNetDataset(dataset_loader),
+                                                             batch_size,
+                                                             shuffle=True,
+                                                             num_workers=num_workers)
+
+    start_time = time.time()
+    for batch_features_x, batch_features_y, batch_targets in training_data_loader:
+        batch_features_x = ab_model.to_model_input(batch_features_x, channels_last)
+        batch_features_y = ab_model.to_model_input(batch_features_y, channels_last)
+        batch_targets = batch_targets.to(ab_model._device)
+        ab_model.train_step(optimizer, scaler, batch_features_x, batch_features_y, batch_targets, precision)
+
+    return time.time() - start_time
+
+
+def main():
+    args = parse_arguments()
+    dataset_loader = get_synthetic_dataset_loader(args.num_pairs)
+
+    results = [("batch loop", "fp32", False, run_batch_loop_epoch(dataset_loader, args.batch_size))]
+    for num_workers in [int(num_workers) for num_workers in args.num_workers.split(",")]:
+        for precision, channels_last in [(constants.PRECISION_FP32, False),
+                                         (constants.PRECISION_BF16, False),
+                                         (constants.PRECISION_BF16, True)]:
+            elapsed_time = run_data_loader_epoch(dataset_loader,
+                                                 args.batch_size,
+                                                 num_workers,
+                                                 precision,
+                                                 channels_last)
+            results.append(("{} workers".format(num_workers), precision, channels_last, elapsed_time))
+
+    print("cpu count: {}".format(os.cpu_count()))
+    print("{:>12} | {:>9} | {:>13} | {:>10} | {:>10}".format("loader", "precision", "channels last", "epoch time",
+                                                            "pairs/sec"))
+    for loader_name, precision, channels_last, elapsed_time in results:
+        print("{:>12} | {:>9} | {:>13} | {:>9.2f}s | {:>10.1f}".format(loader_name,
+                                                                     precision,
+                                                                     str(channels_last),
+                                                                     elapsed_time,
+                                                                     args.num_pairs / elapsed_time))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+import os
+import sys
+import time
+import argparse
+import numpy as np
+import torch
+
+base_directory = os.getcwd()
+sys.path.insert(0, base_directory)
+
+from training_worker.ab_ranking.model.ab_ranking_elm_v1 import ABRankingELMModel
+from training_worker.ab_ranking.model.ab_ranking_data_loader import ABRankingDatasetLoader
+from training_worker.ab_ranking.model import constants
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Benchmark elm v1 epoch time versus batch size on synthetic data")
+
+    parser.add_argument('--num-pairs', type=int, default=20000)
+    parser.add_argument('--input-shape', type=int, default=768)
+    parser.add_argument('--train-percent', type=float, default=0.9)
+    parser.add_argument('--batch-sizes', type=str, default="1,16,64,256,1024")
+    parser.add_argument('--num-random-layers', type=int, default=1)
+    parser.add_argument('--elm-sparsity', type=float, default=0.5)
+
+    return parser.parse_args()
+
+
+def get_synthetic_dataset_loader(num_pairs, input_shape, train_percent):
+    # clip input type, so the pair features are already pooled vectors
+    dataset_loader = ABRankingDatasetLoader(dataset_name="synthetic",
+                                            input_type=constants.CLIP,
+                                            train_percent=train_percent)
+
+    rng = np.random.default_rng(0)
+    features = rng.standard_normal((num_pairs, 2, input_shape)).astype(np.float32)
+    targets = rng.integers(0, 2, num_pairs).astype(np.float32)
+    pairs = [(features[i, 0], features[i, 1], [float(targets[i])]) for i in range(num_pairs)]
+
+    num_training = round(num_pairs * train_percent)
+    dataset_loader.training_image_pair_data_arr = pairs[:num_training]
+    dataset_loader.validation_image_pair_data_arr = pairs[num_training:]
+    dataset_loader.training_data_total = num_training
+    dataset_loader.validation_data_total = num_pairs - num_training
+    dataset_loader.training_data_paths_indices_shuffled = list(range(num_training))
+    dataset_loader.training_image_hashes = [str(i) for i in range(num_training)]
+
+    return dataset_loader
+
+
+def main():
+    args = parse_arguments()
+    torch.manual_seed(0)
+
+    dataset_loader = get_synthetic_dataset_loader(args.num_pairs, args.input_shape, args.train_percent)
+    batch_sizes = [int(batch_size) for batch_size in args.batch_sizes.split(",")]
+
+    results = []
+    for batch_size in batch_sizes:
+        ab_model = ABRankingELMModel(inputs_shape=args.input_shape,
+                                     num_random_layers=args.num_random_layers,
+                                     elm_sparsity=args.elm_sparsity)
+        dataset_loader.current_training_data_index = 0
+
+        # epoch 0 only validates, so 2 epochs is 1 training epoch
+        start_time = time.time()
+        ab_model.train(dataset_loader=dataset_loader,
+                       training_batch_size=batch_size,
+                       epochs=2,
+                       debug_asserts=False)
+        elapsed_time = time.time() - start_time
+
+        results.append((batch_size, elapsed_time, ab_model.validation_loss.item()))
+
+    print("{:>10} | {:>12} | {:>12} | {:>15}".format("batch size", "epoch time", "pairs/sec", "validation loss"))
+    for batch_size, elapsed_time, validation_loss in results:
+        print("{:>10} | {:>11.2f}s | {:>12.0f} | {:>15.4f}".format(batch_size,
+                                                                   elapsed_time,
+                                                                   args.num_pairs / elapsed_time,
+                                                                   validation_loss))
+
+
+if __name__ == '__main__':
+    main()
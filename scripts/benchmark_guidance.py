@@ -0,0 +1,122 @@
+import os
+import sys
+import argparse
+import numpy as np
+import torch
+
+base_directory = os.getcwd()
+sys.path.insert(0, base_directory)
+
+from stable_diffusion.sampler.factory import get_sampler, SAMPLER_NAMES
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Count the noise predictor evaluations of classifier free guidance "
+                                                 "settings and compare their samples to full guidance")
+
+    parser.add_argument('--sampler', type=str, default="ddim", choices=SAMPLER_NAMES)
+    parser.add_argument('--steps', type=int, default=20)
+    parser.add_argument('--num-samples', type=int, default=4096)
+    parser.add_argument('--cfg-scale', type=float, default=7.5)
+    parser.add_argument('--guidance-fractions', type=str, default="1.0,0.75,0.5,0.25")
+
+    return parser.parse_args()
+
+
+# exact noise prediction for data from a mixture of two gaussians per element, with
+# the noise schedule of the latent diffusion model. the conditioning `c` favours the
+# second component, so guidance changes the samples. counts the rows it is evaluated on,
+# which is proportional to the unet flops
+class CountingEpsModel:
+    def __init__(self, n_steps=1000, linear_start=0.00085, linear_end=0.0120, means=(-1., 1.), std=0.1):
+        self.n_steps = n_steps
+        self.device = torch.device("cpu")
+        self.beta = torch.linspace(linear_start ** 0.5, linear_end ** 0.5, n_steps, dtype=torch.float64) ** 2
+        self.alpha_bar = torch.cumprod(1. - self.beta, dim=0)
+        self.log_sigmas = np.log(((1. - self.alpha_bar) / self.alpha_bar).numpy() ** .5)
+        self.means = means
+        self.std = std
+        self.rows = 0
+
+    def get_alpha_bar(self, t):
+        sigma = np.exp(np.interp(t.double().cpu().numpy(), np.arange(self.n_steps), self.log_sigmas))
+        return torch.from_numpy(1. / (1. + sigma ** 2)).to(torch.float64)
+
+    def __call__(self, x, t, c):
+        self.rows += x.shape[0]
+
+        a = self.get_alpha_bar(t).view(-1, *([1] * (x.dim() - 1)))
+        x = x.to(torch.float64)
+        # log prior of the second component
+        log_prior = c.to(torch.float64).view(-1, *([1] * (x.dim() - 1)))
+
+        variance = a * self.std ** 2 + 1. - a
+        log_weights = []
+        means = []
+        for i, mean in enumerate(self.means):
+            log_weights.append(-(x - a ** .5 * mean) ** 2 / (2 * variance) + i * log_prior)
+            means.append(mean + a ** .5 * self.std ** 2 / variance * (x - a ** .5 * mean))
+        weights = torch.softmax(torch.stack(log_weights), dim=0)
+        x0 = (weights * torch.stack(means)).sum(dim=0)
+
+        eps = (x - a ** .5 * x0) / (1. - a) ** .5
+
+        return eps.to(torch.float32)
+
+
+def run_sampler(model, args, x_last, uncond_scale, guidance_fraction=1.):
+    sampler = get_sampler(args.sampler, model, n_steps=args.steps)
+    bs = x_last.shape[0]
+    cond = torch.full((bs, 1), 0.5)
+    # one empty prompt embedding for the whole batch
+    uncond_cond = torch.zeros(1, 1)
+
+    model.rows = 0
+    torch.manual_seed(1)
+    x = sampler.sample(shape=list(x_last.shape), cond=cond, x_last=x_last.clone(), uncond_scale=uncond_scale,
+                       uncond_cond=uncond_cond, guidance_fraction=guidance_fraction)
+
+    return x, model.rows
+
+
+def main():
+    args = parse_arguments()
+    model = CountingEpsModel()
+
+    torch.manual_seed(0)
+    x_last = torch.randn(args.num_samples, 4, 1, 1)
+
+    reference, reference_rows = run_sampler(model, args, x_last, args.cfg_scale)
+    unguided, unguided_rows = run_sampler(model, args, x_last, 1.)
+
+    print("reference: {} with {} steps and guidance scale {}".format(args.sampler, args.steps, args.cfg_scale))
+    print("{:>18} | {:>10} | {:>10} | {:>12} | {:>14}".format("setting", "unet rows", "vs full", "rmse vs ref",
+                                                              "positive share"))
+
+    def report(name, x, rows):
+        rmse = float(((x - reference) ** 2).mean() ** .5)
+        positive_share = float((x > 0).to(torch.float32).mean())
+        print("{:>18} | {:>10} | {:>9.1f}% | {:>12.5f} | {:>14.3f}".format(name, rows, 100. * rows / reference_rows,
+                                                                          rmse, positive_share))
+
+    report("no guidance", unguided, unguided_rows)
+    for guidance_fraction in [float(fraction) for fraction in args.guidance_fractions.split(",")]:
+        x, rows = run_sampler(model, args, x_last, args.cfg_scale, guidance_fraction)
+        report("fraction {:.2f}".format(guidance_fraction), x, rows)
+
+    # half of the batch is guided, the other half is not
+    half = args.num_samples // 2
+    scales = torch.tensor([args.cfg_scale] * half + [1.] * (args.num_samples - half))
+    mixed, mixed_rows = run_sampler(model, args, x_last, scales)
+    report("per sample scales", mixed, mixed_rows)
+
+    # each half matches the batch sampled with its scale
+    error = max(float((mixed[:half] - reference[:half]).abs().max()),
+                float((mixed[half:] - unguided[half:]).abs().max()))
+    if error > 1e-4:
+        raise Exception("per sample guidance scales differ from separate batches: {:.2e}".format(error))
+    print("per sample scales max difference from separate batches: {:.2e}".format(error))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+import os
+import sys
+import argparse
+import numpy as np
+
+base_directory = os.getcwd()
+sys.path.insert(0, base_directory)
+
+from training_worker.ab_ranking.script.hyperparameter_search_elm_v1_local import run_search, get_feature_variants
+from training_worker.ab_ranking.script.hyperparameter_utils import get_feature_variant_name
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Benchmark the local hyperparameter search on synthetic data")
+
+    parser.add_argument('--num-datapoints', type=int, default=5000)
+    parser.add_argument('--input-shape', type=int, default=2 * 768)
+    parser.add_argument('--train-percent', type=float, default=0.9)
+    parser.add_argument('--num-trials', type=int, default=9)
+    parser.add_argument('--num-workers', type=str, default="1,2,4",
+                        help="comma separated worker counts to compare")
+    parser.add_argument('--max-epochs', type=int, default=3)
+
+    return parser.parse_args()
+
+
+def get_synthetic_arrays(num_datapoints, input_shape, train_percent):
+    rng = np.random.default_rng(0)
+    weight = rng.standard_normal(input_shape).astype(np.float32)
+
+    arrays = {}
+    for pooling_strategy, normalize_vectors in get_feature_variants():
+        features = rng.standard_normal((2, num_datapoints, input_shape)).astype(np.float32)
+        # the selected image is the one with the higher linear score
+        selected_first = features[0] @ weight > features[1] @ weight
+        variant_name = get_feature_variant_name(pooling_strategy, normalize_vectors)
+        arrays[variant_name + "-selected"] = np.where(selected_first[:, None], features[0], features[1])
+        arrays[variant_name + "-other"] = np.where(selected_first[:, None], features[1], features[0])
+
+    num_validations = round(num_datapoints * (1.0 - train_percent))
+    arrays["validation-indices"] = np.arange(num_validations)
+    arrays["training-indices"] = np.arange(num_validations, num_datapoints)
+
+    return arrays
+
+
+def main():
+    args = parse_arguments()
+    arrays = get_synthetic_arrays(args.num_datapoints, args.input_shape, args.train_percent)
+
+    results = []
+    for num_workers in [int(num_workers) for num_workers in args.num_workers.split(",")]:
+        trials, elapsed_time = run_search(arrays,
+                                          num_trials=args.num_trials,
+                                          num_workers=num_workers,
+                                          max_epochs=args.max_epochs)
+        results.append((num_workers, elapsed_time, trials[0]["validation-loss"]))
+
+    print("cpu count: {}".format(os.cpu_count()))
+    print("{:>8} | {:>10} | {:>12} | {:>20}".format("workers", "time", "trials/hour", "best validation loss"))
+    for num_workers, elapsed_time, best_validation_loss in results:
+        print("{:>8} | {:>9.2f}s | {:>12.1f} | {:>20.4f}".format(num_workers,
+                                                                 elapsed_time,
+                                                                 args.num_trials * 3600.0 / elapsed_time,
+                                                                 best_validation_loss))
+
+
+if __name__ == '__main__':
+    main()
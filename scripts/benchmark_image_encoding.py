@@ -0,0 +1,80 @@
+import os
+import sys
+import time
+import argparse
+import torch
+
+base_directory = os.getcwd()
+sys.path.insert(0, base_directory)
+
+from stable_diffusion.utils_image import get_images_data
+from utility.image_encoder import ImageEncoder, IMAGE_FORMATS
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Measure the throughput of encoding and hashing decoded batches "
+                                                 "in the calling thread and in a pool of processes")
+
+    parser.add_argument('--batch-sizes', type=str, default="1,2,4,8,16")
+    parser.add_argument('--image-size', type=int, default=512)
+    parser.add_argument('--workers', type=str, default="0,2,4",
+                        help="comma separated numbers of encoder processes, 0 encodes in the calling thread")
+    parser.add_argument('--formats', type=str, default="jpeg,webp")
+    parser.add_argument('--quality', type=int, default=75)
+    parser.add_argument('--repeats', type=int, default=3)
+
+    return parser.parse_args()
+
+
+# smooth images in $[-1, 1]$ with some noise, like decoded samples
+def get_images(batch_size, image_size):
+    torch.manual_seed(0)
+    low_resolution = torch.rand(batch_size, 3, image_size // 32, image_size // 32) * 2. - 1.
+    images = torch.nn.functional.interpolate(low_resolution, size=(image_size, image_size), mode='bicubic')
+    images = images + 0.05 * torch.randn_like(images)
+
+    return images.clamp(-1., 1.)
+
+
+def measure(images, encoder, repeats):
+    # the first batch starts the processes of the pool
+    get_images_data(images, encoder=encoder)
+
+    start_time = time.time()
+    for _ in range(repeats):
+        results = get_images_data(images, encoder=encoder)
+    elapsed_time = (time.time() - start_time) / repeats
+
+    return elapsed_time, sum(len(buffer.getbuffer()) for _, buffer in results) / len(results)
+
+
+def main():
+    args = parse_arguments()
+    formats = args.formats.split(",")
+    for img_format in formats:
+        if img_format not in IMAGE_FORMATS:
+            raise Exception("image format {} is not supported, use one of {}".format(img_format, IMAGE_FORMATS))
+
+    print("{} cpus, {}x{} images, quality {}".format(os.cpu_count(), args.image_size, args.image_size, args.quality))
+    print("{:>6} | {:>6} | {:>7} | {:>10} | {:>10} | {:>8} | {:>10}".format("format", "batch", "workers", "batch ms",
+                                                                          "images/sec", "speedup", "kb/image"))
+    for img_format in formats:
+        encoders = {int(workers): ImageEncoder(num_workers=int(workers), img_format=img_format, quality=args.quality)
+                    for workers in args.workers.split(",")}
+        for batch_size in [int(batch_size) for batch_size in args.batch_sizes.split(",")]:
+            images = get_images(batch_size, args.image_size)
+            reference_time = None
+            for workers, encoder in encoders.items():
+                elapsed_time, image_bytes = measure(images, encoder, args.repeats)
+                if reference_time is None:
+                    reference_time = elapsed_time
+                print("{:>6} | {:>6} | {:>7} | {:>10.1f} | {:>10.1f} | {:>7.2f}x | {:>10.1f}".format(
+                    img_format, batch_size, workers, 1000. * elapsed_time, batch_size / elapsed_time,
+                    reference_time / elapsed_time, image_bytes / 1024.))
+
+        for encoder in encoders.values():
+            encoder.close()
+
+
+if __name__ == '__main__':
+    main()
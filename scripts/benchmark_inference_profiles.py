@@ -0,0 +1,132 @@
+import os
+import sys
+import copy
+import time
+import argparse
+import torch
+
+base_directory = os.getcwd()
+sys.path.insert(0, base_directory)
+
+from stable_diffusion.inference_profile import InferenceProfile, apply_inference_profile, set_inference_profile, \
+    get_profile_autocast, unet_forward
+from stable_diffusion.model.unet.unet import UNetModel
+from stable_diffusion.sampler.factory import get_sampler, SAMPLER_NAMES
+from stable_diffusion.utils_model import initialize_autoencoder
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Compare the sampling speed of the inference profiles "
+                                                 "and their accuracy against fp32")
+
+    parser.add_argument('--modes', type=str,
+                        default="fp32,autocast,bf16,fp16,fp32-channels-last,bf16-channels-last,fp32-compile,"
+                                "bf16-compile",
+                        help="comma separated precisions with optional -channels-last and -compile")
+    parser.add_argument('--device', type=str, default="cuda" if torch.cuda.is_available() else "cpu")
+    parser.add_argument('--channels', type=int, default=320,
+                        help="base channels of the random unet, smaller is faster on cpu")
+    parser.add_argument('--no-vae', action='store_true', help="only check the accuracy of the unet")
+    parser.add_argument('--sampler', type=str, default="ddim", choices=SAMPLER_NAMES)
+    parser.add_argument('--steps', type=int, default=10)
+    parser.add_argument('--batch-size', type=int, default=1)
+    parser.add_argument('--image-size', type=int, default=256)
+    parser.add_argument('--cfg-scale', type=float, default=7.5)
+    parser.add_argument('--accuracy-tolerance', type=float, default=0.05)
+
+    return parser.parse_args()
+
+
+def get_profile(mode, args):
+    precision = mode.split("-")[0]
+    shape = (args.batch_size, args.image_size, args.image_size)
+
+    return InferenceProfile(precision=precision,
+                            channels_last="channels-last" in mode,
+                            compile_unet="compile" in mode,
+                            warmup_shapes=[shape],
+                            accuracy_tolerance=args.accuracy_tolerance)
+
+
+# noise predictor with the schedule of the latent diffusion model
+class UNetEpsModel:
+    def __init__(self, unet_model, device, n_steps=1000, linear_start=0.00085, linear_end=0.0120):
+        self.unet_model = unet_model
+        self.n_steps = n_steps
+        self.device = device
+        self.beta = torch.linspace(linear_start ** 0.5, linear_end ** 0.5, n_steps, dtype=torch.float64) ** 2
+        self.alpha_bar = torch.cumprod(1. - self.beta, dim=0)
+
+    def __call__(self, x, t, c):
+        return unet_forward(self.unet_model, x, t, c)
+
+
+@torch.no_grad()
+def run_mode(mode, args, unet_model, autoencoder):
+    profile = get_profile(mode, args)
+    device = torch.device(args.device)
+    # each profile starts from the fp32 models
+    unet_model = copy.deepcopy(unet_model)
+    autoencoder = copy.deepcopy(autoencoder) if autoencoder is not None else None
+
+    try:
+        start_time = time.time()
+        unet_model, errors = apply_inference_profile(unet_model, autoencoder, profile, device=device)
+        setup_time = time.time() - start_time
+    except ValueError as e:
+        print(e)
+        set_inference_profile(InferenceProfile())
+        return None
+
+    try:
+        sampler = get_sampler(args.sampler, UNetEpsModel(unet_model, device), n_steps=args.steps)
+        size = args.image_size // 8
+        torch.manual_seed(0)
+        cond = torch.randn(args.batch_size, 77, 768, device=device)
+        uncond_cond = torch.zeros(1, 77, 768, device=device)
+
+        with get_profile_autocast(profile, device):
+            start_time = time.time()
+            sampler.sample(shape=[args.batch_size, 4, size, size], cond=cond, uncond_scale=args.cfg_scale,
+                           uncond_cond=uncond_cond)
+            if device.type == "cuda":
+                torch.cuda.synchronize()
+            elapsed_time = time.time() - start_time
+    finally:
+        set_inference_profile(InferenceProfile())
+
+    return {"steps-per-second": args.steps / elapsed_time, "setup-time": setup_time, "errors": errors}
+
+
+def main():
+    args = parse_arguments()
+    device = torch.device(args.device)
+
+    torch.manual_seed(0)
+    unet_model = UNetModel(channels=args.channels, device=device).to(device).eval()
+    autoencoder = None
+    if not args.no_vae:
+        autoencoder = initialize_autoencoder(device=device, force_submodels_init=True).eval()
+
+    print("{:>22} | {:>10} | {:>8} | {:>10} | {:>10} | {:>10} | {:>11}".format("mode", "steps/sec", "speedup", "setup",
+                                                                               "unet error", "vae error",
+                                                                               "tiled error"))
+    reference_speed = None
+    for mode in args.modes.split(","):
+        result = run_mode(mode, args, unet_model, autoencoder)
+        if result is None:
+            print("{:>22} | {:>10} | {:>8} | {:>10} | {:>10} | {:>10} | {:>11}".format(mode, "failed", "-", "-", "-",
+                                                                                       "-", "-"))
+            continue
+
+        if reference_speed is None:
+            reference_speed = result["steps-per-second"]
+        errors = result["errors"]
+        print("{:>22} | {:>10.3f} | {:>7.2f}x | {:>9.1f}s | {:>10.2e} | {:>10} | {:>11}".format(
+            mode, result["steps-per-second"], result["steps-per-second"] / reference_speed, result["setup-time"],
+            errors.get("unet", 0.), "{:.2e}".format(errors["decoder"]) if "decoder" in errors else "-",
+            "{:.2e}".format(errors["tiled decoder"]) if "tiled decoder" in errors else "-"))
+
+
+if __name__ == '__main__':
+    main()
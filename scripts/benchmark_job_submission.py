@@ -0,0 +1,149 @@
+import argparse
+import json
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+base_directory = "./"
+sys.path.insert(0, base_directory)
+
+from worker.http import request
+from worker.prompt_generation.prompt_generator import (create_image_generation_job,
+                                                       generate_image_generation_jobs,
+                                                       add_dataset_jobs)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="benchmark job submission against a local orchestration stand-in")
+
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--num-jobs", type=int, default=2000)
+    parser.add_argument("--tick-size", type=int, default=100)
+    parser.add_argument("--latency-ms", type=float, default=1.0,
+                        help="simulated per-request server latency")
+
+    return parser.parse_args()
+
+
+# minimal in-memory stand-in for the orchestration api
+# implements only the endpoints used when submitting jobs
+class OrchestrationStandIn:
+    def __init__(self, latency_ms):
+        self.latency_ms = latency_ms
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.jobs = []
+
+    def get_sequential_ids(self, dataset, limit):
+        with self.lock:
+            start = self.counters.get(dataset, 0)
+            self.counters[dataset] = start + limit
+
+        return ["{0:04}/{1:06}".format(1 + i // 1000, i) for i in range(start, start + limit)]
+
+    def add_jobs(self, jobs):
+        with self.lock:
+            self.jobs.extend(jobs)
+
+
+def make_handler(stand_in):
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def send_json(self, data):
+            body = json.dumps(data).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            time.sleep(stand_in.latency_ms / 1000.0)
+            url = urlparse(self.path)
+            if url.path.startswith("/dataset/sequential-id/"):
+                dataset = url.path.split("/")[-1]
+                limit = int(parse_qs(url.query).get("limit", ["1"])[0])
+                self.send_json(stand_in.get_sequential_ids(dataset, limit))
+                return
+
+            self.send_response(404)
+            self.end_headers()
+
+        def do_POST(self):
+            time.sleep(stand_in.latency_ms / 1000.0)
+            length = int(self.headers.get("Content-Length", 0))
+            data = json.loads(self.rfile.read(length))
+            if self.path == "/queue/image-generation/add":
+                stand_in.add_jobs([data])
+                self.send_json(True)
+            elif self.path == "/queue/image-generation/add-jobs":
+                stand_in.add_jobs(data)
+                self.send_json(True)
+            else:
+                self.send_response(404)
+                self.end_headers()
+
+    return Handler
+
+
+def create_job(dataset_name):
+    return create_image_generation_job(positive_prompt="icon, flat, white background",
+                                       negative_prompt="blurry",
+                                       prompt_scoring_model="",
+                                       prompt_score=0.0,
+                                       prompt_generation_policy="top-k",
+                                       top_k=0.1,
+                                       dataset_name=dataset_name)
+
+
+def benchmark_per_job(num_jobs, dataset_name):
+    start_time = time.time()
+    for i in range(num_jobs):
+        generate_image_generation_jobs(positive_prompt="icon, flat, white background",
+                                       negative_prompt="blurry",
+                                       prompt_scoring_model="",
+                                       prompt_score=0.0,
+                                       prompt_generation_policy="top-k",
+                                       top_k=0.1,
+                                       dataset_name=dataset_name)
+
+    return num_jobs / (time.time() - start_time)
+
+
+def benchmark_bulk(num_jobs, tick_size, dataset_name):
+    start_time = time.time()
+    num_added = 0
+    while num_added < num_jobs:
+        jobs = [create_job(dataset_name) for i in range(min(tick_size, num_jobs - num_added))]
+        num_added += add_dataset_jobs(dataset_name, jobs)
+
+    return num_jobs / (time.time() - start_time)
+
+
+def main():
+    args = parse_args()
+
+    stand_in = OrchestrationStandIn(args.latency_ms)
+    server = ThreadingHTTPServer(("127.0.0.1", args.port), make_handler(stand_in))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    request.SERVER_ADRESS = "http://127.0.0.1:{}".format(args.port)
+
+    per_job_rate = benchmark_per_job(args.num_jobs, "per-job")
+    bulk_rate = benchmark_bulk(args.num_jobs, args.tick_size, "bulk")
+
+    server.shutdown()
+
+    print("jobs submitted: {}".format(len(stand_in.jobs)))
+    print("per job submission: {:.1f} jobs/sec".format(per_job_rate))
+    print("bulk submission (tick size {}): {:.1f} jobs/sec".format(args.tick_size, bulk_rate))
+    print("speedup: {:.1f}x".format(bulk_rate / per_job_rate))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,122 @@
+import os
+import sys
+import time
+import json
+import resource
+import argparse
+import subprocess
+import safetensors.torch
+import torch
+
+base_directory = os.getcwd()
+sys.path.insert(0, base_directory)
+
+from configs.model_config import ModelPathConfig
+from stable_diffusion import CLIPTextEmbedder
+from stable_diffusion.latent_diffusion import LatentDiffusion
+from stable_diffusion.model_paths import CLIPconfigs
+from stable_diffusion.utils_model import initialize_latent_diffusion, initialize_autoencoder, initialize_unet
+
+MODES = ["separate", "shared"]
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Compare worker cold start time and memory of loading separate "
+                                                 "model copies against one shared memory mapped copy")
+
+    parser.add_argument('--model-path', type=str,
+                        default='input/model/sd/v1-5-pruned-emaonly/v1-5-pruned-emaonly.safetensors')
+    parser.add_argument('--device', type=str, default="cuda" if torch.cuda.is_available() else "cpu")
+    parser.add_argument('--modes', type=str, default=",".join(MODES))
+    # runs one measurement, the benchmark starts a process per measurement so peak memory is not shared
+    parser.add_argument('--single', type=str, default=None, help=argparse.SUPPRESS)
+
+    return parser.parse_args()
+
+
+def get_max_rss_bytes():
+    # kilobytes on linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def load_clip_text_embedder(device):
+    config = ModelPathConfig()
+    clip_text_embedder = CLIPTextEmbedder(device=device)
+    clip_text_embedder.load_submodels(
+        tokenizer_path=config.get_model_folder_path(CLIPconfigs.TXT_EMB_TOKENIZER),
+        transformer_path=config.get_model_folder_path(CLIPconfigs.TXT_EMB_TEXT_MODEL)
+    )
+
+    return clip_text_embedder
+
+
+# how the worker loaded a model copy before the registry: random initialization,
+# the whole checkpoint read into cpu memory, then copied into the model
+def load_latent_diffusion_copy(model_path, device):
+    autoencoder = initialize_autoencoder(device=device, force_submodels_init=True)
+    clip_text_embedder = CLIPTextEmbedder(device=device).init_submodels()
+    unet_model = initialize_unet(device=device)
+    model = LatentDiffusion(linear_start=0.00085, linear_end=0.0120, n_steps=1000, latent_scaling_factor=0.18215,
+                            autoencoder=autoencoder, clip_embedder=clip_text_embedder, unet_model=unet_model,
+                            device=device)
+    model.load_state_dict(safetensors.torch.load_file(model_path, device="cpu"), strict=False)
+
+    return model.to(device).eval()
+
+
+def run_single(mode, model_path, device):
+    base_rss = get_max_rss_bytes()
+    start_time = time.time()
+
+    if mode == "separate":
+        # one copy for inpainting, one for txt2img and a separate text embedder
+        models = [load_latent_diffusion_copy(model_path, device), load_latent_diffusion_copy(model_path, device),
+                  load_clip_text_embedder(device)]
+    elif mode == "shared":
+        clip_text_embedder = load_clip_text_embedder(device)
+        models = [initialize_latent_diffusion(path=model_path, device=device, clip_text_embedder=clip_text_embedder,
+                                              force_submodels_init=True)]
+    else:
+        raise Exception("mode is not supported: {}".format(mode))
+
+    result = {"load-time": time.time() - start_time, "peak-memory": get_max_rss_bytes() - base_rss}
+    if torch.cuda.is_available():
+        result["cuda-memory"] = torch.cuda.memory_allocated()
+
+    return result
+
+
+def run_in_process(args, mode):
+    command = [sys.executable, os.path.abspath(__file__),
+               "--single", mode,
+               "--model-path", args.model_path,
+               "--device", args.device]
+    process = subprocess.run(command, capture_output=True, text=True)
+    if process.returncode != 0:
+        print(process.stderr)
+        return None
+
+    return json.loads(process.stdout.strip().splitlines()[-1])
+
+
+def main():
+    args = parse_arguments()
+
+    if args.single is not None:
+        print(json.dumps(run_single(args.single, args.model_path, args.device)))
+        return
+
+    print("{:>8} | {:>10} | {:>12} | {:>12}".format("mode", "load time", "peak rss", "cuda memory"))
+    for mode in args.modes.split(","):
+        result = run_in_process(args, mode)
+        if result is None:
+            print("{:>8} | {:>10} | {:>12} | {:>12}".format(mode, "failed", "-", "-"))
+            continue
+
+        cuda_memory = "{:.1f}MiB".format(result["cuda-memory"] / (1024 * 1024)) if "cuda-memory" in result else "-"
+        print("{:>8} | {:>9.2f}s | {:>9.1f}MiB | {:>12}".format(mode, result["load-time"],
+                                                                result["peak-memory"] / (1024 * 1024), cuda_memory))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+import os
+import sys
+import time
+import argparse
+import torch
+
+base_directory = os.getcwd()
+sys.path.insert(0, base_directory)
+
+from stable_diffusion.sampler.factory import get_sampler, SAMPLER_NAMES
+from stable_diffusion.sampler.progress import PrintProgress
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Check that sampling wall time does not depend on the terminal width")
+
+    parser.add_argument('--sampler', type=str, default="ddim", choices=SAMPLER_NAMES)
+    parser.add_argument('--steps', type=int, default=50)
+    parser.add_argument('--terminal-widths', type=str, default="40,200",
+                        help="comma separated terminal widths to compare")
+    parser.add_argument('--tolerance', type=float, default=0.5,
+                        help="maximum allowed difference in seconds between the widths")
+
+    return parser.parse_args()
+
+
+# noise predictor with the schedule of the latent diffusion model and a trivial eps,
+# so the timing is dominated by the sampling loop itself
+class ConstantEpsModel:
+    def __init__(self, n_steps=1000, linear_start=0.00085, linear_end=0.0120):
+        self.n_steps = n_steps
+        self.device = torch.device("cpu")
+        self.beta = torch.linspace(linear_start ** 0.5, linear_end ** 0.5, n_steps, dtype=torch.float64) ** 2
+        self.alpha_bar = torch.cumprod(1. - self.beta, dim=0)
+
+    def __call__(self, x, t, c):
+        return torch.zeros_like(x)
+
+
+def run_sample(sampler, terminal_width, callback=None):
+    os.environ["COLUMNS"] = str(terminal_width)
+
+    start_time = time.time()
+    sampler.sample(shape=[1, 4, 8, 8], cond=torch.zeros(1, 77, 768), callback=callback)
+
+    return time.time() - start_time
+
+
+def main():
+    args = parse_arguments()
+    sampler = get_sampler(args.sampler, ConstantEpsModel(), n_steps=args.steps)
+
+    results = []
+    for terminal_width in [int(width) for width in args.terminal_widths.split(",")]:
+        results.append((terminal_width, "none", run_sample(sampler, terminal_width)))
+        results.append((terminal_width, "print", run_sample(sampler, terminal_width, PrintProgress(interval=1.))))
+
+    print("{:>14} | {:>8} | {:>10}".format("terminal width", "callback", "wall time"))
+    for terminal_width, callback_name, elapsed_time in results:
+        print("{:>14} | {:>8} | {:>9.3f}s".format(terminal_width, callback_name, elapsed_time))
+
+    elapsed_times = [elapsed_time for _, _, elapsed_time in results]
+    difference = max(elapsed_times) - min(elapsed_times)
+    if difference > args.tolerance:
+        raise Exception("sampling wall time depends on the terminal width: {:.3f}s difference".format(difference))
+
+    print("max difference: {:.3f}s".format(difference))
+
+
+if __name__ == '__main__':
+    main()
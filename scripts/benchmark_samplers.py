@@ -0,0 +1,100 @@
+import os
+import sys
+import time
+import argparse
+import numpy as np
+import torch
+
+base_directory = os.getcwd()
+sys.path.insert(0, base_directory)
+
+from stable_diffusion.sampler.factory import get_sampler, SAMPLER_DDIM, SAMPLER_EULER, SAMPLER_DPMPP_2M, \
+    SAMPLER_DPMPP_2M_KARRAS, SAMPLER_UNIPC
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Compare the samplers against a many-step ddim reference "
+                                                 "on data where the exact noise prediction is known")
+
+    parser.add_argument('--samplers', type=str,
+                        default=",".join([SAMPLER_DDIM, SAMPLER_EULER, SAMPLER_DPMPP_2M, SAMPLER_DPMPP_2M_KARRAS,
+                                          SAMPLER_UNIPC]))
+    parser.add_argument('--steps', type=str, default="10,15,20,50")
+    parser.add_argument('--reference-steps', type=int, default=500)
+    parser.add_argument('--num-samples', type=int, default=4096)
+    parser.add_argument('--cfg-scale', type=float, default=1.0)
+
+    return parser.parse_args()
+
+
+# exact noise prediction for data from a mixture of two gaussians per element,
+# with the noise schedule of the latent diffusion model.
+# the deterministic samplers all solve the same ode, so their error against a many-step
+# solution with the same x_T measures the discretization error
+class GaussianMixtureEpsModel:
+    def __init__(self, n_steps=1000, linear_start=0.00085, linear_end=0.0120, means=(-1., 1.), std=0.1):
+        self.n_steps = n_steps
+        self.device = torch.device("cpu")
+        self.beta = torch.linspace(linear_start ** 0.5, linear_end ** 0.5, n_steps, dtype=torch.float64) ** 2
+        self.alpha_bar = torch.cumprod(1. - self.beta, dim=0)
+        self.log_sigmas = np.log(((1. - self.alpha_bar) / self.alpha_bar).numpy() ** .5)
+        self.means = means
+        self.std = std
+
+    def get_alpha_bar(self, t):
+        # fractional time steps are interpolated in log sigma like the samplers do
+        sigma = np.exp(np.interp(t.double().cpu().numpy(), np.arange(self.n_steps), self.log_sigmas))
+        return torch.from_numpy(1. / (1. + sigma ** 2)).to(torch.float64)
+
+    def __call__(self, x, t, c):
+        a = self.get_alpha_bar(t).view(-1, *([1] * (x.dim() - 1)))
+        x = x.to(torch.float64)
+
+        # posterior mean of x_0 under each component and the component weights
+        variance = a * self.std ** 2 + 1. - a
+        log_weights = []
+        means = []
+        for mean in self.means:
+            log_weights.append(-(x - a ** .5 * mean) ** 2 / (2 * variance))
+            means.append(mean + a ** .5 * self.std ** 2 / variance * (x - a ** .5 * mean))
+        weights = torch.softmax(torch.stack(log_weights), dim=0)
+        x0 = (weights * torch.stack(means)).sum(dim=0)
+
+        # $\epsilon = \frac{x_t - \sqrt{\bar\alpha_t} x_0}{\sqrt{1 - \bar\alpha_t}}$
+        eps = (x - a ** .5 * x0) / (1. - a) ** .5
+
+        # the conditioning selects no mode, so guidance only scales the same prediction
+        return eps.to(torch.float32)
+
+
+def run_sampler(model, sampler_name, n_steps, x_last, cfg_scale):
+    sampler = get_sampler(sampler_name, model, n_steps=n_steps)
+    cond = torch.zeros(1)
+    uncond_cond = torch.zeros(1) if cfg_scale != 1.0 else None
+
+    start_time = time.time()
+    x = sampler.sample(shape=list(x_last.shape), cond=cond, x_last=x_last.clone(), uncond_scale=cfg_scale,
+                       uncond_cond=uncond_cond)
+
+    return x, time.time() - start_time
+
+
+def main():
+    args = parse_arguments()
+    model = GaussianMixtureEpsModel()
+
+    torch.manual_seed(0)
+    x_last = torch.randn(args.num_samples, 4, 1, 1)
+    reference, _ = run_sampler(model, SAMPLER_DDIM, args.reference_steps, x_last, args.cfg_scale)
+
+    print("reference: ddim with {} steps".format(args.reference_steps))
+    print("{:>16} | {:>5} | {:>12} | {:>9}".format("sampler", "steps", "rmse vs ref", "time"))
+    for sampler_name in args.samplers.split(","):
+        for n_steps in [int(n_steps) for n_steps in args.steps.split(",")]:
+            x, elapsed_time = run_sampler(model, sampler_name, n_steps, x_last, args.cfg_scale)
+            rmse = float(((x - reference) ** 2).mean() ** .5)
+            print("{:>16} | {:>5} | {:>12.5f} | {:>8.3f}s".format(sampler_name, n_steps, rmse, elapsed_time))
+
+
+if __name__ == '__main__':
+    main()
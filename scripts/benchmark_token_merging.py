@@ -0,0 +1,119 @@
+import os
+import sys
+import time
+import argparse
+import torch
+from torch import nn
+
+base_directory = os.getcwd()
+sys.path.insert(0, base_directory)
+
+from stable_diffusion.latent_diffusion import UNetWrapper
+from stable_diffusion.model.unet.unet import UNetModel
+from stable_diffusion.model.unet.unet_attention import token_merging
+from stable_diffusion.sampler.factory import get_sampler, SAMPLER_NAMES
+from stable_diffusion.utils_model import initialize_autoencoder, load_safetensors_state, skip_weight_init
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Compare the sampling speed and the similarity of the samples "
+                                                 "with token merging against sampling without it")
+
+    parser.add_argument('--model-path', type=str, default=None,
+                        help="safetensors checkpoint, the unet has random weights without it")
+    parser.add_argument('--channels', type=int, default=320,
+                        help="base channels of the random unet, smaller is faster on cpu")
+    parser.add_argument('--sampler', type=str, default="ddim", choices=SAMPLER_NAMES)
+    parser.add_argument('--steps', type=int, default=10)
+    parser.add_argument('--image-size', type=int, default=256)
+    parser.add_argument('--ratios', type=str, default="0.3,0.5,0.7",
+                        help="comma separated ratios merged at the highest resolution")
+    parser.add_argument('--seed', type=int, default=0)
+
+    return parser.parse_args()
+
+
+# the unet and autoencoder under the keys they have in the checkpoint
+class Checkpoint(nn.Module):
+    def __init__(self, unet_model, autoencoder=None):
+        super().__init__()
+        self.model = UNetWrapper(unet_model)
+        self.first_stage_model = autoencoder
+
+
+# noise predictor with the schedule of the latent diffusion model
+class UNetEpsModel:
+    def __init__(self, unet_model, n_steps=1000, linear_start=0.00085, linear_end=0.0120):
+        self.unet_model = unet_model
+        self.n_steps = n_steps
+        self.device = torch.device("cpu")
+        self.beta = torch.linspace(linear_start ** 0.5, linear_end ** 0.5, n_steps, dtype=torch.float64) ** 2
+        self.alpha_bar = torch.cumprod(1. - self.beta, dim=0)
+
+    def __call__(self, x, t, c):
+        return self.unet_model(x, t, c)
+
+
+def load_models(args):
+    if args.model_path is None:
+        torch.manual_seed(args.seed)
+        unet_model = UNetModel(channels=args.channels, n_heads=8).eval()
+        return unet_model, None
+
+    with skip_weight_init():
+        checkpoint = Checkpoint(UNetModel(), initialize_autoencoder(device="cpu", force_submodels_init=True))
+    load_safetensors_state(checkpoint, args.model_path, device="cpu")
+
+    return checkpoint.model.diffusion_model.eval(), checkpoint.first_stage_model.eval()
+
+
+def run_sample(eps_model, args, x_last, cond, ratio):
+    sampler = get_sampler(args.sampler, eps_model, n_steps=args.steps)
+
+    with token_merging(ratio):
+        start_time = time.time()
+        x = sampler.sample(shape=list(x_last.shape), cond=cond, x_last=x_last.clone())
+        elapsed_time = time.time() - start_time
+
+    return x, args.steps / elapsed_time
+
+
+def get_psnr(x, reference):
+    mse = float(((x - reference) ** 2).mean())
+    return 10. * torch.log10(torch.tensor(1. / max(mse, 1e-12))).item()
+
+
+@torch.no_grad()
+def main():
+    args = parse_arguments()
+    unet_model, autoencoder = load_models(args)
+    eps_model = UNetEpsModel(unet_model)
+
+    torch.manual_seed(args.seed)
+    size = args.image_size // 8
+    x_last = torch.randn(1, 4, size, size)
+    cond = torch.randn(1, 77, 768)
+
+    # images in $[0, 1]$ when the autoencoder is loaded, latents otherwise
+    def get_output(x):
+        if autoencoder is None:
+            return x
+        return ((autoencoder.decode(x / 0.18215) + 1.) / 2.).clamp(0., 1.)
+
+    reference, reference_speed = run_sample(eps_model, args, x_last, cond, None)
+    reference_output = get_output(reference)
+
+    print("{:>6} | {:>10} | {:>8} | {:>12} | {:>9}".format("ratio", "steps/sec", "speedup", "relative l2",
+                                                          "psnr" if autoencoder is not None else "-"))
+    print("{:>6} | {:>10.3f} | {:>7.2f}x | {:>12.5f} | {:>9}".format("off", reference_speed, 1., 0., "-"))
+    for ratio in [float(ratio) for ratio in args.ratios.split(",")]:
+        x, speed = run_sample(eps_model, args, x_last, cond, ratio)
+        output = get_output(x)
+        relative_l2 = float((output - reference_output).norm() / reference_output.norm())
+        psnr = "{:.2f}dB".format(get_psnr(output, reference_output)) if autoencoder is not None else "-"
+        print("{:>6.2f} | {:>10.3f} | {:>7.2f}x | {:>12.5f} | {:>9}".format(ratio, speed, speed / reference_speed,
+                                                                           relative_l2, psnr))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,134 @@
+import argparse
+import random
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+base_directory = "./"
+sys.path.insert(0, base_directory)
+
+from orchestration.api.api_dataset import get_sequential_id, merge_duplicate_sequential_ids
+from orchestration.api.mongo_schemas import SequentialID
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="check the sequential id allocator for duplicates under concurrency, "
+                                                 "and the merge of duplicate counters at startup")
+
+    parser.add_argument("--db-url", type=str, default=None,
+                        help="mongodb server to check against, an in memory mongomock database is used without it")
+    parser.add_argument("--num-threads", type=int, default=16)
+    parser.add_argument("--allocations-per-thread", type=int, default=50)
+    parser.add_argument("--max-limit", type=int, default=4, help="maximum number of ids reserved per allocation")
+
+    return parser.parse_args()
+
+
+# mongomock runs an update as a read then a write in python, while mongodb makes every
+# single document operation atomic. run each operation of the collection under one lock
+class AtomicCollection:
+    def __init__(self, collection):
+        self.collection = collection
+        self.lock = threading.Lock()
+
+    def __getattr__(self, name):
+        attribute = getattr(self.collection, name)
+        if not callable(attribute):
+            return attribute
+
+        def locked(*args, **kwargs):
+            with self.lock:
+                return attribute(*args, **kwargs)
+
+        return locked
+
+
+def get_collection(args):
+    if args.db_url is None:
+        import mongomock
+        return AtomicCollection(mongomock.MongoClient()["sequential-id-check"]["dataset-sequential-id"]), None
+
+    import pymongo
+    mongodb_client = pymongo.MongoClient(args.db_url)
+    # use a scratch database, never the orchestration one
+    return mongodb_client["sequential-id-check"]["dataset-sequential-id"], mongodb_client
+
+
+def check_merge(collection):
+    # counters written by the previous racy allocator
+    collection.insert_many([
+        {"dataset_name": "existing", "subfolder_count": 1, "file_count": 5},
+        {"dataset_name": "existing", "subfolder_count": 1, "file_count": 12},
+        {"dataset_name": "existing", "subfolder_count": 1, "file_count": 7},
+        {"dataset_name": "other", "subfolder_count": 1, "file_count": 3},
+    ])
+
+    num_removed = merge_duplicate_sequential_ids(collection)
+    # fails with a duplicate key error if a duplicate is left
+    collection.create_index("dataset_name", unique=True)
+
+    counters = {counter["dataset_name"]: counter for counter in collection.find({})}
+    if num_removed != 2 or len(counters) != 2 or counters["existing"]["file_count"] != 12:
+        raise Exception("merge of the duplicate counters kept {}".format(list(counters.values())))
+    if any("subfolder_count" in counter for counter in counters.values()):
+        raise Exception("merge of the duplicate counters did not remove the stored subfolder count")
+
+    print("merge: removed {} duplicate counters, kept the highest file count".format(num_removed))
+
+
+def check_concurrent_allocation(collection, args, dataset, first_file_count):
+    request = SimpleNamespace(app=SimpleNamespace(dataset_sequential_id_collection=collection))
+
+    def allocate(thread_index):
+        rng = random.Random(thread_index)
+        sequential_ids = []
+        for i in range(args.allocations_per_thread):
+            limit = rng.randint(1, args.max_limit)
+            sequential_id_arr = get_sequential_id(request, dataset=dataset, limit=limit)
+            if len(sequential_id_arr) != limit:
+                raise Exception("asked for {} ids, got {}".format(limit, len(sequential_id_arr)))
+            sequential_ids.extend(sequential_id_arr)
+
+        return sequential_ids
+
+    with ThreadPoolExecutor(max_workers=args.num_threads) as executor:
+        results = list(executor.map(allocate, range(args.num_threads)))
+
+    all_sequential_ids = [sequential_id for result in results for sequential_id in result]
+    num_duplicates = len(all_sequential_ids) - len(set(all_sequential_ids))
+    if num_duplicates != 0:
+        raise Exception("{}: the allocator handed out {} duplicate ids".format(dataset, num_duplicates))
+
+    # the ids are the ones the previous allocator stepped through, without gaps
+    reference = SequentialID(dataset)
+    expected_sequential_ids = [reference.get_sequential_id() for _ in range(first_file_count + len(all_sequential_ids))]
+    expected_sequential_ids = expected_sequential_ids[first_file_count:]
+    if sorted(all_sequential_ids) != expected_sequential_ids:
+        raise Exception("{}: the allocated ids are not {} to {}".format(dataset, expected_sequential_ids[0],
+                                                                         expected_sequential_ids[-1]))
+
+    print("{}: {} threads allocated {} ids from {} to {}, no duplicates or gaps".format(
+        dataset, args.num_threads, len(all_sequential_ids), expected_sequential_ids[0], expected_sequential_ids[-1]))
+
+
+def main():
+    args = parse_args()
+    collection, mongodb_client = get_collection(args)
+    collection.drop()
+
+    check_merge(collection)
+    # continues the merged counter, whose last id is file 12
+    check_concurrent_allocation(collection, args, "existing", 13)
+    # the threads race to create the counter of a new dataset
+    check_concurrent_allocation(collection, args, "new", 0)
+
+    collection.drop()
+    if mongodb_client is not None:
+        mongodb_client.close()
+
+    print("OK")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+import os
+import sys
+import time
+import argparse
+import torch
+
+base_directory = os.getcwd()
+sys.path.insert(0, base_directory)
+
+from stable_diffusion.model.vae.autoencoder import Autoencoder
+from stable_diffusion.model.vae.encoder import Encoder
+from stable_diffusion.model.vae.decoder import Decoder
+from stable_diffusion.model.vae.tiling import get_tile_spans
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Compare tiled and untiled autoencoder outputs")
+
+    # the autoencoder tiles images above 512x512 with 512 pixel tiles, 64 pixels of overlap and 64 of context.
+    # the defaults keep those proportions at half the size, 3 tiles per side like a 1024x1024 image,
+    # so the untiled reference fits in cpu memory
+    parser.add_argument('--image-size', type=int, default=512)
+    parser.add_argument('--tile-size', type=int, default=256)
+    parser.add_argument('--tile-overlap', type=int, default=32)
+    parser.add_argument('--tile-padding', type=int, default=32)
+    parser.add_argument('--vae-path', type=str, default=None,
+                        help="autoencoder checkpoint, random weights are used if not given")
+    # with random weights and the default sizes the errors are 1.6e-3 for the encoder and 3.1e-3 for the decoder.
+    # the error depends on the context in pixels, so the 64 pixels of the autoencoder do better than the 32 here.
+    # 16 pixels of context around 128 pixel tiles gives 2.4e-2 for the encoder and 3.1e-2 for the decoder
+    parser.add_argument('--tolerance', type=float, default=1e-2,
+                        help="maximum allowed error relative to the standard deviation of the untiled output")
+    parser.add_argument('--seed', type=int, default=0)
+
+    return parser.parse_args()
+
+
+def run(fn, vae, max_untiled_pixels, tile_size, tile_overlap, tile_padding, x):
+    vae.set_tiling(max_untiled_pixels=max_untiled_pixels, tile_size=tile_size, tile_overlap=tile_overlap,
+                   tile_padding=tile_padding)
+
+    start_time = time.time()
+    with torch.no_grad():
+        out = fn(x)
+
+    return out, time.time() - start_time
+
+
+def relative_error(out, reference):
+    return float((out - reference).pow(2).mean().sqrt() / reference.std())
+
+
+# area of the tiles with their context relative to the image, the tiled layers do this much more work
+def get_tiled_area_ratio(image_size, tile_size, tile_overlap, tile_padding):
+    spans = get_tile_spans(image_size, tile_size, tile_overlap, tile_padding, multiple=8)
+    padded_length = sum(span.padded_end - span.padded_start for span in spans)
+
+    return (padded_length / image_size) ** 2
+
+
+def main():
+    args = parse_arguments()
+    torch.manual_seed(args.seed)
+
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    vae = Autoencoder(encoder=Encoder(device=device), decoder=Decoder(device=device), device=device)
+    if args.vae_path is not None:
+        vae.load(args.vae_path)
+    vae.eval()
+
+    # smooth random images, so the outputs are not dominated by pixel noise
+    image = torch.rand(1, 3, args.image_size // 16, args.image_size // 16, device=device) * 2 - 1
+    image = torch.nn.functional.interpolate(image, size=(args.image_size, args.image_size), mode='bicubic')
+    latent = torch.randn(1, 4, args.image_size // 8, args.image_size // 8, device=device)
+
+    results = []
+    for name, fn, x in [("encode", lambda x: vae.encode(x).mean, image), ("decode", vae.decode, latent)]:
+        reference, full_time = run(fn, vae, None, args.tile_size, args.tile_overlap, args.tile_padding, x)
+        tiled, tiled_time = run(fn, vae, 0, args.tile_size, args.tile_overlap, args.tile_padding, x)
+
+        results.append((name, relative_error(tiled, reference), full_time, tiled_time))
+
+    print("image size {}, tile size {}, overlap {}, padding {}".format(args.image_size, args.tile_size,
+                                                                      args.tile_overlap, args.tile_padding))
+    print("tiles with context cover {:.2f}x the image area".format(
+        get_tiled_area_ratio(args.image_size, args.tile_size, args.tile_overlap, args.tile_padding)))
+    print("{:>7} | {:>14} | {:>9} | {:>9}".format("stage", "relative error", "untiled", "tiled"))
+    for name, tiled_error, full_time, tiled_time in results:
+        print("{:>7} | {:>14.2e} | {:>8.3f}s | {:>8.3f}s".format(name, tiled_error, full_time, tiled_time))
+
+    for name, tiled_error, _, _ in results:
+        if tiled_error > args.tolerance:
+            raise Exception("tiled {} error {:.2e} is above the tolerance {}".format(name, tiled_error,
+                                                                                   args.tolerance))
+
+
+if __name__ == '__main__':
+    main()
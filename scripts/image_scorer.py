@@ -18,6 +18,7 @@ sys.path.insert(0, base_directory)
 from training_worker.ab_ranking.model.ab_ranking_elm_v1 import ABRankingELMModel
 from training_worker.ab_ranking.model.ab_ranking_linear import ABRankingModel as ABRankingLinearModel
 from training_worker.http import request
+from training_worker.ab_ranking.model.reports.upload_score_residual import get_percentiles
 from utility.minio import cmd
 
 
@@ -197,14 +198,11 @@ class ImageScorer:
         return hash_score_pairs, image_paths
 
     def get_percentiles(self, hash_score_pairs):
-        hash_percentile_dict = {}
-        sorted_hash_score_pairs = hash_score_pairs.copy()
-        sorted_hash_score_pairs.sort(key=lambda a: a[1])
+        percentiles = get_percentiles([score for _, score in hash_score_pairs])
 
-        len_hash_scores = len(sorted_hash_score_pairs)
-        for i in range(len(sorted_hash_score_pairs)):
-            percentile = i / len_hash_scores
-            hash_percentile_dict[sorted_hash_score_pairs[i][0]] = percentile
+        hash_percentile_dict = {}
+        for (image_hash, _), percentile in zip(hash_score_pairs, percentiles.tolist()):
+            hash_percentile_dict[image_hash] = percentile
 
         return hash_percentile_dict
 
@@ -0,0 +1,90 @@
+import argparse
+import sys
+
+import pymongo
+from pymongo import UpdateOne
+from dotenv import dotenv_values
+
+base_directory = "./"
+sys.path.insert(0, base_directory)
+
+from orchestration.api.api_utils import JOB_TIME_FIELDS, parse_job_times
+
+JOB_COLLECTIONS = ["pending-jobs", "in-progress-jobs", "completed-jobs", "failed-jobs",
+                   "training-pending-jobs", "training-in-progress-jobs", "training-completed-jobs",
+                   "training-failed-jobs"]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="convert job time strings to native dates")
+
+    parser.add_argument("--env-path", type=str, default="./orchestration/api/.env")
+    parser.add_argument("--batch-size", type=int, default=1000)
+
+    return parser.parse_args()
+
+
+def convert_on_server(collection, field):
+    # let mongodb parse the strings, strings it can not parse are kept as is
+    field_ref = "$" + field
+    pipeline = [{
+        "$set": {
+            field: {
+                "$cond": [
+                    {"$eq": [{"$type": field_ref}, "string"]},
+                    {"$dateFromString": {"dateString": field_ref, "onError": field_ref, "onNull": None}},
+                    field_ref,
+                ]
+            }
+        }
+    }]
+
+    result = collection.update_many({field: {"$type": "string"}}, pipeline)
+
+    return result.modified_count
+
+
+def convert_remaining(collection, batch_size):
+    # strings mongodb could not parse, for example with microseconds
+    query = {"$or": [{field: {"$type": "string"}} for field in JOB_TIME_FIELDS]}
+    projection = {field: 1 for field in JOB_TIME_FIELDS}
+
+    converted_count = 0
+    operations = []
+    for job in collection.find(query, projection):
+        job = parse_job_times(job)
+        new_values = {field: job[field] for field in JOB_TIME_FIELDS if field in job}
+        operations.append(UpdateOne({"_id": job["_id"]}, {"$set": new_values}))
+
+        if len(operations) >= batch_size:
+            converted_count += collection.bulk_write(operations, ordered=False).modified_count
+            operations = []
+
+    if len(operations) > 0:
+        converted_count += collection.bulk_write(operations, ordered=False).modified_count
+
+    return converted_count
+
+
+def main():
+    args = parse_args()
+
+    config = dotenv_values(args.env_path)
+    mongodb_client = pymongo.MongoClient(config["DB_URL"])
+    mongodb_db = mongodb_client["orchestration-job-db"]
+
+    for collection_name in JOB_COLLECTIONS:
+        collection = mongodb_db[collection_name]
+
+        for field in JOB_TIME_FIELDS:
+            modified_count = convert_on_server(collection, field)
+            print("{}: converted {} {} values".format(collection_name, modified_count, field))
+
+        remaining_count = convert_remaining(collection, args.batch_size)
+        print("{}: converted {} remaining jobs".format(collection_name, remaining_count))
+
+    mongodb_client.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,278 @@
+"""
+---
+title: Inference profiles
+summary: >
+ Precision, memory format and compilation of the U-Net and the autoencoder for inference,
+ with a check of the accuracy against float32.
+---
+
+# Inference profiles
+
+An inference profile sets how the [U-Net](model/unet/unet.html) and the
+[autoencoder](model/vae/autoencoder.html) run:
+
+* `precision` is `autocast` to keep float32 weights and run under `torch.autocast`, which is the default,
+  or `fp32`, `fp16` or `bf16` to cast the weights to that data type and run without autocast.
+* `channels_last` stores the convolution weights in the channels last memory format.
+* `compile_unet` compiles the U-Net with `torch.compile`, and runs it once for each of the
+  `warmup_shapes` so the compilation is done before the first job.
+
+The U-Net and the autoencoder take and return float32 in all profiles, so the samplers and the
+text embedder are unchanged. The profile is set for the process, and `get_autocast` follows it.
+
+The accuracy guard runs the U-Net and the decoder on fixed seed inputs in float32 before the
+profile is applied and again after, and fails if their relative error is above the tolerance.
+It also decodes a latent just large enough to be [decoded in tiles](model/vae/tiling.html),
+against an untiled float32 reference, so a profile that is only inaccurate on the tiled path
+taken by large images is rejected too.
+"""
+
+import contextlib
+from typing import Dict, Optional, Sequence, Tuple
+
+import torch
+from torch import nn
+
+PRECISION_AUTOCAST = 'autocast'
+PRECISION_FP32 = 'fp32'
+PRECISION_FP16 = 'fp16'
+PRECISION_BF16 = 'bf16'
+PRECISIONS = [PRECISION_AUTOCAST, PRECISION_FP32, PRECISION_FP16, PRECISION_BF16]
+
+# Data type of the weights for each precision
+PRECISION_DTYPES = {
+    PRECISION_AUTOCAST: torch.float32,
+    PRECISION_FP32: torch.float32,
+    PRECISION_FP16: torch.float16,
+    PRECISION_BF16: torch.bfloat16,
+}
+
+
+class InferenceProfile:
+    """
+    ## Inference profile
+    """
+
+    def __init__(self, precision: str = PRECISION_AUTOCAST, channels_last: bool = False,
+                 compile_unet: bool = False, warmup_shapes: Sequence[Tuple[int, int, int]] = (),
+                 accuracy_tolerance: Optional[float] = None, seed: int = 0):
+        """
+        :param precision: is one of `PRECISIONS`
+        :param channels_last: whether to use the channels last memory format for the U-Net and the autoencoder
+        :param compile_unet: whether to compile the U-Net
+        :param warmup_shapes: are the `(batch_size, height, width)` image shapes to run the compiled U-Net with
+            at startup. Classifier free guidance doubles the batch size
+        :param accuracy_tolerance: is the maximum relative error against float32, no check is done if it's `None`
+        :param seed: is the seed of the inputs of the accuracy check
+        """
+        if precision not in PRECISIONS:
+            raise ValueError(f'Precision {precision} is not supported, use one of {PRECISIONS}')
+
+        self.precision = precision
+        self.channels_last = channels_last
+        self.compile_unet = compile_unet
+        self.warmup_shapes = [tuple(shape) for shape in warmup_shapes]
+        self.accuracy_tolerance = accuracy_tolerance
+        self.seed = seed
+
+    @property
+    def dtype(self) -> torch.dtype:
+        return PRECISION_DTYPES[self.precision]
+
+    @property
+    def use_autocast(self) -> bool:
+        return self.precision == PRECISION_AUTOCAST
+
+    @property
+    def name(self) -> str:
+        name = self.precision
+        if self.channels_last:
+            name += '-channels-last'
+        if self.compile_unet:
+            name += '-compile'
+        return name
+
+
+# The profile of the process
+_inference_profile = InferenceProfile()
+
+
+def get_inference_profile() -> InferenceProfile:
+    return _inference_profile
+
+
+def set_inference_profile(profile: InferenceProfile):
+    global _inference_profile
+    _inference_profile = profile
+
+
+def get_profile_autocast(profile: InferenceProfile, device: torch.device):
+    """
+    ### Autocast context of `profile` on `device`
+    """
+    if not profile.use_autocast:
+        return contextlib.nullcontext()
+
+    return torch.autocast(device_type='cuda' if device.type == 'cuda' else 'cpu')
+
+
+def unet_forward(unet_model: nn.Module, x: torch.Tensor, time_steps: torch.Tensor, cond: torch.Tensor):
+    """
+    ### Run the U-Net in the data type of its weights
+
+    Returns float32 when the weights are in half precision.
+    """
+    dtype = next(unet_model.parameters()).dtype
+    if dtype == torch.float32:
+        return unet_model(x, time_steps, cond)
+
+    return unet_model(x.to(dtype), time_steps, cond.to(dtype)).float()
+
+
+def get_accuracy_inputs(seed: int, device: torch.device, d_cond: int = 768, tiled_latent_size: Optional[int] = None):
+    """
+    #### Fixed seed inputs of the accuracy check
+
+    :param tiled_latent_size: is the size of the square latent decoded in tiles, `None` skips the tiled decode
+    """
+    generator = torch.Generator().manual_seed(seed)
+    x = torch.randn(2, 4, 32, 32, generator=generator).to(device)
+    time_steps = torch.tensor([200, 800]).to(device)
+    cond = torch.randn(2, 77, d_cond, generator=generator).to(device)
+    z = torch.randn(1, 4, 16, 16, generator=generator).to(device)
+    z_tiled = None
+    if tiled_latent_size is not None:
+        z_tiled = torch.randn(1, 4, tiled_latent_size, tiled_latent_size, generator=generator).to(device)
+
+    return x, time_steps, cond, z, z_tiled
+
+
+def get_tiled_latent_size(autoencoder: Optional[nn.Module]) -> Optional[int]:
+    """
+    #### Size of the smallest square latent the autoencoder decodes in more than one tile per side
+
+    `None` if there is no autoencoder or it does not tile.
+    """
+    if autoencoder is None or autoencoder.max_untiled_pixels is None:
+        return None
+
+    scale_factor = autoencoder.scale_factor
+    # One latent pixel more than a tile, so there are two tiles per side
+    size = autoencoder.tile_size // scale_factor + 1
+    while not autoencoder.use_tiling(size * scale_factor, size * scale_factor):
+        size += 1
+
+    return size
+
+
+@contextlib.contextmanager
+def untiled(autoencoder: nn.Module):
+    """
+    #### Decode without tiling in this context
+    """
+    max_untiled_pixels = autoencoder.max_untiled_pixels
+    autoencoder.max_untiled_pixels = None
+    try:
+        yield
+    finally:
+        autoencoder.max_untiled_pixels = max_untiled_pixels
+
+
+@torch.no_grad()
+def get_accuracy_outputs(unet_model: nn.Module, autoencoder: Optional[nn.Module],
+                         profile: InferenceProfile, inputs, tiled: bool = True) -> Dict[str, torch.Tensor]:
+    """
+    #### Outputs of the U-Net and the decoder on the accuracy check inputs
+
+    :param tiled: whether the large latent is decoded in tiles, the reference decodes it whole
+    """
+    x, time_steps, cond, z, z_tiled = inputs
+    outputs = {}
+    with get_profile_autocast(profile, x.device):
+        outputs['unet'] = unet_forward(unet_model, x, time_steps, cond).float().cpu()
+        if autoencoder is not None:
+            outputs['decoder'] = autoencoder.decode(z).float().cpu()
+        if autoencoder is not None and z_tiled is not None:
+            with contextlib.nullcontext() if tiled else untiled(autoencoder):
+                outputs['tiled decoder'] = autoencoder.decode(z_tiled).float().cpu()
+
+    return outputs
+
+
+def apply_inference_profile(unet_model: nn.Module, autoencoder: Optional[nn.Module], profile: InferenceProfile,
+                            device: torch.device = None) -> Tuple[nn.Module, Dict[str, float]]:
+    """
+    ### Apply `profile` to the U-Net and the autoencoder, and set it for the process
+
+    :param unet_model: is the U-Net with float32 weights
+    :param autoencoder: is the autoencoder with float32 weights, or `None`
+    :param profile: is the inference profile
+    :param device: is the device of the models
+    :return: the U-Net to run, which is the compiled module if the profile compiles it,
+        and the relative error of the U-Net, the decoder and the tiled decoder outputs against float32,
+        empty if the profile has no accuracy tolerance
+    """
+    if device is None:
+        device = next(unet_model.parameters()).device
+    models = [unet_model] if autoencoder is None else [unet_model, autoencoder]
+
+    # Reference outputs in float32, without autocast
+    reference = None
+    if profile.accuracy_tolerance is not None:
+        accuracy_inputs = get_accuracy_inputs(profile.seed, device, d_cond=get_d_cond(unet_model),
+                                              tiled_latent_size=get_tiled_latent_size(autoencoder))
+        reference = get_accuracy_outputs(unet_model, autoencoder, InferenceProfile(PRECISION_FP32), accuracy_inputs,
+                                         tiled=False)
+
+    for model in models:
+        model.to(dtype=profile.dtype)
+        if profile.channels_last:
+            model.to(memory_format=torch.channels_last)
+
+    if profile.compile_unet:
+        # `nn.Module.compile` needs PyTorch 2.2, the compiled module wraps the U-Net
+        unet_model = torch.compile(unet_model, dynamic=False)
+
+    set_inference_profile(profile)
+
+    # Compile for the shapes of the jobs at startup
+    if profile.compile_unet:
+        warmup_unet(unet_model, profile, device)
+
+    errors = {}
+    if reference is not None:
+        outputs = get_accuracy_outputs(unet_model, autoencoder, profile, accuracy_inputs)
+        for name, output in outputs.items():
+            errors[name] = float((output - reference[name]).norm() / reference[name].norm())
+            if not errors[name] <= profile.accuracy_tolerance:
+                raise ValueError(f'Inference profile {profile.name}: relative error of the {name} against fp32 is '
+                                 f'{errors[name]:.2e}, above the tolerance {profile.accuracy_tolerance:.2e}')
+
+    return unet_model, errors
+
+
+def get_d_cond(unet_model: nn.Module) -> int:
+    """
+    #### Size of the conditional embeddings of the U-Net
+    """
+    for name, parameter in unet_model.named_parameters():
+        if name.endswith('attn2.to_k.weight'):
+            return parameter.shape[1]
+
+    return 768
+
+
+@torch.no_grad()
+def warmup_unet(unet_model: nn.Module, profile: InferenceProfile, device: torch.device):
+    """
+    #### Run the U-Net once for each warm up shape
+    """
+    d_cond = get_d_cond(unet_model)
+    for batch_size, height, width in profile.warmup_shapes:
+        # With and without classifier free guidance
+        for n in sorted({batch_size, 2 * batch_size}):
+            x = torch.zeros(n, 4, height // 8, width // 8, device=device)
+            time_steps = torch.full((n,), 500, device=device, dtype=torch.long)
+            cond = torch.zeros(n, 77, d_cond, device=device)
+            with get_profile_autocast(profile, device):
+                unet_forward(unet_model, x, time_steps, cond)
@@ -43,6 +43,7 @@ from .model.clip_text_embedder.clip_text_embedder import CLIPTextEmbedder
 from .model.unet.unet import UNetModel
 from .model.vae.autoencoder import Autoencoder
 from .utils_backend import get_device
+from .inference_profile import unet_forward
 
 
 class UNetWrapper(nn.Module):
@@ -58,7 +59,8 @@ class UNetWrapper(nn.Module):
         self.diffusion_model = diffusion_model
 
     def forward(self, x: torch.Tensor, time_steps: torch.Tensor, context: torch.Tensor):
-        return self.diffusion_model(x, time_steps, context)
+        # Run in the precision of the weights, which is set by the [inference profile](inference_profile.html)
+        return unet_forward(self.diffusion_model, x, time_steps, context)
 
 
 class LatentDiffusion(nn.Module):
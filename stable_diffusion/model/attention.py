@@ -0,0 +1,154 @@
+r"""
+---
+title: Attention backends for stable diffusion
+summary: >
+ Selectable implementations of scaled dot-product attention
+ shared by the U-Net transformer and the autoencoder.
+---
+
+# Attention backends
+
+The [U-Net cross attention](unet/unet_attention.html) and the
+[autoencoder attention block](vae/auxiliary_classes.html) compute
+$$\underset{seq}{softmax}\Bigg(\frac{Q K^\top}{\sqrt{d_{key}}}\Bigg)V$$
+with one of these backends:
+
+* `normal` materializes the full attention matrix. This is the original implementation.
+* `sdpa` uses `torch.nn.functional.scaled_dot_product_attention`, which picks the flash,
+  memory-efficient or math kernel available for the device and dtype.
+* `chunked` processes the queries in slices, so the attention matrix of a slice
+  stays within `chunk_memory_budget` bytes. This bounds peak memory on CPU.
+
+The backend is set once for the process with `set_attention_backend`.
+"""
+
+import torch
+import torch.nn.functional as F
+
+ATTENTION_NORMAL = 'normal'
+ATTENTION_SDPA = 'sdpa'
+ATTENTION_CHUNKED = 'chunked'
+ATTENTION_BACKENDS = [ATTENTION_NORMAL, ATTENTION_SDPA, ATTENTION_CHUNKED]
+
+# Use scaled dot-product attention when this version of PyTorch has it
+_attention_backend = ATTENTION_SDPA if hasattr(F, 'scaled_dot_product_attention') else ATTENTION_NORMAL
+# Maximum size in bytes of the attention matrix of one slice for the `chunked` backend
+_chunk_memory_budget = 256 * 1024 * 1024
+
+
+def set_attention_backend(backend: str, chunk_memory_budget: int = None):
+    """
+    ### Select the attention backend
+
+    :param backend: is one of `ATTENTION_BACKENDS`
+    :param chunk_memory_budget: is the maximum size in bytes of the attention matrix of
+        one slice for the `chunked` backend
+    """
+    global _attention_backend, _chunk_memory_budget
+
+    if backend not in ATTENTION_BACKENDS:
+        raise ValueError(f'Attention backend {backend} is not supported, use one of {ATTENTION_BACKENDS}')
+    if backend == ATTENTION_SDPA and not hasattr(F, 'scaled_dot_product_attention'):
+        raise ValueError(f'Attention backend {backend} needs PyTorch 2.0 or newer')
+
+    _attention_backend = backend
+    if chunk_memory_budget is not None:
+        _chunk_memory_budget = chunk_memory_budget
+
+
+def get_attention_backend():
+    return _attention_backend
+
+
+def get_chunk_memory_budget():
+    return _chunk_memory_budget
+
+
+def attention(q: torch.Tensor, k: torch.Tensor, v: torch.Tensor, scale: float, backend: str = None):
+    r"""
+    ### Scaled dot-product attention with the selected backend
+
+    :param q: are the query vectors of shape `[batch_size, n_heads, seq_q, d_head]`
+    :param k: are the key vectors of shape `[batch_size, n_heads, seq_k, d_head]`
+    :param v: are the value vectors of shape `[batch_size, n_heads, seq_k, d_head]`
+    :param scale: is the attention scaling factor, usually $\frac{1}{\sqrt{d_{key}}}$
+    :param backend: overrides the selected backend
+    :return: the attention output of shape `[batch_size, n_heads, seq_q, d_head]`
+    """
+    if backend is None:
+        backend = _attention_backend
+
+    if backend == ATTENTION_SDPA:
+        return sdpa_attention(q, k, v, scale)
+    elif backend == ATTENTION_CHUNKED:
+        return chunked_attention(q, k, v, scale)
+    elif backend == ATTENTION_NORMAL:
+        return normal_attention(q, k, v, scale)
+    else:
+        raise ValueError(f'Attention backend {backend} is not supported, use one of {ATTENTION_BACKENDS}')
+
+
+def normal_attention(q: torch.Tensor, k: torch.Tensor, v: torch.Tensor, scale: float):
+    r"""
+    #### Attention with the full `[batch_size, n_heads, seq_q, seq_k]` matrix
+    """
+    # $\frac{Q K^\top}{\sqrt{d_{key}}}$
+    attn = torch.matmul(q, k.transpose(-1, -2)) * scale
+    # $\underset{seq}{softmax}\Bigg(\frac{Q K^\top}{\sqrt{d_{key}}}\Bigg)$
+    attn = attn.softmax(dim=-1)
+
+    return torch.matmul(attn, v)
+
+
+def sdpa_attention(q: torch.Tensor, k: torch.Tensor, v: torch.Tensor, scale: float):
+    """
+    #### Attention with PyTorch's fused kernels
+
+    `scaled_dot_product_attention` only takes a `scale` from PyTorch 2.1, before that it always
+    scales by $\frac{1}{\sqrt{d_{key}}}$. Any other scale is folded into the queries.
+    """
+    default_scale = q.shape[-1] ** -0.5
+    if scale != default_scale:
+        q = q * (scale / default_scale)
+
+    return F.scaled_dot_product_attention(q, k, v)
+
+
+def get_chunk_size(q: torch.Tensor, k: torch.Tensor, memory_budget: int):
+    """
+    #### Number of queries per slice so that the slice's attention matrices fit in `memory_budget` bytes
+    """
+    batch_size, n_heads, seq_q, _ = q.shape
+    seq_k = k.shape[2]
+    # The scores and their softmax are both alive while a slice is computed
+    bytes_per_query = 2 * batch_size * n_heads * seq_k * q.element_size()
+
+    return max(1, min(seq_q, memory_budget // bytes_per_query))
+
+
+def chunked_attention(q: torch.Tensor, k: torch.Tensor, v: torch.Tensor, scale: float,
+                      memory_budget: int = None):
+    """
+    #### Attention computed over slices of the queries
+
+    Each query only attends over the keys, so slices along the query axis are independent
+    and peak memory is the attention matrix of one slice.
+    """
+    if memory_budget is None:
+        memory_budget = _chunk_memory_budget
+
+    seq_q = q.shape[2]
+    chunk_size = get_chunk_size(q, k, memory_budget)
+    if chunk_size >= seq_q:
+        return normal_attention(q, k, v, scale)
+
+    out = q.new_empty(*q.shape[:3], v.shape[-1])
+    k_t = k.transpose(-1, -2)
+    for start in range(0, seq_q, chunk_size):
+        end = min(start + chunk_size, seq_q)
+        # Scale the queries of the slice, which is smaller than scaling the scores
+        attn = torch.matmul(q[:, :, start:end] * scale, k_t)
+        attn = attn.softmax(dim=-1)
+        out[:, :, start:end] = torch.matmul(attn, v)
+
+    return out
@@ -100,7 +100,7 @@ class UNetModel(nn.Module):
                 channels = channels_list[i]
                 # Add transformer
                 if i in attention_levels:
-                    layers.append(SpatialTransformer(channels, n_heads, tf_layers, d_cond))
+                    layers.append(SpatialTransformer(channels, n_heads, tf_layers, d_cond, level=i))
                 # Add them to the input half of the U-Net and keep track of the number of channels of
                 # its output
                 self.input_blocks.append(TimestepEmbedSequential(*layers))
@@ -113,7 +113,7 @@ class UNetModel(nn.Module):
         # The middle of the U-Net
         self.middle_block = TimestepEmbedSequential(
             ResBlock(channels, d_time_emb),
-            SpatialTransformer(channels, n_heads, tf_layers, d_cond),
+            SpatialTransformer(channels, n_heads, tf_layers, d_cond, level=levels - 1),
             ResBlock(channels, d_time_emb),
         )
 
@@ -130,7 +130,7 @@ class UNetModel(nn.Module):
                 channels = channels_list[i]
                 # Add transformer
                 if i in attention_levels:
-                    layers.append(SpatialTransformer(channels, n_heads, tf_layers, d_cond))
+                    layers.append(SpatialTransformer(channels, n_heads, tf_layers, d_cond, level=i))
                 # Up-sample at every level after last residual block
                 # except the last one.
                 # Note that we are iterating in reverse; i.e. `i == 0` is the last.
@@ -191,7 +191,7 @@ class UNetModel(nn.Module):
         x_input_block = []
 
         # Get time step embeddings
-        t_emb = self.time_step_embedding(time_steps)
+        t_emb = self.time_step_embedding(time_steps).to(x.dtype)
         t_emb = self.time_embed(t_emb)
 
         # Input half of the U-Net
@@ -337,7 +337,8 @@ class GroupNorm32(nn.GroupNorm):
     """
 
     def forward(self, x):
-        return super().forward(x.float()).type(x.dtype)
+        # The parameters are cast too, for models with half precision weights
+        return F.group_norm(x.float(), self.num_groups, self.weight.float(), self.bias.float(), self.eps).type(x.dtype)
 
 
 def normalization(channels):
@@ -14,28 +14,92 @@ This implements the transformer module used in [U-Net](unet.html) that
 We have kept to the model definition and naming unchanged from
 [CompVis/stable-diffusion](https://github.com/CompVis/stable-diffusion)
 so that we can load the checkpoints directly.
+
+### Token merging
+
+With [token merging](https://arxiv.org/abs/2303.17604) enabled, each transformer layer merges
+the most similar tokens with bipartite soft matching before the self-attention and the
+feed-forward network, and copies the outputs back to the merged tokens afterwards.
+The ratio of tokens merged is set per U-Net level with `set_token_merging`,
+and it adds no parameters, so the checkpoints are unchanged.
 """
 
-from typing import Optional
+from contextlib import contextmanager
+from typing import Callable, Optional, Sequence, Tuple, Union
 
 import torch
 import torch.nn.functional as F
 from torch import nn
 
+from stable_diffusion.model.attention import attention, get_attention_backend, ATTENTION_NORMAL
+
+# Ratio of tokens merged at each U-Net level, starting with the highest resolution.
+# Token merging is off when this is empty
+_token_merging_ratios: Tuple[float, ...] = ()
+
+
+def set_token_merging(ratios: Union[float, Sequence[float], None]):
+    """
+    ### Set the ratio of tokens merged at each U-Net level
+
+    :param ratios: are the ratios of the tokens merged at each level, starting with the
+        highest resolution. A single ratio is used for the highest resolution only, where
+        the self-attention over `height * width` tokens costs the most.
+        `None` or `0` turns token merging off.
+    """
+    global _token_merging_ratios
+
+    if ratios is None:
+        ratios = ()
+    elif isinstance(ratios, (int, float)):
+        ratios = (ratios,)
+
+    for ratio in ratios:
+        if not 0. <= ratio < 1.:
+            raise ValueError(f'Token merging ratio {ratio} must be in [0, 1)')
+
+    _token_merging_ratios = tuple(float(ratio) for ratio in ratios)
+
+
+def get_token_merging_ratio(level: int):
+    """
+    ### Ratio of tokens merged at U-Net `level`
+    """
+    if level < len(_token_merging_ratios):
+        return _token_merging_ratios[level]
+
+    return 0.
+
+
+@contextmanager
+def token_merging(ratios: Union[float, Sequence[float], None]):
+    """
+    ### Set the token merging ratios within this context, for a single job
+    """
+    previous_ratios = _token_merging_ratios
+    set_token_merging(ratios)
+    try:
+        yield
+    finally:
+        set_token_merging(previous_ratios)
+
 
 class SpatialTransformer(nn.Module):
     """
     ## Spatial Transformer
     """
 
-    def __init__(self, channels: int, n_heads: int, n_layers: int, d_cond: int):
+    def __init__(self, channels: int, n_heads: int, n_layers: int, d_cond: int, level: int = 0):
         """
         :param channels: is the number of channels in the feature map
         :param n_heads: is the number of attention heads
         :param n_layers: is the number of transformer layers
         :param d_cond: is the size of the conditional embedding
+        :param level: is the U-Net level of the transformer, which selects the token merging ratio
         """
         super().__init__()
+        # U-Net level
+        self.level = level
         # Initial group normalization
         self.norm = torch.nn.GroupNorm(num_groups=32, num_channels=channels, eps=1e-6, affine=True)
         # Initial $1 \times 1$ convolution
@@ -65,9 +129,11 @@ class SpatialTransformer(nn.Module):
         # Transpose and reshape from `[batch_size, channels, height, width]`
         # to `[batch_size, height * width, channels]`
         x = x.permute(0, 2, 3, 1).view(b, h * w, c)
+        # Ratio of tokens to merge
+        merge_ratio = get_token_merging_ratio(self.level)
         # Apply the transformer layers
         for block in self.transformer_blocks:
-            x = block(x, cond)
+            x = block(x, cond, size=(h, w), merge_ratio=merge_ratio)
         # Reshape and transpose from `[batch_size, height * width, channels]`
         # to `[batch_size, channels, height, width]`
         x = x.view(b, h, w, c).permute(0, 3, 1, 2)
@@ -100,17 +166,26 @@ class BasicTransformerBlock(nn.Module):
         self.ff = FeedForward(d_model)
         self.norm3 = nn.LayerNorm(d_model)
 
-    def forward(self, x: torch.Tensor, cond: torch.Tensor):
+    def forward(self, x: torch.Tensor, cond: torch.Tensor, *,
+                size: Optional[Tuple[int, int]] = None, merge_ratio: float = 0.):
         """
         :param x: are the input embeddings of shape `[batch_size, height * width, d_model]`
         :param cond: is the conditional embeddings of shape `[batch_size,  n_cond, d_cond]`
+        :param size: is `(height, width)` of the feature map, needed for token merging
+        :param merge_ratio: is the ratio of tokens merged for the self attention and the feed-forward network
         """
+        # Merge similar tokens, and unmerge the outputs
+        if size is not None and merge_ratio > 0.:
+            merge, unmerge = bipartite_soft_matching(x, *size, merge_ratio)
+        else:
+            merge, unmerge = identity, identity
+
         # Self attention
-        x = self.attn1(self.norm1(x)) + x
+        x = unmerge(self.attn1(merge(self.norm1(x)))) + x
         # Cross-attention with conditioning
         x = self.attn2(self.norm2(x), cond=cond) + x
         # Feed-forward network
-        x = self.ff(self.norm3(x)) + x
+        x = unmerge(self.ff(merge(self.norm3(x)))) + x
         #
         return x
 
@@ -120,6 +195,9 @@ class CrossAttention(nn.Module):
     ### Cross Attention Layer
 
     This falls-back to self-attention when conditional embeddings are not specified.
+
+    Self-attention and cross-attention use the [selected attention backend](../attention.html),
+    unless flash attention is enabled for self-attention.
     """
 
     use_flash_attention: bool = False
@@ -185,9 +263,12 @@ class CrossAttention(nn.Module):
         # Use flash attention if it's available and the head size is less than or equal to `128`
         if CrossAttention.use_flash_attention and self.flash is not None and not has_cond and self.d_head <= 128:
             return self.flash_attention(q, k, v)
-        # Otherwise, fallback to normal attention
-        else:
+        # Use the original implementation for the `normal` backend
+        elif get_attention_backend() == ATTENTION_NORMAL:
             return self.normal_attention(q, k, v)
+        # Otherwise, use the selected attention backend
+        else:
+            return self.backend_attention(q, k, v)
 
     def flash_attention(self, q: torch.Tensor, k: torch.Tensor, v: torch.Tensor):
         """
@@ -234,6 +315,28 @@ class CrossAttention(nn.Module):
         # Map to `[batch_size, height * width, d_model]` with a linear layer
         return self.to_out(out)
 
+    def backend_attention(self, q: torch.Tensor, k: torch.Tensor, v: torch.Tensor):
+        """
+        #### Attention with the [selected backend](../attention.html)
+
+        :param q: are the query vectors before splitting heads, of shape `[batch_size, seq, d_attn]`
+        :param k: are the query vectors before splitting heads, of shape `[batch_size, seq, d_attn]`
+        :param v: are the query vectors before splitting heads, of shape `[batch_size, seq, d_attn]`
+        """
+
+        # Split them to heads of shape `[batch_size, n_heads, seq_len, d_head]`
+        q = q.view(*q.shape[:2], self.n_heads, -1).transpose(1, 2)
+        k = k.view(*k.shape[:2], self.n_heads, -1).transpose(1, 2)
+        v = v.view(*v.shape[:2], self.n_heads, -1).transpose(1, 2)
+
+        # Compute attention output
+        # $$\underset{seq}{softmax}\Bigg(\frac{Q K^\top}{\sqrt{d_{key}}}\Bigg)V$$
+        out = attention(q, k, v, self.scale)
+        # Reshape to `[batch_size, height * width, n_heads * d_head]`
+        out = out.transpose(1, 2).reshape(out.shape[0], out.shape[2], -1)
+        # Map to `[batch_size, height * width, d_model]` with a linear layer
+        return self.to_out(out)
+
     def normal_attention(self, q: torch.Tensor, k: torch.Tensor, v: torch.Tensor):
         """
         #### Normal Attention
@@ -307,3 +410,81 @@ class GeGLU(nn.Module):
         x, gate = self.proj(x).chunk(2, dim=-1)
         # $\text{GeGLU}(x) = (xW + b) * \text{GELU}(xV + c)$
         return x * F.gelu(gate)
+
+
+def identity(x: torch.Tensor):
+    return x
+
+
+def bipartite_soft_matching(x: torch.Tensor, height: int, width: int,
+                            ratio: float) -> Tuple[Callable[[torch.Tensor], torch.Tensor],
+                                                   Callable[[torch.Tensor], torch.Tensor]]:
+    """
+    ### Bipartite soft matching
+
+    The tokens are split into destinations, one in each $2 \times 2$ block of the feature map,
+    and sources. Each source is matched with its most similar destination by the cosine
+    similarity of `x`, and the `ratio * height * width` sources with the most similar matches
+    are merged into their destinations by averaging.
+
+    :param x: are the tokens of shape `[batch_size, height * width, d_model]`
+    :param height: is the height of the feature map
+    :param width: is the width of the feature map
+    :param ratio: is the ratio of the tokens to merge
+    :return: `merge`, which maps `[batch_size, height * width, d]` to the fewer merged tokens,
+        and `unmerge`, which copies each merged token back to the tokens merged into it
+    """
+    batch_size, n_tokens, _ = x.shape
+
+    # Destinations are the top left token of each $2 \times 2$ block
+    is_dst = torch.zeros(height, width, dtype=torch.bool, device=x.device)
+    is_dst[::2, ::2] = True
+    is_dst = is_dst.view(-1)
+    dst_pos = is_dst.nonzero().squeeze(-1)
+    src_pos = (~is_dst).nonzero().squeeze(-1)
+
+    # Number of tokens to merge
+    r = min(int(n_tokens * ratio), src_pos.shape[0])
+    if r <= 0:
+        return identity, identity
+
+    # Cosine similarity of sources and destinations
+    metric = x / x.norm(dim=-1, keepdim=True)
+    scores = metric[:, src_pos] @ metric[:, dst_pos].transpose(-1, -2)
+    # Most similar destination of each source
+    node_max, node_idx = scores.max(dim=-1)
+    # Sources ordered by the similarity of their match, the first `r` are merged
+    edge_idx = node_max.argsort(dim=-1, descending=True)[..., None]
+    unm_idx = edge_idx[:, r:]
+    src_idx = edge_idx[:, :r]
+    # Destination of each merged source
+    dst_idx = node_idx[..., None].gather(dim=1, index=src_idx)
+    # Positions in the feature map of the unmerged and merged sources
+    unm_pos = src_pos[unm_idx]
+    merged_pos = src_pos[src_idx]
+
+    def merge(y: torch.Tensor):
+        d = y.shape[-1]
+        src, dst = y[:, src_pos], y[:, dst_pos]
+        unm = src.gather(dim=1, index=unm_idx.expand(-1, -1, d))
+        src = src.gather(dim=1, index=src_idx.expand(-1, -1, d))
+        # Average the merged sources with their destination
+        dst = dst.scatter_reduce(1, dst_idx.expand(-1, -1, d), src, reduce='mean')
+
+        return torch.cat([unm, dst], dim=1)
+
+    def unmerge(y: torch.Tensor):
+        d = y.shape[-1]
+        n_unm = unm_idx.shape[1]
+        unm, dst = y[:, :n_unm], y[:, n_unm:]
+        # Outputs of the merged sources are those of their destinations
+        src = dst.gather(dim=1, index=dst_idx.expand(-1, -1, d))
+
+        out = y.new_empty(batch_size, n_tokens, d)
+        out[:, dst_pos] = dst
+        out.scatter_(1, unm_pos.expand(-1, -1, d), unm)
+        out.scatter_(1, merged_pos.expand(-1, -1, d), src)
+
+        return out
+
+    return merge, unmerge
@@ -18,6 +18,7 @@ so that we can load the checkpoints directly.
 import os
 import sys
 import safetensors
+from typing import Optional
 
 from utility.utils_logger import logger
 from utility.labml.monit import section
@@ -26,6 +27,7 @@ sys.path.insert(0, os.getcwd())
 from .auxiliary_classes import *
 from .encoder import Encoder
 from .decoder import Decoder
+from .tiling import tiled_forward
 from stable_diffusion.utils_backend import get_device
 from stable_diffusion.model_paths import VAE_ENCODER_PATH, VAE_DECODER_PATH, VAE_PATH
 
@@ -56,8 +58,52 @@ class Autoencoder(nn.Module):
         # Convolution to map from quantized embedding space back to
         # embedding space
         self.post_quant_conv = nn.Conv2d(emb_channels, z_channels, 1)
+        # Images with more pixels than this are encoded and decoded in tiles
+        self.max_untiled_pixels = 512 * 512
+        # Size, overlap and context of the tiles in image pixels
+        self.tile_size = 512
+        self.tile_overlap = 64
+        self.tile_padding = 64
+        # Tile activations are kept on the CPU between layers, so the device only holds one tile
+        self.tile_storage_device = torch.device('cpu')
         self.to(self.device)
 
+    def set_tiling(self, max_untiled_pixels: Optional[int] = 512 * 512, tile_size: int = 512, tile_overlap: int = 64,
+                   tile_padding: int = 64):
+        """
+        ### Configure [tiled](tiling.html) encoding and decoding
+
+        :param max_untiled_pixels: is the number of image pixels above which tiling is used,
+            `None` disables tiling
+        :param tile_size: is the size of the tiles in image pixels, a multiple of the latent scale factor
+        :param tile_overlap: is the overlap of neighbouring tiles in image pixels, a multiple of the latent
+            scale factor
+        :param tile_padding: is the context around each tile in image pixels, a multiple of the latent scale factor
+        """
+        if any(size % self.scale_factor != 0 for size in [tile_size, tile_overlap, tile_padding]):
+            raise ValueError(f'Tile size, overlap and padding must be multiples of {self.scale_factor}')
+        if not 0 <= tile_overlap < tile_size:
+            raise ValueError('Tile overlap must be smaller than the tile size')
+
+        self.max_untiled_pixels = max_untiled_pixels
+        self.tile_size = tile_size
+        self.tile_overlap = tile_overlap
+        self.tile_padding = tile_padding
+
+    @property
+    def scale_factor(self) -> int:
+        """
+        ### Ratio of image size to latent size
+        """
+        # The encoder and decoder halve and double the size at $3$ of their $4$ resolutions
+        return 8
+
+    def use_tiling(self, height: int, width: int) -> bool:
+        """
+        ### Whether an image of `height` by `width` pixels is processed in tiles
+        """
+        return self.max_untiled_pixels is not None and height * width > self.max_untiled_pixels
+
     def save_submodels(self, encoder_path=VAE_ENCODER_PATH, decoder_path=VAE_DECODER_PATH):
 
         self.encoder.save(encoder_path)
@@ -153,23 +199,55 @@ class Autoencoder(nn.Module):
 
         :param img: is the image tensor with shape `[batch_size, img_channels, img_height, img_width]`
         """
+        # Run in the precision of the weights
+        img = img.to(self.dtype)
+
+        # Run the full resolution layers of large images in tiles
+        if self.use_tiling(*img.shape[-2:]):
+            x = tiled_forward(self.encoder.down_layers(), self.encoder, img,
+                              tile_size=self.tile_size, overlap=self.tile_overlap, padding=self.tile_padding,
+                              scale=1 / self.scale_factor, multiple=self.scale_factor,
+                              storage_device=self.tile_storage_device)
+            return GaussianDistribution(self.quant_conv(self.encoder.forward_mid(x)).float())
+
         # Get embeddings with shape `[batch_size, z_channels * 2, z_height, z_height]`
         z = self.encoder(img)
-        # Get the moments in the quantized embedding space
-        moments = self.quant_conv(z)
+        # Get the moments in the quantized embedding space, in float32
+        moments = self.quant_conv(z).float()
         # Return the distribution
         return GaussianDistribution(moments)
 
+    @property
+    def dtype(self):
+        """
+        ### Data type of the weights
+
+        Encoding and decoding run in the data type of the weights, and return float32.
+        """
+        return self.quant_conv.weight.dtype
+
     def decode(self, z: torch.Tensor):
         """
         ### Decode images from latent representation
 
         :param z: is the latent representation with shape `[batch_size, emb_channels, z_height, z_height]`
         """
+        # Run in the precision of the weights
+        z = z.to(self.dtype)
+
+        # Run the full resolution layers of large images in tiles
+        if self.use_tiling(z.shape[-2] * self.scale_factor, z.shape[-1] * self.scale_factor):
+            h = self.decoder.forward_mid(self.post_quant_conv(z))
+            return tiled_forward(self.decoder.up_layers(), self.decoder, h,
+                                 tile_size=self.tile_size // self.scale_factor,
+                                 overlap=self.tile_overlap // self.scale_factor,
+                                 padding=self.tile_padding // self.scale_factor,
+                                 scale=self.scale_factor, storage_device=self.tile_storage_device).float()
+
         # Map to embedding space from the quantized representation
         z = self.post_quant_conv(z)
-        # Decode the image of shape `[batch_size, channels, height, width]`
-        return self.decoder(z)
+        # Decode the image of shape `[batch_size, channels, height, width]` in float32
+        return self.decoder(z).float()
 
 
 if __name__ == "__main__":
@@ -2,6 +2,8 @@ import torch
 import torch.nn.functional as F
 from torch import nn
 
+from stable_diffusion.model.attention import attention, get_attention_backend, ATTENTION_NORMAL
+
 
 class GaussianDistribution:
     """
@@ -65,12 +67,22 @@ class AttnBlock(nn.Module):
         k = k.view(b, c, h * w)
         v = v.view(b, c, h * w)
 
-        # Compute $\underset{seq}{softmax}\Bigg(\frac{Q K^\top}{\sqrt{d_{key}}}\Bigg)$
-        attn = torch.einsum('bci,bcj->bij', q, k) * self.scale
-        attn = F.softmax(attn, dim=2)
+        if get_attention_backend() == ATTENTION_NORMAL:
+            # Compute $\underset{seq}{softmax}\Bigg(\frac{Q K^\top}{\sqrt{d_{key}}}\Bigg)$
+            attn = torch.einsum('bci,bcj->bij', q, k) * self.scale
+            attn = F.softmax(attn, dim=2)
 
-        # Compute $\underset{seq}{softmax}\Bigg(\frac{Q K^\top}{\sqrt{d_{key}}}\Bigg)V$
-        out = torch.einsum('bij,bcj->bci', attn, v)
+            # Compute $\underset{seq}{softmax}\Bigg(\frac{Q K^\top}{\sqrt{d_{key}}}\Bigg)V$
+            out = torch.einsum('bij,bcj->bci', attn, v)
+        else:
+            # Compute $\underset{seq}{softmax}\Bigg(\frac{Q K^\top}{\sqrt{d_{key}}}\Bigg)V$
+            # with the [selected attention backend](../attention.html), as a single head
+            # of shape `[batch_size, 1, height * width, channels]`
+            out = attention(q.transpose(1, 2).unsqueeze(1),
+                            k.transpose(1, 2).unsqueeze(1),
+                            v.transpose(1, 2).unsqueeze(1),
+                            self.scale)
+            out = out.squeeze(1).transpose(1, 2).reshape(b, c, h * w)
 
         # Reshape back to `[batch_size, channels, height, width]`
         out = out.view(b, c, h, w)
@@ -16,7 +16,7 @@ so that we can load the checkpoints directly.
 """
 import os
 import sys
-from typing import List
+from typing import Callable, List
 
 import safetensors
 
@@ -114,6 +114,14 @@ class Decoder(nn.Module):
 
     def forward(self, z: torch.Tensor):
         """
+        :param z: is the embedding tensor with shape `[batch_size, z_channels, z_height, z_height]`
+        """
+        return self.forward_up(self.forward_mid(z))
+
+    def forward_mid(self, z: torch.Tensor):
+        """
+        ### Layers at the embedding resolution
+
         :param z: is the embedding tensor with shape `[batch_size, z_channels, z_height, z_height]`
         """
 
@@ -125,18 +133,43 @@ class Decoder(nn.Module):
         h = self.mid.attn_1(h)
         h = self.mid.block_2(h)
 
+        #
+        return h
+
+    def forward_up(self, h: torch.Tensor):
+        """
+        ### Layers from the embedding resolution up to the image
+
+        :param h: is the output of `forward_mid`
+        """
+        for layer in self.up_layers():
+            h = layer(h)
+
+        #
+        return h
+
+    def up_layers(self) -> List[Callable[[torch.Tensor], torch.Tensor]]:
+        """
+        ### Layers of `forward_up` in order
+
+        These only see a neighbourhood of each pixel, so [tiled decoding](tiling.html)
+        runs them one at a time over all tiles.
+        """
+        layers = []
         # Top-level blocks
         for up in reversed(self.up):
-            # ResNet Blocks
-            for block in up.block:
-                h = block(h)
-            # Up-sampling
-            h = up.upsample(h)
-
+            # ResNet Blocks and up-sampling
+            layers += [*up.block, up.upsample]
         # Normalize and map to image space
-        h = self.norm_out(h)
-        h = swish(h)
-        img = self.conv_out(h)
+        layers.append(self.forward_out)
 
         #
-        return img
+        return layers
+
+    def forward_out(self, h: torch.Tensor):
+        """
+        ### Normalize and map to image space
+        """
+        h = self.norm_out(h)
+        h = swish(h)
+        return self.conv_out(h)
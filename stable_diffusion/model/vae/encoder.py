@@ -17,7 +17,7 @@ so that we can load the checkpoints directly.
 
 import os
 import sys
-from typing import List
+from typing import Callable, List
 
 import safetensors
 
@@ -113,17 +113,44 @@ class Encoder(nn.Module):
         """
         :param img: is the image tensor with shape `[batch_size, img_channels, img_height, img_width]`
         """
+        return self.forward_mid(self.forward_down(img))
 
-        # Map to `channels` with the initial convolution
-        x = self.conv_in(img)
+    def forward_down(self, img: torch.Tensor):
+        """
+        ### Layers from the image down to the embedding resolution
+
+        :param img: is the image tensor with shape `[batch_size, img_channels, img_height, img_width]`
+        """
+        x = img
+        for layer in self.down_layers():
+            x = layer(x)
+
+        #
+        return x
+
+    def down_layers(self) -> List[Callable[[torch.Tensor], torch.Tensor]]:
+        """
+        ### Layers of `forward_down` in order
 
+        These only see a neighbourhood of each pixel, so [tiled encoding](tiling.html)
+        runs them one at a time over all tiles.
+        """
+        # Map to `channels` with the initial convolution
+        layers = [self.conv_in]
         # Top-level blocks
         for down in self.down:
-            # ResNet Blocks
-            for block in down.block:
-                x = block(x)
-            # Down-sampling
-            x = down.downsample(x)
+            # ResNet Blocks and down-sampling
+            layers += [*down.block, down.downsample]
+
+        #
+        return layers
+
+    def forward_mid(self, x: torch.Tensor):
+        """
+        ### Layers at the embedding resolution
+
+        :param x: is the output of `forward_down`
+        """
 
         # Final ResNet blocks with attention
         x = self.mid.block_1(x)
@@ -14,16 +14,13 @@ This implements DDIM sampling from the paper
 """
 
 from typing import Optional, List
-import sys
-import time
-import shutil
 
 import numpy as np
 import torch
 
 from stable_diffusion.latent_diffusion import LatentDiffusion
 from stable_diffusion.sampler.diffusion import DiffusionSampler
-from utility.labml import monit
+from stable_diffusion.sampler.progress import SamplerProgressReporter
 
 
 class DDIMSampler(DiffusionSampler):
@@ -108,16 +105,15 @@ class DDIMSampler(DiffusionSampler):
                uncond_scale: float = 1.,
                uncond_cond: Optional[torch.Tensor] = None,
                skip_steps: int = 0,
-               noise_fn=torch.randn
+               noise_fn=torch.randn,
+               callback=None,
+               guidance_fraction: float = 1.
                ):
         """
         ### Sampling Loop
         (Same docstring as before)
         """
 
-        # Check terminal width
-        terminal_width = shutil.get_terminal_size((80, 20)).columns
-
         # Get device and batch size
         device = self.model.device
         bs = shape[0]
@@ -128,43 +124,27 @@ class DDIMSampler(DiffusionSampler):
         # Time steps to sample at $\tau_{S - i'}, \tau_{S - i' - 1}, \dots, \tau_1$
         time_steps = np.flip(self.time_steps)[skip_steps:]
 
-        # Sampling loop for normal width
-        if(terminal_width > 55):
-            for i, step in monit.enum('Sample', time_steps):
-                # Index $i$ in the list $[\tau_1, \tau_2, \dots, \tau_S]$
-                index = len(time_steps) - i - 1
-                # Time step $\tau_i$
-                ts = x.new_full((bs,), step, dtype=torch.long)
-
-                # Sample $x_{\tau_{i-1}}$
-                x, pred_x0, e_t = self.p_sample(x, cond, ts, step, index=index,
-                                                repeat_noise=repeat_noise,
-                                                temperature=temperature,
-                                                uncond_scale=uncond_scale,
-                                                uncond_cond=uncond_cond,
-                                                noise_fn=noise_fn)
-        else:
-            sys.stdout.write("Sampling... \n")
-            for i, step in enumerate(time_steps):
-                # Index $i$ in the list $[\tau_1, \tau_2, \dots, \tau_S]$
-                index = len(time_steps) - i - 1
-                # Time step $\tau_i$
-                ts = x.new_full((bs,), step, dtype=torch.long)
-
-                # Sample $x_{\tau_{i-1}}$
-                x, pred_x0, e_t = self.p_sample(x, cond, ts, step, index=index,
-                                                repeat_noise=repeat_noise,
-                                                temperature=temperature,
-                                                uncond_scale=uncond_scale,
-                                                uncond_cond=uncond_cond,
-                                                noise_fn=noise_fn)
-
-                # Update loading animation
-                sys.stdout.write('\b' + '-\\|/'[i % 4])
-                sys.stdout.flush()
-
-                # Add a delay for visibility of the loading animation
-                time.sleep(0.1)
+        # Report each step to `callback`
+        progress = SamplerProgressReporter('Sample', len(time_steps), callback)
+
+        # Sampling loop
+        for i, step in enumerate(time_steps):
+            # Index $i$ in the list $[\tau_1, \tau_2, \dots, \tau_S]$
+            index = len(time_steps) - i - 1
+            # Time step $\tau_i$
+            ts = x.new_full((bs,), step, dtype=torch.long)
+
+            # Sample $x_{\tau_{i-1}}$
+            x, pred_x0, e_t = self.p_sample(x, cond, ts, step, index=index,
+                                            repeat_noise=repeat_noise,
+                                            temperature=temperature,
+                                            uncond_scale=self.get_step_uncond_scale(uncond_scale, i,
+                                                                                    len(time_steps),
+                                                                                    guidance_fraction),
+                                            uncond_cond=uncond_cond,
+                                            noise_fn=noise_fn)
+
+            progress.step(i, step, x, pred_x0)
 
         # Return $x_0$
         return x
@@ -283,6 +263,8 @@ class DDIMSampler(DiffusionSampler):
               orig_noise: Optional[torch.Tensor] = None,
               uncond_scale: float = 1.,
               uncond_cond: Optional[torch.Tensor] = None,
+              callback=None,
+              guidance_fraction: float = 1.,
               ):
         r"""
         ### Painting Loop
@@ -297,6 +279,8 @@ class DDIMSampler(DiffusionSampler):
         :param uncond_scale: is the unconditional guidance scale $s$. This is used for
             $\epsilon_\theta(x_t, c) = s\epsilon_\text{cond}(x_t, c) + (s - 1)\epsilon_\text{cond}(x_t, c_u)$
         :param uncond_cond: is the conditional embedding for empty prompt $c_u$
+        :param callback: is called with a [`SamplerProgress`](progress.html) after every step
+        :param guidance_fraction: is the fraction of the steps guidance is applied for
         """
         # Get  batch size
         bs = x.shape[0]
@@ -304,16 +288,21 @@ class DDIMSampler(DiffusionSampler):
         # Time steps to sample at $\tau_{S`}, \tau_{S' - 1}, \dots, \tau_1$
         time_steps = np.flip(self.time_steps[:t_start])
 
-        for i, step in monit.enum('Paint', time_steps):
+        # Report each step to `callback`
+        progress = SamplerProgressReporter('Paint', len(time_steps), callback)
+
+        for i, step in enumerate(time_steps):
             # Index $i$ in the list $[\tau_1, \tau_2, \dots, \tau_S]$
             index = len(time_steps) - i - 1
             # Time step $\tau_i$
             ts = x.new_full((bs,), step, dtype=torch.long)
 
             # Sample $x_{\tau_{i-1}}$
-            x, _, _ = self.p_sample(x, cond, ts, step, index=index,
-                                    uncond_scale=uncond_scale,
-                                    uncond_cond=uncond_cond)
+            x, pred_x0, _ = self.p_sample(x, cond, ts, step, index=index,
+                                          uncond_scale=self.get_step_uncond_scale(uncond_scale, i,
+                                                                                  len(time_steps),
+                                                                                  guidance_fraction),
+                                          uncond_cond=uncond_cond)
 
             # Replace the masked area with original image
             if orig is not None:
@@ -322,5 +311,7 @@ class DDIMSampler(DiffusionSampler):
                 # Replace the masked area
                 x = orig_t * mask + x * (1 - mask)
 
+            progress.step(i, step, x, pred_x0)
+
         #
         return x
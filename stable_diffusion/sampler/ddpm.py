@@ -14,16 +14,13 @@ We use same notations for $\alpha_t$, $\beta_t$ schedules, etc.
 """
 
 from typing import Optional, List
-import sys
-import time
-import shutil
 
 import numpy as np
 import torch
 
 from stable_diffusion.latent_diffusion import LatentDiffusion
 from stable_diffusion.sampler.diffusion import DiffusionSampler
-from utility.labml import monit
+from stable_diffusion.sampler.progress import SamplerProgressReporter
 
 
 class DDPMSampler(DiffusionSampler):
@@ -96,16 +93,15 @@ class DDPMSampler(DiffusionSampler):
                uncond_scale: float = 1.,
                uncond_cond: Optional[torch.Tensor] = None,
                skip_steps: int = 0,
-               noise_fn=torch.randn
+               noise_fn=torch.randn,
+               callback=None,
+               guidance_fraction: float = 1.
                ):
         """
         ### Sampling Loop
         (Same docstring as before)
         """
 
-        # Check terminal width
-        terminal_width = shutil.get_terminal_size((80, 20)).columns
-
         # Get device and batch size
         device = self.model.device
         bs = shape[0]
@@ -116,44 +112,25 @@ class DDPMSampler(DiffusionSampler):
         # Time steps to sample at $T - t', T - t' - 1, \dots, 1$
         time_steps = np.flip(self.time_steps)[skip_steps:]
 
-        # Sampling loop for normal width
-        if(terminal_width > 55):
-            for i, step in monit.enum('Sample', time_steps):
-                # Index $i$ in the list $[\tau_1, \tau_2, \dots, \tau_S]$
-                index = len(time_steps) - i - 1
-                # Time step $\tau_i$
-                ts = x.new_full((bs,), step, dtype=torch.long)
-
-                # Sample $x_{\tau_{i-1}}$
-                x, pred_x0, e_t = self.p_sample(x, cond, ts, step, index=index,
-                                                repeat_noise=repeat_noise,
-                                                temperature=temperature,
-                                                uncond_scale=uncond_scale,
-                                                uncond_cond=uncond_cond,
-                                                noise_fn=noise_fn)
-        else:
-            # Sampling loop for small cheap terminals
-            sys.stdout.write("Sampling... \n")
-            for i, step in enumerate(time_steps):
-                # Index $i$ in the list $[\tau_1, \tau_2, \dots, \tau_S]$
-                index = len(time_steps) - i - 1
-                # Time step $\tau_i$
-                ts = x.new_full((bs,), step, dtype=torch.long)
-
-                # Sample $x_{\tau_{i-1}}$
-                x, pred_x0, e_t = self.p_sample(x, cond, ts, step, index=index,
-                                                repeat_noise=repeat_noise,
-                                                temperature=temperature,
-                                                uncond_scale=uncond_scale,
-                                                uncond_cond=uncond_cond,
-                                                noise_fn=noise_fn)
-
-                # Update loading animation
-                sys.stdout.write('\b' + '-\\|/'[i % 4])
-                sys.stdout.flush()
-
-                # Add a delay for visibility of the loading animation
-                time.sleep(0.1)
+        # Report each step to `callback`
+        progress = SamplerProgressReporter('Sample', len(time_steps), callback)
+
+        # Sampling loop
+        for i, step in enumerate(time_steps):
+            # Time step $t$
+            ts = x.new_full((bs,), step, dtype=torch.long)
+
+            # Sample $x_{t-1}$
+            x, pred_x0, e_t = self.p_sample(x, cond, ts, step,
+                                            repeat_noise=repeat_noise,
+                                            temperature=temperature,
+                                            uncond_scale=self.get_step_uncond_scale(uncond_scale, i,
+                                                                                    len(time_steps),
+                                                                                    guidance_fraction),
+                                            uncond_cond=uncond_cond,
+                                            noise_fn=noise_fn)
+
+            progress.step(i, step, x, pred_x0)
 
         # Return $x_0$
         return x
@@ -13,9 +13,16 @@ We have implemented the following [sampling algorithms](sampler/index.html):
 
 * [Denoising Diffusion Probabilistic Models (DDPM) Sampling](ddpm.html)
 * [Denoising Diffusion Implicit Models (DDIM) Sampling](ddim.html)
+* [Euler and Euler ancestral Sampling](euler.html)
+* [DPM-Solver++(2M) Sampling](dpm_solver.html)
+* [UniPC Sampling](unipc.html)
+
+Samplers are created by name with [`get_sampler`](factory.html).
+
+Sampling progress is reported with [structured progress events](progress.html).
 """
 
-from typing import Optional, List
+from typing import Optional, List, Union
 import torch
 
 from stable_diffusion.latent_diffusion import LatentDiffusion
@@ -38,36 +45,69 @@ class DiffusionSampler:
         self.n_steps = model.n_steps
 
     def get_eps(self, x: torch.Tensor, t: torch.Tensor, c: torch.Tensor, *,
-                uncond_scale: float, uncond_cond: Optional[torch.Tensor]):
-        """
+                uncond_scale: Union[float, torch.Tensor], uncond_cond: Optional[torch.Tensor]):
+        r"""
         ## Get $\epsilon(x_t, c)$
 
         :param x: is $x_t$ of shape `[batch_size, channels, height, width]`
         :param t: is $t$ of shape `[batch_size]`
         :param c: is the conditional embeddings $c$ of shape `[batch_size, emb_size]`
-        :param uncond_scale: is the unconditional guidance scale $s$. This is used for
+        :param uncond_scale: is the unconditional guidance scale $s$, or a tensor of shape `[batch_size]`
+            with the scale of each sample. This is used for
             $\epsilon_\theta(x_t, c) = s\epsilon_\text{cond}(x_t, c) + (s - 1)\epsilon_\text{cond}(x_t, c_u)$
-        :param uncond_cond: is the conditional embedding for empty prompt $c_u$
+        :param uncond_cond: is the conditional embedding for empty prompt $c_u$, of shape `[batch_size, emb_size]`
+            or `[1, emb_size]` to use the same for all samples
         """
-        # When the scale $s = 1$
+        # Without $c_u$ there is no guidance
+        if uncond_cond is None:
+            return self.model(x, t, c)
+
+        # Scale $s$ of each sample
+        scale = torch.as_tensor(uncond_scale, dtype=torch.float32, device=x.device).expand(x.shape[0])
+        # Samples with $s \ne 1$, only these need $\epsilon_\text{cond}(x_t, c_u)$
+        guided = scale != 1.
+        # When the scale $s = 1$ for all samples
         # $$\epsilon_\theta(x_t, c) = \epsilon_\text{cond}(x_t, c)$$
-        if uncond_cond is None or uncond_scale == 1.:
+        if not guided.any():
             return self.model(x, t, c)
 
-        # Duplicate $x_t$ and $t$
-        x_in = torch.cat([x] * 2)
-        t_in = torch.cat([t] * 2)
-        # Concatenated $c$ and $c_u$
-        c_in = torch.cat([uncond_cond, c])
-        # Get $\epsilon_\text{cond}(x_t, c)$ and $\epsilon_\text{cond}(x_t, c_u)$
-        e_t_uncond, e_t_cond = self.model(x_in, t_in, c_in).chunk(2)
+        # Use the same $c_u$ for all samples
+        if uncond_cond.shape[0] != x.shape[0]:
+            uncond_cond = uncond_cond.expand(x.shape[0], *uncond_cond.shape[1:])
+
+        # $x_t$ and $t$ of the guided samples followed by those of all samples
+        x_in = torch.cat([x[guided], x])
+        t_in = torch.cat([t[guided], t])
+        # Concatenated $c_u$ of the guided samples and $c$
+        c_in = torch.cat([uncond_cond[guided], c])
+        # Get $\epsilon_\text{cond}(x_t, c_u)$ of the guided samples and $\epsilon_\text{cond}(x_t, c)$
+        e_t = self.model(x_in, t_in, c_in)
+        n_guided = e_t.shape[0] - x.shape[0]
+        e_t_uncond, e_t_cond = e_t[:n_guided], e_t[n_guided:]
         # Calculate
         # $$\epsilon_\theta(x_t, c) = s\epsilon_\text{cond}(x_t, c) + (s - 1)\epsilon_\text{cond}(x_t, c_u)$$
-        e_t = e_t_uncond + uncond_scale * (e_t_cond - e_t_uncond)
+        # for the guided samples
+        s = scale[guided].to(e_t.dtype).view(-1, *([1] * (e_t.dim() - 1)))
+        e_t = e_t_cond.clone()
+        e_t[guided] = e_t_uncond + s * (e_t_cond[guided] - e_t_uncond)
 
         #
         return e_t
 
+    @staticmethod
+    def get_step_uncond_scale(uncond_scale: Union[float, torch.Tensor], i: int, n_steps: int,
+                              guidance_fraction: float):
+        """
+        ### Unconditional guidance scale of step `i` of `n_steps`
+
+        Guidance is only applied for the first `guidance_fraction` of the steps, the remaining steps
+        use $\epsilon_\text{cond}(x_t, c)$ and evaluate the model on half the batch.
+        """
+        if i >= guidance_fraction * n_steps:
+            return 1.
+
+        return uncond_scale
+
     def sample(self,
                shape: List[int],
                cond: torch.Tensor,
@@ -77,6 +117,8 @@ class DiffusionSampler:
                uncond_scale: float = 1.,
                uncond_cond: Optional[torch.Tensor] = None,
                skip_steps: int = 0,
+               callback=None,
+               guidance_fraction: float = 1.,
                ):
         """
         ### Sampling Loop
@@ -90,6 +132,11 @@ class DiffusionSampler:
             $\epsilon_\theta(x_t, c) = s\epsilon_\text{cond}(x_t, c) + (s - 1)\epsilon_\text{cond}(x_t, c_u)$
         :param uncond_cond: is the conditional embedding for empty prompt $c_u$
         :param skip_steps: is the number of time steps to skip.
+        :param guidance_fraction: is the fraction of the steps guidance is applied for,
+            the remaining steps are conditional only
+        :param callback: is called with a [`SamplerProgress`](progress.html) after every step.
+            Samplers do not write progress to the terminal, pass
+            [`PrintProgress`](progress.html) to get progress lines.
         """
         raise NotImplementedError()
 
@@ -98,6 +145,8 @@ class DiffusionSampler:
               mask: Optional[torch.Tensor] = None, orig_noise: Optional[torch.Tensor] = None,
               uncond_scale: float = 1.,
               uncond_cond: Optional[torch.Tensor] = None,
+              callback=None,
+              guidance_fraction: float = 1.,
               ):
         """
         ### Painting Loop
@@ -111,6 +160,8 @@ class DiffusionSampler:
         :param uncond_scale: is the unconditional guidance scale $s$. This is used for
             $\epsilon_\theta(x_t, c) = s\epsilon_\text{cond}(x_t, c) + (s - 1)\epsilon_\text{cond}(x_t, c_u)$
         :param uncond_cond: is the conditional embedding for empty prompt $c_u$
+        :param callback: is called with a [`SamplerProgress`](progress.html) after every step
+        :param guidance_fraction: is the fraction of the steps guidance is applied for
         """
         raise NotImplementedError()
 
@@ -0,0 +1,73 @@
+r"""
+---
+title: DPM-Solver++(2M) sampling
+summary: >
+ Annotated PyTorch implementation of the DPM-Solver++(2M) multistep sampler
+ for stable diffusion model.
+---
+
+# DPM-Solver++(2M) sampling
+
+This implements the second order multistep solver from
+[DPM-Solver++: Fast Solver for Guided Sampling of Diffusion Probabilistic Models](https://papers.labml.ai/paper/2211.01095).
+It reuses the $\hat{x}_0$ prediction of the previous step, so it costs one model
+evaluation per step like DDIM.
+"""
+
+import math
+
+import numpy as np
+import torch
+
+from stable_diffusion.latent_diffusion import LatentDiffusion
+from stable_diffusion.sampler.sigma_sampler import SigmaSampler
+
+
+class DPMSolverPlusPlus2MSampler(SigmaSampler):
+    r"""
+    ## DPM-Solver++(2M) Sampler
+
+    This extends the [`SigmaSampler` base class](sigma_sampler.html).
+
+    With $\lambda_i = -\log \sigma_i$, $h_i = \lambda_{i+1} - \lambda_i$ and $r_i = \frac{h_{i-1}}{h_i}$,
+
+    \begin{align}
+    D_i &= \Big(1 + \frac{1}{2 r_i}\Big) \hat{x}_0^{(i)} - \frac{1}{2 r_i} \hat{x}_0^{(i-1)} \\
+    \tilde{x}_{i+1} &= \frac{\sigma_{i+1}}{\sigma_i} \tilde{x}_i - (e^{-h_i} - 1) D_i
+    \end{align}
+
+    The first and the last steps are first order, with $D_i = \hat{x}_0^{(i)}$.
+    """
+
+    def __init__(self, model: LatentDiffusion, n_steps: int, karras: bool = True):
+        r"""
+        :param model: is the model to predict noise $\epsilon_\text{cond}(x_t, c)$
+        :param n_steps: is the number of sampling steps, $S$
+        :param karras: specifies whether to use the Karras noise levels
+        """
+        super().__init__(model, n_steps, karras=karras)
+
+    def step(self, x: torch.Tensor, denoised: torch.Tensor, sigmas: np.ndarray, i: int, state: dict, *,
+             temperature: float, repeat_noise: bool, noise_fn=torch.randn):
+        sigma = float(sigmas[i])
+        sigma_next = float(sigmas[i + 1])
+        old_denoised = state.get('old_denoised')
+        state['old_denoised'] = denoised
+
+        # The last step to $\sigma = 0$ gives $\hat{x}_0$
+        if sigma_next == 0:
+            return denoised
+
+        # $h_i = \lambda_{i+1} - \lambda_i$
+        h = math.log(sigma) - math.log(sigma_next)
+
+        # $D_i$
+        if old_denoised is None:
+            d = denoised
+        else:
+            # $r_i = \frac{h_{i-1}}{h_i}$
+            h_last = math.log(float(sigmas[i - 1])) - math.log(sigma)
+            r = h_last / h
+            d = (1 + 1 / (2 * r)) * denoised - (1 / (2 * r)) * old_denoised
+
+        return (sigma_next / sigma) * x - math.expm1(-h) * d
@@ -0,0 +1,92 @@
+r"""
+---
+title: Euler and Euler ancestral sampling
+summary: >
+ Annotated PyTorch implementation of Euler and Euler ancestral sampling
+ for stable diffusion model.
+---
+
+# Euler and Euler ancestral sampling
+
+This implements the Euler method for the diffusion ODE from
+[Elucidating the Design Space of Diffusion-Based Generative Models](https://papers.labml.ai/paper/2206.00364),
+and its ancestral variant that adds fresh noise at each step.
+"""
+
+import numpy as np
+import torch
+
+from stable_diffusion.latent_diffusion import LatentDiffusion
+from stable_diffusion.sampler.sigma_sampler import SigmaSampler
+
+
+class EulerSampler(SigmaSampler):
+    r"""
+    ## Euler Sampler
+
+    This extends the [`SigmaSampler` base class](sigma_sampler.html).
+
+    $$\tilde{x}_{i+1} = \tilde{x}_i + (\sigma_{i+1} - \sigma_i) \frac{\tilde{x}_i - \hat{x}_0}{\sigma_i}$$
+    """
+
+    def __init__(self, model: LatentDiffusion, n_steps: int, karras: bool = False):
+        r"""
+        :param model: is the model to predict noise $\epsilon_\text{cond}(x_t, c)$
+        :param n_steps: is the number of sampling steps, $S$
+        :param karras: specifies whether to use the Karras noise levels
+        """
+        super().__init__(model, n_steps, karras=karras)
+
+    def step(self, x: torch.Tensor, denoised: torch.Tensor, sigmas: np.ndarray, i: int, state: dict, *,
+             temperature: float, repeat_noise: bool, noise_fn=torch.randn):
+        sigma = float(sigmas[i])
+        sigma_next = float(sigmas[i + 1])
+
+        # $\frac{d\tilde{x}}{d\sigma} = \frac{\tilde{x} - \hat{x}_0}{\sigma}$
+        d = (x - denoised) / sigma
+
+        return x + d * (sigma_next - sigma)
+
+
+class EulerAncestralSampler(SigmaSampler):
+    r"""
+    ## Euler Ancestral Sampler
+
+    Takes an Euler step down to $\sigma_{down}$ and adds noise of $\sigma_{up}$ so the
+    result has noise level $\sigma_{i+1}$,
+
+    \begin{align}
+    \sigma_{up} &= \min\Bigg(\sigma_{i+1},
+        \eta \sqrt{\frac{\sigma_{i+1}^2 (\sigma_i^2 - \sigma_{i+1}^2)}{\sigma_i^2}}\Bigg) \\
+    \sigma_{down} &= \sqrt{\sigma_{i+1}^2 - \sigma_{up}^2}
+    \end{align}
+    """
+
+    def __init__(self, model: LatentDiffusion, n_steps: int, eta: float = 1., karras: bool = False):
+        r"""
+        :param model: is the model to predict noise $\epsilon_\text{cond}(x_t, c)$
+        :param n_steps: is the number of sampling steps, $S$
+        :param eta: is $\eta$, the amount of noise added at each step. $\eta = 0$ is the Euler sampler.
+        :param karras: specifies whether to use the Karras noise levels
+        """
+        super().__init__(model, n_steps, karras=karras)
+        self.eta = eta
+
+    def step(self, x: torch.Tensor, denoised: torch.Tensor, sigmas: np.ndarray, i: int, state: dict, *,
+             temperature: float, repeat_noise: bool, noise_fn=torch.randn):
+        sigma = float(sigmas[i])
+        sigma_next = float(sigmas[i + 1])
+
+        # $\sigma_{up}$ and $\sigma_{down}$
+        sigma_up = min(sigma_next, self.eta * (sigma_next ** 2 * (sigma ** 2 - sigma_next ** 2) / sigma ** 2) ** .5)
+        sigma_down = (sigma_next ** 2 - sigma_up ** 2) ** .5
+
+        # Euler step to $\sigma_{down}$
+        d = (x - denoised) / sigma
+        x = x + d * (sigma_down - sigma)
+
+        # Add noise, multiplied by the temperature
+        if sigma_next > 0:
+            x = x + self.get_noise(x, repeat_noise=repeat_noise, noise_fn=noise_fn) * temperature * sigma_up
+
+        return x
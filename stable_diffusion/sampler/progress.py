@@ -0,0 +1,118 @@
+"""
+---
+title: Progress reporting for sampling algorithms
+summary: >
+ Structured progress events for the stable diffusion samplers.
+---
+
+# Progress reporting for [sampling algorithms](index.html)
+
+Samplers report each step to an optional callback instead of drawing to the terminal,
+so sampling time is the same under a terminal, `docker logs`, `nohup` or systemd.
+"""
+
+import time
+from dataclasses import dataclass
+from typing import Optional, Callable
+
+import torch
+
+
+@dataclass
+class SamplerProgress:
+    """
+    ## Progress of one sampling step
+    """
+    # Name of the loop, `Sample` or `Paint`
+    stage: str
+    # Index of the step in the loop, starting from $0$
+    step_index: int
+    # Number of steps in the loop
+    n_steps: int
+    # Time step $t$ sampled at this step
+    time_step: int
+    # Seconds spent on this step
+    step_time: float
+    # Seconds since the loop started
+    elapsed_time: float
+    # Latent $x_{t-1}$ after this step, for previews.
+    # This is the tensor used by the sampler, so callbacks must not modify it in place.
+    x: Optional[torch.Tensor] = None
+    # Predicted $x_0$, if the sampler computes it
+    pred_x0: Optional[torch.Tensor] = None
+
+    @property
+    def is_last(self):
+        return self.step_index == self.n_steps - 1
+
+
+class SamplerProgressReporter:
+    """
+    ## Sends a `SamplerProgress` event per step to a callback
+
+    Does nothing when there is no callback.
+    """
+
+    def __init__(self, stage: str, n_steps: int, callback: Optional[Callable[[SamplerProgress], None]] = None):
+        """
+        :param stage: is the name of the sampling loop
+        :param n_steps: is the number of steps in the loop
+        :param callback: is called with a `SamplerProgress` after every step
+        """
+        self.stage = stage
+        self.n_steps = n_steps
+        self.callback = callback
+        self.start_time = time.time()
+        self.last_step_time = self.start_time
+
+    def step(self, step_index: int, time_step: int, x: torch.Tensor, pred_x0: Optional[torch.Tensor] = None):
+        """
+        ### Report a finished step
+        """
+        if self.callback is None:
+            return
+
+        now = time.time()
+        progress = SamplerProgress(stage=self.stage,
+                                   step_index=step_index,
+                                   n_steps=self.n_steps,
+                                   time_step=int(time_step),
+                                   step_time=now - self.last_step_time,
+                                   elapsed_time=now - self.start_time,
+                                   x=x,
+                                   pred_x0=pred_x0)
+        self.last_step_time = now
+
+        self.callback(progress)
+
+
+class PrintProgress:
+    """
+    ## Callback that prints a progress line every `interval` seconds and at the last step
+
+    Plain lines without carriage returns, so it reads well in log files.
+    """
+
+    def __init__(self, interval: float = 5., print_fn: Callable[[str], None] = print):
+        """
+        :param interval: is the minimum number of seconds between two lines
+        :param print_fn: is called with each line
+        """
+        self.interval = interval
+        self.print_fn = print_fn
+        self.last_print_time = None
+
+    def __call__(self, progress: SamplerProgress):
+        now = time.time()
+        if not progress.is_last and self.last_print_time is not None and \
+                now - self.last_print_time < self.interval:
+            return
+
+        self.last_print_time = now
+        self.print_fn("{} step {}/{}, t={}, {:.3f}s/step, elapsed {:.2f}s".format(
+            progress.stage,
+            progress.step_index + 1,
+            progress.n_steps,
+            progress.time_step,
+            progress.elapsed_time / (progress.step_index + 1),
+            progress.elapsed_time))
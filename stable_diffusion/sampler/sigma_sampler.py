@@ -0,0 +1,261 @@
+r"""
+---
+title: Base class for noise level (sigma) samplers
+summary: >
+ Annotated PyTorch implementation of the shared sampling loop of the
+ Euler, DPM-Solver++ and UniPC samplers for stable diffusion model.
+---
+
+# Noise level (sigma) samplers
+
+The [Euler](euler.html), [DPM-Solver++](dpm_solver.html) and [UniPC](unipc.html) samplers
+solve the diffusion ODE in terms of the noise level
+$$\sigma_t = \sqrt{\frac{1 - \bar\alpha_t}{\bar\alpha_t}}$$
+of the latent $\tilde{x}_t = \frac{x_t}{\sqrt{\bar\alpha_t}} = x_0 + \sigma_t \epsilon$,
+which lets them take a few large steps with high-order updates.
+
+The model is the same $\epsilon_\text{cond}(x_t, c)$ used by [DDIM](ddim.html),
+with $\bar\alpha_t$ from `LatentDiffusion.alpha_bar` and classifier free guidance from
+`DiffusionSampler.get_eps`. Inputs and outputs of `sample`, `paint` and `q_sample`
+are $x_t$ like for DDIM, so the samplers are interchangeable.
+"""
+
+from typing import Optional, List
+
+import numpy as np
+import torch
+
+from stable_diffusion.latent_diffusion import LatentDiffusion
+from stable_diffusion.sampler.diffusion import DiffusionSampler
+from stable_diffusion.sampler.progress import SamplerProgressReporter
+
+
+class SigmaSampler(DiffusionSampler):
+    r"""
+    ## Base class for samplers on the noise levels $\sigma$
+
+    Sub-classes implement `step`, which moves $\tilde{x}$ from $\sigma_i$ to $\sigma_{i+1}$.
+    """
+
+    model: LatentDiffusion
+
+    def __init__(self, model: LatentDiffusion, n_steps: int, karras: bool = False, rho: float = 7.):
+        r"""
+        :param model: is the model to predict noise $\epsilon_\text{cond}(x_t, c)$
+        :param n_steps: is the number of sampling steps, $S$
+        :param karras: specifies whether to space the noise levels like
+            [Karras et al.](https://papers.labml.ai/paper/2206.00364) instead of uniformly in $t$
+        :param rho: is the $\rho$ of the Karras noise levels
+        """
+        super().__init__(model)
+        # Number of sampling steps $S$
+        self.sampling_steps = n_steps
+
+        # $\sigma_t$ of the $T$ time steps the model was trained with
+        alpha_bar = model.alpha_bar.detach().cpu().to(torch.float64).numpy()
+        self.model_sigmas = ((1. - alpha_bar) / alpha_bar) ** .5
+        self.model_log_sigmas = np.log(self.model_sigmas)
+
+        # Noise levels to sample at $\sigma_{\tau_S}, \dots, \sigma_{\tau_1}, 0$
+        if karras:
+            sigmas = get_karras_sigmas(n_steps, self.model_sigmas[0], self.model_sigmas[-1], rho)
+        else:
+            sigmas = self.t_to_sigma(np.linspace(self.n_steps - 1, 0, n_steps))
+        self.sigmas = np.append(sigmas, 0.)
+
+    def t_to_sigma(self, t):
+        r"""
+        ### $\sigma$ of a time step, interpolated in $\log \sigma$ for fractional time steps
+        """
+        return np.exp(np.interp(t, np.arange(self.n_steps), self.model_log_sigmas))
+
+    def sigma_to_t(self, sigma: float):
+        r"""
+        ### Fractional time step of a noise level $\sigma$
+        """
+        return float(np.interp(np.log(sigma), self.model_log_sigmas, np.arange(self.n_steps)))
+
+    def get_denoised(self, x: torch.Tensor, sigma: float, c: torch.Tensor, *,
+                     uncond_scale: float, uncond_cond: Optional[torch.Tensor]):
+        r"""
+        ### Predict $x_0$ from $\tilde{x}_t = x_0 + \sigma_t \epsilon$
+
+        $$\hat{x}_0 = \tilde{x}_t - \sigma_t \epsilon_\theta\Big(\frac{\tilde{x}_t}{\sqrt{1 + \sigma_t^2}}, t\Big)$$
+        """
+        t = torch.full((x.shape[0],), self.sigma_to_t(sigma), device=x.device, dtype=torch.float32)
+        e_t = self.get_eps(x / (1. + sigma ** 2) ** .5, t, c,
+                           uncond_scale=uncond_scale,
+                           uncond_cond=uncond_cond)
+
+        return x - sigma * e_t
+
+    def get_noise(self, x: torch.Tensor, *, repeat_noise: bool, noise_fn=torch.randn):
+        """
+        ### Noise for stochastic steps
+        """
+        # If same noise is used for all samples in the batch
+        if repeat_noise:
+            return noise_fn((1, *x.shape[1:]), device=x.device)
+        # Different noise for each sample
+        return noise_fn(x.shape, device=x.device)
+
+    def step(self, x: torch.Tensor, denoised: torch.Tensor, sigmas: np.ndarray, i: int, state: dict, *,
+             temperature: float, repeat_noise: bool, noise_fn=torch.randn):
+        r"""
+        ### Move $\tilde{x}$ from $\sigma_i$ to $\sigma_{i+1}$
+
+        :param x: is $\tilde{x}$ at $\sigma_i$
+        :param denoised: is $\hat{x}_0$ predicted at $\sigma_i$
+        :param sigmas: are the noise levels of the sampling loop
+        :param i: is the index of the step in the sampling loop
+        :param state: is kept across the steps of a loop, for multistep methods
+        """
+        raise NotImplementedError()
+
+    @torch.no_grad()
+    def sample(self,
+               shape: List[int],
+               cond: torch.Tensor,
+               repeat_noise: bool = False,
+               temperature: float = 1.,
+               x_last: Optional[torch.Tensor] = None,
+               uncond_scale: float = 1.,
+               uncond_cond: Optional[torch.Tensor] = None,
+               skip_steps: int = 0,
+               noise_fn=torch.randn,
+               callback=None,
+               guidance_fraction: float = 1.
+               ):
+        """
+        ### Sampling Loop
+        (Same docstring as before)
+        """
+        # Get $x_T$
+        x = x_last if x_last is not None else noise_fn(shape, device=self.model.device)
+
+        # Noise levels to sample at
+        sigmas = self.sigmas[skip_steps:]
+
+        # $\tilde{x}_T = \sqrt{1 + \sigma_T^2} x_T$
+        x = x * (1. + sigmas[0] ** 2) ** .5
+
+        return self.sample_sigmas('Sample', x, sigmas, cond,
+                                  repeat_noise=repeat_noise,
+                                  temperature=temperature,
+                                  uncond_scale=uncond_scale,
+                                  uncond_cond=uncond_cond,
+                                  noise_fn=noise_fn,
+                                  callback=callback,
+                                  guidance_fraction=guidance_fraction)
+
+    @torch.no_grad()
+    def paint(self, x: torch.Tensor, cond: torch.Tensor, t_start: int, *,
+              orig: Optional[torch.Tensor] = None,
+              mask: Optional[torch.Tensor] = None,
+              orig_noise: Optional[torch.Tensor] = None,
+              uncond_scale: float = 1.,
+              uncond_cond: Optional[torch.Tensor] = None,
+              callback=None,
+              guidance_fraction: float = 1.,
+              ):
+        """
+        ### Painting Loop
+        (Same docstring as before)
+        """
+        # Noise levels to sample at $\sigma_{\tau_{S'}}, \dots, \sigma_{\tau_1}, 0$
+        t_start = min(t_start, self.sampling_steps)
+        sigmas = self.sigmas[self.sampling_steps - t_start:]
+
+        # $\tilde{x}_{S'} = \sqrt{1 + \sigma_{S'}^2} x_{S'}$
+        x = x * (1. + sigmas[0] ** 2) ** .5
+
+        # Fixed noise for the original image
+        if orig is not None and orig_noise is None:
+            orig_noise = torch.randn_like(orig)
+
+        return self.sample_sigmas('Paint', x, sigmas, cond,
+                                  uncond_scale=uncond_scale,
+                                  uncond_cond=uncond_cond,
+                                  callback=callback,
+                                  guidance_fraction=guidance_fraction,
+                                  orig=orig,
+                                  mask=mask,
+                                  orig_noise=orig_noise)
+
+    def sample_sigmas(self, stage: str, x: torch.Tensor, sigmas: np.ndarray, cond: torch.Tensor, *,
+                      repeat_noise: bool = False,
+                      temperature: float = 1.,
+                      uncond_scale: float = 1.,
+                      uncond_cond: Optional[torch.Tensor] = None,
+                      noise_fn=torch.randn,
+                      callback=None,
+                      guidance_fraction: float = 1.,
+                      orig: Optional[torch.Tensor] = None,
+                      mask: Optional[torch.Tensor] = None,
+                      orig_noise: Optional[torch.Tensor] = None):
+        """
+        ### Sampling loop over the noise levels `sigmas`, which end with $0$
+        """
+        # Report each step to `callback`
+        progress = SamplerProgressReporter(stage, len(sigmas) - 1, callback)
+
+        state = {}
+        for i in range(len(sigmas) - 1):
+            sigma = float(sigmas[i])
+            sigma_next = float(sigmas[i + 1])
+
+            # Predict $\hat{x}_0$
+            denoised = self.get_denoised(x, sigma, cond,
+                                         uncond_scale=self.get_step_uncond_scale(uncond_scale, i,
+                                                                                 len(sigmas) - 1,
+                                                                                 guidance_fraction),
+                                         uncond_cond=uncond_cond)
+            # Get $\tilde{x}$ at $\sigma_{i+1}$
+            x = self.step(x, denoised, sigmas, i, state,
+                          temperature=temperature,
+                          repeat_noise=repeat_noise,
+                          noise_fn=noise_fn)
+
+            # Replace the masked area with original image at the same noise level
+            if orig is not None:
+                orig_t = orig + sigma_next * orig_noise
+                x = orig_t * mask + x * (1 - mask)
+
+            if progress.callback is not None:
+                progress.step(i, self.sigma_to_t(sigma), x / (1. + sigma_next ** 2) ** .5, denoised)
+
+        # $\tilde{x}_0 = x_0$
+        return x
+
+    @torch.no_grad()
+    def q_sample(self, x0: torch.Tensor, index: int, noise: Optional[torch.Tensor] = None):
+        r"""
+        ### Sample $x_t$ from $x_0$ at the noise level of step `index`
+
+        :param x0: is $x_0$ of shape `[batch_size, channels, height, width]`
+        :param index: is the index $i$ of the step in $[\tau_1, \tau_2, \dots, \tau_S]$
+        :param noise: is the noise, $\epsilon$
+        """
+        # Random noise, if noise is not specified
+        if noise is None:
+            noise = torch.randn_like(x0)
+
+        # $\sigma_{\tau_i}$
+        sigma = float(self.sigmas[self.sampling_steps - 1 - min(index, self.sampling_steps - 1)])
+
+        # $x_t = \frac{x_0 + \sigma_t \epsilon}{\sqrt{1 + \sigma_t^2}}$
+        return (x0 + sigma * noise) / (1. + sigma ** 2) ** .5
+
+
+def get_karras_sigmas(n_steps: int, sigma_min: float, sigma_max: float, rho: float = 7.):
+    r"""
+    ### Noise levels of [Karras et al.](https://papers.labml.ai/paper/2206.00364)
+
+    $$\sigma_i = \Big(\sigma_{max}^{\frac{1}{\rho}} +
+     \frac{i}{S - 1}\big(\sigma_{min}^{\frac{1}{\rho}} - \sigma_{max}^{\frac{1}{\rho}}\big)\Big)^\rho$$
+    """
+    ramp = np.linspace(0, 1, n_steps)
+    min_inv_rho = sigma_min ** (1 / rho)
+    max_inv_rho = sigma_max ** (1 / rho)
+
+    return (max_inv_rho + ramp * (min_inv_rho - max_inv_rho)) ** rho
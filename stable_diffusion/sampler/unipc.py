@@ -0,0 +1,133 @@
+r"""
+---
+title: UniPC sampling
+summary: >
+ Annotated PyTorch implementation of the UniPC predictor-corrector sampler
+ for stable diffusion model.
+---
+
+# UniPC sampling
+
+This implements the second order UniPC sampler with the $B(h) = e^{-h} - 1$ variant from
+[UniPC: A Unified Predictor-Corrector Framework for Fast Sampling of Diffusion Models](https://papers.labml.ai/paper/2302.04867).
+
+Each step predicts $\tilde{x}_{i+1}$ with a multistep update (UniP), then, once the model has
+been evaluated at $\tilde{x}_{i+1}$, corrects it with that prediction (UniC).
+The corrector reuses the model evaluation of the next step, so it costs one model
+evaluation per step like DDIM.
+"""
+
+import math
+from typing import Optional
+
+import numpy as np
+import torch
+
+from stable_diffusion.latent_diffusion import LatentDiffusion
+from stable_diffusion.sampler.sigma_sampler import SigmaSampler
+
+
+class UniPCSampler(SigmaSampler):
+    r"""
+    ## UniPC Sampler
+
+    This extends the [`SigmaSampler` base class](sigma_sampler.html).
+
+    With $\lambda_i = -\log \sigma_i$ and $h = \lambda_t - \lambda_s$, both the predictor and the
+    corrector update
+    $$\tilde{x}_t = \frac{\sigma_t}{\sigma_s} \tilde{x}_s - (e^{-h} - 1) \hat{x}_0^{(s)}
+     - B(h) \sum_k \rho_k D_k$$
+    where $D_k$ are the differences of $\hat{x}_0$ predictions scaled by
+    $r_k = \frac{\lambda_{s_k} - \lambda_s}{h}$.
+    """
+
+    def __init__(self, model: LatentDiffusion, n_steps: int, karras: bool = True):
+        r"""
+        :param model: is the model to predict noise $\epsilon_\text{cond}(x_t, c)$
+        :param n_steps: is the number of sampling steps, $S$
+        :param karras: specifies whether to use the Karras noise levels
+        """
+        super().__init__(model, n_steps, karras=karras)
+
+    def step(self, x: torch.Tensor, denoised: torch.Tensor, sigmas: np.ndarray, i: int, state: dict, *,
+             temperature: float, repeat_noise: bool, noise_fn=torch.randn):
+        sigma = float(sigmas[i])
+        sigma_next = float(sigmas[i + 1])
+
+        # Correct $\tilde{x}_i$ with $\hat{x}_0$ predicted at $\tilde{x}_i$
+        if i > 0:
+            x = self.update(state['x'], state['denoised'], float(sigmas[i - 1]), sigma,
+                            prev_sigma=float(sigmas[i - 2]) if i > 1 else None,
+                            prev_denoised=state.get('prev_denoised'),
+                            denoised_t=denoised)
+
+        # Predict $\tilde{x}_{i+1}$
+        if sigma_next == 0:
+            # The last step to $\sigma = 0$ gives $\hat{x}_0$
+            x_next = denoised
+        else:
+            x_next = self.update(x, denoised, sigma, sigma_next,
+                                 prev_sigma=float(sigmas[i - 1]) if i > 0 else None,
+                                 prev_denoised=state.get('denoised'))
+
+        state['prev_denoised'] = state.get('denoised')
+        state['denoised'] = denoised
+        state['x'] = x
+
+        return x_next
+
+    @staticmethod
+    def update(x: torch.Tensor, denoised: torch.Tensor, sigma: float, sigma_next: float, *,
+               prev_sigma: Optional[float] = None,
+               prev_denoised: Optional[torch.Tensor] = None,
+               denoised_t: Optional[torch.Tensor] = None):
+        r"""
+        ### UniPC update from $\sigma_s$ to $\sigma_t$
+
+        This is the predictor if `denoised_t` is `None` and the corrector otherwise.
+
+        :param x: is $\tilde{x}_s$
+        :param denoised: is $\hat{x}_0^{(s)}$
+        :param sigma: is $\sigma_s$
+        :param sigma_next: is $\sigma_t$
+        :param prev_sigma: is the $\sigma$ of the step before $s$, for the second order update
+        :param prev_denoised: is $\hat{x}_0$ of the step before $s$, for the second order update
+        :param denoised_t: is $\hat{x}_0^{(t)}$ predicted at the predicted $\tilde{x}_t$
+        """
+        # $h = \lambda_t - \lambda_s$
+        h = math.log(sigma) - math.log(sigma_next)
+        hh = -h
+        # $e^{-h} - 1$
+        h_phi_1 = math.expm1(hh)
+        # $B(h) = e^{-h} - 1$
+        b_h = math.expm1(hh)
+
+        # First order update, same as DPM-Solver++
+        x_t = (sigma_next / sigma) * x - h_phi_1 * denoised
+
+        # $D_1 = \frac{\hat{x}_0^{(s_1)} - \hat{x}_0^{(s)}}{r_1}$ with the previous prediction
+        d1 = None
+        if prev_denoised is not None:
+            r = (math.log(sigma) - math.log(prev_sigma)) / h
+            d1 = (prev_denoised - denoised) / r
+
+        # Predictor, $\rho = \frac{1}{2}$
+        if denoised_t is None:
+            if d1 is None:
+                return x_t
+            return x_t - b_h * 0.5 * d1
+
+        # $D_t = \hat{x}_0^{(t)} - \hat{x}_0^{(s)}$ for the corrector, $r_t = 1$
+        d_t = denoised_t - denoised
+        if d1 is None:
+            return x_t - b_h * 0.5 * d_t
+
+        # Solve $\begin{pmatrix}1 & 1 \\ r_1 & 1\end{pmatrix} \rho = b$ for the second order corrector
+        h_phi_k = h_phi_1 / hh - 1
+        b1 = h_phi_k / b_h
+        h_phi_k = h_phi_k / hh - 1 / 2
+        b2 = h_phi_k * 2 / b_h
+        rho_1 = (b1 - b2) / (1 - r)
+        rho_t = b1 - rho_1
+
+        return x_t - b_h * (rho_1 * d1 + rho_t * d_t)
@@ -10,8 +10,7 @@ from utility.utils_logger import logger
 sys.path.append(os.path.abspath(""))
 from stable_diffusion.utils_backend import get_device, get_autocast, set_seed
 from stable_diffusion.utils_image import load_img
-from stable_diffusion.sampler.ddim import DDIMSampler
-from stable_diffusion.sampler.ddpm import DDPMSampler
+from stable_diffusion.sampler.factory import get_sampler
 from stable_diffusion.utils_model import initialize_latent_diffusion
 from stable_diffusion.latent_diffusion import LatentDiffusion
 from stable_diffusion.sampler.diffusion import DiffusionSampler
@@ -40,7 +39,7 @@ class StableDiffusion:
     ):
         """
         :param checkpoint_path: is the path of the checkpoint
-        :param sampler_name: is the name of the [sampler](../sampler/index.html)
+        :param sampler_name: is the name of the [sampler](../sampler/factory.html)
         :param n_steps: is the number of sampling steps
         :param ddim_eta: is the [DDIM sampling](../sampler/ddim.html) $\eta$ constant
         """
@@ -96,8 +95,7 @@ class StableDiffusion:
     @n_steps.setter
     def n_steps(self, value):
         self._n_steps = value
-        if self.sampler_name == "ddpm":
-            self.initialize_sampler()
+        self.initialize_sampler()
 
     @property
     def sampler_name(self):
@@ -167,8 +165,9 @@ class StableDiffusion:
             self, uncond_scale: float, prompts: list, negative_prompts: list, batch_size: int = 1
     ):
         # In unconditional scaling is not $1$ get the embeddings for empty prompts (no conditioning).
+        # A single embedding is used for the whole batch.
         if uncond_scale != 1.0 and len(negative_prompts) == 0:
-            un_cond = self.model.get_text_conditioning(batch_size * [""])
+            un_cond = self.model.get_text_conditioning([""])
         elif len(negative_prompts) != 0:
             un_cond = self.model.get_text_conditioning(negative_prompts)
         else:
@@ -188,6 +187,8 @@ class StableDiffusion:
             un_cond: Optional[torch.Tensor] = None,
             mask: Optional[torch.Tensor] = None,
             orig_noise: Optional[torch.Tensor] = None,
+            callback=None,
+            guidance_fraction: float = 1.0,
     ):
         orig_2 = None
         # If we have a mask and noise, it's in-painting
@@ -205,6 +206,8 @@ class StableDiffusion:
             orig_noise=orig_noise,
             uncond_scale=uncond_scale,
             uncond_cond=un_cond,
+            callback=callback,
+            guidance_fraction=guidance_fraction,
         )
 
         return x
@@ -257,12 +260,9 @@ class StableDiffusion:
             )
 
     def initialize_sampler(self):
-        if self.sampler_name == "ddim":
-            self.sampler = DDIMSampler(
-                self.model, n_steps=self.n_steps, ddim_eta=self.ddim_eta
-            )
-        elif self.sampler_name == "ddpm":
-            self.sampler = DDPMSampler(self.model)
+        self.sampler = get_sampler(
+            self.sampler_name, self.model, n_steps=self.n_steps, ddim_eta=self.ddim_eta
+        )
 
     @torch.no_grad()
     def generate_images(
@@ -278,6 +278,8 @@ class StableDiffusion:
             low_vram: bool = False,
             noise_fn=torch.randn,
             temperature: float = 1.0,
+            callback=None,
+            guidance_fraction: float = 1.0,
     ):
         """
         :param seed: the seed to use when generating the images
@@ -289,6 +291,8 @@ class StableDiffusion:
         :param uncond_scale: is the unconditional guidance scale $s$. This is used for
             $\epsilon_\theta(x_t, c) = s\epsilon_\text{cond}(x_t, c) + (s - 1)\epsilon_\text{cond}(x_t, c_u)$
         :param low_vram: whether to limit VRAM usage
+        :param callback: is called with the [sampling progress](sampler/progress.html) after every step
+        :param guidance_fraction: is the fraction of the sampling steps guidance is applied for
         """
         # Number of channels in the image
         c = 4
@@ -319,6 +323,8 @@ class StableDiffusion:
                 uncond_cond=un_cond,
                 noise_fn=noise_fn,
                 temperature=temperature,
+                callback=callback,
+                guidance_fraction=guidance_fraction,
             )
             return self.get_image_from_latent(x)
 
@@ -336,6 +342,8 @@ class StableDiffusion:
             low_vram: bool = False,
             noise_fn=torch.randn,
             temperature: float = 1.0,
+            callback=None,
+            guidance_fraction: float = 1.0,
     ):
         """
         :param seed: the seed to use when generating the images
@@ -347,6 +355,8 @@ class StableDiffusion:
         :param uncond_scale: is the unconditional guidance scale $s$. This is used for
             $\epsilon_\theta(x_t, c) = s\epsilon_\text{cond}(x_t, c) + (s - 1)\epsilon_\text{cond}(x_t, c_u)$
         :param low_vram: whether to limit VRAM usage
+        :param callback: is called with the [sampling progress](sampler/progress.html) after every step
+        :param guidance_fraction: is the fraction of the sampling steps guidance is applied for
         """
         # Number of channels in the image
         c = 4
@@ -364,8 +374,8 @@ class StableDiffusion:
         # Make a batch of prompts
         prompts = batch_size * [embedded_prompt]
         cond = torch.cat(prompts, dim=0)
-        null_prompts = batch_size * [null_prompt]
-        uncond_cond = torch.cat(null_prompts, dim=0)
+        # The sampler uses the same $c_u$ for the whole batch
+        uncond_cond = null_prompt
 
         # AMP auto casting
         autocast = get_autocast()
@@ -379,6 +389,8 @@ class StableDiffusion:
                 uncond_cond=uncond_cond,
                 noise_fn=noise_fn,
                 temperature=temperature,
+                callback=callback,
+                guidance_fraction=guidance_fraction,
             )
 
             return x
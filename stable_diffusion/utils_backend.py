@@ -6,6 +6,7 @@ import torch
 from torch.mps import current_allocated_memory as mps_current_allocated_memory
 
 from utility.utils_logger import logger
+from stable_diffusion.inference_profile import get_inference_profile
 
 def get_device(device=None):
     if device is not None:
@@ -50,7 +51,12 @@ def get_memory_status(device=None):
 def get_autocast(force_cpu: bool = False):
     """
     ### Get autocast
+
+    Models whose [inference profile](inference_profile.html) sets their precision run without autocast.
     """
+    if not get_inference_profile().use_autocast:
+        return contextlib.nullcontext()
+
     if torch.cuda.is_available() and not force_cpu:
         return torch.autocast(device_type='cuda')
 
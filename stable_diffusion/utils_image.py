@@ -9,6 +9,7 @@ import torchvision
 from PIL import Image
 from torchvision.transforms import ToPILImage
 
+from utility.image_encoder import ImageEncoder
 from utility.path import separate_bucket_and_file_path
 from utility.minio import cmd
 from worker.image_generation.generation_data.generated_image_data import GeneratedImageData
@@ -16,11 +17,9 @@ from worker.image_generation.generation_data.prompt_embedding import PromptEmbed
 
 
 def calculate_sha256(tensor):
-    if tensor.device == "cpu":
-        tensor_bytes = tensor.numpy().tobytes()  # Convert tensor to a byte array
-    else:
-        tensor_bytes = tensor.cpu().numpy().tobytes()  # Convert tensor to a byte array
-    sha256_hash = hashlib.sha256(tensor_bytes)
+    # Hash the memory of the contiguous array, without copying it to a byte string
+    tensor_array = np.ascontiguousarray(tensor.detach().cpu().numpy())
+    sha256_hash = hashlib.sha256(memoryview(tensor_array).cast('B'))
     return sha256_hash.hexdigest()
 
 
@@ -133,24 +132,47 @@ def save_images_to_minio(minio_client, images: torch.Tensor, dest_path: str, img
     return output_file_hash
 
 
-def get_image_data(images: torch.Tensor, img_format: str = 'jpeg'):
+def images_to_uint8(images: torch.Tensor) -> np.ndarray:
+    """
+    ### Convert decoded images to one uint8 array
+
+    The mapping to `[0, 255]` runs on the device of the images, so only the uint8 batch is copied to the cpu.
+
+    :param images: is the tensor with images in `[-1, 1]` of shape `[batch_size, channels, height, width]`
+    :return: the `[batch_size, height, width, channels]` uint8 array
+    """
     # Map images to `[0, 1]` space and clip
-    images = torch.clamp((images + 1.0) / 2.0, min=0.0, max=1.0)
-    # Transpose to `[batch_size, height, width, channels]` and convert to numpy
-    images = images.cpu()
-    images = images.permute(0, 2, 3, 1)
-    images = images.detach().float().numpy()
+    images = torch.clamp((images.detach().float() + 1.0) / 2.0, min=0.0, max=1.0)
+    # Scale to `[0, 255]`, truncating like `astype(np.uint8)`, and transpose to `[batch_size, height, width, channels]`
+    images = (255. * images).to(torch.uint8).permute(0, 2, 3, 1)
 
-    # Save images
-    for i, img in enumerate(images):
-        img = Image.fromarray((255. * img).astype(np.uint8))
-        # convert to bytes arr
-        img_byte_arr = io.BytesIO()
-        img.save(img_byte_arr, format=img_format)
-        img_byte_arr.seek(0)
+    return images.cpu().numpy()
 
-        # get hash
-        output_file_hash = (hashlib.sha256(img_byte_arr.getbuffer())).hexdigest()
+
+def get_images_data(images: torch.Tensor, img_format: str = 'jpeg', quality: int = 75,
+                    encoder: Optional[ImageEncoder] = None):
+    """
+    ### Encode and hash a batch of images
+
+    :param images: is the tensor with images in `[-1, 1]` of shape `[batch_size, channels, height, width]`
+    :param img_format: is the image format, `jpeg` or `webp`, used when no encoder is given
+    :param quality: is the quality of the encoding, used when no encoder is given
+    :param encoder: is the `ImageEncoder` that encodes the batch in its processes
+    :return: a list with the sha256 of the encoded image and the buffer to upload for each image
+    """
+    if encoder is None:
+        encoder = ImageEncoder(img_format=img_format, quality=quality)
+
+    return [(image_hash, buffer) for buffer, image_hash in encoder.encode(images_to_uint8(images))]
+
+
+def get_image_data(images: torch.Tensor, img_format: str = 'jpeg', quality: int = 75,
+                   encoder: Optional[ImageEncoder] = None):
+    """
+    ### Encode and hash images, returning the last one
+    """
+    output_file_hash, img_byte_arr = get_images_data(images, img_format=img_format, quality=quality,
+                                                     encoder=encoder)[-1]
 
     return output_file_hash, img_byte_arr
 
@@ -8,11 +8,13 @@ summary: >
 # Utility functions for [stable diffusion](index.html)
 """
 
+from contextlib import contextmanager, nullcontext
 from pathlib import Path
-from typing import Union
+from typing import Union, Tuple
 
 import safetensors
 import torch
+from torch import nn
 from transformers import CLIPTokenizer, CLIPTextModel
 
 from stable_diffusion.model_paths import VAE_PATH, VAE_ENCODER_PATH, VAE_DECODER_PATH
@@ -212,21 +214,83 @@ def load_unet(path: Union[str, Path] = UNET_PATH, device=None) -> UNetModel:
     return unet_model
 
 
+@contextmanager
+def skip_weight_init():
+    """
+    ### Skip the random weight initialization of layers created in this context
+
+    Used when the weights are loaded from a checkpoint right after, so the random
+    initialization would be thrown away.
+    """
+    init_functions = ['uniform_', 'normal_', 'trunc_normal_', 'constant_', 'ones_', 'zeros_',
+                      'xavier_uniform_', 'xavier_normal_', 'kaiming_uniform_', 'kaiming_normal_']
+    original_functions = {name: getattr(nn.init, name) for name in init_functions}
+    for name in init_functions:
+        setattr(nn.init, name, lambda tensor, *args, **kwargs: tensor)
+    try:
+        yield
+    finally:
+        for name, function in original_functions.items():
+            setattr(nn.init, name, function)
+
+
+def load_safetensors_state(model: nn.Module, path: Union[str, Path], device=None, skip_prefixes: Tuple[str, ...] = ()):
+    """
+    ### Load a safetensors checkpoint into `model`
+
+    The file is memory mapped and each tensor is copied straight to `device` into the
+    parameter or buffer it belongs to, so the checkpoint is never held in CPU memory as a whole.
+
+    :param skip_prefixes: are the prefixes of the keys that are not loaded
+    :return: the missing and the extra keys
+    """
+    device = get_device(device)
+    state = model.state_dict(keep_vars=True)
+    missing_keys = set(state.keys())
+    extra_keys = []
+
+    with safetensors.safe_open(str(path), framework="pt", device=str(device)) as f:
+        for key in f.keys():
+            if key.startswith(skip_prefixes):
+                continue
+            if key not in state:
+                extra_keys.append(key)
+                continue
+
+            tensor = f.get_tensor(key)
+            if tensor.shape != state[key].shape:
+                raise ValueError(f"Shape of {key} is {tuple(tensor.shape)} in the checkpoint and "
+                                 f"{tuple(state[key].shape)} in the model")
+            with torch.no_grad():
+                state[key].copy_(tensor)
+            missing_keys.discard(key)
+
+    return sorted(missing_keys), extra_keys
+
+
 def initialize_latent_diffusion(path: Union[str, Path] = None, device=None, autoencoder=None, clip_text_embedder=None,
                                 unet_model=None, force_submodels_init=False) -> LatentDiffusion:
     """
     ### Load [`LatentDiffusion` model](latent_diffusion.html)
+
+    A `clip_text_embedder` that is given is used as it is, its weights are not loaded from the checkpoint.
     """
     device = get_device(device)
+    skip_prefixes = ('cond_stage_model.',) if clip_text_embedder is not None else ()
 
-    # Initialize the submodels, if not given
+    # Initialize the submodels, if not given.
+    # The U-Net and the autoencoder weights are all in the checkpoint, so they are not randomly initialized
+    uninitialized_prefixes = []
     if force_submodels_init:
-        if autoencoder is None:
-            autoencoder = initialize_autoencoder(device=device, force_submodels_init=force_submodels_init)
+        with skip_weight_init() if path is not None else nullcontext():
+            if autoencoder is None:
+                autoencoder = initialize_autoencoder(device=device, force_submodels_init=force_submodels_init)
+                uninitialized_prefixes.append('first_stage_model.')
+            if unet_model is None:
+                unet_model = initialize_unet(device=device)
+                uninitialized_prefixes.append('model.diffusion_model.')
         if clip_text_embedder is None:
             clip_text_embedder = CLIPTextEmbedder(device=device).init_submodels()
-        if unet_model is None:
-            unet_model = initialize_unet(device=device)
 
 
     # Initialize the Latent Diffusion model
@@ -241,16 +305,17 @@ def initialize_latent_diffusion(path: Union[str, Path] = None, device=None, auto
                                 device=device)
     if path is not None:
         # Load the checkpoint
-
         with section(f"stable diffusion checkpoint loading, from {path}"):
-            tensors_dict = safetensors.torch.load_file(path, device="cpu")
-
-        # Set model state
-        with section('model state loading'):
-            missing_keys, extra_keys = model.load_state_dict(tensors_dict, strict=False)
+            missing_keys, extra_keys = load_safetensors_state(model, path, device=device,
+                                                              skip_prefixes=skip_prefixes)
             print(f"missing keys {len(missing_keys)}: {missing_keys}")
             print(f"extra keys {len(extra_keys)}: {extra_keys}")
 
+        # The weights that were not initialized must all come from the checkpoint
+        missing_weights = [key for key in missing_keys if key.startswith(tuple(uninitialized_prefixes))]
+        if len(missing_weights) != 0:
+            raise ValueError(f"Weights missing from the checkpoint {path}: {missing_weights}")
+
         # Debugging output
         # inspect(global_step=checkpoint.get('global_step', -1), missing_keys=missing_keys, extra_keys=extra_keys,
         #         _expand=True)
@@ -10,6 +10,7 @@ from threading import Semaphore
 import msgpack
 import threading
 from random import shuffle, choice, sample
+from bisect import bisect_right
 from tqdm import tqdm
 from concurrent.futures import ThreadPoolExecutor, as_completed
 
@@ -18,6 +19,7 @@ sys.path.insert(0, base_directory)
 
 from utility.minio import cmd
 from training_worker.ab_ranking.model import constants
+from training_worker.ab_ranking.model.dataset_snapshot import DatasetSnapshot, pool_features_vector
 
 DATASETS_BUCKET = "datasets"
 
@@ -52,22 +54,41 @@ def get_ab_data(minio_client, path, index):
     return ab_data, flagged, index
 
 
-def get_aggregated_selection_datapoints(minio_client, dataset_name):
+def get_aggregated_selection_datapoints(minio_client, dataset_name, snapshot: DatasetSnapshot = None):
     prefix = os.path.join(dataset_name, "data/ranking/aggregate")
     dataset_paths = cmd.get_list_of_objects_with_prefix(minio_client, DATASETS_BUCKET, prefix=prefix)
 
     print("Get selection datapoints contents and filter out flagged datapoints...")
     ab_data_list = [None] * len(dataset_paths)
     flagged_count = 0
+
+    # datapoints already in the snapshot are not fetched again
+    paths_to_fetch = []
+    if snapshot is not None:
+        snapshot.retain_datapoints(dataset_paths)
+
+    for index, path in enumerate(dataset_paths):
+        ab_data_fields = snapshot.get_datapoint(path) if snapshot is not None else None
+        if ab_data_fields is None:
+            paths_to_fetch.append((index, path))
+        elif ab_data_fields["flagged"]:
+            flagged_count += 1
+        else:
+            ab_data_list[index] = ABData(**ab_data_fields)
+
+    if snapshot is not None:
+        print("# of new selection datapoints to fetch=", len(paths_to_fetch))
+
     with ThreadPoolExecutor(max_workers=5) as executor:
         futures = []
-        count = 0
-        for path in dataset_paths:
-            futures.append(executor.submit(get_ab_data, minio_client=minio_client, path=path, index=count))
-            count += 1
+        for index, path in paths_to_fetch:
+            futures.append(executor.submit(get_ab_data, minio_client=minio_client, path=path, index=index))
 
-        for future in tqdm(as_completed(futures), total=len(dataset_paths)):
+        for future in tqdm(as_completed(futures), total=len(paths_to_fetch)):
             ab_data, flagged, index = future.result()
+            if snapshot is not None:
+                snapshot.add_datapoint(dataset_paths[index], vars(ab_data))
+
             if not flagged:
                 ab_data_list[index] = ab_data
             else:
@@ -117,6 +138,49 @@ def split_ab_data_vectors(image_pair_data):
     return image_x_feature_vector, image_y_feature_vector, target_probability
 
 
+# loads shards in the given order on a background thread, so downloading the next shards overlaps training
+# on the current one. at most max_shards loaded shards exist at once: the one being read and the prefetched ones
+class ShardPrefetcher:
+    def __init__(self, load_shard, shard_order, max_shards):
+        self.queue = Queue()
+        self.semaphore = Semaphore(max_shards)
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self.run, args=(load_shard, shard_order), daemon=True)
+        self.thread.start()
+
+    def run(self, load_shard, shard_order):
+        for shard_index in shard_order:
+            # wait for a free slot, checking regularly if the prefetcher was stopped
+            while not self.semaphore.acquire(timeout=0.1):
+                if self.stop_event.is_set():
+                    return
+
+            if self.stop_event.is_set():
+                return
+
+            try:
+                self.queue.put((load_shard(shard_index), None))
+            except Exception as e:
+                self.queue.put((None, e))
+                return
+
+    # returns the next shard, blocks until it is loaded
+    def get(self):
+        shard, exception = self.queue.get()
+        if exception is not None:
+            raise exception
+
+        return shard
+
+    # called when a shard returned by get() is no longer used
+    def release(self):
+        self.semaphore.release()
+
+    def stop(self):
+        self.stop_event.set()
+        self.thread.join()
+
+
 class ABRankingDatasetLoader:
     def __init__(self,
                  dataset_name,
@@ -130,7 +194,11 @@ class ABRankingDatasetLoader:
                  pooling_strategy=constants.AVERAGE_POOLING,
                  normalize_vectors=True,
                  target_option=constants.TARGET_1_AND_0,
-                 duplicate_flip_option=constants.DUPLICATE_AND_FLIP_ALL):
+                 duplicate_flip_option=constants.DUPLICATE_AND_FLIP_ALL,
+                 streaming=False,
+                 shard_size=256,
+                 max_shards_in_memory=3,
+                 snapshot_dir=None):
         self.dataset_name = dataset_name
         self.input_type = input_type
 
@@ -180,6 +248,28 @@ class ABRankingDatasetLoader:
         self.image_selected_index_0_count = 0
         self.image_selected_index_1_count = 0
 
+        # streaming, features are read in shards of shard_size selection datapoints
+        # and only max_shards_in_memory shards are held in ram at once
+        self.streaming = streaming
+        self.shard_size = shard_size
+        self.max_shards_in_memory = max_shards_in_memory
+        self.training_shards = []
+        self.training_shard_pairs = []
+        self.training_shard_order = []
+        self.training_shard_offsets = []
+        self.training_prefetcher = None
+        self.current_training_shard = None
+        self.current_training_shard_position = -1
+        self.validation_shards = []
+        self.validation_shard_pairs = []
+        self.streamed_pairs_count = 0
+        self.streaming_load_time = 0
+
+        # local snapshot of the datapoints and pooled features, only new datapoints and images are fetched.
+        # features are pooled when read, so the efficient net functions can't be used with it
+        self.snapshot_dir = snapshot_dir
+        self.snapshot = None
+
         # # random
         # self.rand_a = np.random.rand(2, 77, 768)
         # self.rand_b = np.random.rand(2, 77, 768)
@@ -193,8 +283,13 @@ class ABRankingDatasetLoader:
         if self.dataset_name not in dataset_list:
             raise Exception("Dataset is not in minio server")
 
+        if self.snapshot_dir is not None:
+            self.snapshot = DatasetSnapshot(self.snapshot_dir, self.dataset_name, self.input_type,
+                                            self.pooling_strategy)
+            self.snapshot.load()
+
         # if exist then get paths for aggregated selection datapoints
-        dataset = get_aggregated_selection_datapoints(self.minio_client, self.dataset_name)
+        dataset = get_aggregated_selection_datapoints(self.minio_client, self.dataset_name, self.snapshot)
         len_dataset = len(dataset)
         print("# of dataset retrieved=", len_dataset)
         if len(dataset) == 0:
@@ -228,11 +323,19 @@ class ABRankingDatasetLoader:
         self.training_data_paths_indices = training_data_paths_indices
         self.validation_data_paths_indices = validation_data_paths_indices
 
-        # always load to ram
-        self.load_all_training_data(self.training_ab_data_paths_list)
-        self.load_all_validation_data(self.validation_ab_data_paths_list)
+        if self.streaming:
+            # only the selection datapoints are kept, features are read per shard when needed
+            self.prepare_streaming_training_data()
+            self.prepare_streaming_validation_data()
+        else:
+            # always load to ram
+            self.load_all_training_data(self.training_ab_data_paths_list)
+            self.load_all_validation_data(self.validation_ab_data_paths_list)
         self.total_num_data = self.validation_data_total + self.training_data_total
 
+        if self.snapshot is not None:
+            self.snapshot.save()
+
         print("Dataset loaded...")
         print("Time elapsed: {0}s".format(format(time.time() - start_time, ".2f")))
 
@@ -249,49 +352,55 @@ class ABRankingDatasetLoader:
 
         return selected_index_0_count, selected_index_1_count, total_count
 
-    def get_selection_datapoint_image_pair(self, dataset, index=0):
-        image_pairs = []
-        ab_data = dataset
-
-        selected_image_index = ab_data.selected_image_index
-        file_path_img_1 = ab_data.image_1_path
-        file_path_img_2 = ab_data.image_2_path
-
+    def get_features_vector(self, file_path):
         input_type_extension = "_embedding.msgpack"
         if self.input_type == constants.CLIP:
             input_type_extension = "_clip.msgpack"
 
         # get .msgpack data
-        features_path_img_1 = file_path_img_1.replace(".jpg", input_type_extension)
-        features_path_img_1 = features_path_img_1.replace("datasets/", "")
+        features_path = file_path.replace(".jpg", input_type_extension)
+        features_path = features_path.replace("datasets/", "")
 
-        features_path_img_2 = file_path_img_2.replace(".jpg", input_type_extension)
-        features_path_img_2 = features_path_img_2.replace("datasets/", "")
-
-        features_img_1_data = get_object(self.minio_client, features_path_img_1)
-        features_img_1_data = msgpack.unpackb(features_img_1_data)
-        features_vector_img_1 = []
+        features_data = get_object(self.minio_client, features_path)
+        features_data = msgpack.unpackb(features_data)
+        features_vector = []
 
         if self.input_type in [constants.EMBEDDING, constants.EMBEDDING_POSITIVE]:
-            features_vector_img_1.extend(features_img_1_data["positive_embedding"]["__ndarray__"])
+            features_vector.extend(features_data["positive_embedding"]["__ndarray__"])
         if self.input_type in [constants.EMBEDDING, constants.EMBEDDING_NEGATIVE]:
-            features_vector_img_1.extend(features_img_1_data["negative_embedding"]["__ndarray__"])
+            features_vector.extend(features_data["negative_embedding"]["__ndarray__"])
         if self.input_type == constants.CLIP:
-            features_vector_img_1.extend(features_img_1_data["clip-feature-vector"])
+            features_vector.extend(features_data["clip-feature-vector"])
 
-        features_vector_img_1 = np.array(features_vector_img_1)
-        features_img_2_data = get_object(self.minio_client, features_path_img_2)
-        features_img_2_data = msgpack.unpackb(features_img_2_data)
-        features_vector_img_2 = []
+        return np.array(features_vector)
 
-        if self.input_type in [constants.EMBEDDING, constants.EMBEDDING_POSITIVE]:
-            features_vector_img_2.extend(features_img_2_data["positive_embedding"]["__ndarray__"])
-        if self.input_type in [constants.EMBEDDING, constants.EMBEDDING_NEGATIVE]:
-            features_vector_img_2.extend(features_img_2_data["negative_embedding"]["__ndarray__"])
-        if self.input_type == constants.CLIP:
-            features_vector_img_2.extend(features_img_2_data["clip-feature-vector"])
+    # features vector of an image, from the snapshot if there is one
+    def get_image_features_vector(self, file_path, image_hash):
+        if self.snapshot is None:
+            return self.get_features_vector(file_path)
+
+        features_vector = self.snapshot.get_features(image_hash)
+        if features_vector is None:
+            features_vector = self.get_features_vector(file_path)
+            # clip vectors are not pooled
+            if self.input_type != constants.CLIP:
+                features_vector = pool_features_vector(features_vector, self.pooling_strategy)
+            else:
+                features_vector = features_vector.astype(np.float32)
+            self.snapshot.add_features(image_hash, features_vector)
 
-        features_vector_img_2 = np.array(features_vector_img_2)
+        return features_vector
+
+    def get_selection_datapoint_image_pair(self, dataset, index=0):
+        image_pairs = []
+        ab_data = dataset
+
+        selected_image_index = ab_data.selected_image_index
+        file_path_img_1 = ab_data.image_1_path
+        file_path_img_2 = ab_data.image_2_path
+
+        features_vector_img_1 = self.get_image_features_vector(file_path_img_1, ab_data.hash_image_1)
+        features_vector_img_2 = self.get_image_features_vector(file_path_img_2, ab_data.hash_image_2)
 
         # if image 1 is the selected
         if selected_image_index == 0:
@@ -428,6 +537,10 @@ class ABRankingDatasetLoader:
         print("Time elapsed: {0}s".format(format(time_elapsed, ".2f")))
 
     def shuffle_training_data(self):
+        if self.streaming:
+            self.shuffle_streaming_training_data()
+            return
+
         print("Shuffling training data...")
         # shuffle
         new_shuffled_indices = []
@@ -444,6 +557,216 @@ class ABRankingDatasetLoader:
         self.training_image_pair_data_arr = shuffled_training
         self.training_image_hashes = shuffled_training_image_hashes
 
+    # ------------------------------- Streaming -------------------------------
+    # selection datapoints as (ab data, path index, targets), the targets decide the pairs made from the datapoint
+    def get_streaming_datapoints(self, ab_data_list, data_paths_indices):
+        datapoints = []
+        for ab_data, path_index in zip(ab_data_list, data_paths_indices):
+            if ab_data.selected_image_index == 0:
+                self.image_selected_index_0_count += 1
+            else:
+                self.image_selected_index_1_count += 1
+
+            targets = []
+            if (self.target_option == constants.TARGET_1_AND_0) or (self.target_option == constants.TARGET_1_ONLY):
+                targets.append(1.0)
+
+            if (self.target_option == constants.TARGET_1_AND_0) or (self.target_option == constants.TARGET_0_ONLY):
+                use_target_0 = True
+                if (self.target_option == constants.TARGET_1_AND_0) and (
+                        self.duplicate_flip_option == constants.DUPLICATE_AND_FLIP_RANDOM):
+                    # then should have 50/50 chance of being duplicated or not
+                    rand_int = choice([0, 1])
+                    if rand_int == 1:
+                        # then don't duplicate
+                        use_target_0 = False
+
+                if use_target_0:
+                    targets.append(0.0)
+
+            datapoints.append((ab_data, path_index, targets))
+
+        # shuffle selection datapoints once, epochs then shuffle shard order and pairs within a shard
+        shuffle(datapoints)
+
+        return datapoints
+
+    def get_shards(self, datapoints):
+        shards = []
+        shard_pairs = []
+        for start in range(0, len(datapoints), self.shard_size):
+            shard = datapoints[start:start + self.shard_size]
+            # pairs of a shard as (datapoint index in shard, target)
+            pairs = [(i, target) for i, (_, _, targets) in enumerate(shard) for target in targets]
+            shuffle(pairs)
+
+            shards.append(shard)
+            shard_pairs.append(pairs)
+
+        return shards, shard_pairs
+
+    def get_shards_hashes_and_indices(self, shards, shard_pairs, shard_order):
+        image_hashes = []
+        data_paths_indices = []
+        for shard_index in shard_order:
+            shard = shards[shard_index]
+            for i, target in shard_pairs[shard_index]:
+                ab_data, path_index, _ = shard[i]
+                if ab_data.selected_image_index == 0:
+                    selected_img_hash, other_img_hash = ab_data.hash_image_1, ab_data.hash_image_2
+                else:
+                    selected_img_hash, other_img_hash = ab_data.hash_image_2, ab_data.hash_image_1
+
+                if target == 1.0:
+                    image_hashes.append(selected_img_hash)
+                else:
+                    image_hashes.append(other_img_hash)
+                data_paths_indices.append(path_index)
+
+        return image_hashes, data_paths_indices
+
+    def prepare_streaming_training_data(self):
+        datapoints = self.get_streaming_datapoints(self.training_ab_data_paths_list, self.training_data_paths_indices)
+        self.training_shards, self.training_shard_pairs = self.get_shards(datapoints)
+        self.training_data_total = sum(len(pairs) for pairs in self.training_shard_pairs)
+        self.training_data_paths_indices = [path_index for _, path_index, targets in datapoints for _ in targets]
+        print("# of training shards=", len(self.training_shards))
+
+        self.shuffle_streaming_training_data()
+
+    def prepare_streaming_validation_data(self):
+        datapoints = self.get_streaming_datapoints(self.validation_ab_data_paths_list,
+                                                   self.validation_data_paths_indices)
+        self.validation_shards, self.validation_shard_pairs = self.get_shards(datapoints)
+        self.validation_data_total = sum(len(pairs) for pairs in self.validation_shard_pairs)
+        self.validation_data_paths_indices = [path_index for _, path_index, targets in datapoints for _ in targets]
+
+        self.validation_image_hashes, \
+            self.validation_data_paths_indices_shuffled = self.get_shards_hashes_and_indices(
+            self.validation_shards,
+            self.validation_shard_pairs,
+            range(len(self.validation_shards)))
+
+    def shuffle_streaming_training_data(self):
+        # keep the features read during the epoch
+        if self.snapshot is not None:
+            self.snapshot.save()
+
+        print("Shuffling training shards...")
+        self.training_shard_order = list(range(len(self.training_shards)))
+        shuffle(self.training_shard_order)
+        for pairs in self.training_shard_pairs:
+            shuffle(pairs)
+
+        # position in the epoch where each shard starts
+        self.training_shard_offsets = []
+        offset = 0
+        for shard_index in self.training_shard_order:
+            self.training_shard_offsets.append(offset)
+            offset += len(self.training_shard_pairs[shard_index])
+
+        self.training_image_hashes, \
+            self.training_data_paths_indices_shuffled = self.get_shards_hashes_and_indices(
+            self.training_shards,
+            self.training_shard_pairs,
+            self.training_shard_order)
+
+        # start reading the new epoch order from the first shard
+        self.start_training_prefetcher(0)
+
+    def load_shard(self, shards, shard_pairs, shard_index):
+        start_time = time.time()
+        shard = shards[shard_index]
+
+        # features of the selected and the other image of each datapoint
+        with ThreadPoolExecutor(max_workers=5) as executor:
+            features = list(executor.map(self.get_selection_datapoint_features, [ab_data for ab_data, _, _ in shard]))
+
+        image_pairs = []
+        for i, target in shard_pairs[shard_index]:
+            selected_features_vector, other_features_vector = features[i]
+            if target == 1.0:
+                image_pairs.append((selected_features_vector, other_features_vector, [1.0]))
+            else:
+                image_pairs.append((other_features_vector, selected_features_vector, [0.0]))
+
+        self.streamed_pairs_count += len(image_pairs)
+        self.streaming_load_time += time.time() - start_time
+        self.datapoints_per_sec = self.streamed_pairs_count / max(self.streaming_load_time, 1e-6)
+
+        return image_pairs
+
+    def get_selection_datapoint_features(self, ab_data):
+        features_vector_img_1 = self.get_image_features_vector(ab_data.image_1_path,
+                                                               ab_data.hash_image_1).astype(np.float32)
+        features_vector_img_2 = self.get_image_features_vector(ab_data.image_2_path,
+                                                               ab_data.hash_image_2).astype(np.float32)
+
+        if ab_data.selected_image_index == 0:
+            return features_vector_img_1, features_vector_img_2
+
+        return features_vector_img_2, features_vector_img_1
+
+    def load_training_shard(self, shard_index):
+        return self.load_shard(self.training_shards, self.training_shard_pairs, shard_index)
+
+    def load_validation_shard(self, shard_index):
+        return self.load_shard(self.validation_shards, self.validation_shard_pairs, shard_index)
+
+    def stop_training_prefetcher(self):
+        if self.training_prefetcher is not None:
+            self.training_prefetcher.stop()
+            self.training_prefetcher = None
+
+        self.current_training_shard = None
+        self.current_training_shard_position = -1
+
+    # prefetch the shards of the epoch order starting at the given position
+    def start_training_prefetcher(self, position):
+        self.stop_training_prefetcher()
+        self.training_prefetcher = ShardPrefetcher(self.load_training_shard,
+                                                   self.training_shard_order[position:],
+                                                   self.max_shards_in_memory)
+        # the shard before the position counts as read, so the next get() returns the shard at the position
+        self.current_training_shard_position = position - 1
+
+    def get_training_pair(self, index):
+        if not self.streaming:
+            return self.training_image_pair_data_arr[index]
+
+        position = bisect_right(self.training_shard_offsets, index) - 1
+        if position != self.current_training_shard_position:
+            if self.training_prefetcher is None or position != self.current_training_shard_position + 1:
+                # not the next shard in order, e.g. the index was reset, so restart from the position
+                self.start_training_prefetcher(position)
+            elif self.current_training_shard is not None:
+                # done with the current shard
+                self.current_training_shard = None
+                self.training_prefetcher.release()
+
+            self.current_training_shard = self.training_prefetcher.get()
+            self.current_training_shard_position = position
+
+        return self.current_training_shard[index - self.training_shard_offsets[position]]
+
+    # validation image pairs, one shard at a time
+    def get_validation_pairs_per_shard(self):
+        if not self.streaming:
+            yield self.validation_image_pair_data_arr
+            return
+
+        prefetcher = ShardPrefetcher(self.load_validation_shard,
+                                     range(len(self.validation_shards)),
+                                     self.max_shards_in_memory)
+        try:
+            for _ in range(len(self.validation_shards)):
+                image_pairs = prefetcher.get()
+                yield image_pairs
+                del image_pairs
+                prefetcher.release()
+        finally:
+            prefetcher.stop()
+
     # ------------------------------- For AB Ranking Efficient Net -------------------------------
     def get_next_training_feature_vectors_and_target_efficient_net(self, num_data, device=None):
         image_x_feature_vectors = []
@@ -451,7 +774,7 @@ class ABRankingDatasetLoader:
         target_probabilities = []
 
         for _ in range(num_data):
-            training_image_pair_data = self.training_image_pair_data_arr[self.current_training_data_index]
+            training_image_pair_data = self.get_training_pair(self.current_training_data_index)
             image_x_feature_vector, image_y_feature_vector, target_probability = split_ab_data_vectors(
                 training_image_pair_data)
             image_x_feature_vectors.append(image_x_feature_vector)
@@ -514,13 +837,36 @@ class ABRankingDatasetLoader:
         return image_x_feature_vectors, image_y_feature_vectors, target_probabilities
 
     def get_validation_feature_vectors_and_target_efficient_net(self):
+        if self.snapshot is not None:
+            raise Exception("efficient net needs unpooled features, snapshot_dir is not supported")
+
+        image_x_feature_vectors = []
+        image_y_feature_vectors = []
+        target_probabilities = []
+
+        # pool one shard at a time when streaming, so only the pooled vectors of all shards are held
+        for image_pairs in self.get_validation_pairs_per_shard():
+            image_x_feature_vectors_shard, \
+                image_y_feature_vectors_shard, \
+                target_probabilities_shard = self.get_feature_vectors_and_target_efficient_net(image_pairs)
+            image_x_feature_vectors.append(image_x_feature_vectors_shard)
+            image_y_feature_vectors.append(image_y_feature_vectors_shard)
+            target_probabilities.append(target_probabilities_shard)
+
+        image_x_feature_vectors = torch.cat(image_x_feature_vectors)
+        image_y_feature_vectors = torch.cat(image_y_feature_vectors)
+        target_probabilities = torch.cat(target_probabilities)
+        print("feature shape after pooling and unsqueeze=", image_x_feature_vectors.shape)
+
+        return image_x_feature_vectors, image_y_feature_vectors, target_probabilities
+
+    def get_feature_vectors_and_target_efficient_net(self, image_pairs):
         image_x_feature_vectors = []
         image_y_feature_vectors = []
         target_probabilities = []
 
         # get ab data
-        for i in range(len(self.validation_image_pair_data_arr)):
-            validation_image_pair_data = self.validation_image_pair_data_arr[i]
+        for validation_image_pair_data in image_pairs:
             image_x_feature_vector, image_y_feature_vector, target_probability = split_ab_data_vectors(
                 validation_image_pair_data)
             image_x_feature_vectors.append(image_x_feature_vector)
@@ -535,12 +881,10 @@ class ABRankingDatasetLoader:
         image_x_feature_vectors = torch.tensor(image_x_feature_vectors).to(torch.float)
         image_y_feature_vectors = torch.tensor(image_y_feature_vectors).to(torch.float)
         target_probabilities = torch.tensor(target_probabilities).to(torch.float)
-        print("feature shape =", image_x_feature_vectors.shape)
 
         if self.normalize_vectors:
             image_x_feature_vectors = torch_normalize(image_x_feature_vectors, p=1.0, dim=2)
             image_y_feature_vectors = torch_normalize(image_y_feature_vectors, p=1.0, dim=2)
-            print("feature shape after normalizing=", image_x_feature_vectors.shape)
 
         if self.pooling_strategy == constants.AVERAGE_POOLING:
             # do average pooling
@@ -576,8 +920,6 @@ class ABRankingDatasetLoader:
         image_x_feature_vectors = image_x_feature_vectors.unsqueeze(1)
         image_y_feature_vectors = image_y_feature_vectors.unsqueeze(1)
 
-        print("feature shape after pooling and unsqueeze=", image_x_feature_vectors.shape)
-
         return image_x_feature_vectors, image_y_feature_vectors, target_probabilities
 
     # ------------------------------- For AB Ranking Linear -------------------------------
@@ -587,7 +929,7 @@ class ABRankingDatasetLoader:
         target_probabilities = []
 
         for _ in range(num_data):
-            training_image_pair_data = self.training_image_pair_data_arr[self.current_training_data_index]
+            training_image_pair_data = self.get_training_pair(self.current_training_data_index)
             image_x_feature_vector, image_y_feature_vector, target_probability = split_ab_data_vectors(
                 training_image_pair_data)
             image_x_feature_vectors.append(image_x_feature_vector)
@@ -649,9 +991,34 @@ class ABRankingDatasetLoader:
         image_y_feature_vectors = []
         target_probabilities = []
 
+        # pool one shard at a time when streaming, so only the pooled vectors of all shards are held
+        for image_pairs in self.get_validation_pairs_per_shard():
+            image_x_feature_vectors_shard, \
+                image_y_feature_vectors_shard, \
+                target_probabilities_shard = self.get_feature_vectors_and_target_linear(image_pairs)
+            image_x_feature_vectors.append(image_x_feature_vectors_shard)
+            image_y_feature_vectors.append(image_y_feature_vectors_shard)
+            target_probabilities.append(target_probabilities_shard)
+
+        image_x_feature_vectors = torch.cat(image_x_feature_vectors)
+        image_y_feature_vectors = torch.cat(image_y_feature_vectors)
+        target_probabilities = torch.cat(target_probabilities)
+        print("feature shape after reshape=", image_x_feature_vectors.shape)
+
+        if device is not None:
+            image_x_feature_vectors = image_x_feature_vectors.to(device)
+            image_y_feature_vectors = image_y_feature_vectors.to(device)
+            target_probabilities = target_probabilities.to(device)
+
+        return image_x_feature_vectors, image_y_feature_vectors, target_probabilities
+
+    def get_feature_vectors_and_target_linear(self, image_pairs):
+        image_x_feature_vectors = []
+        image_y_feature_vectors = []
+        target_probabilities = []
+
         # get ab data
-        for i in range(len(self.validation_image_pair_data_arr)):
-            validation_image_pair_data = self.validation_image_pair_data_arr[i]
+        for validation_image_pair_data in image_pairs:
             image_x_feature_vector, image_y_feature_vector, target_probability = split_ab_data_vectors(
                 validation_image_pair_data)
             image_x_feature_vectors.append(image_x_feature_vector)
@@ -692,17 +1059,10 @@ class ABRankingDatasetLoader:
                 image_y_feature_vectors = index_select(image_y_feature_vectors,
                                                        dim=2,
                                                        index=image_y_feature_vector_max_indices)
-            print("feature shape after pooling=", image_x_feature_vectors.shape)
 
         # then concatenate
         image_x_feature_vectors = image_x_feature_vectors.reshape(len(image_x_feature_vectors), -1)
         image_y_feature_vectors = image_y_feature_vectors.reshape(len(image_y_feature_vectors), -1)
-        print("feature shape after reshape=", image_x_feature_vectors.shape)
-
-        if device is not None:
-            image_x_feature_vectors = image_x_feature_vectors.to(device)
-            image_y_feature_vectors = image_y_feature_vectors.to(device)
-            target_probabilities = target_probabilities.to(device)
 
         return image_x_feature_vectors, image_y_feature_vectors, target_probabilities
 
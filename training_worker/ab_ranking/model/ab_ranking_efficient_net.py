@@ -6,7 +6,11 @@ import torch
 import torch.nn as nn
 import torch.optim as optim
 import copy
-import math
+import time
+import contextlib
+import numpy as np
+from torch.nn.functional import normalize as torch_normalize
+from torch.utils.data import Dataset, DataLoader
 from tqdm import tqdm
 from datetime import datetime
 import threading
@@ -14,7 +18,9 @@ import threading
 base_directory = os.getcwd()
 sys.path.insert(0, base_directory)
 
-from training_worker.ab_ranking.model.ab_ranking_data_loader import ABRankingDatasetLoader
+from training_worker.ab_ranking.model.ab_ranking_data_loader import ABRankingDatasetLoader, split_ab_data_vectors, \
+    index_select
+from training_worker.ab_ranking.model import constants
 from utility.minio import cmd
 from training_worker.ab_ranking.model.efficient_net_model import EfficientNet as efficientnet_pytorch
 
@@ -33,6 +39,56 @@ class EfficientNetModel(nn.Module):
         return x1
 
 
+# training pairs of a dataset loader, pooled one pair at a time so data loader workers can do it
+class ABRankingEfficientNetDataset(Dataset):
+    def __init__(self, dataset_loader: ABRankingDatasetLoader):
+        self.num_pairs = dataset_loader.get_len_training_ab_data()
+        self.normalize_vectors = dataset_loader.normalize_vectors
+        self.pooling_strategy = dataset_loader.pooling_strategy
+        self.image_pairs = dataset_loader.training_image_pair_data_arr
+
+        # a streaming dataset loader holds only a few shards, so pairs are read through it
+        self.dataset_loader = None
+        if dataset_loader.streaming:
+            self.dataset_loader = dataset_loader
+
+    def __len__(self):
+        return self.num_pairs
+
+    def __getitem__(self, index):
+        if self.dataset_loader is not None:
+            image_pair = self.dataset_loader.get_training_pair(index)
+        else:
+            image_pair = self.image_pairs[index]
+
+        image_x_feature_vector, image_y_feature_vector, target_probability = split_ab_data_vectors(image_pair)
+
+        return self.get_pooled_feature_vector(image_x_feature_vector), \
+            self.get_pooled_feature_vector(image_y_feature_vector), \
+            torch.tensor(target_probability, dtype=torch.float)
+
+    # same normalizing and pooling as get_next_training_feature_vectors_and_target_efficient_net,
+    # for a single (2, 77, 768) embedding, returns (1, 1, 2 * 768)
+    def get_pooled_feature_vector(self, feature_vector):
+        feature_vector = torch.from_numpy(np.asarray(feature_vector, dtype=np.float32))
+
+        if self.normalize_vectors:
+            feature_vector = torch_normalize(feature_vector, p=1.0, dim=1)
+
+        if self.pooling_strategy == constants.AVERAGE_POOLING:
+            # do average pooling
+            feature_vector = torch.mean(feature_vector, dim=1)
+        elif self.pooling_strategy == constants.MAX_POOLING:
+            # do max pooling
+            feature_vector = torch.max(feature_vector, dim=1).values
+        elif self.pooling_strategy == constants.MAX_ABS_POOLING:
+            # max abs pooling
+            feature_vector_max_indices = torch.max(torch.abs(feature_vector), dim=1).indices
+            feature_vector = index_select(feature_vector, dim=1, index=feature_vector_max_indices)
+
+        return feature_vector.reshape(1, 1, -1)
+
+
 class ABRankingEfficientNetModel:
     def __init__(self, efficient_net_version="b0", in_channels=1, num_classes=1, inputs_shape=(1, 1, 768*2)):
         if torch.cuda.is_available():
@@ -95,11 +151,22 @@ class ABRankingEfficientNetModel:
               epochs=100,
               learning_rate=0.05,
               weight_decay=0.01,
-              debug_asserts=False):
+              debug_asserts=False,
+              num_workers=2,
+              precision=constants.PRECISION_FP32,
+              channels_last=False):
+        if precision not in constants.ALLOWED_PRECISIONS:
+            raise Exception("precision is not supported: {}".format(precision))
+
         training_loss_per_epoch = []
         validation_loss_per_epoch = []
 
+        if channels_last:
+            self.model = self.model.to(memory_format=torch.channels_last)
+
         optimizer = optim.AdamW(self.model.parameters(), lr=learning_rate, weight_decay=weight_decay)
+        # loss scaling is only needed for fp16
+        scaler = torch.cuda.amp.GradScaler(enabled=precision == constants.PRECISION_FP16)
         self.model_type = 'image-pair-ranking-efficient-net'
         self.loss_func_name = "l1"
 
@@ -107,15 +174,17 @@ class ABRankingEfficientNetModel:
         validation_features_x, \
             validation_features_y, \
             validation_targets = dataset_loader.get_validation_feature_vectors_and_target_efficient_net()
-        validation_features_x = validation_features_x.to(self._device)
-        validation_features_y = validation_features_y.to(self._device)
+        validation_features_x = self.to_model_input(validation_features_x, channels_last)
+        validation_features_y = self.to_model_input(validation_features_y, channels_last)
         validation_targets = validation_targets.to(self._device)
 
-        # get total number of training features
-        num_features = dataset_loader.get_len_training_ab_data()
+        # training pairs are pooled and batched by data loader workers
+        training_dataset = ABRankingEfficientNetDataset(dataset_loader)
+        training_data_loader = self.get_training_data_loader(training_dataset,
+                                                             training_batch_size,
+                                                             shuffle=True,
+                                                             num_workers=num_workers)
 
-        # get number of batches to do per epoch
-        training_num_batches = math.ceil(num_features / training_batch_size)
         loss = None
         for epoch in tqdm(range(epochs), desc="Training epoch"):
             training_loss_arr = []
@@ -125,36 +194,23 @@ class ABRankingEfficientNetModel:
 
             # Only train after 0th epoch
             if epoch != 0:
-                # fill data buffer
-                dataset_loader.spawn_filling_workers()
-
-                for i in range(training_num_batches):
-                    num_data_to_get = training_batch_size
-                    # last batch
-                    if i == training_num_batches - 1:
-                        num_data_to_get = num_features - (i * (training_batch_size))
-
-                    batch_features_x_orig, \
-                        batch_features_y_orig,\
-                        batch_targets_orig = dataset_loader.get_next_training_feature_vectors_and_target_efficient_net(num_data_to_get, self._device)
-
+                epoch_start_time = time.time()
+                for batch_features_x, batch_features_y, batch_targets in training_data_loader:
                     if debug_asserts:
-                        assert batch_features_x_orig.shape == (training_batch_size,) + self.model.inputs_shape
-                        assert batch_features_y_orig.shape == (training_batch_size,) + self.model.inputs_shape
-                        assert batch_targets_orig.shape == (training_batch_size, 1)
-
-                    batch_features_x = batch_features_x_orig.clone().requires_grad_(True).to(self._device)
-                    batch_features_y = batch_features_y_orig.clone().requires_grad_(True).to(self._device)
-                    batch_targets = batch_targets_orig.clone().requires_grad_(True).to(self._device)
+                        assert batch_features_x.shape == (len(batch_features_x),) + self.model.inputs_shape
+                        assert batch_features_y.shape == (len(batch_features_y),) + self.model.inputs_shape
+                        assert batch_targets.shape == (len(batch_targets), 1)
 
-                    with torch.no_grad():
-                        predicted_score_images_y = self.model.forward(batch_features_y)
+                    batch_features_x = self.to_model_input(batch_features_x, channels_last)
+                    batch_features_y = self.to_model_input(batch_features_y, channels_last)
+                    batch_targets = batch_targets.to(self._device, non_blocking=True)
 
-                    optimizer.zero_grad()
-                    predicted_score_images_x = self.model.forward(batch_features_x)
-
-                    predicted_score_images_y_copy = predicted_score_images_y.clone().requires_grad_(True).to(self._device)
-                    batch_pred_probabilities = self.forward_elo(predicted_score_images_x, predicted_score_images_y_copy)
+                    loss, batch_pred_probabilities = self.train_step(optimizer,
+                                                                     scaler,
+                                                                     batch_features_x,
+                                                                     batch_features_y,
+                                                                     batch_targets,
+                                                                     precision)
 
                     if debug_asserts:
                         # assert
@@ -164,30 +220,24 @@ class ABRankingEfficientNetModel:
 
                         assert batch_targets.shape == batch_pred_probabilities.shape
 
-                    # add loss penalty
-                    # neg_score = torch.multiply(predicted_score_images_x, -1.0)
-                    # negative_score_loss_penalty = self.model.relu_fn(neg_score)
-
-                    loss = self.model.l1_loss(batch_pred_probabilities, batch_targets)
-                    # loss = torch.add(loss, negative_score_loss_penalty)
-
-                    loss.backward()
-                    optimizer.step()
-
                     training_loss_arr.append(loss.detach().cpu())
 
+                epoch_time = time.time() - epoch_start_time
+                print("Training pairs/sec: {0}".format(format(len(training_dataset) / epoch_time, ".2f")))
+
                 if debug_asserts:
                     for name, param in self.model.named_parameters():
                         if torch.isnan(param.grad).any():
                             print("nan gradient found")
                             raise SystemExit
                         # print("param={}, grad={}".format(name, param.grad))
-                    
-                # refill training ab data
-                dataset_loader.fill_training_ab_data()
+
+                # a streaming dataset loader shuffles its own shards
+                if dataset_loader.streaming:
+                    dataset_loader.shuffle_training_data()
 
             # Calculate Validation Loss
-            with torch.no_grad():
+            with torch.no_grad(), self.get_autocast(precision):
                 for i in range(len(validation_features_x)):
                     validation_feature_x = validation_features_x[i]
                     validation_feature_x = validation_feature_x.unsqueeze(0)
@@ -196,8 +246,8 @@ class ABRankingEfficientNetModel:
                     validation_target = validation_targets[i]
                     validation_target = validation_target.unsqueeze(0)
 
-                    predicted_score_image_x = self.model.forward(validation_feature_x)
-                    predicted_score_image_y = self.model.forward(validation_feature_y)
+                    predicted_score_image_x = self.model.forward(validation_feature_x).float()
+                    predicted_score_image_y = self.model.forward(validation_feature_y).float()
                     validation_probability = self.forward_elo(predicted_score_image_x, predicted_score_image_y)
 
                     if debug_asserts:
@@ -232,27 +282,24 @@ class ABRankingEfficientNetModel:
             self.training_loss = epoch_training_loss.detach().cpu()
             self.validation_loss = epoch_validation_loss.detach().cpu()
 
-        with torch.no_grad():
-            # fill data buffer
-            dataset_loader.spawn_filling_workers()
-
+        with torch.no_grad(), self.get_autocast(precision):
             training_predicted_score_images_x = []
             training_predicted_score_images_y = []
             training_predicted_probabilities = []
             training_target_probabilities = []
 
-            # get performance metrics
-            for i in range(training_num_batches):
-                num_data_to_get = training_batch_size
-                if i == training_num_batches - 1:
-                    num_data_to_get = num_features - (i * (training_batch_size))
-
-                batch_features_x, \
-                    batch_features_y,\
-                    batch_targets = dataset_loader.get_next_training_feature_vectors_and_target_efficient_net(num_data_to_get, self._device)
-
-                batch_predicted_score_images_x = self.model.forward(batch_features_x)
-                batch_predicted_score_images_y = self.model.forward(batch_features_y)
+            # get performance metrics, in the dataset loader order so the image hashes match
+            performance_data_loader = self.get_training_data_loader(training_dataset,
+                                                                    training_batch_size,
+                                                                    shuffle=False,
+                                                                    num_workers=num_workers)
+            for batch_features_x, batch_features_y, batch_targets in performance_data_loader:
+                batch_features_x = self.to_model_input(batch_features_x, channels_last)
+                batch_features_y = self.to_model_input(batch_features_y, channels_last)
+                batch_targets = batch_targets.to(self._device, non_blocking=True)
+
+                batch_predicted_score_images_x = self.model.forward(batch_features_x).float()
+                batch_predicted_score_images_y = self.model.forward(batch_features_y).float()
                 batch_pred_probabilities = self.forward_elo(batch_predicted_score_images_x,
                                                              batch_predicted_score_images_y)
                 if debug_asserts:
@@ -279,8 +326,8 @@ class ABRankingEfficientNetModel:
                 validation_feature_y = validation_features_y[i]
                 validation_feature_y = validation_feature_y.unsqueeze(0)
 
-                predicted_score_image_x = self.model.forward(validation_feature_x)
-                predicted_score_image_y = self.model.forward(validation_feature_y)
+                predicted_score_image_x = self.model.forward(validation_feature_x).float()
+                predicted_score_image_y = self.model.forward(validation_feature_y).float()
                 pred_probability = self.forward_elo(predicted_score_image_x, predicted_score_image_y)
                 if debug_asserts:
                     # assert pred(x,y) = 1- pred(y,x)
@@ -304,6 +351,60 @@ class ABRankingEfficientNetModel:
             training_loss_per_epoch, \
             validation_loss_per_epoch
 
+    def get_training_data_loader(self, training_dataset, batch_size, shuffle, num_workers):
+        # a streaming dataset loader reads its shards in its own order, from the main process
+        if training_dataset.dataset_loader is not None:
+            shuffle = False
+            num_workers = 0
+
+        return DataLoader(training_dataset,
+                          batch_size=batch_size,
+                          shuffle=shuffle,
+                          num_workers=num_workers,
+                          pin_memory=self._device.type == "cuda",
+                          persistent_workers=num_workers > 0)
+
+    def get_autocast(self, precision):
+        if precision == constants.PRECISION_BF16:
+            return torch.autocast(device_type=self._device.type, dtype=torch.bfloat16)
+        if precision == constants.PRECISION_FP16:
+            return torch.autocast(device_type=self._device.type, dtype=torch.float16)
+
+        return contextlib.nullcontext()
+
+    def to_model_input(self, features, channels_last=False):
+        features = features.to(self._device, non_blocking=True)
+        if channels_last:
+            features = features.contiguous(memory_format=torch.channels_last)
+
+        return features
+
+    def train_step(self, optimizer, scaler, batch_features_x, batch_features_y, batch_targets,
+                   precision=constants.PRECISION_FP32):
+        with self.get_autocast(precision):
+            with torch.no_grad():
+                predicted_score_images_y = self.model.forward(batch_features_y)
+
+            optimizer.zero_grad()
+            predicted_score_images_x = self.model.forward(batch_features_x)
+
+        # probabilities and loss in fp32
+        batch_pred_probabilities = self.forward_elo(predicted_score_images_x.float(),
+                                                    predicted_score_images_y.float())
+
+        # add loss penalty
+        # neg_score = torch.multiply(predicted_score_images_x, -1.0)
+        # negative_score_loss_penalty = self.model.relu_fn(neg_score)
+
+        loss = self.model.l1_loss(batch_pred_probabilities, batch_targets)
+        # loss = torch.add(loss, negative_score_loss_penalty)
+
+        scaler.scale(loss).backward()
+        scaler.step(optimizer)
+        scaler.update()
+
+        return loss, batch_pred_probabilities
+
     def forward_bradley_terry(self, predicted_score_images_x, predicted_score_images_y, use_sigmoid=True):
         if use_sigmoid:
             # scale the score
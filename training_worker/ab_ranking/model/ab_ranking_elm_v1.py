@@ -10,7 +10,6 @@ import math
 import threading
 from io import BytesIO
 from tqdm import tqdm
-from random import sample
 base_directory = os.getcwd()
 sys.path.insert(0, base_directory)
 
@@ -18,56 +17,141 @@ from training_worker.ab_ranking.model.ab_ranking_data_loader import ABRankingDat
 from utility.minio import cmd
 
 
+# at or above this sparsity the random projections are kept as sparse csr matrices
+# so evaluation cost is proportional to the number of nonzeros
+ELM_SPARSE_KERNEL_MIN_SPARSITY = 0.9
+
+
+# fixed random projection + bias + relu
+# the projection is regenerated from the seed, it is a non persistent buffer
+# so it moves with .to(device) but is not part of the saved state dict
+class ELMRandomLayer(nn.Module):
+    def __init__(self, in_features, out_features, elm_sparsity=0.0, seed=0):
+        super(ELMRandomLayer, self).__init__()
+        # at 1.0 every weight is dropped and the rescale divides by zero
+        if not 0.0 <= elm_sparsity < 1.0:
+            raise Exception("elm sparsity should be in [0.0, 1.0), got {}".format(elm_sparsity))
+
+        self.in_features = in_features
+        self.out_features = out_features
+        self.elm_sparsity = elm_sparsity
+        self.seed = seed
+        self.use_sparse_kernel = elm_sparsity >= ELM_SPARSE_KERNEL_MIN_SPARSITY
+
+        generator = torch.Generator().manual_seed(seed)
+
+        # same init range as nn.Linear, scaled so sparsity keeps the output variance
+        bound = 1.0 / math.sqrt(in_features)
+        weight = (torch.rand(out_features, in_features, generator=generator) * 2.0 - 1.0) * bound
+        bias = (torch.rand(out_features, generator=generator) * 2.0 - 1.0) * bound
+
+        if elm_sparsity != 0.0:
+            # set some to zero
+            keep_mask = torch.rand(out_features, in_features, generator=generator) >= elm_sparsity
+            weight = weight * keep_mask / math.sqrt(1.0 - elm_sparsity)
+
+        if self.use_sparse_kernel:
+            # (out, in), used as the left operand of addmm
+            self.register_buffer("weight", weight.to_sparse_csr(), persistent=False)
+            self.register_buffer("bias", bias.unsqueeze(1), persistent=False)
+        else:
+            # (in, out), so addmm needs no transpose
+            self.register_buffer("weight", weight.t().contiguous(), persistent=False)
+            self.register_buffer("bias", bias, persistent=False)
+
+    # (..., in_features) -> (..., out_features)
+    def forward(self, x):
+        batch_shape = x.shape[:-1]
+        x = x.reshape(-1, self.in_features)
+
+        if self.use_sparse_kernel:
+            output = torch.addmm(self.bias, self.weight, x.t()).t()
+        else:
+            output = torch.addmm(self.bias, x, self.weight)
+
+        output = torch.relu_(output)
+
+        return output.reshape(batch_shape + (self.out_features,))
+
+    def extra_repr(self):
+        return "in_features={}, out_features={}, elm_sparsity={}, seed={}".format(self.in_features,
+                                                                                  self.out_features,
+                                                                                  self.elm_sparsity,
+                                                                                  self.seed)
+
+
 class ABRankingELMBaseModel(nn.Module):
-    def __init__(self, inputs_shape, num_random_layers=2, elm_sparsity=0.0):
+    def __init__(self, inputs_shape, num_random_layers=2, elm_sparsity=0.0, hidden_size=None, seed=None,
+                 random_projection=True):
         super(ABRankingELMBaseModel, self).__init__()
         self.inputs_shape = inputs_shape
         self.output_size = 1
+        self.num_random_layers = num_random_layers
+        self.elm_sparsity = elm_sparsity
+        self.random_projection = random_projection
+
+        if hidden_size is None or not random_projection:
+            hidden_size = inputs_shape
+        self.hidden_size = hidden_size
+
+        if seed is None:
+            seed = int(torch.randint(0, 2 ** 31 - 1, (1,)).item())
+        self.seed = seed
 
         self.l1_loss = nn.L1Loss()
-        self.num_random_layers = num_random_layers
-        self.random_layers = []
-        self.linear_last_layer = nn.Linear(self.inputs_shape, self.output_size)
+        self.random_layers = nn.ModuleList()
+        self.random_layers_init()
 
-        self.random_layers_init(elm_sparsity)
+        size = self.hidden_size if self.num_random_layers > 0 else self.inputs_shape
+        self.linear_last_layer = nn.Linear(size, self.output_size)
 
     # for score
+    # x can have any batch shape, (..., inputs_shape) -> (..., 1)
     def forward(self, x):
-        assert x.shape == (1, self.inputs_shape)
+        assert x.shape[-1] == self.inputs_shape
 
         # go through random layers first
-        for i in range(self.num_random_layers):
-            x = self.random_layers[i](x)
+        x = self.forward_random_layers(x)
 
         output = self.linear_last_layer(x)
 
-        assert output.shape == (1,1)
+        assert output.shape == x.shape[:-1] + (self.output_size,)
         return output
 
-    # TODO: add bias for the layers too
-    def random_layers_init(self, elm_sparsity=0.0):
-        for _ in range(self.num_random_layers):
-            random_layer = nn.ReLU()
-            # give random weights
-            rand_weights = torch.randn(self.inputs_shape)
+    # features fed to the last layer, these never change during training
+    def forward_random_layers(self, x):
+        for random_layer in self.random_layers:
+            x = random_layer(x)
 
-            if elm_sparsity != 0.0:
-                # set some to zero
-                num_of_indices = round(self.inputs_shape * elm_sparsity)
-                indexes_to_zero = sample(range(0, self.inputs_shape - 1), num_of_indices)
-                for index in indexes_to_zero:
-                    rand_weights[index] = 0.0
+        return x
 
-            random_layer.weight = nn.Parameter(rand_weights, requires_grad=False)
-
-            # freeze weights
-            random_layer.requires_grad_(False)
-
-            self.random_layers.append(random_layer)
+    def random_layers_init(self):
+        for i in range(self.num_random_layers):
+            if not self.random_projection:
+                # models saved before the random projections were added only apply relu
+                self.random_layers.append(nn.ReLU())
+                continue
+
+            in_features = self.inputs_shape if i == 0 else self.hidden_size
+            self.random_layers.append(ELMRandomLayer(in_features,
+                                                     self.hidden_size,
+                                                     elm_sparsity=self.elm_sparsity,
+                                                     seed=self.seed + i))
+
+    # everything needed to regenerate the random layers
+    def get_elm_config(self):
+        return {
+            "inputs-shape": self.inputs_shape,
+            "num-random-layers": self.num_random_layers,
+            "elm-sparsity": self.elm_sparsity,
+            "hidden-size": self.hidden_size,
+            "seed": self.seed,
+            "random-projection": self.random_projection,
+        }
 
 
 class ABRankingELMModel:
-    def __init__(self, inputs_shape, num_random_layers=1, elm_sparsity=0.5):
+    def __init__(self, inputs_shape, num_random_layers=1, elm_sparsity=0.5, hidden_size=None, seed=None):
         print("inputs_shape=", inputs_shape)
         if torch.cuda.is_available():
             device = 'cuda'
@@ -75,7 +159,11 @@ class ABRankingELMModel:
             device = 'cpu'
         self._device = torch.device(device)
 
-        self.model = ABRankingELMBaseModel(inputs_shape, num_random_layers, elm_sparsity).to(self._device)
+        self.model = ABRankingELMBaseModel(inputs_shape,
+                                           num_random_layers,
+                                           elm_sparsity,
+                                           hidden_size=hidden_size,
+                                           seed=seed).to(self._device)
         self.model_type = 'ab-ranking-elm-v1'
         self.loss_func_name = ''
         self.file_path = ''
@@ -100,6 +188,8 @@ class ABRankingELMModel:
         # Preparing the model to be saved
         model = {}
         model['model_dict'] = self.model.state_dict()
+        # the random layers are regenerated from this on load
+        model['elm-config'] = self.model.get_elm_config()
         # Adding metadata
         model['model-type'] = self.model_type
         model['file-path'] = self.file_path
@@ -122,6 +212,21 @@ class ABRankingELMModel:
         self.file_path = model['file-path']
         self.model_hash = model['model-hash']
         self.date = model['date']
+
+        # rebuild the random layers, the model file only has the last layer
+        elm_config = model.get('elm-config')
+        if elm_config is not None:
+            self.model = ABRankingELMBaseModel(elm_config['inputs-shape'],
+                                               elm_config['num-random-layers'],
+                                               elm_config['elm-sparsity'],
+                                               hidden_size=elm_config['hidden-size'],
+                                               seed=elm_config['seed'],
+                                               random_projection=elm_config['random-projection']).to(self._device)
+        else:
+            self.model = ABRankingELMBaseModel(self.model.inputs_shape,
+                                               self.model.num_random_layers,
+                                               random_projection=False).to(self._device)
+
         self.model.load_state_dict(model['model_dict'])
 
     def train(self,
@@ -170,9 +275,9 @@ class ABRankingELMModel:
                         num_data_to_get, self._device)
 
                     if debug_asserts:
-                        assert batch_features_x_orig.shape == (training_batch_size, self.model.inputs_shape)
-                        assert batch_features_y_orig.shape == (training_batch_size, self.model.inputs_shape)
-                        assert batch_targets_orig.shape == (training_batch_size, 1)
+                        assert batch_features_x_orig.shape == (num_data_to_get, self.model.inputs_shape)
+                        assert batch_features_y_orig.shape == (num_data_to_get, self.model.inputs_shape)
+                        assert batch_targets_orig.shape == (num_data_to_get, 1)
 
                     batch_features_x = batch_features_x_orig.clone().requires_grad_(True).to(self._device)
                     batch_features_y = batch_features_y_orig.clone().requires_grad_(True).to(self._device)
@@ -194,10 +299,10 @@ class ABRankingELMModel:
                     loss = self.model.l1_loss(batch_pred_probabilities, batch_targets)
 
                     if add_loss_penalty:
-                        # add loss penalty
+                        # add loss penalty, averaged over the batch
                         neg_score = torch.multiply(predicted_score_images_x, -1.0)
                         negative_score_loss_penalty = torch.relu(neg_score)
-                        loss = torch.add(loss, negative_score_loss_penalty)
+                        loss = torch.add(loss, torch.mean(negative_score_loss_penalty))
 
                     loss.backward()
                     optimizer.step()
@@ -218,35 +323,25 @@ class ABRankingELMModel:
                 dataset_loader.current_training_data_index = 0
 
             # Calculate Validation Loss
+            # the whole validation set goes through the model as one batch
             with torch.no_grad():
-                for i in range(len(validation_features_x)):
-                    validation_feature_x = validation_features_x[i]
-                    validation_feature_x = validation_feature_x.unsqueeze(0)
-                    validation_feature_y = validation_features_y[i]
-                    validation_feature_y = validation_feature_y.unsqueeze(0)
+                predicted_score_images_x = self.model.forward(validation_features_x)
+                predicted_score_images_y = self.model.forward(validation_features_y)
 
-                    validation_target = validation_targets[i]
-                    validation_target = validation_target.unsqueeze(0)
-
-                    predicted_score_image_x = self.model.forward(validation_feature_x)
-                    with torch.no_grad():
-                        predicted_score_image_y = self.model.forward(validation_feature_y)
+                validation_pred_probabilities = forward_bradley_terry(predicted_score_images_x,
+                                                                      predicted_score_images_y)
 
-                    validation_pred_probabilities = forward_bradley_terry(predicted_score_image_x,
-                                                                          predicted_score_image_y)
+                if debug_asserts:
+                    assert validation_pred_probabilities.shape == validation_targets.shape
 
-                    if debug_asserts:
-                        assert validation_pred_probabilities.shape == validation_target.shape
+                # per sample l1 loss
+                validation_loss = torch.abs(torch.sub(validation_pred_probabilities, validation_targets))
 
-                    validation_loss = self.model.l1_loss(validation_pred_probabilities, validation_target)
-
-                    if add_loss_penalty:
-                        # add loss penalty
-                        neg_score = torch.multiply(predicted_score_image_x, -1.0)
-                        negative_score_loss_penalty = torch.relu(neg_score)
-                        validation_loss = torch.add(validation_loss, negative_score_loss_penalty)
-
-                    validation_loss_arr.append(validation_loss.detach().cpu())
+                if add_loss_penalty:
+                    # add loss penalty
+                    neg_score = torch.multiply(predicted_score_images_x, -1.0)
+                    negative_score_loss_penalty = torch.relu(neg_score)
+                    validation_loss = torch.add(validation_loss, negative_score_loss_penalty)
 
             # calculate epoch loss
             # epoch's training loss
@@ -255,8 +350,7 @@ class ABRankingELMModel:
                 epoch_training_loss = torch.mean(training_loss_arr)
 
             # epoch's validation loss
-            validation_loss_arr = torch.stack(validation_loss_arr)
-            epoch_validation_loss = torch.mean(validation_loss_arr)
+            epoch_validation_loss = torch.mean(validation_loss).detach().cpu()
 
             if epoch_training_loss is None:
                 epoch_training_loss = epoch_validation_loss
@@ -269,6 +363,153 @@ class ABRankingELMModel:
             self.validation_loss = epoch_validation_loss.detach().cpu()
 
         # Calculate model performance
+        training_predicted_score_images_x, \
+            training_predicted_score_images_y, \
+            training_predicted_probabilities, \
+            training_target_probabilities, \
+            validation_predicted_score_images_x, \
+            validation_predicted_score_images_y, \
+            validation_predicted_probabilities = self.get_performance_data(dataset_loader,
+                                                                           validation_features_x,
+                                                                           validation_features_y,
+                                                                           training_batch_size,
+                                                                           debug_asserts)
+
+        return training_predicted_score_images_x, \
+            training_predicted_score_images_y, \
+            training_predicted_probabilities, \
+            training_target_probabilities, \
+            validation_predicted_score_images_x, \
+            validation_predicted_score_images_y, \
+            validation_predicted_probabilities, \
+            validation_targets, \
+            training_loss_per_epoch, \
+            validation_loss_per_epoch
+
+    # fits the last layer without gradient descent
+    # the bradley terry logistic loss of the pair differences of the random layer features
+    # is minimized with ridge regularized irls steps, each step reads the training data once
+    # returns the same data as train(), with one loss per irls step instead of per epoch
+    def fit_closed_form(self,
+                        dataset_loader: ABRankingDatasetLoader,
+                        ridge_lambda=0.01,
+                        irls_steps=4,
+                        add_loss_penalty=True,
+                        training_batch_size=1024,
+                        debug_asserts=True):
+        training_loss_per_step = []
+        validation_loss_per_step = []
+
+        self.model_type = 'image-pair-ranking-elm-v1'
+        self.loss_func_name = "L1"
+
+        # get validation data
+        validation_features_x, \
+            validation_features_y, \
+            validation_targets = dataset_loader.get_validation_feature_vectors_and_target_linear(self._device)
+
+        num_features = dataset_loader.get_len_training_ab_data()
+        training_num_batches = math.ceil(num_features / training_batch_size)
+
+        with torch.no_grad():
+            # solve in float64, the normal equations are badly conditioned in float32
+            weight = torch.zeros(self.model.linear_last_layer.in_features, dtype=torch.float64, device=self._device)
+
+            for step in range(irls_steps + 1):
+                # one pass over the training data a batch at a time, so a streaming dataset
+                # loader only holds a few shards. the pass gives the loss and the bias of the
+                # current weight, and the normal equations of the next irls step.
+                # step 0 reports the losses of the zero weight model
+                hessian = None
+                gradient_term = None
+                training_loss_sum = 0.0
+                min_score = math.inf
+                dataset_loader.current_training_data_index = 0
+                for i in range(training_num_batches):
+                    num_data_to_get = training_batch_size
+                    if i == training_num_batches - 1:
+                        num_data_to_get = num_features - (i * training_batch_size)
+
+                    batch_features_x, \
+                        batch_features_y, \
+                        batch_targets = dataset_loader.get_next_training_feature_vectors_and_target_linear(
+                        num_data_to_get, self._device)
+
+                    if debug_asserts:
+                        assert batch_features_x.shape == (num_data_to_get, self.model.inputs_shape)
+                        assert batch_targets.shape == (num_data_to_get, 1)
+
+                    hidden_x = self.model.forward_random_layers(batch_features_x).double()
+                    hidden_y = self.model.forward_random_layers(batch_features_y).double()
+                    diff = get_bradley_terry_pair_differences(hidden_x, hidden_y)
+
+                    batch_hessian, \
+                        batch_gradient_term, \
+                        batch_probabilities = get_bradley_terry_irls_terms(diff, batch_targets, weight)
+                    hessian = batch_hessian if hessian is None else hessian + batch_hessian
+                    gradient_term = batch_gradient_term if gradient_term is None else gradient_term + batch_gradient_term
+
+                    # the bias makes every training x score non negative, so with add_loss_penalty
+                    # the penalty of the training loss is zero and the loss does not depend on the bias
+                    training_loss_sum += torch.sum(torch.abs(batch_probabilities - batch_targets.reshape(-1))).item()
+                    min_score = min(min_score, torch.min(torch.matmul(hidden_x, weight)).item())
+
+                dataset_loader.current_training_data_index = 0
+
+                set_last_layer(self.model, weight, add_loss_penalty=add_loss_penalty, min_score=min_score)
+                training_loss = torch.tensor(training_loss_sum / num_features)
+                validation_loss = get_l1_loss(self.model,
+                                              validation_features_x,
+                                              validation_features_y,
+                                              validation_targets,
+                                              add_loss_penalty)
+
+                print(f"IRLS step {step}/{irls_steps} | Loss: {training_loss:.4f} | Validation Loss: {validation_loss:.4f}")
+                training_loss_per_step.append(training_loss)
+                validation_loss_per_step.append(validation_loss)
+
+                if step != irls_steps:
+                    weight = solve_bradley_terry_irls(hessian, gradient_term, ridge_lambda)
+
+            self.training_loss = training_loss
+            self.validation_loss = validation_loss
+
+        # Calculate model performance
+        training_predicted_score_images_x, \
+            training_predicted_score_images_y, \
+            training_predicted_probabilities, \
+            training_target_probabilities, \
+            validation_predicted_score_images_x, \
+            validation_predicted_score_images_y, \
+            validation_predicted_probabilities = self.get_performance_data(dataset_loader,
+                                                                           validation_features_x,
+                                                                           validation_features_y,
+                                                                           training_batch_size,
+                                                                           debug_asserts)
+
+        return training_predicted_score_images_x, \
+            training_predicted_score_images_y, \
+            training_predicted_probabilities, \
+            training_target_probabilities, \
+            validation_predicted_score_images_x, \
+            validation_predicted_score_images_y, \
+            validation_predicted_probabilities, \
+            validation_targets, \
+            training_loss_per_step, \
+            validation_loss_per_step
+
+    # scores and probabilities of the training and validation data, used by the reports
+    # training data is read from the start of the dataset loader in batches
+    def get_performance_data(self,
+                             dataset_loader: ABRankingDatasetLoader,
+                             validation_features_x,
+                             validation_features_y,
+                             training_batch_size=1,
+                             debug_asserts=True):
+        num_features = dataset_loader.get_len_training_ab_data()
+        training_num_batches = math.ceil(num_features / training_batch_size)
+        dataset_loader.current_training_data_index = 0
+
         with torch.no_grad():
             training_predicted_score_images_x = []
             training_predicted_score_images_y = []
@@ -295,37 +536,29 @@ class ABRankingELMModel:
                     # assert pred(x,y) = 1- pred(y,x)
                     batch_pred_probabilities_inverse = forward_bradley_terry(batch_predicted_score_images_y,
                                                                                   batch_predicted_score_images_x)
-                    tensor_ones = torch.tensor([1.0] * len(batch_pred_probabilities_inverse)).to(self._device)
-                    assert torch.allclose(batch_pred_probabilities, torch.subtract(tensor_ones, batch_pred_probabilities_inverse), atol=1e-05)
+                    assert torch.allclose(batch_pred_probabilities, 1.0 - batch_pred_probabilities_inverse, atol=1e-05)
 
                 training_predicted_score_images_x.extend(batch_predicted_score_images_x)
                 training_predicted_score_images_y.extend(batch_predicted_score_images_y)
                 training_predicted_probabilities.extend(batch_pred_probabilities)
                 training_target_probabilities.extend(batch_targets)
 
+            dataset_loader.current_training_data_index = 0
+
             # validation
-            validation_predicted_score_images_x = []
-            validation_predicted_score_images_y = []
-            validation_predicted_probabilities = []
-            for i in range(len(validation_features_x)):
-                validation_feature_x = validation_features_x[i]
-                validation_feature_x = validation_feature_x.unsqueeze(0)
-                validation_feature_y = validation_features_y[i]
-                validation_feature_y = validation_feature_y.unsqueeze(0)
-
-                predicted_score_image_x = self.model.forward(validation_feature_x)
-                predicted_score_image_y = self.model.forward(validation_feature_y)
-                pred_probability = forward_bradley_terry(predicted_score_image_x, predicted_score_image_y)
+            predicted_score_images_x = self.model.forward(validation_features_x)
+            predicted_score_images_y = self.model.forward(validation_features_y)
+            pred_probabilities = forward_bradley_terry(predicted_score_images_x, predicted_score_images_y)
 
-                if debug_asserts:
-                    # assert pred(x,y) = 1- pred(y,x)
-                    pred_probability_inverse = forward_bradley_terry(predicted_score_image_y, predicted_score_image_x)
-                    tensor_ones = torch.tensor([1.0] * len(pred_probability_inverse)).to(self._device)
-                    assert torch.allclose(pred_probability, torch.subtract(tensor_ones, pred_probability_inverse), atol=1e-05)
+            if debug_asserts:
+                # assert pred(x,y) = 1- pred(y,x)
+                pred_probabilities_inverse = forward_bradley_terry(predicted_score_images_y, predicted_score_images_x)
+                assert torch.allclose(pred_probabilities, 1.0 - pred_probabilities_inverse, atol=1e-05)
 
-                validation_predicted_score_images_x.append(predicted_score_image_x)
-                validation_predicted_score_images_y.append(predicted_score_image_y)
-                validation_predicted_probabilities.append(pred_probability)
+            # keep the per sample (1, 1) shape of the reports
+            validation_predicted_score_images_x = list(predicted_score_images_x.unsqueeze(1))
+            validation_predicted_score_images_y = list(predicted_score_images_y.unsqueeze(1))
+            validation_predicted_probabilities = list(pred_probabilities.unsqueeze(1))
 
         return training_predicted_score_images_x, \
             training_predicted_score_images_y, \
@@ -333,10 +566,7 @@ class ABRankingELMModel:
             training_target_probabilities, \
             validation_predicted_score_images_x, \
             validation_predicted_score_images_y, \
-            validation_predicted_probabilities, \
-            validation_targets, \
-            training_loss_per_epoch, \
-            validation_loss_per_epoch
+            validation_predicted_probabilities
 
     def predict(self, positive_input, negative_input):
         # get rid of the 1 dimension at start
@@ -406,3 +636,82 @@ def forward_bradley_terry(predicted_score_images_x, predicted_score_images_y, us
         pred_probabilities = torch.div(predicted_score_images_x, sum_predicted_score)
 
     return pred_probabilities
+
+
+
+# pair difference features of the bradley terry logistic loss, same scaling as forward_bradley_terry
+# the last layer bias cancels in the differences
+def get_bradley_terry_pair_differences(hidden_x, hidden_y):
+    return torch.div(torch.sub(hidden_x, hidden_y), 50.0)
+
+
+# terms of the irls normal equations of the pair differences at weight, D^T W D and
+# D^T (W D w + t - p), and the probabilities p. the terms of batches of pairs add up
+def get_bradley_terry_irls_terms(diff, targets, weight):
+    targets = targets.reshape(-1).to(diff.dtype)
+
+    logits = torch.matmul(diff, weight)
+    probabilities = torch.sigmoid(logits)
+    irls_weights = torch.clamp(probabilities * (1.0 - probabilities), min=1e-6)
+
+    hessian = torch.matmul(diff.t(), diff * irls_weights.unsqueeze(1))
+    gradient_term = torch.matmul(diff.t(), irls_weights * logits + targets - probabilities)
+
+    return hessian, gradient_term, probabilities
+
+
+def solve_bradley_terry_irls(hessian, gradient_term, ridge_lambda=0.01):
+    hessian = hessian.clone()
+    hessian.diagonal().add_(ridge_lambda)
+
+    return torch.linalg.solve(hessian, gradient_term)
+
+
+# one ridge regularized irls (newton) step of the logistic loss of the pair differences
+# (D^T W D + lambda I) w = D^T (W D w + t - p)
+# from zero weights this is the ridge least squares solution
+def get_bradley_terry_irls_step(diff, targets, weight, ridge_lambda=0.01):
+    hessian, gradient_term, _ = get_bradley_terry_irls_terms(diff, targets, weight)
+
+    return solve_bradley_terry_irls(hessian, gradient_term, ridge_lambda)
+
+
+# last layer weight of the random layer features, solve in float64 since
+# the normal equations are badly conditioned in float32
+def fit_bradley_terry_irls(hidden_x, hidden_y, targets, ridge_lambda=0.01, irls_steps=4):
+    diff = get_bradley_terry_pair_differences(hidden_x.double(), hidden_y.double())
+    weight = torch.zeros(diff.shape[1], dtype=diff.dtype, device=diff.device)
+
+    for _ in range(irls_steps):
+        weight = get_bradley_terry_irls_step(diff, targets, weight, ridge_lambda)
+
+    return weight
+
+
+# with add_loss_penalty the bias is the smallest value that makes every training x score non negative
+# min_score is the lowest training x score without bias, computed from hidden_x when not given
+def set_last_layer(model: ABRankingELMBaseModel, weight, hidden_x=None, add_loss_penalty=True, min_score=None):
+    bias = 0.0
+    if add_loss_penalty:
+        if min_score is None:
+            min_score = torch.min(torch.matmul(hidden_x.to(weight.dtype), weight)).item()
+        bias = max(0.0, -min_score)
+
+    layer = model.linear_last_layer
+    with torch.no_grad():
+        layer.weight.copy_(weight.to(layer.weight.dtype).unsqueeze(0))
+        layer.bias.fill_(bias)
+
+
+# same loss as the validation loss of ABRankingELMModel.train
+def get_l1_loss(model: ABRankingELMBaseModel, features_x, features_y, targets, add_loss_penalty=True):
+    with torch.no_grad():
+        predicted_score_images_x = model.forward(features_x)
+        predicted_score_images_y = model.forward(features_y)
+        pred_probabilities = forward_bradley_terry(predicted_score_images_x, predicted_score_images_y)
+
+        loss = torch.abs(torch.sub(pred_probabilities, targets))
+        if add_loss_penalty:
+            loss = torch.add(loss, torch.relu(torch.multiply(predicted_score_images_x, -1.0)))
+
+    return torch.mean(loss).detach().cpu()
@@ -17,4 +17,15 @@ EMBEDDING = "embedding"
 EMBEDDING_POSITIVE = "embedding-positive"
 EMBEDDING_NEGATIVE = "embedding-negative"
 CLIP = "clip"
-ALLOWED_INPUT_TYPES = [EMBEDDING, EMBEDDING_POSITIVE, EMBEDDING_NEGATIVE, CLIP]
\ No newline at end of file
+ALLOWED_INPUT_TYPES = [EMBEDDING, EMBEDDING_POSITIVE, EMBEDDING_NEGATIVE, CLIP]
+
+# ELM fit methods
+ELM_FIT_GRADIENT = "gradient"
+ELM_FIT_CLOSED_FORM = "closed-form"
+ALLOWED_ELM_FIT_METHODS = [ELM_FIT_GRADIENT, ELM_FIT_CLOSED_FORM]
+
+# Training precisions
+PRECISION_FP32 = "fp32"
+PRECISION_BF16 = "bf16"
+PRECISION_FP16 = "fp16"
+ALLOWED_PRECISIONS = [PRECISION_FP32, PRECISION_BF16, PRECISION_FP16]
@@ -0,0 +1,145 @@
+import os
+import json
+import hashlib
+import threading
+import numpy as np
+
+from training_worker.ab_ranking.model import constants
+
+
+# pooled features vector of one image, same result as the pooling of the linear feature vector functions
+# of the dataset loader, so the pooled vector can stand in for the raw (2, 77, 768) embedding
+def pool_features_vector(features_vector, pooling_strategy):
+    features_vector = np.asarray(features_vector, dtype=np.float32)
+
+    if pooling_strategy == constants.AVERAGE_POOLING:
+        return np.mean(features_vector, axis=-2, keepdims=True)
+    if pooling_strategy == constants.MAX_POOLING:
+        return np.max(features_vector, axis=-2, keepdims=True)
+    if pooling_strategy == constants.MAX_ABS_POOLING:
+        max_abs_indices = np.argmax(np.abs(features_vector), axis=-2)
+        return np.take_along_axis(features_vector, np.expand_dims(max_abs_indices, axis=-2), axis=-2)
+
+    raise Exception("pooling strategy is not supported: {}".format(pooling_strategy))
+
+
+# identifies the set of aggregated selection datapoint files a snapshot was built from
+def get_watermark(datapoint_paths):
+    hasher = hashlib.sha256()
+    for path in sorted(datapoint_paths):
+        hasher.update(path.encode())
+        hasher.update(b"\n")
+
+    return hasher.hexdigest()
+
+
+# local copy of a dataset's selection datapoints and pooled image features
+# datapoints are keyed by their aggregated file path and features by image hash,
+# so a new run only fetches the datapoints and images that are not in the snapshot yet
+class DatasetSnapshot:
+    def __init__(self, snapshot_dir, dataset_name, input_type, pooling_strategy):
+        self.directory = os.path.join(snapshot_dir, dataset_name, "{}-{}".format(input_type, pooling_strategy))
+        self.input_type = input_type
+        self.pooling_strategy = pooling_strategy
+
+        # aggregated datapoint path -> ab data fields
+        self.datapoints = {}
+        # image hash -> pooled features vector
+        self.features = {}
+        self.watermark = None
+        self.is_dirty = False
+        self.lock = threading.Lock()
+
+    def get_manifest_path(self):
+        return os.path.join(self.directory, "manifest.json")
+
+    def load(self):
+        manifest_path = self.get_manifest_path()
+        if not os.path.exists(manifest_path):
+            print("No dataset snapshot found in {}".format(self.directory))
+            return
+
+        with open(manifest_path, "r") as f:
+            manifest = json.load(f)
+
+        self.watermark = manifest["watermark"]
+        self.datapoints = manifest["datapoints"]
+
+        features_data = np.load(os.path.join(self.directory, manifest["features-file"]))
+        self.features = dict(zip(features_data["image-hash"].tolist(), features_data["features"]))
+
+        print("Loaded dataset snapshot with {} datapoints and {} image features".format(len(self.datapoints),
+                                                                                        len(self.features)))
+
+    def save(self):
+        with self.lock:
+            if not self.is_dirty:
+                return
+
+            # drop features of images that are no longer in any datapoint
+            referenced_image_hashes = set()
+            for ab_data_fields in self.datapoints.values():
+                referenced_image_hashes.add(ab_data_fields["hash_image_1"])
+                referenced_image_hashes.add(ab_data_fields["hash_image_2"])
+            image_hashes = [image_hash for image_hash in self.features if image_hash in referenced_image_hashes]
+            features = np.stack([self.features[image_hash] for image_hash in image_hashes]) \
+                if len(image_hashes) != 0 else np.zeros((0,), dtype=np.float32)
+            datapoints = dict(self.datapoints)
+            self.is_dirty = False
+
+        os.makedirs(self.directory, exist_ok=True)
+        self.watermark = get_watermark(datapoints.keys())
+
+        # write under new names then swap the manifest, so an interrupted save keeps the old snapshot
+        features_file = "features-{}.npz".format(self.watermark[:16])
+        features_tmp_path = os.path.join(self.directory, features_file + ".tmp")
+        with open(features_tmp_path, "wb") as f:
+            np.savez(f, **{"image-hash": np.asarray(image_hashes, dtype=str), "features": features})
+        os.replace(features_tmp_path, os.path.join(self.directory, features_file))
+
+        manifest = {
+            "watermark": self.watermark,
+            "input-type": self.input_type,
+            "pooling-strategy": self.pooling_strategy,
+            "features-file": features_file,
+            "datapoints": datapoints,
+        }
+        manifest_tmp_path = self.get_manifest_path() + ".tmp"
+        with open(manifest_tmp_path, "w") as f:
+            json.dump(manifest, f)
+        os.replace(manifest_tmp_path, self.get_manifest_path())
+
+        # remove features files of older snapshots
+        for file_name in os.listdir(self.directory):
+            if file_name.startswith("features-") and file_name != features_file:
+                os.remove(os.path.join(self.directory, file_name))
+
+        print("Saved dataset snapshot with {} datapoints and {} image features".format(len(datapoints),
+                                                                                       len(image_hashes)))
+
+    def get_datapoint(self, path):
+        return self.datapoints.get(path)
+
+    def add_datapoint(self, path, ab_data_fields):
+        with self.lock:
+            self.datapoints[path] = ab_data_fields
+            self.is_dirty = True
+
+    # keep only the datapoints that are still in the dataset
+    def retain_datapoints(self, paths):
+        paths = set(paths)
+        with self.lock:
+            removed_paths = [path for path in self.datapoints if path not in paths]
+            for path in removed_paths:
+                del self.datapoints[path]
+
+            if len(removed_paths) != 0:
+                self.is_dirty = True
+
+    def get_features(self, image_hash):
+        return self.features.get(image_hash)
+
+    def add_features(self, image_hash, features_vector):
+        with self.lock:
+            self.features[image_hash] = features_vector
+            self.is_dirty = True
@@ -1,11 +1,15 @@
 import os
 import sys
+import numpy as np
+import torch
+from io import BytesIO
 from tqdm import tqdm
 from concurrent.futures import ThreadPoolExecutor, as_completed
 base_directory = os.getcwd()
 sys.path.insert(0, base_directory)
 
 from training_worker.http import request
+from utility.minio import cmd
 
 
 def add_model_card(model_card):
@@ -14,6 +18,113 @@ def add_model_card(model_card):
     return int(model_id)
 
 
+# values can be a tensor, an array, or a list of per sample tensors, which may be on the gpu
+def to_flat_array(values, dtype=np.float64):
+    if isinstance(values, (list, tuple)) and len(values) > 0 and isinstance(values[0], torch.Tensor):
+        values = torch.cat([value.detach().reshape(-1) for value in values])
+    if isinstance(values, torch.Tensor):
+        values = values.detach().cpu().numpy()
+
+    return np.asarray(values, dtype=dtype).reshape(-1)
+
+
+# percentile of each value as the fraction of values strictly smaller than it,
+# so tied values get the same percentile and untied values get i / len like a plain sort
+def get_percentiles(values):
+    values = to_flat_array(values)
+    if len(values) == 0:
+        return values
+
+    sorted_values = np.sort(values)
+    ranks = np.searchsorted(sorted_values, values, side="left")
+
+    return ranks / len(values)
+
+
+# image hash, score, residual and their percentiles of the selected images (target 1.0),
+# in chronological order of the selection datapoints
+def get_score_residual_columns(train_prob_predictions,
+                               training_targets,
+                               validation_prob_predictions,
+                               validation_targets,
+                               training_pred_scores_img_x,
+                               validation_pred_scores_img_x,
+                               training_image_hashes,
+                               validation_image_hashes,
+                               training_shuffled_indices_origin,
+                               validation_shuffled_indices_origin):
+    image_hashes = []
+    scores = []
+    residuals = []
+    chronological_indices = []
+    is_validation = []
+    for split_is_validation, prob_predictions, targets, pred_scores_img_x, split_image_hashes, indices_origin in [
+        (False, train_prob_predictions, training_targets, training_pred_scores_img_x, training_image_hashes,
+         training_shuffled_indices_origin),
+        (True, validation_prob_predictions, validation_targets, validation_pred_scores_img_x, validation_image_hashes,
+         validation_shuffled_indices_origin)]:
+        selected = to_flat_array(targets) == 1.0
+
+        image_hashes.append(np.asarray(split_image_hashes, dtype=str)[selected])
+        scores.append(to_flat_array(pred_scores_img_x)[selected])
+        residuals.append(np.abs(1.0 - to_flat_array(prob_predictions)[selected]))
+        chronological_indices.append(to_flat_array(indices_origin, dtype=np.int64)[selected])
+        is_validation.append(np.full(int(np.sum(selected)), split_is_validation))
+
+    chronological_indices = np.concatenate(chronological_indices)
+    order = np.argsort(chronological_indices, kind="stable")
+
+    scores = np.concatenate(scores)[order]
+    residuals = np.concatenate(residuals)[order]
+
+    return {
+        "image-hash": np.concatenate(image_hashes)[order],
+        "score": scores,
+        "score-percentile": get_percentiles(scores),
+        "residual": residuals,
+        "residual-percentile": get_percentiles(residuals),
+        "chronological-index": chronological_indices[order],
+        "is-validation": np.concatenate(is_validation)[order],
+    }
+
+
+def get_score_residual_path(output_path, model_id):
+    return os.path.join(output_path, "score-residual", "{}.npz".format(model_id))
+
+
+# writes the columns of get_score_residual_columns as a single .npz object
+def upload_score_residual_columns(minio_client,
+                                  bucket_name,
+                                  output_path,
+                                  model_id: int,
+                                  columns):
+    print("Uploading score and residual columns...")
+    buffer = BytesIO()
+    np.savez_compressed(buffer, model_id=np.int64(model_id), **columns)
+    buffer.seek(0)
+
+    score_residual_path = get_score_residual_path(output_path, model_id)
+    cmd.upload_data(minio_client, bucket_name, score_residual_path, buffer)
+
+    return score_residual_path
+
+
+# adds the score, residual and residual percentile of every image in the columns of
+# get_score_residual_columns with a single request
+def upload_score_residual_bulk(model_id: int, columns):
+    print("Uploading scores and residuals...")
+    score_residual_data = {
+        "model_id": model_id,
+        "image_hashes": columns["image-hash"].tolist(),
+        "scores": columns["score"].tolist(),
+        "residuals": columns["residual"].tolist(),
+        "residual_percentiles": columns["residual-percentile"].tolist(),
+    }
+
+    request.http_add_score_residual_columns(score_residual_data)
+
+
+# per image requests, for orchestration servers without the bulk endpoint
 def upload_score_residual(model_id: int,
                           train_prob_predictions,
                           training_targets,
@@ -25,130 +136,54 @@ def upload_score_residual(model_id: int,
                           validation_image_hashes,
                           training_shuffled_indices_origin,
                           validation_shuffled_indices_origin):
+    columns = get_score_residual_columns(train_prob_predictions,
+                                         training_targets,
+                                         validation_prob_predictions,
+                                         validation_targets,
+                                         training_pred_scores_img_x,
+                                         validation_pred_scores_img_x,
+                                         training_image_hashes,
+                                         validation_image_hashes,
+                                         training_shuffled_indices_origin,
+                                         validation_shuffled_indices_origin)
+    upload_score_residual_entries(model_id, columns)
+
+
+# adds the score, residual and residual percentile of each image in the columns of get_score_residual_columns
+def upload_score_residual_entries(model_id: int, columns):
     print("Uploading scores and residuals...")
+    image_hashes = columns["image-hash"].tolist()
+    scores = columns["score"].tolist()
+    residuals = columns["residual"].tolist()
+    residual_percentiles = columns["residual-percentile"].tolist()
 
-    # chronological_pred_scores_img_x_target_0 = [None] * int(
-    #     (len(training_pred_scores_img_x) + len(validation_pred_scores_img_x)) / 2)
-    #
-    # count = 0
-    # for score in training_pred_scores_img_x:
-    #     if training_targets[count] == [0.0]:
-    #         chronological_pred_scores_img_x_target_0[training_shuffled_indices_origin[count]] = score.item()
-    #     else:
-    #         chronological_pred_scores_img_x_target_1[training_shuffled_indices_origin[count]] = score.item()
-    #     count += 1
-    # count = 0
-    #
-    # for score in validation_pred_scores_img_x:
-    #     if validation_targets[count] == [0.0]:
-    #         chronological_pred_scores_img_x_target_0[validation_shuffled_indices_origin[count]] = score.item()
-    #     else:
-    #         chronological_pred_scores_img_x_target_1[validation_shuffled_indices_origin[count]] = score.item()
-    #     count += 1
-    chronological_residuals = [None] * int(len(training_targets) + len(validation_targets))
-    chronological_image_hashes = [None] * int(len(training_targets) + len(validation_targets))
-
-    print("From training datapoints...")
-    # training
-    with ThreadPoolExecutor(max_workers=10) as executor:
-        futures = []
-
-        count = 0
-        for i in range(len(training_targets)):
-            if training_targets[i] == [1.0]:
-                img_hash = training_image_hashes[i]
-                img_score = training_pred_scores_img_x[i].item()
-                img_residual = abs(1.0 - train_prob_predictions[i].item())
-
-                chronological_index = training_shuffled_indices_origin[count]
-                chronological_residuals[chronological_index] = img_residual
-                chronological_image_hashes[chronological_index] = img_hash
-
-                # upload score
-                score_data = {
-                    "model_id": model_id,
-                    "image_hash": img_hash,
-                    "score": img_score,
-                }
-
-                # upload residual
-                residual_data = {
-                    "model_id": model_id,
-                    "image_hash": img_hash,
-                    "residual": img_residual,
-                }
-
-                futures.append(executor.submit(request.http_add_score, score_data=score_data))
-                futures.append(executor.submit(request.http_add_residual, residual_data=residual_data))
-            count += 1
-
-        for _ in tqdm(as_completed(futures), total=len(futures)):
-            continue
-
-    print("From validation datapoints...")
-    # validation
     with ThreadPoolExecutor(max_workers=10) as executor:
         futures = []
 
-        count = 0
-        for i in tqdm(range(len(validation_targets))):
-            if validation_targets[i] == [1.0]:
-                img_hash = validation_image_hashes[i]
-                img_score = validation_pred_scores_img_x[i].item()
-                img_residual = abs(1.0 - validation_prob_predictions[i].item())
-
-                chronological_index = validation_shuffled_indices_origin[count]
-                chronological_residuals[chronological_index] = img_residual
-                chronological_image_hashes[chronological_index] = img_hash
-
-                # upload score
-                score_data = {
-                    "model_id": model_id,
-                    "image_hash": img_hash,
-                    "score": img_score,
-                }
-
-                # upload residual
-                residual_data = {
-                    "model_id": model_id,
-                    "image_hash": img_hash,
-                    "residual": img_residual,
-                }
-
-                futures.append(executor.submit(request.http_add_score, score_data=score_data))
-                futures.append(executor.submit(request.http_add_residual, residual_data=residual_data))
-            count += 1
-
-        for _ in tqdm(as_completed(futures), total=len(futures)):
-            continue
-
-    print("Process residual percentiles...")
-    hash_residual_pairs = []
-    # remove None items
-    for i in range(len(chronological_residuals)):
-        if chronological_residuals[i] != None:
-            hash_residual_pairs.append((chronological_image_hashes[i], chronological_residuals[i]))
-
-    hash_residual_percentile_dict = {}
-    hash_residual_pairs.sort(key=lambda a: a[1])
-
-    len_hash_scores = len(hash_residual_pairs)
-    for i in range(len_hash_scores):
-        percentile = i / len_hash_scores
-        hash_residual_percentile_dict[hash_residual_pairs[i][0]] = percentile
-
-    # upload residual percentile
-    with ThreadPoolExecutor(max_workers=10) as executor:
-        futures = []
-
-        for img_hash, residual_percentile in hash_residual_percentile_dict.items():
+        for img_hash, img_score, img_residual, residual_percentile in zip(image_hashes,
+                                                                          scores,
+                                                                          residuals,
+                                                                          residual_percentiles):
+            score_data = {
+                "model_id": model_id,
+                "image_hash": img_hash,
+                "score": img_score,
+            }
+            residual_data = {
+                "model_id": model_id,
+                "image_hash": img_hash,
+                "residual": img_residual,
+            }
             residual_percentile_data = {
                 "model_id": model_id,
                 "image_hash": img_hash,
                 "residual_percentile": residual_percentile,
             }
 
-            futures.append(executor.submit(request.http_add_residual_percentile, residual_percentile_data=residual_percentile_data))
+            futures.append(executor.submit(request.http_add_score, score_data=score_data))
+            futures.append(executor.submit(request.http_add_residual, residual_data=residual_data))
+            futures.append(executor.submit(request.http_add_residual_percentile,
+                                           residual_percentile_data=residual_percentile_data))
 
         for _ in tqdm(as_completed(futures), total=len(futures)):
             continue
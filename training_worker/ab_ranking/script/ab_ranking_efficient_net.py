@@ -30,7 +30,10 @@ def train_ranking(dataset_name: str,
                   load_data_to_ram=False,
                   debug_asserts=False,
                   normalize_vectors=False,
-                  pooling_strategy=constants.AVERAGE_POOLING):
+                  pooling_strategy=constants.AVERAGE_POOLING,
+                  num_workers=2,
+                  precision=constants.PRECISION_FP32,
+                  channels_last=False):
     date_now = datetime.now(tz=timezone("Asia/Hong_Kong")).strftime('%Y-%m-%d')
     print("Current datetime: {}".format(datetime.now(tz=timezone("Asia/Hong_Kong"))))
     bucket_name = "datasets"
@@ -78,7 +81,10 @@ def train_ranking(dataset_name: str,
                                                     epochs=epochs,
                                                     learning_rate=learning_rate,
                                                     weight_decay=weight_decay,
-                                                   debug_asserts=debug_asserts)
+                                                    debug_asserts=debug_asserts,
+                                                    num_workers=num_workers,
+                                                    precision=precision,
+                                                    channels_last=channels_last)
 
     # Upload model to minio
     model_name = "{}.pth".format(date_now)
@@ -220,7 +226,8 @@ def run_ab_ranking_efficient_net_task(training_task, minio_access_key, minio_sec
     return model_output_path, report_output_path, graph_output_path
 
 
-def test_run(minio_ip_addr,minio_access_key,minio_secret_key,batch_size,epochs,lr):
+def test_run(minio_ip_addr,minio_access_key,minio_secret_key,batch_size,epochs,lr,num_workers=2,
+             precision=constants.PRECISION_FP32,channels_last=False):
     train_ranking(minio_ip_addr=minio_ip_addr,  # will use defualt if none is given
                   minio_access_key=minio_access_key,
                   minio_secret_key=minio_secret_key,
@@ -234,7 +241,10 @@ def test_run(minio_ip_addr,minio_access_key,minio_secret_key,batch_size,epochs,l
                   load_data_to_ram=True,
                   debug_asserts=True,
                   normalize_vectors=True,
-                  pooling_strategy=constants.MAX_POOLING)
+                  pooling_strategy=constants.MAX_POOLING,
+                  num_workers=num_workers,
+                  precision=precision,
+                  channels_last=channels_last)
 
 
 if __name__ == '__main__':
@@ -250,7 +260,14 @@ if __name__ == '__main__':
     parser.add_argument('--epochs', metavar='epochs', required=True,
                       help='number of epochs for training') 
     parser.add_argument('--lr', metavar='lr', required=True,
-                      help='learning rate for training')                                             
+                      help='learning rate for training')
+    parser.add_argument('--num-workers', metavar='num-workers', type=int, default=2,
+                      help='number of data loader worker processes')
+    parser.add_argument('--precision', metavar='precision', default=constants.PRECISION_FP32,
+                      choices=constants.ALLOWED_PRECISIONS, help='autocast precision for training')
+    parser.add_argument('--channels-last', action='store_true',
+                      help='use channels last memory format')
                                                              
     args = parser.parse_args()
-    test_run(args.minio_addr,args.minio_access_key,args.minio_secret_key,int(args.batch_size),int(args.epochs),float(args.lr))
+    test_run(args.minio_addr,args.minio_access_key,args.minio_secret_key,int(args.batch_size),int(args.epochs),float(args.lr),
+             args.num_workers,args.precision,args.channels_last)
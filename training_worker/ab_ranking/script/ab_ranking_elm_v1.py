@@ -16,7 +16,7 @@ from training_worker.ab_ranking.model.ab_ranking_data_loader import ABRankingDat
 from training_worker.ab_ranking.model.reports.get_model_card import get_model_card_buf
 from utility.minio import cmd
 from training_worker.ab_ranking.model import constants
-from training_worker.ab_ranking.model.reports import upload_score_residual
+from training_worker.ab_ranking.script.upload_utils import run_upload, add_model_card_and_upload_score_residual
 
 
 def train_ranking(dataset_name: str,
@@ -39,7 +39,15 @@ def train_ranking(dataset_name: str,
                   target_option=constants.TARGET_1_AND_0,
                   duplicate_flip_option=constants.DUPLICATE_AND_FLIP_ALL,
                   randomize_data_per_epoch=True,
-                  elm_sparsity=0.5):
+                  elm_sparsity=0.5,
+                  elm_hidden_size=None,
+                  fit_method=constants.ELM_FIT_GRADIENT,
+                  ridge_lambda=0.01,
+                  irls_steps=4,
+                  streaming_data=False,
+                  snapshot_dir=None,
+                  dataset_loader: ABRankingDatasetLoader = None,
+                  uploader=None):
     date_now = datetime.now(tz=timezone("Asia/Hong_Kong")).strftime('%Y-%m-%d')
     print("Current datetime: {}".format(datetime.now(tz=timezone("Asia/Hong_Kong"))))
     bucket_name = "datasets"
@@ -52,24 +60,30 @@ def train_ranking(dataset_name: str,
     if input_type not in constants.ALLOWED_INPUT_TYPES:
         raise Exception("input type is not supported: {}".format(input_type))
 
+    if fit_method not in constants.ALLOWED_ELM_FIT_METHODS:
+        raise Exception("fit method is not supported: {}".format(fit_method))
+
     input_shape = 2 * 768
     if input_type in [constants.EMBEDDING_POSITIVE, constants.EMBEDDING_NEGATIVE, constants.CLIP]:
         input_shape = 768
 
-    # load dataset
-    dataset_loader = ABRankingDatasetLoader(dataset_name=dataset_name,
-                                            minio_ip_addr=minio_ip_addr,
-                                            minio_access_key=minio_access_key,
-                                            minio_secret_key=minio_secret_key,
-                                            input_type=input_type,
-                                            buffer_size=buffer_size,
-                                            train_percent=train_percent,
-                                            load_to_ram=load_data_to_ram,
-                                            pooling_strategy=pooling_strategy,
-                                            normalize_vectors=normalize_vectors,
-                                            target_option=target_option,
-                                            duplicate_flip_option=duplicate_flip_option)
-    dataset_loader.load_dataset()
+    # load dataset, unless an already loaded one is shared between models
+    if dataset_loader is None:
+        dataset_loader = ABRankingDatasetLoader(dataset_name=dataset_name,
+                                                minio_ip_addr=minio_ip_addr,
+                                                minio_access_key=minio_access_key,
+                                                minio_secret_key=minio_secret_key,
+                                                input_type=input_type,
+                                                buffer_size=buffer_size,
+                                                train_percent=train_percent,
+                                                load_to_ram=load_data_to_ram,
+                                                pooling_strategy=pooling_strategy,
+                                                normalize_vectors=normalize_vectors,
+                                                target_option=target_option,
+                                                duplicate_flip_option=duplicate_flip_option,
+                                                streaming=streaming_data,
+                                                snapshot_dir=snapshot_dir)
+        dataset_loader.load_dataset()
 
     # get final filename
     sequence = 0
@@ -88,24 +102,43 @@ def train_ranking(dataset_name: str,
 
     ab_model = ABRankingELMModel(inputs_shape=input_shape,
                                  num_random_layers=num_random_layers,
-                                 elm_sparsity=elm_sparsity)
-    training_predicted_score_images_x, \
-        training_predicted_score_images_y, \
-        training_predicted_probabilities, \
-        training_target_probabilities, \
-        validation_predicted_score_images_x, \
-        validation_predicted_score_images_y, \
-        validation_predicted_probabilities, \
-        validation_target_probabilities, \
-        training_loss_per_epoch, \
-        validation_loss_per_epoch = ab_model.train(dataset_loader=dataset_loader,
-                                                   training_batch_size=training_batch_size,
-                                                   epochs=epochs,
-                                                   learning_rate=learning_rate,
-                                                   weight_decay=weight_decay,
-                                                   add_loss_penalty=add_loss_penalty,
-                                                   randomize_data_per_epoch=randomize_data_per_epoch,
-                                                   debug_asserts=debug_asserts)
+                                 elm_sparsity=elm_sparsity,
+                                 hidden_size=elm_hidden_size)
+    if fit_method == constants.ELM_FIT_CLOSED_FORM:
+        training_predicted_score_images_x, \
+            training_predicted_score_images_y, \
+            training_predicted_probabilities, \
+            training_target_probabilities, \
+            validation_predicted_score_images_x, \
+            validation_predicted_score_images_y, \
+            validation_predicted_probabilities, \
+            validation_target_probabilities, \
+            training_loss_per_epoch, \
+            validation_loss_per_epoch = ab_model.fit_closed_form(dataset_loader=dataset_loader,
+                                                                 ridge_lambda=ridge_lambda,
+                                                                 irls_steps=irls_steps,
+                                                                 add_loss_penalty=add_loss_penalty,
+                                                                 debug_asserts=debug_asserts)
+        # the loss graph has one point per irls step
+        epochs = len(training_loss_per_epoch)
+    else:
+        training_predicted_score_images_x, \
+            training_predicted_score_images_y, \
+            training_predicted_probabilities, \
+            training_target_probabilities, \
+            validation_predicted_score_images_x, \
+            validation_predicted_score_images_y, \
+            validation_predicted_probabilities, \
+            validation_target_probabilities, \
+            training_loss_per_epoch, \
+            validation_loss_per_epoch = ab_model.train(dataset_loader=dataset_loader,
+                                                       training_batch_size=training_batch_size,
+                                                       epochs=epochs,
+                                                       learning_rate=learning_rate,
+                                                       weight_decay=weight_decay,
+                                                       add_loss_penalty=add_loss_penalty,
+                                                       randomize_data_per_epoch=randomize_data_per_epoch,
+                                                       debug_asserts=debug_asserts)
 
     # data for chronological score graph
     training_shuffled_indices_origin = []
@@ -197,7 +230,7 @@ def train_ranking(dataset_name: str,
     report_buffer = BytesIO(report_str.encode(encoding='UTF-8'))
 
     # upload the txt report
-    cmd.upload_data(dataset_loader.minio_client, bucket_name, report_output_path, report_buffer)
+    run_upload(uploader, cmd.upload_data, dataset_loader.minio_client, bucket_name, report_output_path, report_buffer)
 
     # show and save graph
     graph_name = "{}.png".format(filename)
@@ -241,7 +274,7 @@ def train_ranking(dataset_name: str,
                                     validation_shuffled_indices_origin,
                                     dataset_loader.total_selection_datapoints)
     # upload the graph report
-    cmd.upload_data(dataset_loader.minio_client, bucket_name, graph_output_path, graph_buffer)
+    run_upload(uploader, cmd.upload_data, dataset_loader.minio_client, bucket_name, graph_output_path, graph_buffer)
 
     # get model card and upload
     model_card_name = "{}.json".format(filename)
@@ -252,23 +285,25 @@ def train_ranking(dataset_name: str,
                                         graph_output_path,
                                         input_type,
                                         output_type)
-    cmd.upload_data(dataset_loader.minio_client, bucket_name, model_card_name_output_path, model_card_buf)
-
-    # add model card
-    model_id = upload_score_residual.add_model_card(model_card)
-
-    # upload score and residual
-    upload_score_residual.upload_score_residual(model_id,
-                                                training_predicted_probabilities,
-                                                training_target_probabilities,
-                                                validation_predicted_probabilities,
-                                                validation_target_probabilities,
-                                                training_predicted_score_images_x,
-                                                validation_predicted_score_images_x,
-                                                dataset_loader.training_image_hashes,
-                                                dataset_loader.validation_image_hashes,
-                                                training_shuffled_indices_origin,
-                                                validation_shuffled_indices_origin)
+    run_upload(uploader, cmd.upload_data, dataset_loader.minio_client, bucket_name, model_card_name_output_path, model_card_buf)
+
+    # add model card, then upload score and residual
+    run_upload(uploader,
+               add_model_card_and_upload_score_residual,
+               dataset_loader.minio_client,
+               bucket_name,
+               output_path,
+               model_card,
+               training_predicted_probabilities,
+               training_target_probabilities,
+               validation_predicted_probabilities,
+               validation_target_probabilities,
+               training_predicted_score_images_x,
+               validation_predicted_score_images_x,
+               dataset_loader.training_image_hashes,
+               dataset_loader.validation_image_hashes,
+               training_shuffled_indices_origin,
+               validation_shuffled_indices_origin)
 
     return model_output_path, report_output_path, graph_output_path
 
@@ -282,7 +317,8 @@ def run_ab_ranking_elm_v1_task(training_task, minio_access_key, minio_secret_key
                                           epochs=training_task["epochs"],
                                           learning_rate=training_task["learning_rate"],
                                           buffer_size=training_task["buffer_size"],
-                                          train_percent=training_task["train_percent"])
+                                          train_percent=training_task["train_percent"],
+                                          fit_method=training_task.get("fit_method", constants.ELM_FIT_GRADIENT))
 
     return model_output_path, report_output_path, graph_output_path
 
@@ -15,7 +15,7 @@ from training_worker.ab_ranking.model.ab_ranking_data_loader import ABRankingDat
 from training_worker.ab_ranking.model.reports.get_model_card import get_model_card_buf
 from utility.minio import cmd
 from training_worker.ab_ranking.model import constants
-from training_worker.ab_ranking.model.reports import upload_score_residual
+from training_worker.ab_ranking.script.upload_utils import run_upload, add_model_card_and_upload_score_residual
 
 
 def train_ranking(dataset_name: str,
@@ -37,6 +37,10 @@ def train_ranking(dataset_name: str,
                   target_option=constants.TARGET_1_AND_0,
                   duplicate_flip_option=constants.DUPLICATE_AND_FLIP_ALL,
                   randomize_data_per_epoch=True,
+                  streaming_data=False,
+                  snapshot_dir=None,
+                  dataset_loader: ABRankingDatasetLoader = None,
+                  uploader=None,
                   ):
     date_now = datetime.now(tz=timezone("Asia/Hong_Kong")).strftime('%Y-%m-%d')
     print("Current datetime: {}".format(datetime.now(tz=timezone("Asia/Hong_Kong"))))
@@ -54,20 +58,23 @@ def train_ranking(dataset_name: str,
     if input_type in [constants.EMBEDDING_POSITIVE, constants.EMBEDDING_NEGATIVE, constants.CLIP]:
         input_shape = 768
 
-    # load dataset
-    dataset_loader = ABRankingDatasetLoader(dataset_name=dataset_name,
-                                            minio_ip_addr=minio_ip_addr,
-                                            minio_access_key=minio_access_key,
-                                            minio_secret_key=minio_secret_key,
-                                            input_type=input_type,
-                                            buffer_size=buffer_size,
-                                            train_percent=train_percent,
-                                            load_to_ram=load_data_to_ram,
-                                            pooling_strategy=pooling_strategy,
-                                            normalize_vectors=normalize_vectors,
-                                            target_option=target_option,
-                                            duplicate_flip_option=duplicate_flip_option)
-    dataset_loader.load_dataset()
+    # load dataset, unless an already loaded one is shared between models
+    if dataset_loader is None:
+        dataset_loader = ABRankingDatasetLoader(dataset_name=dataset_name,
+                                                minio_ip_addr=minio_ip_addr,
+                                                minio_access_key=minio_access_key,
+                                                minio_secret_key=minio_secret_key,
+                                                input_type=input_type,
+                                                buffer_size=buffer_size,
+                                                train_percent=train_percent,
+                                                load_to_ram=load_data_to_ram,
+                                                pooling_strategy=pooling_strategy,
+                                                normalize_vectors=normalize_vectors,
+                                                target_option=target_option,
+                                                duplicate_flip_option=duplicate_flip_option,
+                                                streaming=streaming_data,
+                                                snapshot_dir=snapshot_dir)
+        dataset_loader.load_dataset()
 
     # get final filename
     sequence = 0
@@ -192,7 +199,7 @@ def train_ranking(dataset_name: str,
     report_buffer = BytesIO(report_str.encode(encoding='UTF-8'))
 
     # upload the txt report
-    cmd.upload_data(dataset_loader.minio_client, bucket_name, report_output_path, report_buffer)
+    run_upload(uploader, cmd.upload_data, dataset_loader.minio_client, bucket_name, report_output_path, report_buffer)
 
     # show and save graph
     graph_name = "{}.png".format(filename)
@@ -237,7 +244,7 @@ def train_ranking(dataset_name: str,
                                     dataset_loader.total_selection_datapoints)
 
     # upload the graph report
-    cmd.upload_data(dataset_loader.minio_client, bucket_name,graph_output_path, graph_buffer)
+    run_upload(uploader, cmd.upload_data, dataset_loader.minio_client, bucket_name,graph_output_path, graph_buffer)
 
     # get model card and upload
     model_card_name = "{}.json".format(filename)
@@ -248,23 +255,25 @@ def train_ranking(dataset_name: str,
                                         graph_output_path,
                                         input_type,
                                         output_type)
-    cmd.upload_data(dataset_loader.minio_client, bucket_name, model_card_name_output_path, model_card_buf)
-
-    # add model card
-    model_id = upload_score_residual.add_model_card(model_card)
-
-    # upload score and residual
-    upload_score_residual.upload_score_residual(model_id,
-                                                training_predicted_probabilities,
-                                                training_target_probabilities,
-                                                validation_predicted_probabilities,
-                                                validation_target_probabilities,
-                                                training_predicted_score_images_x,
-                                                validation_predicted_score_images_x,
-                                                dataset_loader.training_image_hashes,
-                                                dataset_loader.validation_image_hashes,
-                                                training_shuffled_indices_origin,
-                                                validation_shuffled_indices_origin)
+    run_upload(uploader, cmd.upload_data, dataset_loader.minio_client, bucket_name, model_card_name_output_path, model_card_buf)
+
+    # add model card, then upload score and residual
+    run_upload(uploader,
+               add_model_card_and_upload_score_residual,
+               dataset_loader.minio_client,
+               bucket_name,
+               output_path,
+               model_card,
+               training_predicted_probabilities,
+               training_target_probabilities,
+               validation_predicted_probabilities,
+               validation_target_probabilities,
+               training_predicted_score_images_x,
+               validation_predicted_score_images_x,
+               dataset_loader.training_image_hashes,
+               dataset_loader.validation_image_hashes,
+               training_shuffled_indices_origin,
+               validation_shuffled_indices_origin)
 
     return model_output_path, report_output_path, graph_output_path
 
@@ -0,0 +1,151 @@
+import os
+import sys
+import time
+
+base_directory = os.getcwd()
+sys.path.insert(0, base_directory)
+
+from training_worker.ab_ranking.model.ab_ranking_data_loader import ABRankingDatasetLoader
+from training_worker.ab_ranking.model import constants
+from training_worker.ab_ranking.script import ab_ranking_linear, ab_ranking_elm_v1, ab_ranking_xgboost
+from training_worker.ab_ranking.script.upload_utils import BackgroundUploader
+
+MODEL_TYPE_LINEAR = "linear"
+MODEL_TYPE_ELM_V1 = "elm-v1"
+MODEL_TYPE_XGBOOST = "xgboost"
+ALLOWED_MODEL_TYPES = [MODEL_TYPE_LINEAR, MODEL_TYPE_ELM_V1, MODEL_TYPE_XGBOOST]
+
+
+def get_train_function(model_type):
+    if model_type == MODEL_TYPE_LINEAR:
+        return ab_ranking_linear.train_ranking
+    if model_type == MODEL_TYPE_ELM_V1:
+        return ab_ranking_elm_v1.train_ranking
+    if model_type == MODEL_TYPE_XGBOOST:
+        return ab_ranking_xgboost.train_xgboost
+
+    raise Exception("model type is not supported: {}".format(model_type))
+
+
+# loads the dataset once, trains every model type on it and uploads the outputs in the background
+# returns a dict of model type to (model path, report path, graph path) and a dict of phase to seconds.
+# xgboost writes no txt report, its report path is None
+def train_multi_model(dataset_name: str,
+                      model_types=ALLOWED_MODEL_TYPES,
+                      minio_ip_addr=None,
+                      minio_access_key=None,
+                      minio_secret_key=None,
+                      input_type="embedding",
+                      buffer_size=20000,
+                      train_percent=0.9,
+                      load_data_to_ram=True,
+                      normalize_vectors=True,
+                      pooling_strategy=constants.AVERAGE_POOLING,
+                      target_option=constants.TARGET_1_AND_0,
+                      duplicate_flip_option=constants.DUPLICATE_AND_FLIP_ALL,
+                      streaming_data=False,
+                      snapshot_dir=None,
+                      model_params=None,
+                      max_upload_workers=4):
+    for model_type in model_types:
+        if model_type not in ALLOWED_MODEL_TYPES:
+            raise Exception("model type is not supported: {}".format(model_type))
+
+    if model_params is None:
+        model_params = {}
+
+    timings = {}
+    total_start_time = time.time()
+
+    # load and pool the dataset once for all models
+    start_time = time.time()
+    dataset_loader = ABRankingDatasetLoader(dataset_name=dataset_name,
+                                            minio_ip_addr=minio_ip_addr,
+                                            minio_access_key=minio_access_key,
+                                            minio_secret_key=minio_secret_key,
+                                            input_type=input_type,
+                                            buffer_size=buffer_size,
+                                            train_percent=train_percent,
+                                            load_to_ram=load_data_to_ram,
+                                            pooling_strategy=pooling_strategy,
+                                            normalize_vectors=normalize_vectors,
+                                            target_option=target_option,
+                                            duplicate_flip_option=duplicate_flip_option,
+                                            streaming=streaming_data,
+                                            snapshot_dir=snapshot_dir)
+    dataset_loader.load_dataset()
+    timings["dataset-load"] = time.time() - start_time
+
+    uploader = BackgroundUploader(max_workers=max_upload_workers)
+    outputs = {}
+    try:
+        for model_type in model_types:
+            print("Training {} model...".format(model_type))
+            start_time = time.time()
+
+            # each model starts reading the shared data from the beginning
+            dataset_loader.current_training_data_index = 0
+            train_function = get_train_function(model_type)
+            outputs[model_type] = train_function(dataset_name=dataset_name,
+                                                 input_type=input_type,
+                                                 buffer_size=buffer_size,
+                                                 train_percent=train_percent,
+                                                 load_data_to_ram=load_data_to_ram,
+                                                 normalize_vectors=normalize_vectors,
+                                                 pooling_strategy=pooling_strategy,
+                                                 target_option=target_option,
+                                                 duplicate_flip_option=duplicate_flip_option,
+                                                 dataset_loader=dataset_loader,
+                                                 uploader=uploader,
+                                                 **model_params.get(model_type, {}))
+            timings["train-" + model_type] = time.time() - start_time
+
+        # wait for the remaining uploads
+        start_time = time.time()
+        uploader.wait()
+        timings["upload-wait"] = time.time() - start_time
+    finally:
+        uploader.shutdown()
+
+    timings["total"] = time.time() - total_start_time
+
+    print("Multi model training time:")
+    for phase, elapsed_time in timings.items():
+        print("    {}: {}s".format(phase, format(elapsed_time, ".2f")))
+
+    return outputs, timings
+
+
+# training parameters of a model type. linear and elm-v1 default to the task epochs and learning rate,
+# like run_ab_ranking_linear_task and run_ab_ranking_elm_v1_task, the task entry for the model type overrides them
+def get_model_params(training_task, model_type):
+    model_params = {}
+    if model_type in [MODEL_TYPE_LINEAR, MODEL_TYPE_ELM_V1]:
+        model_params["epochs"] = training_task["epochs"]
+        model_params["learning_rate"] = training_task["learning_rate"]
+    if model_type == MODEL_TYPE_ELM_V1:
+        model_params["fit_method"] = training_task.get("fit_method", constants.ELM_FIT_GRADIENT)
+
+    model_params.update(training_task.get(model_type, {}))
+
+    return model_params
+
+
+def run_ab_ranking_multi_model_task(training_task, minio_access_key, minio_secret_key):
+    model_types = training_task.get("model_types", ALLOWED_MODEL_TYPES)
+
+    # per model type training parameters
+    model_params = {}
+    for model_type in model_types:
+        model_params[model_type] = get_model_params(training_task, model_type)
+
+    return train_multi_model(dataset_name=training_task["dataset_name"],
+                             model_types=model_types,
+                             minio_access_key=minio_access_key,
+                             minio_secret_key=minio_secret_key,
+                             input_type=training_task.get("input_type", "embedding"),
+                             buffer_size=training_task.get("buffer_size", 20000),
+                             train_percent=training_task.get("train_percent", 0.9),
+                             streaming_data=training_task.get("streaming_data", False),
+                             snapshot_dir=training_task.get("snapshot_dir", None),
+                             model_params=model_params)
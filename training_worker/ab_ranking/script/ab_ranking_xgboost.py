@@ -3,7 +3,6 @@ import torch
 import sys
 from datetime import datetime
 from pytz import timezone
-import numpy as np
 from xgboost import XGBRegressor
 import time
 
@@ -19,8 +18,10 @@ from training_worker.ab_ranking.model.reports.get_model_card import get_model_ca
 from utility.minio import cmd
 from training_worker.ab_ranking.model import constants
 from training_worker.ab_ranking.model.reports import upload_score_residual
+from training_worker.ab_ranking.script.upload_utils import run_upload
+from training_worker.ab_ranking.script.xgboost_utils import TrainingBatchIter, get_validation_feature_matrices, \
+    get_pair_design_matrix, get_design_input_data, predict_training_design, PAIR_CONCAT
 
-import numpy as np
 import matplotlib.pyplot as plt
 import warnings
 from sklearn.model_selection import train_test_split
@@ -46,6 +47,10 @@ def train_xgboost(dataset_name: str,
                   target_option=constants.TARGET_1_AND_0,
                   duplicate_flip_option=constants.DUPLICATE_AND_FLIP_ALL,
                   randomize_data_per_epoch=True,
+                  streaming_data=False,
+                  snapshot_dir=None,
+                  dataset_loader: ABRankingDatasetLoader = None,
+                  uploader=None,
                   ):
     # raise exception if input is not clip
     if input_type not in ["clip", "embedding"]:
@@ -67,20 +72,23 @@ def train_xgboost(dataset_name: str,
     if input_type in [constants.EMBEDDING_POSITIVE, constants.EMBEDDING_NEGATIVE, constants.CLIP]:
         input_shape = 768
 
-    # load dataset
-    dataset_loader = ABRankingDatasetLoader(dataset_name=dataset_name,
-                                            minio_ip_addr=minio_ip_addr,
-                                            minio_access_key=minio_access_key,
-                                            minio_secret_key=minio_secret_key,
-                                            input_type=input_type,
-                                            buffer_size=buffer_size,
-                                            train_percent=train_percent,
-                                            load_to_ram=load_data_to_ram,
-                                            pooling_strategy=pooling_strategy,
-                                            normalize_vectors=normalize_vectors,
-                                            target_option=target_option,
-                                            duplicate_flip_option=duplicate_flip_option)
-    dataset_loader.load_dataset()
+    # load dataset, unless an already loaded one is shared between models
+    if dataset_loader is None:
+        dataset_loader = ABRankingDatasetLoader(dataset_name=dataset_name,
+                                                minio_ip_addr=minio_ip_addr,
+                                                minio_access_key=minio_access_key,
+                                                minio_secret_key=minio_secret_key,
+                                                input_type=input_type,
+                                                buffer_size=buffer_size,
+                                                train_percent=train_percent,
+                                                load_to_ram=load_data_to_ram,
+                                                pooling_strategy=pooling_strategy,
+                                                normalize_vectors=normalize_vectors,
+                                                target_option=target_option,
+                                                duplicate_flip_option=duplicate_flip_option,
+                                                streaming=streaming_data,
+                                                snapshot_dir=snapshot_dir)
+        dataset_loader.load_dataset()
 
     # get final filename
     sequence = 0
@@ -97,45 +105,20 @@ def train_xgboost(dataset_name: str,
     training_total_size = dataset_loader.get_len_training_ab_data()
     validation_total_size = dataset_loader.get_len_validation_ab_data()
 
-    # get training data and convert to numpy array
-    training_features_x, \
-        training_features_y, \
-        training_targets = dataset_loader.get_next_training_feature_vectors_and_target_linear(training_total_size)
-
-    training_features_x = training_features_x.numpy()
-    training_features_y = training_features_y.numpy()
-    training_targets = training_targets.numpy()
-
-    training_data = []
-    for i in range(len(training_features_x)):
-        concatenated = np.concatenate((training_features_x[i], training_features_y[i]))
-        training_data.append(concatenated)
-
-
-    training_data = np.asarray(training_data)
-    print("training data shape=", training_data.shape)
-    print("training target shape=", training_targets.shape)
-
-    # get validation data
+    # validation data as float32 arrays, x || y per pair
     validation_features_x, \
         validation_features_y, \
-        validation_targets = dataset_loader.get_validation_feature_vectors_and_target_linear()
-    validation_features_x = validation_features_x.numpy()
-    validation_features_y = validation_features_y.numpy()
-    validation_targets = validation_targets.numpy()
-    validation_data = []
-    for i in range(len(validation_features_x)):
-            concatenated = np.concatenate((validation_features_x[i], validation_features_y[i]))
-            validation_data.append(concatenated)
-
-
-    validation_data = np.asarray(validation_data)
+        validation_targets = get_validation_feature_matrices(dataset_loader)
+    validation_data = get_pair_design_matrix(validation_features_x, validation_features_y, PAIR_CONCAT)
     print("validation data shape=", validation_data.shape)
     print("validation target shape=", validation_targets.shape)
 
     # Create regression matrices
-    dtrain_reg = xgb.DMatrix(training_data, training_targets)
-    dtest_reg = xgb.DMatrix(validation_data, validation_targets)
+    # the training pairs are quantized for the hist tree method a batch at a time,
+    # the validation matrix reuses the training bins
+    dtrain_reg = xgb.QuantileDMatrix(TrainingBatchIter(dataset_loader, get_design_input_data))
+    dtest_reg = xgb.QuantileDMatrix(validation_data, validation_targets, ref=dtrain_reg)
+    print("training data shape=", (dtrain_reg.num_row(), dtrain_reg.num_col()))
 
     # Define hyperparameters
     params = {"objective": "reg:squarederror", "device": "cuda:0"}
@@ -150,8 +133,8 @@ def train_xgboost(dataset_name: str,
                       )
 
     # make a prediction
-    training_pred_results = xgboost_model.predict(dtrain_reg)
-    validation_pred_results = xgboost_model.predict(dtest_reg)
+    training_pred_results, training_targets = predict_training_design(xgboost_model, dataset_loader, PAIR_CONCAT)
+    validation_pred_results = xgboost_model.inplace_predict(validation_data)
 
     # summarize prediction
     # print('Predicted: ', validation_pred_results)
@@ -184,7 +167,7 @@ def train_xgboost(dataset_name: str,
     buffer = BytesIO(xgboost_model_buf)
     buffer.seek(0)
 
-    cmd.upload_data(dataset_loader.minio_client, "datasets", model_output_path, buffer)
+    run_upload(uploader, cmd.upload_data, dataset_loader.minio_client, "datasets", model_output_path, buffer)
 
     #
     # # Generate report
@@ -307,7 +290,7 @@ def train_xgboost(dataset_name: str,
                                     dataset_loader.total_selection_datapoints)
 
     # upload the graph report
-    cmd.upload_data(dataset_loader.minio_client, bucket_name, graph_output_path, graph_buffer)
+    run_upload(uploader, cmd.upload_data, dataset_loader.minio_client, bucket_name, graph_output_path, graph_buffer)
 
     # # get model card and upload
     # model_card_name = "{}.json".format(filename)
@@ -336,6 +319,7 @@ def train_xgboost(dataset_name: str,
     #                                             training_shuffled_indices_origin,
     #                                             validation_shuffled_indices_origin)
 
+    return model_output_path, None, graph_output_path
 
 
 if __name__ == '__main__':
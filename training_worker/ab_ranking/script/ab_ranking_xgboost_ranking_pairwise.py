@@ -19,6 +19,8 @@ from training_worker.ab_ranking.model.reports.get_model_card import get_model_ca
 from utility.minio import cmd
 from training_worker.ab_ranking.model import constants
 from training_worker.ab_ranking.model.reports import upload_score_residual
+from training_worker.ab_ranking.script.xgboost_utils import TrainingBatchIter, get_validation_feature_matrices, \
+    get_pair_ranking_matrix, get_ranking_input_data, predict_pair_scores, predict_training_pair_scores, get_num_correct
 
 import numpy as np
 import matplotlib.pyplot as plt
@@ -124,46 +126,24 @@ def train_xgboost(dataset_name: str,
     training_total_size = dataset_loader.get_len_training_ab_data()
     validation_total_size = dataset_loader.get_len_validation_ab_data()
 
-    # get training data and convert to numpy array
-    training_features_x, \
-        training_features_y, \
-        training_targets = dataset_loader.get_next_training_feature_vectors_and_target_linear(training_total_size)
-
-    training_features_x = training_features_x.numpy()
-    training_features_y = training_features_y.numpy()
-    training_targets = training_targets.numpy()
-
-    training_data = training_features_x
-
-    print("training data shape=", training_data.shape)
-    print("training target shape=", training_targets.shape)
-
-    # get validation data
+    # validation data as float32 arrays
     validation_features_x, \
         validation_features_y, \
-        validation_targets = dataset_loader.get_validation_feature_vectors_and_target_linear()
-    validation_features_x = validation_features_x.numpy()
-    validation_features_y = validation_features_y.numpy()
-    validation_targets = validation_targets.numpy()
-
-    validation_data = validation_features_x
+        validation_targets = get_validation_feature_matrices(dataset_loader)
 
+    # each pair is a query group of 2 rows, x then y
+    validation_data, validation_labels, validation_group = get_pair_ranking_matrix(validation_features_x,
+                                                                                   validation_features_y,
+                                                                                   validation_targets)
     print("validation data shape=", validation_data.shape)
     print("validation target shape=", validation_targets.shape)
 
-    # Create regression matrices
-    dtrain_reg = xgb.DMatrix(training_data, training_targets)
-    dtest_reg = xgb.DMatrix(validation_data, validation_targets)
-
-    train_len= int(len(training_targets)/2)
-    validate_len = int(len(validation_targets)/2)
-
-    # group
-    train_group = np.array([2 for _ in range(train_len)])
-    validation_group = np.array([2 for _ in range(validate_len)])
-
-    dtrain_reg.set_group(train_group)
-    dtest_reg.set_group(validation_group)
+    # Create ranking matrices
+    # the training pairs are quantized for the hist tree method a batch at a time,
+    # the validation matrix reuses the training bins
+    dtrain_reg = xgb.QuantileDMatrix(TrainingBatchIter(dataset_loader, get_ranking_input_data))
+    print("training data shape=", (dtrain_reg.num_row(), dtrain_reg.num_col()))
+    dtest_reg = xgb.QuantileDMatrix(validation_data, validation_labels, group=validation_group, ref=dtrain_reg)
 
     params = {'objective': 'rank:pairwise', 'eta': 0.1, 'gamma': 1.0,
               'min_child_weight': 0.1, 'max_depth': 6}
@@ -178,38 +158,25 @@ def train_xgboost(dataset_name: str,
                               early_stopping_rounds=50,  # Activate early stopping
                               )
 
-    # make a prediction
-    # training_pred_scores_results = xgboost_model.predict(dtrain_reg)
-    # validation_pred_scores_results = xgboost_model.predict(dtest_reg)
-
     # get training predicted probability
-    dtrain_x = xgb.DMatrix(training_features_x)
-    dtrain_y = xgb.DMatrix(training_features_y)
-    train_x_pred_scores = xgboost_model.predict(dtrain_x)
-    train_y_pred_scores = xgboost_model.predict(dtrain_y)
+    train_x_pred_scores, \
+        train_y_pred_scores, \
+        training_targets = predict_training_pair_scores(xgboost_model, dataset_loader)
 
     # add const
     train_x_pred_scores = train_x_pred_scores + 10
     train_y_pred_scores = train_y_pred_scores + 10
-
-    train_pred_prob = []
-    for i in range(len(train_x_pred_scores)):
-        prob = forward_bradley_terry(train_x_pred_scores[i], train_y_pred_scores[i])
-        train_pred_prob.append(prob)
+    train_pred_prob = forward_bradley_terry(train_x_pred_scores, train_y_pred_scores)
 
     # get validation predicted probability
-    dvalidation_x = xgb.DMatrix(validation_features_x)
-    dvalidation_y = xgb.DMatrix(validation_features_y)
-    validation_x_pred_scores = xgboost_model.predict(dvalidation_x)
-    validation_y_pred_scores = xgboost_model.predict(dvalidation_y)
+    validation_x_pred_scores, validation_y_pred_scores = predict_pair_scores(xgboost_model,
+                                                                             validation_features_x,
+                                                                             validation_features_y)
 
     # add const
     validation_x_pred_scores = validation_x_pred_scores + 10
     validation_y_pred_scores = validation_y_pred_scores + 10
-    validation_pred_prob = []
-    for i in range(len(validation_x_pred_scores)):
-        prob = forward_bradley_terry(validation_x_pred_scores[i], validation_y_pred_scores[i])
-        validation_pred_prob.append(prob)
+    validation_pred_prob = forward_bradley_terry(validation_x_pred_scores, validation_y_pred_scores)
 
     ab_model = ABRankingModel(inputs_shape=input_shape)
     training_predicted_score_images_x = train_x_pred_scores
@@ -241,23 +208,13 @@ def train_xgboost(dataset_name: str,
 
     cmd.upload_data(dataset_loader.minio_client, "datasets", model_output_path, buffer)
 
-    train_sum_correct = 0
-    for i in range(len(training_target_probabilities)):
-        if training_target_probabilities[i] == [1.0]:
-            if training_predicted_score_images_x[i] > training_predicted_score_images_y[i]:
-                train_sum_correct += 1
-        else:
-            if training_predicted_score_images_x[i] < training_predicted_score_images_y[i]:
-                train_sum_correct += 1
-
-    validation_sum_correct = 0
-    for i in range(len(validation_target_probabilities)):
-        if validation_target_probabilities[i] == [1.0]:
-            if validation_predicted_score_images_x[i] > validation_predicted_score_images_y[i]:
-                validation_sum_correct += 1
-        else:
-            if validation_predicted_score_images_x[i] < validation_predicted_score_images_y[i]:
-                validation_sum_correct += 1
+    train_sum_correct = get_num_correct(training_target_probabilities,
+                                        training_predicted_score_images_x,
+                                        training_predicted_score_images_y)
+
+    validation_sum_correct = get_num_correct(validation_target_probabilities,
+                                             validation_predicted_score_images_x,
+                                             validation_predicted_score_images_y)
 
     selected_index_0_count, selected_index_1_count, total_images_count = dataset_loader.get_image_selected_index_data()
     # # save report
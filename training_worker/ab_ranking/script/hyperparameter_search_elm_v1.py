@@ -11,7 +11,8 @@ from ray.tune.search.optuna import OptunaSearch
 base_directory = os.getcwd()
 sys.path.insert(0, base_directory)
 
-from training_worker.ab_ranking.model.ab_ranking_elm_v1 import ABRankingELMModel, forward_bradley_terry
+from training_worker.ab_ranking.model.ab_ranking_elm_v1 import ABRankingELMModel, forward_bradley_terry, \
+    fit_bradley_terry_irls, set_last_layer, get_l1_loss
 from training_worker.ab_ranking.model.reports.graph_report_ab_ranking_linear import *
 from training_worker.ab_ranking.model.ab_ranking_data_loader import ABRankingDatasetLoader
 from training_worker.ab_ranking.model import constants
@@ -43,7 +44,6 @@ def train_elm_v1_hyperparameter(model,
     training_num_batches = math.ceil(num_features / training_batch_size)
     for epoch in tqdm(range(epochs), desc="Training epoch"):
         training_loss_arr = []
-        validation_loss_arr = []
         epoch_training_loss = None
         epoch_validation_loss = None
 
@@ -81,10 +81,10 @@ def train_elm_v1_hyperparameter(model,
                 loss = model.l1_loss(batch_pred_probabilities, batch_targets)
 
                 if add_loss_penalty:
-                    # add loss penalty
+                    # add loss penalty, averaged over the batch
                     neg_score = torch.multiply(predicted_score_images_x, -1.0)
                     negative_score_loss_penalty = torch.relu(neg_score)
-                    loss = torch.add(loss, negative_score_loss_penalty)
+                    loss = torch.add(loss, torch.mean(negative_score_loss_penalty))
 
                 loss.backward()
                 optimizer.step()
@@ -92,33 +92,22 @@ def train_elm_v1_hyperparameter(model,
                 training_loss_arr.append(loss.detach().cpu())
 
         # Calculate Validation Loss
+        # the whole validation set goes through the model as one batch
         with torch.no_grad():
-            for i in range(len(validation_features_x)):
-                validation_feature_x = validation_features_x[i]
-                validation_feature_x = validation_feature_x.unsqueeze(0)
-                validation_feature_y = validation_features_y[i]
-                validation_feature_y = validation_feature_y.unsqueeze(0)
+            predicted_score_images_x = model.forward(validation_features_x)
+            predicted_score_images_y = model.forward(validation_features_y)
 
-                validation_target = validation_targets[i]
-                validation_target = validation_target.unsqueeze(0)
+            validation_pred_probabilities = forward_bradley_terry(predicted_score_images_x,
+                                                                  predicted_score_images_y)
 
-                predicted_score_image_x = model.forward(validation_feature_x)
-                with torch.no_grad():
-                    predicted_score_image_y = model.forward(validation_feature_y)
-
-                validation_pred_probabilities = forward_bradley_terry(predicted_score_image_x,
-                                                                           predicted_score_image_y)
-
-
-                validation_loss = model.l1_loss(validation_pred_probabilities, validation_target)
-
-                if add_loss_penalty:
-                    # add loss penalty
-                    neg_score = torch.multiply(predicted_score_image_x, -1.0)
-                    negative_score_loss_penalty = torch.relu(neg_score)
-                    validation_loss = torch.add(validation_loss, negative_score_loss_penalty)
+            # per sample l1 loss
+            validation_loss = torch.abs(torch.sub(validation_pred_probabilities, validation_targets))
 
-                validation_loss_arr.append(validation_loss.detach().cpu())
+            if add_loss_penalty:
+                # add loss penalty
+                neg_score = torch.multiply(predicted_score_images_x, -1.0)
+                negative_score_loss_penalty = torch.relu(neg_score)
+                validation_loss = torch.add(validation_loss, negative_score_loss_penalty)
 
         # calculate epoch loss
         # epoch's training loss
@@ -127,8 +116,7 @@ def train_elm_v1_hyperparameter(model,
             epoch_training_loss = torch.mean(training_loss_arr)
 
         # epoch's validation loss
-        validation_loss_arr = torch.stack(validation_loss_arr)
-        epoch_validation_loss = torch.mean(validation_loss_arr)
+        epoch_validation_loss = torch.mean(validation_loss)
 
         if epoch_training_loss is None:
             epoch_training_loss = epoch_validation_loss
@@ -144,6 +132,46 @@ def train_elm_v1_hyperparameter(model,
     print("Training Finished.")
 
 
+# closed form alternative to train_elm_v1_hyperparameter, see ABRankingELMModel.fit_closed_form
+def fit_elm_v1_hyperparameter_closed_form(model,
+                                          dataset_loader: ABRankingDatasetLoader,
+                                          ridge_lambda=0.01,
+                                          irls_steps=4,
+                                          add_loss_penalty=False,
+                                          selection_datapoints_dict=None,
+                                          embeddings_dict=None):
+    # get validation data
+    validation_features_x, \
+        validation_features_y, \
+        validation_targets = dataset_loader.get_validation_feature_vectors_and_target_hyperparam_elm(selection_datapoints_dict=selection_datapoints_dict,
+                                                                                                     embeddings_dict=embeddings_dict)
+
+    # get all training data at once
+    num_features = dataset_loader.get_len_training_ab_data()
+    dataset_loader.current_training_data_index = 0
+    training_features_x, \
+        training_features_y, \
+        training_targets = dataset_loader.get_next_training_feature_vectors_and_target_hyperparam_elm(num_features,
+                                                                                                      selection_datapoints_dict=selection_datapoints_dict,
+                                                                                                      embeddings_dict=embeddings_dict)
+    dataset_loader.current_training_data_index = 0
+
+    with torch.no_grad():
+        hidden_x = model.forward_random_layers(training_features_x).double()
+        hidden_y = model.forward_random_layers(training_features_y).double()
+        weight = fit_bradley_terry_irls(hidden_x, hidden_y, training_targets, ridge_lambda, irls_steps)
+        set_last_layer(model, weight, hidden_x, add_loss_penalty)
+
+        training_loss = get_l1_loss(model, training_features_x, training_features_y, training_targets,
+                                    add_loss_penalty)
+        validation_loss = get_l1_loss(model, validation_features_x, validation_features_y, validation_targets,
+                                      add_loss_penalty)
+
+    session.report({"training-loss": training_loss.item(), "validation-loss": validation_loss.item()})
+
+    print("Training Finished.")
+
+
 def train_hyperparameter_search(config,
                                 dataset_paths,
                                 selection_datapoints_dict,
@@ -178,6 +206,16 @@ def train_hyperparameter_search(config,
                                  elm_sparsity=elm_sparsity)
 
     # do training
+    if config.get("fit_method") == constants.ELM_FIT_CLOSED_FORM:
+        fit_elm_v1_hyperparameter_closed_form(model=ab_model.model,
+                                              dataset_loader=dataset_loader,
+                                              ridge_lambda=config["ridge_lambda"],
+                                              irls_steps=config["irls_steps"],
+                                              add_loss_penalty=add_loss_penalty,
+                                              selection_datapoints_dict=selection_datapoints_dict,
+                                              embeddings_dict=embeddings_dict)
+        return
+
     train_elm_v1_hyperparameter(model=ab_model.model,
                                 dataset_loader=dataset_loader,
                                 training_batch_size=1,
@@ -190,7 +228,7 @@ def train_hyperparameter_search(config,
                                 embeddings_dict=embeddings_dict)
 
 
-def do_search(minio_access_key, minio_secret_key, dataset_name):
+def do_search(minio_access_key, minio_secret_key, dataset_name, fit_method=constants.ELM_FIT_GRADIENT):
     # get data first
     dataset_paths, selection_datapoints_dict, embeddings_dict = get_data_dicts(minio_access_key=minio_access_key,
                                                                                minio_secret_key=minio_secret_key,
@@ -228,7 +266,16 @@ def do_search(minio_access_key, minio_secret_key, dataset_name):
                                           0.80,
                                           0.60,
                                           0.40,
-                                          0.20])
+                                          0.20]),
+        "fit_method": fit_method,
+        "ridge_lambda": tune.choice([10.0,
+                                     1.0,
+                                     0.1,
+                                     0.01]),
+        "irls_steps": tune.choice([1,
+                                   2,
+                                   4,
+                                   8]),
         }
 
     trainable_with_cpu_gpu = tune.with_resources(train_hyperparameter_search, {"cpu": 2})
@@ -261,6 +308,8 @@ def parse_arguments():
     train_parser.add_argument('--minio-secret-key', type=str, help='Minio secret key')
     train_parser.add_argument('--dataset-name', type=str, help='The dataset name to use for training',
                               default='environmental')
+    train_parser.add_argument('--fit-method', type=str, help='How to fit the last layer',
+                              choices=constants.ALLOWED_ELM_FIT_METHODS, default=constants.ELM_FIT_GRADIENT)
 
     return parser.parse_args()
 
@@ -271,7 +320,7 @@ def main():
     command = args.subcommand
 
     if command == 'search':
-        do_search(args.minio_access_key, args.minio_secret_key, args.dataset_name)
+        do_search(args.minio_access_key, args.minio_secret_key, args.dataset_name, args.fit_method)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,373 @@
+import os
+import sys
+import argparse
+import math
+import time
+import multiprocessing
+import numpy as np
+import torch
+import torch.optim as optim
+from random import Random
+from concurrent.futures import ProcessPoolExecutor
+
+base_directory = os.getcwd()
+sys.path.insert(0, base_directory)
+
+from training_worker.ab_ranking.model.ab_ranking_elm_v1 import ABRankingELMBaseModel, forward_bradley_terry, \
+    get_l1_loss
+from training_worker.ab_ranking.model import constants
+from training_worker.ab_ranking.script.hyperparameter_utils import get_data_dicts, \
+    pack_selection_datapoint_features, get_feature_variant_name, SharedArrays
+
+# same choices as the ray tune search in hyperparameter_search_elm_v1.py
+# epochs are not searched, they are the successive halving budget
+SEARCH_SPACE = {
+    "num_random_layers": [0, 1, 2, 3],
+    "learning_rate": [1.0, 0.5, 0.1, 0.05, 0.01, 0.005, 0.001, 0.0001, 0.0005],
+    "weight_decay": [0.0, 0.1, 0.01, 0.001, 0.0001],
+    "training_batch_size": [16, 64, 256],
+    "add_loss_penalty": [True, False],
+    "randomize_data_per_epoch": [True, False],
+    "pooling_strategy": [constants.AVERAGE_POOLING, constants.MAX_POOLING],
+    "normalize_vectors": [True, False],
+    "target_option": [constants.TARGET_1_AND_0, constants.TARGET_1_ONLY, constants.TARGET_0_ONLY],
+    "duplicate_flip_option": [constants.DUPLICATE_AND_FLIP_ALL, constants.DUPLICATE_AND_FLIP_RANDOM],
+    "elm_sparsity": [0.00, 0.80, 0.60, 0.40, 0.20],
+}
+
+# shared feature arrays of this pool process, set by init_trial_worker
+shared_features = None
+
+
+def get_feature_variants():
+    return [(pooling_strategy, normalize_vectors)
+            for pooling_strategy in SEARCH_SPACE["pooling_strategy"]
+            for normalize_vectors in SEARCH_SPACE["normalize_vectors"]]
+
+
+def sample_configs(num_trials, seed=0):
+    rng = Random(seed)
+    configs = []
+    for i in range(num_trials):
+        config = {name: rng.choice(choices) for name, choices in SEARCH_SPACE.items()}
+        # seeds the random layers and the data order of the trial
+        config["seed"] = rng.randrange(2 ** 31 - 1)
+        configs.append(config)
+
+    return configs
+
+
+def init_trial_worker(descriptors, num_threads):
+    global shared_features
+
+    # one trial per process, more threads per trial only adds contention
+    torch.set_num_threads(num_threads)
+    shared_features = SharedArrays.attach(descriptors)
+
+
+# same duplication as ABRankingDatasetLoader.load_dataset_hyperparameter
+# returns (datapoint index, target) arrays, target 1.0 means the selected image is x
+def get_trial_pairs(config, datapoint_indices, rng):
+    target_option = config["target_option"]
+
+    pair_indices = []
+    targets = []
+    if target_option in [constants.TARGET_1_AND_0, constants.TARGET_1_ONLY]:
+        pair_indices.append(datapoint_indices)
+        targets.append(np.ones(len(datapoint_indices), dtype=np.float32))
+
+    if target_option in [constants.TARGET_1_AND_0, constants.TARGET_0_ONLY]:
+        flipped_indices = datapoint_indices
+        if target_option == constants.TARGET_1_AND_0 and \
+                config["duplicate_flip_option"] == constants.DUPLICATE_AND_FLIP_RANDOM:
+            # 50/50 chance of being duplicated
+            flipped_indices = datapoint_indices[rng.random(len(datapoint_indices)) < 0.5]
+
+        pair_indices.append(flipped_indices)
+        targets.append(np.zeros(len(flipped_indices), dtype=np.float32))
+
+    pair_indices = np.concatenate(pair_indices)
+    targets = np.concatenate(targets)
+
+    # shuffle
+    order = rng.permutation(len(pair_indices))
+
+    return pair_indices[order], targets[order]
+
+
+# gathers a batch from the shared arrays, only the batch is copied
+def get_pair_features(selected_features, other_features, pair_indices, targets):
+    selected_batch = torch.from_numpy(selected_features[pair_indices])
+    other_batch = torch.from_numpy(other_features[pair_indices])
+    is_selected_x = torch.from_numpy(targets == 1.0).unsqueeze(1)
+
+    features_x = torch.where(is_selected_x, selected_batch, other_batch)
+    features_y = torch.where(is_selected_x, other_batch, selected_batch)
+    batch_targets = torch.from_numpy(targets).unsqueeze(1)
+
+    return features_x, features_y, batch_targets
+
+
+# trains one trial from start_epoch to end_epoch, resuming from state if given
+# runs in a pool process, the features are read from the shared arrays
+def run_trial(config, start_epoch, end_epoch, state=None):
+    variant_name = get_feature_variant_name(config["pooling_strategy"], config["normalize_vectors"])
+    selected_features = shared_features[variant_name + "-selected"]
+    other_features = shared_features[variant_name + "-other"]
+    training_indices = shared_features["training-indices"]
+    validation_indices = shared_features["validation-indices"]
+
+    # seeds the last layer init, so a trial gives the same result in any worker
+    torch.manual_seed(config["seed"])
+    model = ABRankingELMBaseModel(inputs_shape=selected_features.shape[1],
+                                  num_random_layers=config["num_random_layers"],
+                                  elm_sparsity=config["elm_sparsity"],
+                                  seed=config["seed"])
+    optimizer = optim.AdamW(model.parameters(), lr=config["learning_rate"], weight_decay=config["weight_decay"])
+    if state is not None:
+        model.load_state_dict(state["model"])
+        optimizer.load_state_dict(state["optimizer"])
+
+    # the pairs of a trial are the same in every rung
+    rng = np.random.default_rng(config["seed"])
+    training_pair_indices, training_targets = get_trial_pairs(config, training_indices, rng)
+    validation_pair_indices, validation_targets = get_trial_pairs(config, validation_indices, rng)
+
+    add_loss_penalty = config["add_loss_penalty"]
+    training_batch_size = config["training_batch_size"]
+    num_pairs = len(training_pair_indices)
+    training_num_batches = math.ceil(num_pairs / training_batch_size)
+
+    training_loss_arr = []
+    for epoch in range(start_epoch, end_epoch):
+        order = np.arange(num_pairs)
+        if config["randomize_data_per_epoch"]:
+            order = np.random.default_rng([config["seed"], epoch]).permutation(num_pairs)
+
+        for i in range(training_num_batches):
+            batch_order = order[i * training_batch_size:(i + 1) * training_batch_size]
+            batch_features_x, \
+                batch_features_y, \
+                batch_targets = get_pair_features(selected_features,
+                                                  other_features,
+                                                  training_pair_indices[batch_order],
+                                                  training_targets[batch_order])
+
+            with torch.no_grad():
+                predicted_score_images_y = model.forward(batch_features_y)
+
+            optimizer.zero_grad()
+            predicted_score_images_x = model.forward(batch_features_x)
+
+            batch_pred_probabilities = forward_bradley_terry(predicted_score_images_x, predicted_score_images_y)
+            loss = model.l1_loss(batch_pred_probabilities, batch_targets)
+
+            if add_loss_penalty:
+                # add loss penalty, averaged over the batch
+                negative_score_loss_penalty = torch.relu(torch.multiply(predicted_score_images_x, -1.0))
+                loss = torch.add(loss, torch.mean(negative_score_loss_penalty))
+
+            loss.backward()
+            optimizer.step()
+
+            training_loss_arr.append(loss.item())
+
+    validation_features_x, \
+        validation_features_y, \
+        validation_targets = get_pair_features(selected_features,
+                                               other_features,
+                                               validation_pair_indices,
+                                               validation_targets)
+    validation_loss = get_l1_loss(model, validation_features_x, validation_features_y, validation_targets,
+                                  add_loss_penalty).item()
+
+    training_loss = float(np.mean(training_loss_arr)) if len(training_loss_arr) != 0 else validation_loss
+    if math.isnan(validation_loss):
+        validation_loss = math.inf
+
+    return {
+        "training-loss": training_loss,
+        "validation-loss": validation_loss,
+        "state": {
+            "model": model.state_dict(),
+            "optimizer": optimizer.state_dict(),
+        },
+    }
+
+
+# trains every config for min_epochs, keeps the best 1 / reduction_factor of the trials by validation loss,
+# trains those up to reduction_factor times more epochs, and so on until max_epochs
+def successive_halving(executor, configs, min_epochs=1, max_epochs=9, reduction_factor=3):
+    trials = [{"trial-id": i,
+               "config": config,
+               "epochs": 0,
+               "state": None,
+               "training-loss": None,
+               "validation-loss": None} for i, config in enumerate(configs)]
+
+    rung_epochs = min_epochs
+    while True:
+        print("Rung: {} trials, {} epochs".format(len(trials), rung_epochs))
+        futures = [executor.submit(run_trial, trial["config"], trial["epochs"], rung_epochs, trial["state"])
+                   for trial in trials]
+
+        for trial, future in zip(trials, futures):
+            try:
+                result = future.result()
+            except Exception as e:
+                print("Trial {} failed: {}".format(trial["trial-id"], e))
+                result = {"training-loss": math.inf, "validation-loss": math.inf, "state": None}
+
+            trial["epochs"] = rung_epochs
+            trial["state"] = result["state"]
+            trial["training-loss"] = result["training-loss"]
+            trial["validation-loss"] = result["validation-loss"]
+
+        trials.sort(key=lambda trial: trial["validation-loss"])
+        if rung_epochs >= max_epochs or len(trials) <= 1:
+            return trials
+
+        trials = trials[:max(1, len(trials) // reduction_factor)]
+        rung_epochs = min(rung_epochs * reduction_factor, max_epochs)
+
+
+# arrays holds "<feature variant>-selected", "<feature variant>-other", "training-indices" and
+# "validation-indices", they are copied into shared memory once and read by every trial
+def run_search(arrays,
+               num_trials=27,
+               num_workers=None,
+               threads_per_worker=1,
+               min_epochs=1,
+               max_epochs=9,
+               reduction_factor=3,
+               seed=0):
+    if num_workers is None:
+        num_workers = max(1, os.cpu_count() // threads_per_worker)
+
+    configs = sample_configs(num_trials, seed)
+
+    shared_arrays = SharedArrays.create(arrays)
+    start_time = time.time()
+    try:
+        # spawn, forking a process that already used torch threads is not safe
+        with ProcessPoolExecutor(max_workers=num_workers,
+                                 mp_context=multiprocessing.get_context("spawn"),
+                                 initializer=init_trial_worker,
+                                 initargs=(shared_arrays.descriptors, threads_per_worker)) as executor:
+            trials = successive_halving(executor, configs, min_epochs, max_epochs, reduction_factor)
+    finally:
+        shared_arrays.unlink()
+
+    elapsed_time = time.time() - start_time
+    print("Search finished: {} trials, {} workers, {:.2f}s, {:.1f} trials/hour".format(num_trials,
+                                                                                       num_workers,
+                                                                                       elapsed_time,
+                                                                                       num_trials * 3600.0 / elapsed_time))
+
+    return trials, elapsed_time
+
+
+def get_packed_arrays(dataset_paths, selection_datapoints_dict, embeddings_dict, train_percent=0.9, seed=0):
+    packed_features = pack_selection_datapoint_features(dataset_paths,
+                                                        selection_datapoints_dict,
+                                                        embeddings_dict,
+                                                        get_feature_variants())
+
+    arrays = {}
+    for variant_name, (selected_features, other_features) in packed_features.items():
+        arrays[variant_name + "-selected"] = selected_features
+        arrays[variant_name + "-other"] = other_features
+
+    # same split for every trial
+    num_datapoints = len(dataset_paths)
+    num_validations = round(num_datapoints * (1.0 - train_percent))
+    datapoint_indices = np.random.default_rng(seed).permutation(num_datapoints)
+    arrays["validation-indices"] = np.sort(datapoint_indices[:num_validations])
+    arrays["training-indices"] = np.sort(datapoint_indices[num_validations:])
+
+    return arrays
+
+
+def do_search(minio_access_key,
+              minio_secret_key,
+              dataset_name,
+              num_trials=27,
+              num_workers=None,
+              threads_per_worker=1,
+              min_epochs=1,
+              max_epochs=9,
+              reduction_factor=3,
+              train_percent=0.9,
+              seed=0):
+    # get data first
+    dataset_paths, selection_datapoints_dict, embeddings_dict = get_data_dicts(minio_access_key=minio_access_key,
+                                                                               minio_secret_key=minio_secret_key,
+                                                                               dataset_name=dataset_name)
+
+    arrays = get_packed_arrays(dataset_paths, selection_datapoints_dict, embeddings_dict, train_percent, seed)
+    del selection_datapoints_dict, embeddings_dict
+
+    trials, elapsed_time = run_search(arrays,
+                                      num_trials=num_trials,
+                                      num_workers=num_workers,
+                                      threads_per_worker=threads_per_worker,
+                                      min_epochs=min_epochs,
+                                      max_epochs=max_epochs,
+                                      reduction_factor=reduction_factor,
+                                      seed=seed)
+
+    for trial in trials:
+        print("Trial {}: validation loss={:.4f}, training loss={:.4f}, epochs={}, config={}".format(
+            trial["trial-id"], trial["validation-loss"], trial["training-loss"], trial["epochs"], trial["config"]))
+
+    best_result_config = trials[0]["config"]
+    print(best_result_config)
+
+    return best_result_config
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(
+        description="Hyperparameter search with a local process pool and successive halving")
+    subparsers = parser.add_subparsers(title="subcommands", dest="subcommand")
+    subparsers.required = True
+
+    # Subparser for 'search' command
+    train_parser = subparsers.add_parser("search", help="Search optimum parameters for the model")
+    train_parser.add_argument('--minio-access-key', type=str, help='Minio access key')
+    train_parser.add_argument('--minio-secret-key', type=str, help='Minio secret key')
+    train_parser.add_argument('--dataset-name', type=str, help='The dataset name to use for training',
+                              default='environmental')
+    train_parser.add_argument('--num-trials', type=int, default=27)
+    train_parser.add_argument('--num-workers', type=int, default=None, help='Defaults to one per cpu core')
+    train_parser.add_argument('--threads-per-worker', type=int, default=1)
+    train_parser.add_argument('--min-epochs', type=int, default=1)
+    train_parser.add_argument('--max-epochs', type=int, default=9)
+    train_parser.add_argument('--reduction-factor', type=int, default=3)
+    train_parser.add_argument('--train-percent', type=float, default=0.9)
+    train_parser.add_argument('--seed', type=int, default=0)
+
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+
+    command = args.subcommand
+
+    if command == 'search':
+        do_search(args.minio_access_key,
+                  args.minio_secret_key,
+                  args.dataset_name,
+                  num_trials=args.num_trials,
+                  num_workers=args.num_workers,
+                  threads_per_worker=args.threads_per_worker,
+                  min_epochs=args.min_epochs,
+                  max_epochs=args.max_epochs,
+                  reduction_factor=args.reduction_factor,
+                  train_percent=args.train_percent,
+                  seed=args.seed)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,8 @@
 import sys
 import json
+import msgpack
+import numpy as np
+from multiprocessing import shared_memory
 from tqdm import tqdm
 
 base_directory = "./"
@@ -7,6 +10,7 @@ sys.path.insert(0, base_directory)
 
 from utility.minio import cmd
 from training_worker.ab_ranking.model.ab_ranking_data_loader import get_aggregated_selection_datapoints, get_object, ABData
+from training_worker.ab_ranking.model import constants
 
 
 def get_data_dicts(minio_access_key, minio_secret_key, dataset_name):
@@ -62,3 +66,134 @@ def get_data_dicts(minio_access_key, minio_secret_key, dataset_name):
         embeddings_dict[embeddings_path_img_2] = embeddings_img_2_data
 
     return dataset_paths, selection_datapoints_dict, embeddings_dict
+
+
+def get_embeddings_path(file_path):
+    # embeddings are in file_path_embedding.msgpack
+    embeddings_path = file_path.replace(".jpg", "_embedding.msgpack")
+    embeddings_path = embeddings_path.replace("datasets/", "")
+
+    return embeddings_path
+
+
+# (num embeddings, 77, 768) float32 array of one image
+def get_embeddings_array(embeddings_data, input_type):
+    embeddings_data = msgpack.unpackb(embeddings_data)
+
+    embeddings_vector = []
+    if input_type in [constants.EMBEDDING, constants.EMBEDDING_POSITIVE]:
+        embeddings_vector.extend(embeddings_data["positive_embedding"]["__ndarray__"])
+    if input_type in [constants.EMBEDDING, constants.EMBEDDING_NEGATIVE]:
+        embeddings_vector.extend(embeddings_data["negative_embedding"]["__ndarray__"])
+
+    return np.array(embeddings_vector, dtype=np.float32)
+
+
+# same normalization and pooling as ABRankingDatasetLoader, (num embeddings, 77, 768) -> (num embeddings * 768)
+def pool_embeddings_array(embeddings_array, pooling_strategy, normalize_vectors):
+    if normalize_vectors:
+        norm = np.sum(np.abs(embeddings_array), axis=1, keepdims=True)
+        embeddings_array = embeddings_array / np.maximum(norm, 1e-12)
+
+    if pooling_strategy == constants.AVERAGE_POOLING:
+        pooled = np.mean(embeddings_array, axis=1)
+    elif pooling_strategy == constants.MAX_POOLING:
+        pooled = np.max(embeddings_array, axis=1)
+    elif pooling_strategy == constants.MAX_ABS_POOLING:
+        max_indices = np.argmax(np.abs(embeddings_array), axis=1)
+        pooled = np.take_along_axis(embeddings_array, np.expand_dims(max_indices, axis=1), axis=1).squeeze(1)
+    else:
+        raise Exception("pooling strategy is not supported: {}".format(pooling_strategy))
+
+    return pooled.reshape(-1)
+
+
+def get_feature_variant_name(pooling_strategy, normalize_vectors):
+    return "pooling-{}-normalize-{}".format(pooling_strategy, int(normalize_vectors))
+
+
+# decodes every selection datapoint once and pools it for each (pooling strategy, normalize vectors) variant
+# returns {variant name: (selected features, other features)}, both (num datapoints, feature size) float32
+def pack_selection_datapoint_features(dataset_paths,
+                                      selection_datapoints_dict,
+                                      embeddings_dict,
+                                      feature_variants,
+                                      input_type=constants.EMBEDDING):
+    packed_features = {}
+    for pooling_strategy, normalize_vectors in feature_variants:
+        packed_features[get_feature_variant_name(pooling_strategy, normalize_vectors)] = ([], [])
+
+    print("Packing features...")
+    for dataset_path in tqdm(dataset_paths):
+        ab_data = selection_datapoints_dict[dataset_path]
+
+        embeddings_img_1 = get_embeddings_array(embeddings_dict[get_embeddings_path(ab_data.image_1_path)], input_type)
+        embeddings_img_2 = get_embeddings_array(embeddings_dict[get_embeddings_path(ab_data.image_2_path)], input_type)
+
+        if ab_data.selected_image_index == 0:
+            selected_embeddings, other_embeddings = embeddings_img_1, embeddings_img_2
+        else:
+            selected_embeddings, other_embeddings = embeddings_img_2, embeddings_img_1
+
+        for pooling_strategy, normalize_vectors in feature_variants:
+            selected_list, other_list = packed_features[get_feature_variant_name(pooling_strategy, normalize_vectors)]
+            selected_list.append(pool_embeddings_array(selected_embeddings, pooling_strategy, normalize_vectors))
+            other_list.append(pool_embeddings_array(other_embeddings, pooling_strategy, normalize_vectors))
+
+    for name, (selected_list, other_list) in packed_features.items():
+        packed_features[name] = (np.stack(selected_list), np.stack(other_list))
+
+    return packed_features
+
+
+# numpy arrays in named shared memory blocks
+# the process that creates them owns the blocks and must call unlink(),
+# its child processes attach to the same memory with attach(descriptors) without copying
+class SharedArrays:
+    def __init__(self):
+        self.shared_memory_blocks = []
+        self.arrays = {}
+        self.descriptors = {}
+
+    @staticmethod
+    def create(arrays: dict):
+        shared_arrays = SharedArrays()
+        for name, array in arrays.items():
+            array = np.ascontiguousarray(array)
+            block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+            shared_array = np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)
+            shared_array[...] = array
+
+            shared_arrays.shared_memory_blocks.append(block)
+            shared_arrays.arrays[name] = shared_array
+            shared_arrays.descriptors[name] = (block.name, array.shape, array.dtype.str)
+
+        return shared_arrays
+
+    @staticmethod
+    def attach(descriptors: dict):
+        shared_arrays = SharedArrays()
+        for name, (block_name, shape, dtype) in descriptors.items():
+            block = shared_memory.SharedMemory(name=block_name)
+            shared_array = np.ndarray(shape, dtype=np.dtype(dtype), buffer=block.buf)
+            shared_array.flags.writeable = False
+
+            shared_arrays.shared_memory_blocks.append(block)
+            shared_arrays.arrays[name] = shared_array
+            shared_arrays.descriptors[name] = (block_name, shape, dtype)
+
+        return shared_arrays
+
+    def __getitem__(self, name):
+        return self.arrays[name]
+
+    def close(self):
+        self.arrays = {}
+        for block in self.shared_memory_blocks:
+            block.close()
+
+    def unlink(self):
+        self.close()
+        for block in self.shared_memory_blocks:
+            block.unlink()
+        self.shared_memory_blocks = []
@@ -0,0 +1,72 @@
+import os
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+base_directory = os.getcwd()
+sys.path.insert(0, base_directory)
+
+from training_worker.ab_ranking.model.reports import upload_score_residual
+
+
+# runs uploads in background threads so training of the next model does not wait for them
+# wait() blocks until every submitted upload is done and raises the first upload error
+class BackgroundUploader:
+    def __init__(self, max_workers=4):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.futures = []
+        self.lock = threading.Lock()
+
+    def submit(self, fn, *args, **kwargs):
+        future = self.executor.submit(fn, *args, **kwargs)
+        with self.lock:
+            self.futures.append(future)
+
+        return future
+
+    def wait(self):
+        with self.lock:
+            futures = self.futures
+            self.futures = []
+
+        first_exception = None
+        for future in futures:
+            exception = future.exception()
+            if exception is not None and first_exception is None:
+                first_exception = exception
+
+        if first_exception is not None:
+            raise first_exception
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True)
+
+
+# calls fn now, or in the background if an uploader is given
+def run_upload(uploader, fn, *args, **kwargs):
+    if uploader is None:
+        return fn(*args, **kwargs)
+
+    uploader.submit(fn, *args, **kwargs)
+
+
+# the score, residual and residual percentile entries are added with one bulk request.
+# per_image_entries sends three requests per image instead, for orchestration servers without the
+# bulk endpoint. it is off by default since it is slower than the baseline upload it replaced
+def add_model_card_and_upload_score_residual(minio_client, bucket_name, output_path, model_card,
+                                             *score_residual_args, per_image_entries=False):
+    model_id = upload_score_residual.add_model_card(model_card)
+
+    # the columns are computed once for the .npz object and the score, residual and percentile entries
+    columns = upload_score_residual.get_score_residual_columns(*score_residual_args)
+    upload_score_residual.upload_score_residual_columns(minio_client,
+                                                        bucket_name,
+                                                        output_path,
+                                                        model_id,
+                                                        columns)
+    if per_image_entries:
+        upload_score_residual.upload_score_residual_entries(model_id, columns)
+    else:
+        upload_score_residual.upload_score_residual_bulk(model_id, columns)
+
+    return model_id
@@ -0,0 +1,162 @@
+import sys
+import numpy as np
+import xgboost as xgb
+
+base_directory = "./"
+sys.path.insert(0, base_directory)
+
+from training_worker.ab_ranking.model.ab_ranking_data_loader import ABRankingDatasetLoader
+
+# pair design matrix modes
+PAIR_CONCAT = "concat"  # x || y
+PAIR_DIFF = "diff"  # x - y
+PAIR_X_ONLY = "x-only"
+
+# pairs read from the dataset loader at once when building and predicting the training data
+TRAINING_BATCH_SIZE = 4096
+
+
+def to_float32_array(tensor):
+    return np.ascontiguousarray(tensor.detach().cpu().numpy(), dtype=np.float32)
+
+
+# (first pair index, features x, features y, targets) float32 batches of the training pairs in loader order.
+# a streaming dataset loader only holds the shards of the current batch
+def get_training_batches(dataset_loader: ABRankingDatasetLoader, batch_size=TRAINING_BATCH_SIZE):
+    num_pairs = dataset_loader.get_len_training_ab_data()
+
+    dataset_loader.current_training_data_index = 0
+    try:
+        for start in range(0, num_pairs, batch_size):
+            features_x, \
+                features_y, \
+                targets = dataset_loader.get_next_training_feature_vectors_and_target_linear(
+                min(batch_size, num_pairs - start))
+
+            yield start, to_float32_array(features_x), to_float32_array(features_y), to_float32_array(targets)
+    finally:
+        dataset_loader.current_training_data_index = 0
+
+
+# gives xgboost the training pairs a batch at a time. a QuantileDMatrix built from it only
+# keeps the quantized features, the float32 training matrix is never held in memory at once.
+# get_input_data maps a training batch to the keyword arguments of input_data
+class TrainingBatchIter(xgb.DataIter):
+    def __init__(self, dataset_loader: ABRankingDatasetLoader, get_input_data, batch_size=TRAINING_BATCH_SIZE):
+        self.dataset_loader = dataset_loader
+        self.get_input_data = get_input_data
+        self.batch_size = batch_size
+        self.batches = None
+        super().__init__()
+
+    def next(self, input_data):
+        if self.batches is None:
+            self.batches = get_training_batches(self.dataset_loader, self.batch_size)
+
+        batch = next(self.batches, None)
+        if batch is None:
+            return False
+
+        input_data(**self.get_input_data(*batch))
+        return True
+
+    def reset(self):
+        if self.batches is not None:
+            self.batches.close()
+        self.batches = None
+
+
+# (num pairs, feature size) float32 x and y features and (num pairs, 1) targets of the validation data
+def get_validation_feature_matrices(dataset_loader: ABRankingDatasetLoader):
+    validation_features_x, \
+        validation_features_y, \
+        validation_targets = dataset_loader.get_validation_feature_vectors_and_target_linear()
+
+    return to_float32_array(validation_features_x), \
+        to_float32_array(validation_features_y), \
+        to_float32_array(validation_targets)
+
+
+# contiguous float32 (num pairs, columns) matrix, can be given to xgboost without a copy
+def get_pair_design_matrix(features_x, features_y, mode=PAIR_CONCAT):
+    if mode == PAIR_CONCAT:
+        design_matrix = np.concatenate((features_x, features_y), axis=1)
+    elif mode == PAIR_DIFF:
+        design_matrix = np.subtract(features_x, features_y)
+    elif mode == PAIR_X_ONLY:
+        design_matrix = features_x
+    else:
+        raise Exception("pair design matrix mode is not supported: {}".format(mode))
+
+    return np.ascontiguousarray(design_matrix, dtype=np.float32)
+
+
+# rows x_0, y_0, x_1, y_1, ... with labels target, 1 - target and one query group of 2 rows per pair
+def get_pair_ranking_matrix(features_x, features_y, targets):
+    num_pairs = len(features_x)
+    targets = np.asarray(targets, dtype=np.float32).reshape(-1)
+
+    ranking_matrix = np.stack((features_x, features_y), axis=1).reshape(2 * num_pairs, -1)
+    labels = np.stack((targets, 1.0 - targets), axis=1).reshape(-1)
+    group = np.full(num_pairs, 2, dtype=np.uint32)
+
+    return np.ascontiguousarray(ranking_matrix, dtype=np.float32), labels, group
+
+
+# input data of a training batch for TrainingBatchIter, x || y rows labelled with the target
+def get_design_input_data(start, features_x, features_y, targets, mode=PAIR_CONCAT):
+    return {"data": get_pair_design_matrix(features_x, features_y, mode), "label": targets}
+
+
+# input data of a training batch for TrainingBatchIter, the rows of get_pair_ranking_matrix.
+# the query id of both rows of a pair is its index in the training data, so ids increase across batches
+def get_ranking_input_data(start, features_x, features_y, targets):
+    ranking_matrix, labels, _ = get_pair_ranking_matrix(features_x, features_y, targets)
+    qid = np.repeat(np.arange(start, start + len(features_x), dtype=np.uint32), 2)
+
+    return {"data": ranking_matrix, "label": labels, "qid": qid}
+
+
+# scores x and y of every pair with a single predict call
+def predict_pair_scores(booster, features_x, features_y):
+    num_pairs = len(features_x)
+    scores = booster.inplace_predict(np.concatenate((features_x, features_y), axis=0))
+
+    return scores[:num_pairs], scores[num_pairs:]
+
+
+# predictions of the x || y rows of the training pairs and their targets, read a batch at a time
+def predict_training_design(booster, dataset_loader: ABRankingDatasetLoader, mode=PAIR_CONCAT,
+                            batch_size=TRAINING_BATCH_SIZE):
+    predictions = []
+    targets = []
+    for _, features_x, features_y, batch_targets in get_training_batches(dataset_loader, batch_size):
+        predictions.append(booster.inplace_predict(get_pair_design_matrix(features_x, features_y, mode)))
+        targets.append(batch_targets)
+
+    return np.concatenate(predictions), np.concatenate(targets)
+
+
+# scores x and y of the training pairs and their targets, read a batch at a time
+def predict_training_pair_scores(booster, dataset_loader: ABRankingDatasetLoader, batch_size=TRAINING_BATCH_SIZE):
+    scores_x = []
+    scores_y = []
+    targets = []
+    for _, features_x, features_y, batch_targets in get_training_batches(dataset_loader, batch_size):
+        batch_scores_x, batch_scores_y = predict_pair_scores(booster, features_x, features_y)
+        scores_x.append(batch_scores_x)
+        scores_y.append(batch_scores_y)
+        targets.append(batch_targets)
+
+    return np.concatenate(scores_x), np.concatenate(scores_y), np.concatenate(targets)
+
+
+# number of pairs where the score order agrees with the target
+def get_num_correct(targets, scores_x, scores_y):
+    targets = np.asarray(targets).reshape(-1)
+    scores_x = np.asarray(scores_x).reshape(-1)
+    scores_y = np.asarray(scores_y).reshape(-1)
+
+    correct = np.where(targets == 1.0, scores_x > scores_y, scores_x < scores_y)
+
+    return int(np.sum(correct))
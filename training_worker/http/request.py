@@ -138,6 +138,22 @@ def http_add_residual(residual_data):
     return None
 
 
+# scores, residuals and residual percentiles of every image of a model in one request
+def http_add_score_residual_columns(score_residual_data):
+    url = SERVER_ADRESS + "/score/set-image-rank-scores-and-residuals"
+    headers = {"Content-type": "application/json"}  # Setting content type header to indicate sending JSON data
+
+    try:
+        response = requests.post(url, json=score_residual_data, headers=headers)
+
+        if response.status_code != 200:
+            print(f"request failed with status code: {response.status_code}: {str(response.content)}")
+    except Exception as e:
+        print('request exception ', e)
+
+    return None
+
+
 def http_add_percentile(percentile_data):
     url = SERVER_ADRESS + "/percentile/set-image-rank-percentile"
     headers = {"Content-type": "application/json"}  # Setting content type header to indicate sending JSON data
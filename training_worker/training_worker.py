@@ -8,7 +8,9 @@ base_directory = "./"
 sys.path.insert(0, base_directory)
 
 from training_worker.http import request
-from training_worker.ab_ranking_linear.script.ab_ranking_linear import run_ab_ranking_linear_task
+from training_worker.ab_ranking.script.ab_ranking_linear import run_ab_ranking_linear_task
+from training_worker.ab_ranking.script.ab_ranking_elm_v1 import run_ab_ranking_elm_v1_task
+from training_worker.ab_ranking.script.ab_ranking_multi_model import run_ab_ranking_multi_model_task
 
 
 def info(message):
@@ -74,12 +76,16 @@ def main():
             job_start_time = time.time()
             task_type = job['task_type']
             try:
-                if task_type == 'ab_ranking_linear_task':
+                if task_type in ['ab_ranking_linear_task', 'ab_ranking_elm_v1_task']:
+                    run_task = run_ab_ranking_linear_task
+                    if task_type == 'ab_ranking_elm_v1_task':
+                        run_task = run_ab_ranking_elm_v1_task
+
                     model_output_path, \
                         report_output_path, \
-                        graph_output_path = run_ab_ranking_linear_task(training_task=job,
-                                                                       minio_access_key=minio_access_key,
-                                                                       minio_secret_key=minio_secret_key)
+                        graph_output_path = run_task(training_task=job,
+                                                     minio_access_key=minio_access_key,
+                                                     minio_secret_key=minio_secret_key)
 
                     # update job info after completion
                     job['task_completion_time'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
@@ -91,6 +97,29 @@ def main():
                     info("output_model_path: " + model_output_path)
                     info("job completed: " + job["uuid"])
 
+                    # update status
+                    request.http_update_job_completed(job)
+                elif task_type == 'ab_ranking_multi_model_task':
+                    outputs, timings = run_ab_ranking_multi_model_task(training_task=job,
+                                                                       minio_access_key=minio_access_key,
+                                                                       minio_secret_key=minio_secret_key)
+
+                    # update job info after completion
+                    job['task_completion_time'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+                    task_output_file_dict = {}
+                    for model_type, (model_output_path, report_output_path, graph_output_path) in outputs.items():
+                        task_output_file_dict[model_type] = {
+                            'output_model_path': model_output_path,
+                            'output_graph_path': graph_output_path
+                        }
+                        # xgboost has no txt report
+                        if report_output_path is not None:
+                            task_output_file_dict[model_type]['output_report_path'] = report_output_path
+                        info("{} output_model_path: {}".format(model_type, model_output_path))
+                    task_output_file_dict['timings'] = timings
+                    job['task_output_file_dict'] = task_output_file_dict
+                    info("job completed: " + job["uuid"])
+
                     # update status
                     request.http_update_job_completed(job)
                 else:
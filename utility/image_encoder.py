@@ -0,0 +1,73 @@
+import hashlib
+import io
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+IMAGE_FORMATS = ['jpeg', 'webp']
+
+
+# encodes one `[height, width, channels]` uint8 image, returns the encoded bytes and their sha256.
+# runs in the encoder processes, so it only depends on numpy and PIL
+def encode_image(image, img_format='jpeg', quality=75):
+    img = Image.fromarray(image)
+    buffer = io.BytesIO()
+    img.save(buffer, format=img_format, quality=quality)
+    data = buffer.getvalue()
+
+    return data, hashlib.sha256(data).hexdigest()
+
+
+# encodes and hashes the images of a decoded batch in a pool of processes, so the
+# cpu work of a batch runs in parallel and does not hold the gil of the worker threads.
+# with no encoder processes the images are encoded in the calling thread
+class ImageEncoder:
+    def __init__(self, num_workers=0, img_format='jpeg', quality=75):
+        if img_format not in IMAGE_FORMATS:
+            raise Exception("image format {} is not supported, use one of {}".format(img_format, IMAGE_FORMATS))
+        if not 1 <= quality <= 100:
+            raise Exception("image quality should be between 1 and 100, got {}".format(quality))
+
+        self.num_workers = num_workers
+        self.img_format = img_format
+        self.quality = quality
+        self.pool = None
+        if num_workers > 0:
+            # spawn, since forking the multithreaded worker can deadlock the children
+            self.pool = ProcessPoolExecutor(max_workers=num_workers,
+                                            mp_context=multiprocessing.get_context("spawn"))
+
+    # starts the processes, so the first batch does not wait for them
+    def warmup(self):
+        if self.pool is None:
+            return
+
+        image = np.zeros((8, 8, 3), dtype=np.uint8)
+        futures = [self.pool.submit(encode_image, image, self.img_format, self.quality)
+                   for _ in range(self.num_workers)]
+        for future in futures:
+            future.result()
+
+    # images is a `[batch_size, height, width, channels]` uint8 array.
+    # returns a list of (buffer, sha256), each buffer is at position 0 and ready to upload
+    def encode(self, images):
+        images = np.ascontiguousarray(images)
+        if images.dtype != np.uint8 or images.ndim != 4:
+            raise Exception("expected a [batch_size, height, width, channels] uint8 array, got {} {}".format(
+                images.dtype, images.shape))
+
+        # a single image is not worth the round trip to the pool
+        if self.pool is None or len(images) == 1:
+            results = [encode_image(image, self.img_format, self.quality) for image in images]
+        else:
+            results = list(self.pool.map(encode_image, images, [self.img_format] * len(images),
+                                         [self.quality] * len(images)))
+
+        return [(io.BytesIO(data), data_hash) for data, data_hash in results]
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
@@ -54,6 +54,25 @@ def http_add_job(job):
         print(f"POST request failed with status code: {response.status_code}")
 
 
+# adds a list of jobs with a single request
+def http_add_jobs(jobs):
+    url = SERVER_ADRESS + "/queue/image-generation/add-jobs"
+    headers = {"Content-type": "application/json"}  # Setting content type header to indicate sending JSON data
+
+    try:
+        response = requests.post(url, json=jobs, headers=headers)
+
+        if response.status_code == 201 or response.status_code == 200:
+            return True
+
+        print(f"POST request failed with status code: {response.status_code}")
+
+    except Exception as e:
+        print('request exception ', e)
+
+    return False
+
+
 def http_update_job_completed(job):
     url = SERVER_ADRESS + "/queue/image-generation/update-completed"
     headers = {"Content-type": "application/json"}  # Setting content type header to indicate sending JSON data
@@ -12,9 +12,13 @@ from stable_diffusion.utils_image import save_images_to_minio, save_image_data_t
 
 
 def generate_image_from_text(minio_client, txt2img, clip_text_embedder, job_uuid, dataset, sampler, sampler_steps,
-                             positive_prompts, negative_prompts, cfg_strength, seed, image_width, image_height, output_path):
+                             positive_prompts, negative_prompts, cfg_strength, seed, image_width, image_height, output_path,
+                             sampler_callback=None, negative_embedded_prompts=None, guidance_fraction=1.0,
+                             image_encoder=None):
     embedded_prompts = clip_text_embedder(positive_prompts)
-    negative_embedded_prompts = clip_text_embedder(negative_prompts)
+    # workers pass the cached embedding of the negative prompt
+    if negative_embedded_prompts is None:
+        negative_embedded_prompts = clip_text_embedder(negative_prompts)
 
     prompt_scoring_model = 'N/A'
     prompt_score = 'N/A'
@@ -28,12 +32,14 @@ def generate_image_from_text(minio_client, txt2img, clip_text_embedder, job_uuid
         uncond_scale=cfg_strength,
         seed=seed,
         w=image_width,
-        h=image_height
+        h=image_height,
+        callback=sampler_callback,
+        guidance_fraction=guidance_fraction
     )
 
     images = txt2img.get_image_from_latent(latent)
     output_file_path = output_path
-    output_file_hash, img_data = get_image_data(images)
+    output_file_hash, img_data = get_image_data(images, encoder=image_encoder)
 
     # save image meta data
     save_image_data_to_minio(minio_client, job_uuid, datetime.now().strftime('%Y-%m-%d %H:%M:%S'), dataset,
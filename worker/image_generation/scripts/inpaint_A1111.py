@@ -10,7 +10,6 @@ from dataclasses import dataclass, field
 from datetime import datetime
 from os.path import join
 from typing import Any
-import io
 import cv2
 import numpy as np
 import torch
@@ -25,15 +24,15 @@ from utility import masking, images, rng, prompt_parser
 from utility.rng import ImageRNG
 from utility.utils_logger import logger
 from utility.path import separate_bucket_and_file_path
+from utility.image_encoder import ImageEncoder
 from utility.minio import cmd
 from configs.model_config import ModelPathConfig
-from stable_diffusion.sampler.ddim import DDIMSampler
-from stable_diffusion.sampler.ddpm import DDPMSampler
+from stable_diffusion.sampler.factory import get_sampler
 from stable_diffusion.sampler.diffusion import DiffusionSampler
 from stable_diffusion.latent_diffusion import LatentDiffusion
 from stable_diffusion.utils_backend import get_device, torch_gc, without_autocast, get_autocast
 from stable_diffusion import StableDiffusion, CLIPTextEmbedder
-from stable_diffusion.model_paths import (SDconfigs, CLIPconfigs)
+from stable_diffusion.model_paths import CLIPconfigs
 
 # NOTE: It's just for the prompt embedder. Later refactor
 
@@ -199,8 +198,12 @@ class StableDiffusionProcessing:
     sd: StableDiffusion = None
     model: LatentDiffusion = None
     clip_text_embedder: CLIPTextEmbedder = None
+    # called with a negative prompt to get its embedding, workers pass their cached embeddings
+    embed_negative_prompt: Any = None
     n_steps: int = 50
     ddim_eta: float = 0.0
+    # called with the sampling progress after every step
+    sampler_callback: Any = None
 
     def prompt_embedding_vectors(self, prompt_array):
         embedded_prompts = []
@@ -233,7 +236,7 @@ class StableDiffusionProcessing:
         StableDiffusionProcessing.cached_c = [None, None]
         StableDiffusionProcessing.cached_uc = [None, None]
 
-        self.clip_text_embedder.to("cpu")
+        # the text embedder is shared with the other tasks, so it stays on its device
         torch.cuda.empty_cache()
 
     def setup_prompts(self):
@@ -306,7 +309,10 @@ class StableDiffusionProcessing:
         negative_prompts = prompt_parser.SdConditioning(self.negative_prompts, width=self.width, height=self.height,
                                                         is_negative_prompt=True)
 
-        self.uc = self.prompt_embedding_vectors(negative_prompts)[0]
+        if self.embed_negative_prompt is not None:
+            self.uc = self.embed_negative_prompt(negative_prompts[0])
+        else:
+            self.uc = self.prompt_embedding_vectors(negative_prompts)[0]
         self.c = self.prompt_embedding_vectors(prompts)[0]
 
 
@@ -326,6 +332,13 @@ class StableDiffusionProcessingImg2Img(StableDiffusionProcessing):
     inpainting_mask_invert: int = 0
     initial_noise_multiplier: float = None
     latent_mask: Image = None
+    # the init image and the mask are read from these files when they are not given, and what
+    # is prepared from them is kept in `init_cache` by their content
+    init_image_path: str = None
+    init_mask_path: str = None
+    init_cache: Any = None
+    # encodes and hashes the images of the batch
+    image_encoder: Any = field(default_factory=ImageEncoder)
 
     image_mask: Any = field(default=None, init=False)
 
@@ -357,12 +370,53 @@ class StableDiffusionProcessingImg2Img(StableDiffusionProcessing):
     def init(self, all_prompts, all_seeds, all_subseeds):
         self.image_cfg_scale: float = None
 
-        if self.sampler_name == 'ddim':
-            self.sampler = DDIMSampler(self.model,
-                                       n_steps=self.n_steps,
-                                       ddim_eta=self.ddim_eta)
-        elif self.sampler_name == 'ddpm':
-            self.sampler = DDPMSampler(self.model)
+        self.sampler = get_sampler(self.sampler_name, self.model, n_steps=self.n_steps, ddim_eta=self.ddim_eta)
+
+        cache_key = self.get_init_cache_key()
+        init_data = self.init_cache.get(cache_key) if cache_key is not None else None
+        if init_data is None:
+            init_data = self.prepare_init()
+            if cache_key is not None:
+                self.init_cache.put(cache_key, init_data)
+
+        self.apply_init(init_data, all_seeds)
+
+    def get_init_cache_key(self):
+        # only images read from files are cached, by their content
+        if self.init_cache is None or self.init_image_path is None or self.latent_mask is not None:
+            return None
+
+        content_hashes = [self.init_cache.get_file_hash(self.init_image_path)]
+        if self.init_mask_path is not None:
+            content_hashes.append(self.init_cache.get_file_hash(self.init_mask_path))
+
+        # everything prepare_init depends on besides the images
+        settings = {
+            "width": self.width,
+            "height": self.height,
+            "batch_size": self.batch_size,
+            "resize_mode": self.resize_mode,
+            "mask_blur_x": self.mask_blur_x,
+            "mask_blur_y": self.mask_blur_y,
+            "inpaint_full_res": self.inpaint_full_res,
+            "inpaint_full_res_padding": self.inpaint_full_res_padding,
+            "inpainting_mask_invert": self.inpainting_mask_invert,
+            "inpainting_fill": self.inpainting_fill,
+            "img2img_color_correction": opts.img2img_color_correction,
+            "img2img_background_color": opts.img2img_background_color,
+        }
+
+        return self.init_cache.get_key(content_hashes, settings)
+
+    def prepare_init(self):
+        """
+        Prepares what sampling needs from the init images and the mask, the same for every
+        job with the same images and settings
+        """
+        if self.init_images is None:
+            self.init_images = [Image.open(self.init_image_path)]
+        if self.image_mask is None and self.init_mask_path is not None:
+            self.image_mask = Image.open(self.init_mask_path)
 
         crop_region = None
 
@@ -472,24 +526,58 @@ class StableDiffusionProcessingImg2Img(StableDiffusionProcessing):
 
         # self.init_latent = images_tensor_to_samples(image, approximation_indexes.get(opts.sd_vae_encode_method),
         #                                             self.sd_model)
-        self.init_latent = self.model.autoencoder_encode(image)
+        # the latent distribution of the init images, the init latent is sampled from it for each job
+        latent_distribution = self.model.first_stage_model.encode(image)
         torch_gc()
 
-        if self.resize_mode == 3:
-            self.init_latent = torch.nn.functional.interpolate(self.init_latent,
-                                                               size=(self.height // opt_f, self.width // opt_f),
-                                                               mode="bilinear")
-
         if image_mask is not None:
-            init_mask = latent_mask
-            latmask = init_mask.convert('RGB').resize((self.init_latent.shape[3], self.init_latent.shape[2]))
+            # the size of the init latent, which is resized for `resize_mode` 3
+            if self.resize_mode == 3:
+                latent_height, latent_width = self.height // opt_f, self.width // opt_f
+            else:
+                latent_height, latent_width = latent_distribution.mean.shape[2:]
+            latmask = latent_mask.convert('RGB').resize((latent_width, latent_height))
             latmask = np.moveaxis(np.array(latmask, dtype=np.float32), 2, 0) / 255
             latmask = latmask[0]
             latmask = np.around(latmask)
             latmask = np.tile(latmask[None], (4, 1, 1))
+            latmask = torch.asarray(latmask).type(torch.float32)
+        else:
+            latmask = None
+
+        return {
+            "latent_mean": latent_distribution.mean.cpu(),
+            "latent_std": latent_distribution.std.cpu(),
+            "latmask": latmask,
+            "batch_size": self.batch_size,
+            "paste_to": getattr(self, "paste_to", None),
+            "mask_for_overlay": self.mask_for_overlay,
+            "overlay_images": self.overlay_images,
+            "color_corrections": self.color_corrections,
+        }
+
+    def apply_init(self, init_data, all_seeds):
+        self.batch_size = init_data["batch_size"]
+        self.paste_to = init_data["paste_to"]
+        self.mask_for_overlay = init_data["mask_for_overlay"]
+        self.overlay_images = init_data["overlay_images"]
+        self.color_corrections = init_data["color_corrections"]
+
+        # sample the init latent like autoencoder_encode does
+        latent_mean = init_data["latent_mean"].to(self.device)
+        latent_std = init_data["latent_std"].to(self.device)
+        self.init_latent = self.model.latent_scaling_factor * (latent_mean + latent_std * torch.randn_like(latent_std))
 
-            self.mask = torch.asarray(1.0 - latmask).to(self.device).type(torch.float32)
-            self.nmask = torch.asarray(latmask).to(self.device).type(torch.float32)
+        if self.resize_mode == 3:
+            self.init_latent = torch.nn.functional.interpolate(self.init_latent,
+                                                               size=(self.height // opt_f, self.width // opt_f),
+                                                               mode="bilinear")
+
+        if init_data["latmask"] is not None:
+            latmask = init_data["latmask"].to(self.device)
+
+            self.mask = 1.0 - latmask
+            self.nmask = latmask
 
             # this needs to be fixed to be done in sample() using actual seeds for batches
             if self.inpainting_fill == 2:
@@ -523,6 +611,7 @@ class StableDiffusionProcessingImg2Img(StableDiffusionProcessing):
                                      uncond_scale=uncond_scale,
                                      uncond_cond=unconditional_conditioning,
                                      mask=self.mask,
+                                     callback=self.sampler_callback,
                                      )
         if self.mask is not None:
             samples = samples * self.nmask + self.init_latent * self.mask
@@ -632,26 +721,23 @@ def process_images(p: StableDiffusionProcessingImg2Img):
 
             del samples_ddim
 
+            # one copy of the uint8 batch to the cpu
+            x_samples_ddim = (255. * x_samples_ddim).to(torch.uint8).permute(0, 2, 3, 1).cpu().numpy()
+
+            output_images = []
             for i, x_sample in enumerate(x_samples_ddim):
                 p.batch_index = i
 
-                x_sample = 255. * np.moveaxis(x_sample.cpu().numpy(), 0, 2)
-                x_sample = x_sample.astype(np.uint8)
-
                 image = Image.fromarray(x_sample)
 
                 image = apply_overlay(image, p.paste_to, i, p.overlay_images)
+                output_images.append(np.asarray(image.convert('RGB')))
 
-                # convert to bytes arr
-                img_byte_arr = io.BytesIO()
-                image.save(img_byte_arr, format='JPEG')
-                img_byte_arr.seek(0)
-
-                # get hash
-                output_file_hash = (hashlib.sha256(img_byte_arr.getbuffer())).hexdigest()
+            # encode and hash the batch, in parallel when the encoder has processes
+            img_byte_arr, output_file_hash = p.image_encoder.encode(np.stack(output_images))[-1]
 
-                # save to minio server
-                output_file_path = p.outpath
+            # save to minio server
+            output_file_path = p.outpath
 
             del x_samples_ddim
             torch_gc()
@@ -671,9 +757,7 @@ def get_model(device, n_steps):
     # NOTE: Initializing stable diffusion
     sd = StableDiffusion(device=device, n_steps=n_steps)
     config = ModelPathConfig()
-    sd.quick_initialize().load_autoencoder(config.get_model(SDconfigs.VAE)).load_decoder(
-        config.get_model(SDconfigs.VAE_DECODER))
-    sd.model.load_unet(config.get_model(SDconfigs.UNET))
+    # all the weights are in the checkpoint, so the submodels are not loaded separately
     sd.initialize_latent_diffusion(path='input/model/sd/v1-5-pruned-emaonly/v1-5-pruned-emaonly.safetensors',
                                    force_submodels_init=True)
     model = sd.model
@@ -684,7 +768,9 @@ def get_model(device, n_steps):
 def img2img(prompt: str, negative_prompt: str, sampler_name: str, batch_size: int, n_iter: int, steps: int,
             cfg_scale: float, width: int, height: int, mask_blur: int, inpainting_fill: int,
             outpath, styles, init_images, mask, resize_mode, denoising_strength,
-            image_cfg_scale, inpaint_full_res_padding, inpainting_mask_invert, sd=None, clip_text_embedder=None, model=None, device=None):
+            image_cfg_scale, inpaint_full_res_padding, inpainting_mask_invert, sd=None, clip_text_embedder=None, model=None, device=None,
+            sampler_callback=None, embed_negative_prompt=None, init_image_path=None, init_mask_path=None,
+            init_cache=None, image_encoder=None):
     p = StableDiffusionProcessingImg2Img(
         outpath=outpath,
         prompt=prompt,
@@ -698,7 +784,7 @@ def img2img(prompt: str, negative_prompt: str, sampler_name: str, batch_size: in
         width=width,
         height=height,
         init_images=init_images,
-        mask=create_binary_mask(mask),
+        mask=create_binary_mask(mask) if mask is not None else None,
         mask_blur=mask_blur,
         inpainting_fill=inpainting_fill,
         resize_mode=resize_mode,
@@ -708,8 +794,14 @@ def img2img(prompt: str, negative_prompt: str, sampler_name: str, batch_size: in
         inpainting_mask_invert=inpainting_mask_invert,
         sd=sd,
         clip_text_embedder=clip_text_embedder,
+        embed_negative_prompt=embed_negative_prompt,
         model=model,
-        device=device
+        device=device,
+        sampler_callback=sampler_callback,
+        init_image_path=init_image_path,
+        init_mask_path=init_mask_path,
+        init_cache=init_cache,
+        image_encoder=image_encoder if image_encoder is not None else ImageEncoder()
     )
 
     with closing(p):
@@ -9,8 +9,7 @@ sys.path.append(os.path.abspath(''))
 
 from stable_diffusion.utils_backend import get_device
 from stable_diffusion.utils_image import load_img
-from stable_diffusion.sampler.ddim import DDIMSampler
-from stable_diffusion.sampler.ddpm import DDPMSampler
+from stable_diffusion.sampler.factory import get_sampler
 from stable_diffusion.utils_model import initialize_latent_diffusion
 from stable_diffusion.latent_diffusion import LatentDiffusion
 from stable_diffusion.sampler.diffusion import DiffusionSampler
@@ -36,7 +35,7 @@ class StableDiffusionBaseScript:
                  ):
         """
         :param checkpoint_path: is the path of the checkpoint
-        :param sampler_name: is the name of the [sampler](../sampler/index.html)
+        :param sampler_name: is the name of the [sampler](../sampler/factory.html)
         :param n_steps: is the number of sampling steps
         :param ddim_eta: is the [DDIM sampling](../sampler/ddim.html) $\eta$ constant
         """
@@ -109,6 +108,8 @@ class StableDiffusionBaseScript:
                                                low_vram: bool = False,
                                                noise_fn=torch.randn,
                                                temperature: float = 1.0,
+                                               callback=None,
+                                               guidance_fraction: float = 1.0,
                                                ):
         """
         :param seed: the seed to use when generating the images
@@ -120,6 +121,8 @@ class StableDiffusionBaseScript:
         :param uncond_scale: is the unconditional guidance scale $s$. This is used for
             $\epsilon_\theta(x_t, c) = s\epsilon_\text{cond}(x_t, c) + (s - 1)\epsilon_\text{cond}(x_t, c_u)$
         :param low_vram: whether to limit VRAM usage
+        :param callback: is called with the [sampling progress](../sampler/progress.html) after every step
+        :param guidance_fraction: is the fraction of the sampling steps guidance is applied for
         """
 
         # check null_prompt, raise exception if None
@@ -150,7 +153,9 @@ class StableDiffusionBaseScript:
                                     uncond_scale=uncond_scale,
                                     uncond_cond=null_prompt,
                                     noise_fn=noise_fn,
-                                    temperature=temperature)
+                                    temperature=temperature,
+                                    callback=callback,
+                                    guidance_fraction=guidance_fraction)
 
             return x
 
@@ -161,7 +166,9 @@ class StableDiffusionBaseScript:
               uncond_scale: float = 1.0,
               un_cond: Optional[torch.Tensor] = None,
               mask: Optional[torch.Tensor] = None,
-              orig_noise: Optional[torch.Tensor] = None):
+              orig_noise: Optional[torch.Tensor] = None,
+              callback=None,
+              guidance_fraction: float = 1.0):
 
         orig_2 = None
         # If we have a mask and noise, it's in-painting
@@ -175,7 +182,9 @@ class StableDiffusionBaseScript:
                                mask=mask,
                                orig_noise=orig_noise,
                                uncond_scale=uncond_scale,
-                               uncond_cond=un_cond)
+                               uncond_cond=un_cond,
+                               callback=callback,
+                               guidance_fraction=guidance_fraction)
 
         return x
 
@@ -247,12 +256,7 @@ class StableDiffusionBaseScript:
                 "Stable Diffusion model couldn't be loaded. Check that the .ckpt file exists in the specified location (path), and that it is not corrupted.")
 
     def initialize_sampler(self):
-        if self.sampler_name == 'ddim':
-            self.sampler = DDIMSampler(self.model,
-                                       n_steps=self.n_steps,
-                                       ddim_eta=self.ddim_eta)
-        elif self.sampler_name == 'ddpm':
-            self.sampler = DDPMSampler(self.model)
+        self.sampler = get_sampler(self.sampler_name, self.model, n_steps=self.n_steps, ddim_eta=self.ddim_eta)
 
     def cache_empty_embedding(self, batch_size: int = 1):
         self.empty_embedding = self.model.get_text_conditioning(batch_size * [""])
@@ -0,0 +1,166 @@
+import hashlib
+import os
+import pickle
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import torch
+from PIL import Image
+
+
+# bytes held by a cached value
+def get_size_bytes(value):
+    if isinstance(value, torch.Tensor):
+        return value.element_size() * value.nelement()
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, Image.Image):
+        return value.width * value.height * len(value.getbands())
+    if isinstance(value, (list, tuple)):
+        return sum(get_size_bytes(item) for item in value)
+    if isinstance(value, dict):
+        return sum(get_size_bytes(item) for item in value.values())
+
+    return 0
+
+
+# keeps what inpainting prepares from an init image and a mask, the sampled latent
+# distribution, the latent mask and the overlays, keyed by the content of the files and
+# the settings used. inpainting datasets reuse a few base images, so repeated jobs skip
+# reading the images and encoding them with the vae.
+# entries are kept in memory and on disk, each bounded in size, least recently used first out
+class InpaintingCache:
+    def __init__(self, max_memory_bytes=512 * 1024 * 1024, cache_dir=None, max_disk_bytes=2 * 1024 * 1024 * 1024):
+        self.max_memory_bytes = max_memory_bytes
+        self.cache_dir = cache_dir
+        self.max_disk_bytes = max_disk_bytes
+        # key -> (entry, size in bytes)
+        self.entries = OrderedDict()
+        self.memory_bytes = 0
+        # (path, modification time, size) -> sha256 of the file
+        self.file_hashes = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+        if self.cache_dir is not None:
+            os.makedirs(self.cache_dir, exist_ok=True)
+
+    # hash of the file content, only read again when the file changes on disk
+    def get_file_hash(self, path):
+        stat = os.stat(path)
+        file_key = (os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+
+        with self.lock:
+            if file_key in self.file_hashes:
+                return self.file_hashes[file_key]
+
+        with open(path, "rb") as file:
+            file_hash = hashlib.sha256(file.read()).hexdigest()
+
+        with self.lock:
+            self.file_hashes[file_key] = file_hash
+
+        return file_hash
+
+    @staticmethod
+    def get_key(content_hashes, settings):
+        key = hashlib.sha256()
+        for content_hash in content_hashes:
+            key.update(str(content_hash).encode())
+        key.update(repr(sorted(settings.items())).encode())
+
+        return key.hexdigest()
+
+    def get_disk_path(self, key):
+        return os.path.join(self.cache_dir, key + ".pt")
+
+    def get(self, key):
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key][0]
+
+        entry = self.load_from_disk(key)
+        with self.lock:
+            if entry is None:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self.add_to_memory(key, entry)
+
+        return entry
+
+    def put(self, key, entry):
+        with self.lock:
+            self.add_to_memory(key, entry)
+
+        self.save_to_disk(key, entry)
+
+    def add_to_memory(self, key, entry):
+        if key in self.entries:
+            self.memory_bytes -= self.entries.pop(key)[1]
+
+        size = get_size_bytes(entry)
+        if size > self.max_memory_bytes:
+            return
+
+        self.entries[key] = (entry, size)
+        self.memory_bytes += size
+        while self.memory_bytes > self.max_memory_bytes:
+            _, (_, evicted_size) = self.entries.popitem(last=False)
+            self.memory_bytes -= evicted_size
+
+    def load_from_disk(self, key):
+        if self.cache_dir is None:
+            return None
+
+        path = self.get_disk_path(key)
+        try:
+            # the entries hold images, and the files are only written by this cache
+            entry = torch.load(path, map_location="cpu", weights_only=False)
+        # a missing, partly written or corrupt file is a cache miss
+        except (OSError, EOFError, RuntimeError, pickle.UnpicklingError):
+            return None
+
+        # mark as recently used for the disk eviction
+        os.utime(path)
+
+        return entry
+
+    def save_to_disk(self, key, entry):
+        if self.cache_dir is None:
+            return
+
+        path = self.get_disk_path(key)
+        # write to a temporary file first, so a partly written entry is never loaded
+        temp_path = "{}.{}.tmp".format(path, threading.get_ident())
+        torch.save(entry, temp_path)
+        os.replace(temp_path, path)
+
+        self.evict_from_disk()
+
+    def evict_from_disk(self):
+        files = []
+        for file_name in os.listdir(self.cache_dir):
+            if not file_name.endswith(".pt"):
+                continue
+            path = os.path.join(self.cache_dir, file_name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+
+        disk_bytes = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if disk_bytes <= self.max_disk_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            disk_bytes -= size
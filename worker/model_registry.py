@@ -0,0 +1,61 @@
+import resource
+import threading
+import time
+
+import torch
+
+
+# resident memory of the process in MiB, from /proc when available
+def get_resident_memory_mb():
+    try:
+        with open("/proc/self/status") as status_file:
+            for line in status_file:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+
+    # peak resident memory, in KiB on linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def get_memory_report():
+    report = "rss {:.0f} MiB".format(get_resident_memory_mb())
+    if torch.cuda.is_available():
+        report += ", cuda allocated {:.0f} MiB".format(torch.cuda.memory_allocated() / (1024 * 1024))
+
+    return report
+
+
+# loads each model once, the first time it is asked for, and hands the same
+# instance to every caller. loaders get the registry so they can share the
+# models they are built from
+class ModelRegistry:
+    def __init__(self):
+        self.loaders = {}
+        self.models = {}
+        self.load_times = {}
+        # loaders ask for the models they depend on while the lock is held
+        self.lock = threading.RLock()
+
+    def register(self, name, loader):
+        if name in self.models:
+            raise Exception("model {} is already loaded".format(name))
+
+        self.loaders[name] = loader
+
+    def is_loaded(self, name):
+        return name in self.models
+
+    def get(self, name):
+        with self.lock:
+            if name not in self.models:
+                if name not in self.loaders:
+                    raise Exception("model {} is not registered".format(name))
+
+                start_time = time.time()
+                self.models[name] = self.loaders[name](self)
+                self.load_times[name] = time.time() - start_time
+                print("loaded {} in {:.2f}s, {}".format(name, self.load_times[name], get_memory_report()))
+
+            return self.models[name]
@@ -5,6 +5,7 @@ import os
 import math
 import csv
 import uuid
+import threading
 from tqdm import tqdm
 
 base_directory = os.getcwd()
@@ -460,6 +461,7 @@ def generate_image_generation_jobs_using_generated_prompts(csv_dataset_path,
     # get sequential ids
     sequential_ids = request.http_get_sequential_id(dataset_name, prompt_count)
 
+    jobs = []
     count = 0
     # generate jobs
     for prompt in prompts:
@@ -490,12 +492,13 @@ def generate_image_generation_jobs_using_generated_prompts(csv_dataset_path,
                                          model_file_path=model_file_path,
                                          task_input_dict=task_input_dict)
         generation_task_json = generation_task.to_dict()
-
-        # add job
-        request.http_add_job(generation_task_json)
+        jobs.append(generation_task_json)
 
         count += 1
 
+    # add all the jobs with a single request
+    request.http_add_jobs(jobs)
+
 
 def generate_inpainting_generation_jobs_using_generated_prompts(csv_dataset_path,
                                                                 prompt_count,
@@ -513,6 +516,7 @@ def generate_inpainting_generation_jobs_using_generated_prompts(csv_dataset_path
     # get sequential ids
     sequential_ids = request.http_get_sequential_id(dataset_name, prompt_count)
 
+    jobs = []
     count = 0
     # generate jobs
     for prompt in prompts:
@@ -552,12 +556,13 @@ def generate_inpainting_generation_jobs_using_generated_prompts(csv_dataset_path
                                          model_file_path=model_file_path,
                                          task_input_dict=task_input_dict)
         generation_task_json = generation_task.to_dict()
-
-        # add job
-        request.http_add_job(generation_task_json)
+        jobs.append(generation_task_json)
 
         count += 1
 
+    # add all the jobs with a single request
+    request.http_add_jobs(jobs)
+
 
 def run_generate_image_generation_task(generation_task: GenerationTask):
     generate_image_generation_jobs_using_generated_prompts(
@@ -580,18 +585,15 @@ def run_generate_inpainting_generation_task(generation_task: GenerationTask):
 
 
 
-def generate_image_generation_jobs(positive_prompt,
-                                   negative_prompt,
-                                   prompt_scoring_model,
-                                   prompt_score,
-                                   prompt_generation_policy,
-                                   top_k,
-                                   dataset_name):
-
-    # get sequential ids
-    sequential_ids = request.http_get_sequential_id(dataset_name, 1)
+def create_image_generation_job(positive_prompt,
+                                negative_prompt,
+                                prompt_scoring_model,
+                                prompt_score,
+                                prompt_generation_policy,
+                                top_k,
+                                dataset_name,
+                                file_path="[auto]"):
 
-    count = 0
     # generate UUID
     task_uuid = str(uuid.uuid4())
     task_type = "image_generation_task"
@@ -604,7 +606,7 @@ def generate_image_generation_jobs(positive_prompt,
         "cfg_strength": 12,
         "seed": "",
         "dataset": dataset_name,
-        "file_path": sequential_ids[count]+".jpg",
+        "file_path": file_path,
         "num_images": 1,
         "image_width": 512,
         "image_height": 512,
@@ -622,28 +624,44 @@ def generate_image_generation_jobs(positive_prompt,
                                      model_file_name=model_file_name,
                                      model_file_path=model_file_path,
                                      task_input_dict=task_input_dict)
-    generation_task_json = generation_task.to_dict()
 
-    # add job
-    request.http_add_job(generation_task_json)
+    return generation_task.to_dict()
 
 
+def generate_image_generation_jobs(positive_prompt,
+                                   negative_prompt,
+                                   prompt_scoring_model,
+                                   prompt_score,
+                                   prompt_generation_policy,
+                                   top_k,
+                                   dataset_name):
 
+    # get sequential ids
+    sequential_ids = request.http_get_sequential_id(dataset_name, 1)
 
+    generation_task_json = create_image_generation_job(positive_prompt=positive_prompt,
+                                                       negative_prompt=negative_prompt,
+                                                       prompt_scoring_model=prompt_scoring_model,
+                                                       prompt_score=prompt_score,
+                                                       prompt_generation_policy=prompt_generation_policy,
+                                                       top_k=top_k,
+                                                       dataset_name=dataset_name,
+                                                       file_path=sequential_ids[0] + ".jpg")
 
-# use the dataset csv & the base prompt csv to generate inpainting jobs
-def generate_inpainting_job(positive_prompt,
-                            negative_prompt,
-                            prompt_scoring_model,
-                            prompt_score,
-                            prompt_generation_policy,
-                            top_k,
-                            dataset_name,
-                            init_img_path="./test/test_inpainting/white_512x512.jpg",
-                            mask_path="./test/test_inpainting/icon_mask.png"):
+    # add job
+    request.http_add_job(generation_task_json)
 
-    # get sequential ids
-    sequential_ids = request.http_get_sequential_id(dataset_name, 1)
+
+def create_inpainting_job(positive_prompt,
+                          negative_prompt,
+                          prompt_scoring_model,
+                          prompt_score,
+                          prompt_generation_policy,
+                          top_k,
+                          dataset_name,
+                          init_img_path="./test/test_inpainting/white_512x512.jpg",
+                          mask_path="./test/test_inpainting/icon_mask.png",
+                          file_path="[auto]"):
 
     task_uuid = str(uuid.uuid4())
     task_type = "inpainting_generation_task"
@@ -656,7 +674,7 @@ def generate_inpainting_job(positive_prompt,
         "cfg_strength": 12,
         "seed": "",
         "dataset": dataset_name,
-        "file_path": sequential_ids[0] + ".jpg",
+        "file_path": file_path,
         "image_width": 512,
         "image_height": 512,
         "sampler": "ddim",
@@ -677,19 +695,100 @@ def generate_inpainting_job(positive_prompt,
         "top_k": top_k,
     }
 
-
     generation_task = GenerationTask(uuid=task_uuid,
                                      task_type=task_type,
                                      model_name=model_name,
                                      model_file_name=model_file_name,
                                      model_file_path=model_file_path,
                                      task_input_dict=task_input_dict)
-    generation_task_json = generation_task.to_dict()
+
+    return generation_task.to_dict()
+
+
+# use the dataset csv & the base prompt csv to generate inpainting jobs
+def generate_inpainting_job(positive_prompt,
+                            negative_prompt,
+                            prompt_scoring_model,
+                            prompt_score,
+                            prompt_generation_policy,
+                            top_k,
+                            dataset_name,
+                            init_img_path="./test/test_inpainting/white_512x512.jpg",
+                            mask_path="./test/test_inpainting/icon_mask.png"):
+
+    # get sequential ids
+    sequential_ids = request.http_get_sequential_id(dataset_name, 1)
+
+    generation_task_json = create_inpainting_job(positive_prompt=positive_prompt,
+                                                 negative_prompt=negative_prompt,
+                                                 prompt_scoring_model=prompt_scoring_model,
+                                                 prompt_score=prompt_score,
+                                                 prompt_generation_policy=prompt_generation_policy,
+                                                 top_k=top_k,
+                                                 dataset_name=dataset_name,
+                                                 init_img_path=init_img_path,
+                                                 mask_path=mask_path,
+                                                 file_path=sequential_ids[0] + ".jpg")
 
     # add job
     request.http_add_job(generation_task_json)
 
 
+# leases sequential ids from the orchestration api in blocks
+# so that most allocations are served locally without a request
+# ids that are leased but never used are skipped, this leaves gaps
+# in the file names when the process restarts
+class SequentialIdLease:
+    def __init__(self, block_size=256):
+        self.block_size = block_size
+        self.dataset_sequential_ids = {}
+        self.lock = threading.Lock()
+
+    def get_sequential_ids(self, dataset_name, count):
+        with self.lock:
+            sequential_ids = self.dataset_sequential_ids.setdefault(dataset_name, [])
+
+            if len(sequential_ids) < count:
+                # prefetch a whole block, or more if the request is bigger
+                fetch_count = max(self.block_size, count - len(sequential_ids))
+                new_sequential_ids = request.http_get_sequential_id(dataset_name, fetch_count)
+                if new_sequential_ids is None:
+                    return None
+
+                sequential_ids.extend(new_sequential_ids)
+
+            result = sequential_ids[:count]
+            del sequential_ids[:count]
+
+            return result
+
+
+# submits the jobs of one dataset in bulk
+# reserves all the sequential ids with a single request
+# (or from the lease when given) and inserts all the jobs with a single request
+def add_dataset_jobs(dataset_name, jobs, sequential_id_lease=None):
+    if len(jobs) == 0:
+        return 0
+
+    # get sequential ids
+    if sequential_id_lease is not None:
+        sequential_ids = sequential_id_lease.get_sequential_ids(dataset_name, len(jobs))
+    else:
+        sequential_ids = request.http_get_sequential_id(dataset_name, len(jobs))
+    if sequential_ids is None or len(sequential_ids) != len(jobs):
+        print(f"could not reserve {len(jobs)} sequential ids for dataset {dataset_name}")
+        return 0
+
+    for job, sequential_id in zip(jobs, sequential_ids):
+        job["task_input_dict"]["file_path"] = sequential_id + ".jpg"
+
+    # add jobs
+    if not request.http_add_jobs(jobs):
+        return 0
+
+    return len(jobs)
+
+
 def load_base_prompts(base_prompts_csv_path):
     if base_prompts_csv_path is None:
         return []
@@ -3,7 +3,6 @@ import time
 import random
 from datetime import datetime
 import argparse
-from PIL import Image
 from termcolor import colored
 import os
 import threading
@@ -18,12 +17,18 @@ from worker.prompt_generation.prompt_generator import run_generate_inpainting_ge
 from worker.image_generation.scripts.inpaint_A1111 import img2img
 from worker.image_generation.scripts.generate_image_from_text import generate_image_from_text
 from worker.worker_state import WorkerState
+from worker.inpainting_cache import InpaintingCache
 from worker.http import request
 from utility.path import separate_bucket_and_file_path
+from utility.image_encoder import ImageEncoder
 from utility.minio import cmd
 from stable_diffusion.utils_image import save_images_to_minio, save_image_data_to_minio, save_image_embedding_to_minio, get_image_data
 from worker.clip_calculation.clip_calculator import run_clip_calculation_task
 from worker.generation_task.generation_task import GenerationTask
+from stable_diffusion.sampler.progress import PrintProgress
+from stable_diffusion.model.attention import set_attention_backend, ATTENTION_BACKENDS
+from stable_diffusion.model.unet.unet_attention import token_merging
+from stable_diffusion.inference_profile import InferenceProfile, PRECISIONS, PRECISION_AUTOCAST
 
 
 class ThreadState:
@@ -52,7 +57,13 @@ def warning(thread_state, message):
                                                                                                           'yellow') + message)
 
 
-def run_image_generation_task(worker_state, generation_task):
+# forwards the sampler progress of a task as a heartbeat line every few seconds
+def get_sampler_heartbeat(thread_state, generation_task, interval=5.):
+    return PrintProgress(interval=interval,
+                         print_fn=lambda line: info(thread_state, "job {}: {}".format(generation_task.uuid, line)))
+
+
+def run_image_generation_task(worker_state, generation_task, sampler_callback=None):
     # Random seed for now
     # Should we use the seed from job parameters ?
     random.seed(time.time())
@@ -73,21 +84,22 @@ def run_image_generation_task(worker_state, generation_task):
         seed=seed,
         image_width=generation_task.task_input_dict["image_width"],
         image_height=generation_task.task_input_dict["image_height"],
+        negative_embedded_prompts=worker_state.get_negative_prompt_embedding(
+            generation_task.task_input_dict["negative_prompt"]),
+        # fraction of the sampling steps with classifier free guidance, the rest are conditional only
+        guidance_fraction=generation_task.task_input_dict.get("cfg_guidance_fraction", 1.0),
+        image_encoder=worker_state.image_encoder,
         output_path=os.path.join("datasets",
                                  generation_task.task_input_dict[
                                      "dataset"],
                                  generation_task.task_input_dict[
-                                     "file_path"]))
+                                     "file_path"]),
+        sampler_callback=sampler_callback)
 
     return output_file_path, output_file_hash, img_data, seed
 
 
-def run_inpainting_generation_task(worker_state, generation_task: GenerationTask):
-    # TODO(): Make a cache for these images
-    # Check if they changed on disk maybe and reload
-    init_image = Image.open(generation_task.task_input_dict["init_img"])
-    init_mask = Image.open(generation_task.task_input_dict["init_mask"])
-
+def run_inpainting_generation_task(worker_state, generation_task: GenerationTask, sampler_callback=None):
     positive_prompts = generation_task.task_input_dict["positive_prompt"]
     negative_prompts = generation_task.task_input_dict["negative_prompt"]
 
@@ -118,8 +130,13 @@ def run_inpainting_generation_task(worker_state, generation_task: GenerationTask
         outpath=os.path.join("datasets", generation_task.task_input_dict['dataset'],
                              generation_task.task_input_dict['file_path']),
         styles=generation_task.task_input_dict["styles"],
-        init_images=[init_image],
-        mask=init_mask,
+        # the images are only read when the worker has not prepared them for inpainting before
+        init_images=None,
+        mask=None,
+        init_image_path=generation_task.task_input_dict["init_img"],
+        init_mask_path=generation_task.task_input_dict["init_mask"],
+        init_cache=worker_state.inpainting_cache,
+        image_encoder=worker_state.image_encoder,
         resize_mode=generation_task.task_input_dict["resize_mode"],
         denoising_strength=generation_task.task_input_dict["denoising_strength"],
         image_cfg_scale=generation_task.task_input_dict["image_cfg_scale"],
@@ -128,12 +145,14 @@ def run_inpainting_generation_task(worker_state, generation_task: GenerationTask
         sd=worker_state.stable_diffusion,
         model=worker_state.stable_diffusion.model,
         clip_text_embedder=worker_state.clip_text_embedder,
-        device=worker_state.device
+        embed_negative_prompt=worker_state.get_negative_prompt_embedding,
+        device=worker_state.device,
+        sampler_callback=sampler_callback
     )
 
 
     embedded_prompts = worker_state.clip_text_embedder(positive_prompts)
-    negative_embedded_prompts = worker_state.clip_text_embedder(negative_prompts)
+    negative_embedded_prompts = worker_state.get_negative_prompt_embedding(negative_prompts)
 
     # Convert embeddings to float32
     embedded_prompts = embedded_prompts.to(torch.float32)
@@ -166,6 +185,30 @@ def parse_args():
                         help="The minio secret key to use so worker can upload files to minio server")
     parser.add_argument("--worker-type", type=str, default="",
                         help="The task types the worker will accept and do. If blank then worker will accept all task types.")
+    parser.add_argument("--attention-backend", type=str, default=None, choices=ATTENTION_BACKENDS,
+                        help="The attention implementation of the unet and vae. Defaults to sdpa when available.")
+    parser.add_argument("--attention-chunk-memory-mb", type=int, default=None,
+                        help="Memory budget of one attention slice for the chunked attention backend.")
+    parser.add_argument("--inpainting-cache-memory-mb", type=int, default=512,
+                        help="Memory for the init latents and masks of inpainting jobs kept between jobs.")
+    parser.add_argument("--inpainting-cache-disk-mb", type=int, default=2048,
+                        help="Disk space for the init latents and masks of inpainting jobs kept between jobs.")
+    parser.add_argument("--inpainting-cache-dir", type=str, default="output/inpainting-cache",
+                        help="Directory of the inpainting cache on disk.")
+    parser.add_argument("--precision", type=str, default=PRECISION_AUTOCAST, choices=PRECISIONS,
+                        help="Precision of the unet and vae weights, autocast keeps fp32 weights and uses autocast.")
+    parser.add_argument("--channels-last", action="store_true",
+                        help="Use the channels last memory format for the unet and vae.")
+    parser.add_argument("--compile-unet", action="store_true",
+                        help="Compile the unet with torch.compile.")
+    parser.add_argument("--warmup-shapes", type=str, default="1x512x512",
+                        help="Comma separated batch_sizexheightxwidth image shapes the compiled unet is run with at startup.")
+    parser.add_argument("--accuracy-tolerance", type=float, default=0.05,
+                        help="Maximum relative error of the unet and vae outputs against fp32 at startup.")
+    parser.add_argument("--image-encoding-workers", type=int, default=0,
+                        help="Processes that encode and hash the images of a batch. With 0 they are encoded in the job thread.")
+    parser.add_argument("--image-quality", type=int, default=75,
+                        help="Quality of the jpeg encoding of the generated images.")
 
     return parser.parse_args()
 
@@ -230,7 +273,7 @@ def upload_image_data_and_update_job_status(worker_state, job, generation_task,
     top_k = generation_task.task_input_dict["top_k"]
 
     embedded_prompts = clip_text_embedder(positive_prompts)
-    negative_embedded_prompts = clip_text_embedder(negative_prompts)
+    negative_embedded_prompts = worker_state.get_negative_prompt_embedding(negative_prompts)
 
     # Convert embeddings to float32
     embedded_prompts = embedded_prompts.to(torch.float32)
@@ -301,49 +344,57 @@ def process_jobs(worker_state):
             generation_task = GenerationTask.from_dict(job)
 
             try:
-                if task_type == 'inpainting_generation_task':
-                    output_file_path, output_file_hash, img_data = run_inpainting_generation_task(worker_state,
-                                                                                                      generation_task)
-
-                    # spawn upload data and update job thread
-                    thread = threading.Thread(target=upload_image_data_and_update_job_status, args=(
-                        worker_state, job, generation_task, -1, output_file_path, output_file_hash, img_data,))
-                    thread.start()
-
-                elif task_type == 'image_generation_task':
-                    output_file_path, output_file_hash, img_data, seed = run_image_generation_task(worker_state, generation_task)
-
-                    # spawn upload data and update job thread
-                    thread = threading.Thread(target=upload_image_data_and_update_job_status, args=(
-                        worker_state, job, generation_task, seed, output_file_path, output_file_hash, img_data,))
-                    thread.start()
-
-                elif task_type == 'clip_calculation_task':
-                    output_file_path, output_file_hash, clip_data = run_clip_calculation_task(worker_state, generation_task)
-
-                    # spawn upload data and update job thread
-                    thread = threading.Thread(target=upload_data_and_update_job_status, args=(
-                        job, output_file_path, output_file_hash, clip_data, worker_state.minio_client,))
-                    thread.start()
-
-                elif task_type == "generate_image_generation_task":
-                    # run generate image generation task
-                    run_generate_image_generation_task(generation_task)
-                    job['task_completion_time'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-                    info(thread_state, "job completed: " + job["uuid"])
-                    request.http_update_job_completed(job)
-
-                elif task_type == "generate_inpainting_generation_task":
-                    # run generate inpainting generation task
-                    run_generate_inpainting_generation_task(generation_task)
-                    job['task_completion_time'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-                    info(thread_state, "job completed: " + job["uuid"])
-                    request.http_update_job_completed(job)
-                else:
-                    e = "job with task type '" + task_type + "' is not supported"
-                    error(thread_state, e)
-                    job['task_error_str'] = e
-                    request.http_update_job_failed(job)
+                # ratio of the unet self attention tokens merged for this job, a list has a ratio per unet level.
+                # the ratio is restored when the job ends, also when it fails
+                with token_merging(generation_task.task_input_dict.get("token_merging_ratio", None)):
+                    if task_type == 'inpainting_generation_task':
+                        output_file_path, output_file_hash, img_data = run_inpainting_generation_task(
+                            worker_state,
+                            generation_task,
+                            sampler_callback=get_sampler_heartbeat(thread_state, generation_task))
+
+                        # spawn upload data and update job thread
+                        thread = threading.Thread(target=upload_image_data_and_update_job_status, args=(
+                            worker_state, job, generation_task, -1, output_file_path, output_file_hash, img_data,))
+                        thread.start()
+
+                    elif task_type == 'image_generation_task':
+                        output_file_path, output_file_hash, img_data, seed = run_image_generation_task(
+                            worker_state,
+                            generation_task,
+                            sampler_callback=get_sampler_heartbeat(thread_state, generation_task))
+
+                        # spawn upload data and update job thread
+                        thread = threading.Thread(target=upload_image_data_and_update_job_status, args=(
+                            worker_state, job, generation_task, seed, output_file_path, output_file_hash, img_data,))
+                        thread.start()
+
+                    elif task_type == 'clip_calculation_task':
+                        output_file_path, output_file_hash, clip_data = run_clip_calculation_task(worker_state, generation_task)
+
+                        # spawn upload data and update job thread
+                        thread = threading.Thread(target=upload_data_and_update_job_status, args=(
+                            job, output_file_path, output_file_hash, clip_data, worker_state.minio_client,))
+                        thread.start()
+
+                    elif task_type == "generate_image_generation_task":
+                        # run generate image generation task
+                        run_generate_image_generation_task(generation_task)
+                        job['task_completion_time'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+                        info(thread_state, "job completed: " + job["uuid"])
+                        request.http_update_job_completed(job)
+
+                    elif task_type == "generate_inpainting_generation_task":
+                        # run generate inpainting generation task
+                        run_generate_inpainting_generation_task(generation_task)
+                        job['task_completion_time'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+                        info(thread_state, "job completed: " + job["uuid"])
+                        request.http_update_job_completed(job)
+                    else:
+                        e = "job with task type '" + task_type + "' is not supported"
+                        error(thread_state, e)
+                        job['task_error_str'] = e
+                        request.http_update_job_failed(job)
             except Exception as e:
                 error(thread_state, f"generation task failed: {traceback.format_exc()}")
                 job['task_error_str'] = str(e)
@@ -380,8 +431,28 @@ def main():
     if 'clip_calculation_task' in worker_type_list or len(worker_type_list) == 0:
         load_clip = True
 
+    if args.attention_backend is not None:
+        chunk_memory_budget = None
+        if args.attention_chunk_memory_mb is not None:
+            chunk_memory_budget = args.attention_chunk_memory_mb * 1024 * 1024
+        set_attention_backend(args.attention_backend, chunk_memory_budget=chunk_memory_budget)
+
     # Initialize worker state
-    worker_state = WorkerState(args.device, args.minio_access_key, args.minio_secret_key, queue_size, load_clip)
+    inference_profile = InferenceProfile(
+        precision=args.precision,
+        channels_last=args.channels_last,
+        compile_unet=args.compile_unet,
+        warmup_shapes=[[int(size) for size in shape.split("x")] for shape in args.warmup_shapes.split(",") if shape],
+        accuracy_tolerance=args.accuracy_tolerance)
+    image_encoder = ImageEncoder(num_workers=args.image_encoding_workers, quality=args.image_quality)
+    image_encoder.warmup()
+    worker_state = WorkerState(args.device, args.minio_access_key, args.minio_secret_key, queue_size, load_clip,
+                               inpainting_cache=InpaintingCache(
+                                   max_memory_bytes=args.inpainting_cache_memory_mb * 1024 * 1024,
+                                   cache_dir=args.inpainting_cache_dir,
+                                   max_disk_bytes=args.inpainting_cache_disk_mb * 1024 * 1024),
+                               inference_profile=inference_profile,
+                               image_encoder=image_encoder)
     # Loading models
     worker_state.load_models()
 
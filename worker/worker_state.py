@@ -1,54 +1,150 @@
 
 import queue
 import sys
+import threading
+import time
+from collections import OrderedDict
+
+import torch
 
 base_directory = "./"
 sys.path.insert(0, base_directory)
 
 from utility.minio.cmd import get_minio_client
 from stable_diffusion import StableDiffusion, CLIPTextEmbedder
+from stable_diffusion.utils_model import initialize_latent_diffusion
+from stable_diffusion.inference_profile import InferenceProfile, apply_inference_profile
 from configs.model_config import ModelPathConfig
-from stable_diffusion.model_paths import (SDconfigs, CLIPconfigs)
+from stable_diffusion.model_paths import CLIPconfigs
 from worker.image_generation.scripts.stable_diffusion_base_script import StableDiffusionBaseScript
+from worker.model_registry import ModelRegistry, get_memory_report
+from worker.inpainting_cache import InpaintingCache
+from utility.image_encoder import ImageEncoder
 from utility.clip import clip
+
+MODEL_CLIP_TEXT_EMBEDDER = "clip_text_embedder"
+MODEL_LATENT_DIFFUSION = "latent_diffusion"
+MODEL_STABLE_DIFFUSION = "stable_diffusion"
+MODEL_TXT2IMG = "txt2img"
+MODEL_CLIP = "clip"
+
+# negative prompt embeddings kept by a worker
+NEGATIVE_PROMPT_CACHE_SIZE = 32
+
+
 class WorkerState:
-    def __init__(self, device, minio_access_key, minio_secret_key, queue_size, load_clip):
+    def __init__(self, device, minio_access_key, minio_secret_key, queue_size, load_clip, inpainting_cache=None,
+                 inference_profile=None, image_encoder=None):
         self.device = device
         self.config = ModelPathConfig()
-        self.stable_diffusion = None
-        self.clip_text_embedder = None
-        self.txt2img = None
+        self.models = ModelRegistry()
         self.minio_client = get_minio_client(minio_access_key, minio_secret_key)
         self.queue_size = queue_size
         self.job_queue = queue.Queue()
         self.load_clip = load_clip
-        if load_clip:
-            self.clip = clip.ClipModel(device=device)
+        # negative prompt -> embedding, most jobs use the empty prompt or one of a few negative prompts
+        self.negative_prompt_embeddings = OrderedDict()
+        self.negative_prompt_lock = threading.Lock()
+        # init latents and masks of inpainting jobs, kept in memory only by default
+        self.inpainting_cache = inpainting_cache if inpainting_cache is not None else InpaintingCache()
+        # precision, memory format and compilation of the unet and the vae
+        self.inference_profile = inference_profile if inference_profile is not None else InferenceProfile()
+        # encodes and hashes the generated images, in the calling thread by default
+        self.image_encoder = image_encoder if image_encoder is not None else ImageEncoder()
 
-    def load_models(self, model_path='input/model/sd/v1-5-pruned-emaonly/v1-5-pruned-emaonly.safetensors'):
-        # NOTE: Initializing stable diffusion
-        self.stable_diffusion = StableDiffusion(device=self.device)
-        self.stable_diffusion.quick_initialize().load_autoencoder(self.config.get_model(SDconfigs.VAE)).load_decoder(
-            self.config.get_model(SDconfigs.VAE_DECODER))
-        self.stable_diffusion.model.load_unet(self.config.get_model(SDconfigs.UNET))
-        self.stable_diffusion.initialize_latent_diffusion(path=model_path, force_submodels_init=True)
-        self.clip_text_embedder = CLIPTextEmbedder(device=self.device)
-
-        self.clip_text_embedder.load_submodels(
+    # the txt2img, inpainting and embedding paths all share the models of the registry,
+    # which are loaded the first time they are used
+    @property
+    def clip_text_embedder(self):
+        return self.models.get(MODEL_CLIP_TEXT_EMBEDDER)
+
+    @property
+    def stable_diffusion(self):
+        return self.models.get(MODEL_STABLE_DIFFUSION)
+
+    @property
+    def txt2img(self):
+        return self.models.get(MODEL_TXT2IMG)
+
+    @property
+    def clip(self):
+        return self.models.get(MODEL_CLIP)
+
+    def get_negative_prompt_embedding(self, negative_prompt):
+        with self.negative_prompt_lock:
+            if negative_prompt in self.negative_prompt_embeddings:
+                self.negative_prompt_embeddings.move_to_end(negative_prompt)
+                return self.negative_prompt_embeddings[negative_prompt]
+
+            with torch.no_grad():
+                embedding = self.clip_text_embedder(negative_prompt)
+            self.negative_prompt_embeddings[negative_prompt] = embedding
+            # drop the least recently used embedding
+            if len(self.negative_prompt_embeddings) > NEGATIVE_PROMPT_CACHE_SIZE:
+                self.negative_prompt_embeddings.popitem(last=False)
+
+            return embedding
+
+    def load_clip_text_embedder(self, models):
+        clip_text_embedder = CLIPTextEmbedder(device=self.device)
+        clip_text_embedder.load_submodels(
             tokenizer_path=self.config.get_model_folder_path(CLIPconfigs.TXT_EMB_TOKENIZER),
             transformer_path=self.config.get_model_folder_path(CLIPconfigs.TXT_EMB_TEXT_MODEL)
         )
 
-        # Starts the text2img
-        self.txt2img = StableDiffusionBaseScript(
+        return clip_text_embedder
+
+    def load_latent_diffusion(self, models, model_path):
+        # the text embedder is shared, so only the unet and the autoencoder are read from the checkpoint
+        model = initialize_latent_diffusion(path=model_path, device=self.device,
+                                            clip_text_embedder=models.get(MODEL_CLIP_TEXT_EMBEDDER),
+                                            force_submodels_init=True)
+
+        # fails when the profile is not accurate enough against fp32.
+        # the wrapper runs the returned unet, which is the compiled one if the profile compiles it
+        model.model.diffusion_model, errors = apply_inference_profile(model.model.diffusion_model,
+                                                                      model.first_stage_model,
+                                                                      self.inference_profile,
+                                                                      device=model.device)
+        print("inference profile {}, relative error against fp32: {}".format(
+            self.inference_profile.name, ", ".join("{} {:.2e}".format(name, error) for name, error in errors.items())))
+
+        return model
+
+    def load_stable_diffusion(self, models):
+        return StableDiffusion(device=self.device, model=models.get(MODEL_LATENT_DIFFUSION))
+
+    def load_txt2img(self, models):
+        txt2img = StableDiffusionBaseScript(
             sampler_name="ddim",
             n_steps=20,
             force_cpu=False,
             cuda_device=self.device,
         )
-        self.txt2img.initialize_latent_diffusion(autoencoder=None, clip_text_embedder=None, unet_model=None,
-                                                 path=model_path, force_submodels_init=True)
+        txt2img.initialize_from_model(models.get(MODEL_LATENT_DIFFUSION))
+        txt2img.cache_empty_embedding()
+
+        return txt2img
+
+    def load_clip_model(self, models):
+        clip_model = clip.ClipModel(device=self.device)
+        clip_model.load_clip()
+
+        return clip_model
+
+    def load_models(self, model_path='input/model/sd/v1-5-pruned-emaonly/v1-5-pruned-emaonly.safetensors'):
+        self.models.register(MODEL_CLIP_TEXT_EMBEDDER, self.load_clip_text_embedder)
+        self.models.register(MODEL_LATENT_DIFFUSION, lambda models: self.load_latent_diffusion(models, model_path))
+        self.models.register(MODEL_STABLE_DIFFUSION, self.load_stable_diffusion)
+        self.models.register(MODEL_TXT2IMG, self.load_txt2img)
+        self.models.register(MODEL_CLIP, self.load_clip_model)
 
-        # load clip model
+        # load the models up front, so the first job does not wait for them
+        print("loading models, {}".format(get_memory_report()))
+        start_time = time.time()
+        model_names = [MODEL_STABLE_DIFFUSION, MODEL_TXT2IMG]
         if self.load_clip:
-            self.clip.load_clip()
+            model_names.append(MODEL_CLIP)
+        for model_name in model_names:
+            self.models.get(model_name)
+        print("loaded models in {:.2f}s, {}".format(time.time() - start_time, get_memory_report()))